@@ -0,0 +1,253 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+import hmac
+import logging
+
+from config import env_config
+from utils.http_pool import http_pool
+from speech.tts import tts_engine
+from speech.transcode_pool import transcode_pool
+from speech.streaming_recognition import recognition_sessions
+from utils.executors import executors
+from utils.endpoint_health import endpoint_health
+from llm.agent import AgentManager
+from llm.context_window import context_window
+from llm.summarizer import summary_scheduler
+from llm.prompt_cache import prompt_cache
+from llm.response_cache import response_cache
+from llm.hedging import hedged_requests
+from llm.cancellation import cancellation_tracker
+from storage.conversation_store import conversation_store
+from storage.sqlite_store import sqlite_store
+from storage.state_backend import state_backend
+from storage.character_registry import character_registry
+
+# 创建路由实例
+router = APIRouter()
+
+# 配置日志
+logger = logging.getLogger("ai_chat_service.api.admin")
+
+# 未配置管理令牌时允许的客户端地址
+_LOOPBACK_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+def _require_admin(request: Request):
+    """
+    修改状态的管理操作的访问控制
+    
+    配置了ADMIN_TOKEN时校验X-Admin-Token请求头，否则只允许本机访问；不满足时返回403
+    """
+    if env_config.ADMIN_TOKEN:
+        token = request.headers.get("X-Admin-Token", "")
+        if hmac.compare_digest(token.encode("utf-8"), env_config.ADMIN_TOKEN.encode("utf-8")):
+            return
+    elif request.client is not None and request.client.host in _LOOPBACK_HOSTS:
+        return
+    logger.warning(f"拒绝未授权的管理操作: {request.method} {request.url.path}")
+    raise HTTPException(status_code=403, detail="无权执行管理操作")
+
+# 出站连接池统计
+@router.get("/http-pool")
+async def get_http_pool_stats():
+    """
+    获取出站HTTP连接池使用统计
+    
+    按上游主机返回连接池大小、请求数、并发中请求数、使用率和连接复用率
+    """
+    return http_pool.stats()
+
+# TTS端点发现状态
+@router.get("/tts-endpoint")
+async def get_tts_endpoint_status():
+    """
+    获取TTS API端点发现状态
+    
+    返回当前使用的 (URL, 请求体格式) 组合、探测次数和仍在失败缓存中的组合
+    """
+    return tts_engine.endpoint_discovery.status()
+
+# 重新探测TTS端点
+@router.post("/tts-endpoint/reprobe", dependencies=[Depends(_require_admin)])
+async def reprobe_tts_endpoint():
+    """
+    在后台重新探测TTS API端点
+    
+    需要管理令牌（X-Admin-Token），未配置ADMIN_TOKEN时只允许本机访问
+    """
+    started = tts_engine.endpoint_discovery.start_background_probe()
+    logger.info(f"手动触发TTS端点探测: {'已启动' if started else '已有探测进行中'}")
+    return {"started": started}
+
+# TTS音频缓存统计
+@router.get("/tts-cache")
+async def get_tts_cache_stats():
+    """
+    获取TTS音频缓存统计
+    
+    返回内存和磁盘缓存的条目数、字节数、命中/未命中次数和淘汰次数
+    """
+    return tts_engine.cache.stats()
+
+# 清空TTS音频缓存
+@router.delete("/tts-cache", dependencies=[Depends(_require_admin)])
+async def purge_tts_cache():
+    """
+    清空TTS音频缓存（内存和磁盘）
+    
+    需要管理令牌（X-Admin-Token），未配置ADMIN_TOKEN时只允许本机访问
+    """
+    return tts_engine.cache.purge()
+
+# 转码工作进程池统计
+@router.get("/transcode-pool")
+async def get_transcode_pool_stats():
+    """
+    获取常驻转码工作进程池统计
+    
+    返回工作进程数、忙碌数、队列深度、超时/崩溃/重启次数以及平均等待和执行时间
+    """
+    return transcode_pool.stats()
+
+# 语音执行器统计
+@router.get("/executors")
+async def get_executor_stats():
+    """
+    获取ASR/TTS/音频转换线程池和音频处理进程池的统计
+    
+    返回各执行器的并发上限、运行中/排队中任务数、饱和度、拒绝次数以及平均等待和执行时间
+    """
+    return executors.stats()
+
+# 流式识别会话统计
+@router.get("/recognition-sessions")
+async def get_recognition_session_stats():
+    """
+    获取流式语音识别会话统计
+    
+    返回进行中的会话数、上限、空闲过期时间、创建/完成/过期/拒绝次数和缓冲的PCM字节数
+    """
+    return recognition_sessions.stats()
+
+# 角色Agent缓存统计
+@router.get("/agents")
+async def get_agent_stats():
+    """
+    获取角色Agent缓存统计
+    
+    返回存活/对话中的Agent数、容量、空闲回收时间、命中/未命中次数以及淘汰和过期回收次数
+    """
+    return AgentManager.get_instance().stats()
+
+# 上下文窗口裁剪统计
+@router.get("/context-window")
+async def get_context_window_stats():
+    """
+    获取对话历史裁剪统计
+    
+    返回预算配置、请求数、被裁剪的请求数、节省的token数、丢弃的消息数以及token估算缓存命中情况
+    """
+    return context_window.stats()
+
+# 对话摘要队列统计
+@router.get("/summaries")
+async def get_summary_stats():
+    """
+    获取后台对话摘要队列统计
+    
+    返回排队数、并发数、提交/完成/失败/丢弃次数以及平均生成时间
+    """
+    return summary_scheduler.stats()
+
+# 提示前缀复用统计
+@router.get("/prompt-cache")
+async def get_prompt_cache_stats():
+    """
+    获取提示前缀复用统计
+    
+    返回请求数、不同前缀数、前缀复用率，以及上游返回的提示token数和缓存命中token数
+    """
+    return prompt_cache.stats()
+
+# LLM响应缓存统计
+@router.get("/response-cache")
+async def get_response_cache_stats():
+    """
+    获取LLM响应缓存统计
+    
+    返回缓存条数、命中率、合并的并发请求数、写入和淘汰次数，以及进行中的上游请求数
+    """
+    return response_cache.stats()
+
+# 上游端点健康状态
+@router.get("/endpoints")
+async def get_endpoint_health():
+    """
+    获取上游端点健康状态
+    
+    按端点组（DeepSeek、TTS）返回每个URL的熔断状态、延迟和错误率EWMA、请求数和熔断次数，以及当前的尝试顺序
+    """
+    return endpoint_health.stats()
+
+# 对冲请求统计
+@router.get("/hedging")
+async def get_hedging_stats():
+    """
+    获取LLM对冲请求统计
+    
+    返回当前的对冲触发延迟、请求数、发出和胜出的对冲请求数、因限额跳过的对冲数和故障转移次数
+    """
+    return hedged_requests.stats()
+
+# 客户端断开统计
+@router.get("/cancellations")
+async def get_cancellation_stats():
+    """
+    获取客户端断开统计
+    
+    返回完整生成和中途取消的回复数（按聊天和语音区分）、取消前已生成的token数、
+    估算节省的token数和取消的语音合成任务数
+    """
+    return cancellation_tracker.stats()
+
+# 服务端会话存储统计
+@router.get("/conversations")
+async def get_conversation_stats():
+    """
+    获取服务端会话存储统计
+    
+    返回会话数、上限、创建的会话数、追加的消息数和淘汰的会话数
+    """
+    return conversation_store.stats()
+
+# SQLite持久化统计
+@router.get("/storage")
+async def get_storage_stats():
+    """
+    获取SQLite持久化统计
+    
+    返回排队中的写操作数、已提交的写操作数和批次数、平均批大小、最近一批的耗时，
+    以及延迟加载的读取次数和等待未提交写入的次数；未启用持久化时只返回enabled=false
+    """
+    if sqlite_store is None:
+        return {"enabled": False}
+    return {"enabled": True, **sqlite_store.stats()}
+
+# 共享状态后端统计
+@router.get("/state-backend")
+async def get_state_backend_stats():
+    """
+    获取共享状态后端统计
+    
+    返回后端类型（memory或sqlite）、是否在工作进程间共享、键值数、排队中的转交数据和读写次数
+    """
+    return state_backend.stats()
+
+# 角色目录统计
+@router.get("/characters")
+async def get_character_registry_stats():
+    """
+    获取角色目录统计
+    
+    返回角色数、不同名称数、目录版本号（每次新增、修改或删除角色时加一），
+    以及搜索索引的gram数、倒排表总长度、查询次数和平均候选角色数
+    """
+    return character_registry.stats()
@@ -1,24 +1,15 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Response
+from typing import List, Optional
 import logging
 
+from storage.character_registry import character_registry
+
 # 创建路由实例
 router = APIRouter()
 
 # 配置日志
 logger = logging.getLogger("ai_chat_service.api.character")
 
-# 角色数据（实际应用中应该从数据库获取）
-characters_data = [
-    {"id": 1, "name": "哈利波特", "avatar": "🧙‍♂️", "description": "魔法世界的传奇巫师", "category": "fiction"},
-    {"id": 2, "name": "苏格拉底", "avatar": "👨‍🏫", "description": "古希腊著名哲学家", "category": "historical"},
-    {"id": 3, "name": "爱因斯坦", "avatar": "🧠", "description": "著名物理学家，相对论提出者", "category": "historical"},
-    {"id": 4, "name": "林黛玉", "avatar": "💃", "description": "《红楼梦》中的经典人物", "category": "fiction"},
-    {"id": 5, "name": "莎士比亚", "avatar": "📝", "description": "英国著名剧作家和诗人", "category": "historical"},
-    {"id": 6, "name": "哪吒", "avatar": "👶", "description": "中国古代神话中的神童", "category": "mythology"},
-    {"id": 7, "name": "牛顿", "avatar": "🍎", "description": "万有引力定律的发现者", "category": "historical"},
-    {"id": 8, "name": "孙悟空", "avatar": "🐒", "description": "《西游记》中的齐天大圣", "category": "mythology"},
-]
-
 # 角色相关接口
 @router.get("/characters", tags=["角色"])
 async def get_characters():
@@ -28,27 +19,31 @@ async def get_characters():
     返回所有可用的AI角色
     """
     logger.info("获取角色列表")
-    return characters_data
+    return character_registry.all()
 
 @router.get("/characters/search", tags=["角色"])
-async def search_characters(q: str = None):
+async def search_characters(
+    response: Response,
+    q: str = None,
+    category: Optional[List[str]] = Query(None, description="只返回这些分类的角色（可重复）"),
+    limit: int = Query(50, ge=1, le=500, description="最多返回条数"),
+    offset: int = Query(0, ge=0, description="跳过的条数")
+):
     """
-    搜索角色
+    搜索角色（按相关度排序：名称完全相同、名称开头、名称包含、描述包含）
+    
+    - **q**: 搜索关键词（空格分隔的多个词需全部匹配）
+    - **category**: 分类过滤，可重复指定多个分类
+    - **limit**: 最多返回条数
+    - **offset**: 跳过的条数
     
-    - **q**: 搜索关键词
+    返回本页的角色列表，匹配的角色总数在响应头X-Total-Count中
     """
     logger.info(f"搜索角色，关键词: {q}")
     
-    if not q:
-        return characters_data
-    
-    # 过滤角色列表
-    filtered_characters = [
-        char for char in characters_data
-        if q.lower() in char["name"].lower() or q.lower() in char["description"].lower()
-    ]
-    
-    return filtered_characters
+    characters, total = character_registry.search(q, category, limit, offset)
+    response.headers["X-Total-Count"] = str(total)
+    return characters
 
 @router.get("/characters/{character_id}", tags=["角色"])
 async def get_character_by_id(character_id: int):
@@ -60,7 +55,7 @@ async def get_character_by_id(character_id: int):
     logger.info(f"获取角色详情，角色ID: {character_id}")
     
     # 查找指定ID的角色
-    character = next((char for char in characters_data if char["id"] == character_id), None)
+    character = character_registry.get(character_id)
     
     if not character:
         raise HTTPException(status_code=404, detail="角色不存在")
@@ -1,7 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Request, Query
 from typing import List, Dict, Any, Optional
 from fastapi.responses import StreamingResponse
+from datetime import datetime
+from contextlib import aclosing
+import asyncio
 import logging
+import time
 
 # 导入数据模型
 from api.models import (
@@ -17,9 +21,15 @@ from api.models import (
 # 导入LLM模型和Agent
 from llm.openai_llm import OpenAILLM
 from llm.deeplseek_llm import DeepSeekLLM
-from llm.agent import AgentManager
+from llm.agent import Agent, AgentBusy, AgentManager
+from llm.response_cache import CachedLLM, response_cache
+from llm.cancellation import cancellation_tracker
+from storage.conversation_store import Conversation, conversation_store
+from storage.sqlite_store import sqlite_store
+from storage.state_backend import state_backend
 from config import env_config
-from api.character_routes import characters_data
+from storage.character_registry import character_registry
+from utils.sse import sse_event, with_heartbeat, HEARTBEAT_FRAME
 
 # 创建路由实例
 router = APIRouter()
@@ -32,10 +42,18 @@ class ModelManager:
     """管理不同的LLM模型实例"""
     _instance = None
     _models = {}
+    _cached_models = {}
     
     @classmethod
-    def get_model(cls, provider: str = None, model_name: str = None):
-        """获取指定的模型实例"""
+    def get_model(cls, provider: str = None, model_name: str = None, cached: bool = False):
+        """
+        获取指定的模型实例
+        
+        参数:
+            provider: 模型提供商
+            model_name: 模型名称
+            cached: 是否返回带响应缓存和请求合并的包装（响应缓存关闭时返回原模型）
+        """
         # 如果没有提供提供商，使用默认值
         provider = provider or env_config.DEFAULT_LLM_PROVIDER
         model_key = f"{provider}:{model_name}" if model_name else provider
@@ -54,11 +72,16 @@ class ModelManager:
             else:
                 raise ValueError(f"不支持的模型提供商: {provider}")
         
+        if cached and env_config.LLM_RESPONSE_CACHE_ENABLED:
+            if model_key not in cls._cached_models:
+                cls._cached_models[model_key] = CachedLLM(cls._models[model_key], provider, response_cache)
+            return cls._cached_models[model_key]
+        
         return cls._models[model_key]
 
 # 处理聊天请求
-@router.post("/send", response_model=ChatResponse, responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
-async def send_chat_message(request: ChatRequest):
+@router.post("/send", response_model=ChatResponse, responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}, 503: {"model": ErrorResponse}})
+async def send_chat_message(request: ChatRequest, http_request: Request = None):
     """
     发送聊天消息并获取AI回复
     
@@ -66,9 +89,12 @@ async def send_chat_message(request: ChatRequest):
     - **character_id**: 角色ID（可选）
     - **character_context**: 角色上下文信息（可选）
     - **chat_history**: 聊天历史记录（可选）
-    - **stream**: 是否使用流式响应（可选，默认为False）
+    - **stream**: 是否使用流式响应（可选，默认为False；为True时返回与 /stream 相同的SSE事件流）
     - **model_provider**: 模型提供商（可选）
     - **model_name**: 模型名称（可选）
+    - **use_cache**: 是否使用响应缓存（可选，默认为False；相同请求复用回复，并发的相同请求只调用一次模型）
+    - **session_id**: 用户或客户端会话标识（可选，与character_id一起在服务端保存会话）
+    - **conversation_id**: 会话ID（可选，提供时由服务端重建聊天历史，无需再发送chat_history）
     
     响应：
     - **reply**: AI的回复文本
@@ -76,55 +102,42 @@ async def send_chat_message(request: ChatRequest):
     - **timestamp**: 时间戳
     - **model_provider**: 使用的模型提供商
     - **model_name**: 使用的模型名称
+    - **conversation_id**: 服务端保存的会话ID（请求带session_id或conversation_id时返回）
     """
     try:
         logger.info(f"接收到聊天请求，角色ID: {request.character_id}")
         
-        # 如果使用流式响应
+        # 如果使用流式响应，返回SSE事件流
         if request.stream:
-            # 流式响应需要特殊处理
-            # 注意：FastAPI的流式响应需要使用异步生成器
-            # 由于时间限制，这里暂时不实现完整的流式响应
-            raise HTTPException(status_code=400, detail="流式响应暂未实现")
-        
-        # 获取模型实例
-        model = ModelManager.get_model(request.model_provider, request.model_name)
-        provider = request.model_provider or env_config.DEFAULT_LLM_PROVIDER
-        model_name = request.model_name or getattr(env_config, f"{provider.upper()}_MODEL", "default")
+            return await _build_stream_response(request, http_request)
         
-        # 获取角色上下文信息
-        character_context = request.character_context
-        
-        # 如果没有直接提供角色上下文但提供了角色ID，尝试从字符数据中获取角色信息
-        if not character_context and request.character_id:
-            for char in characters_data:
-                if char['id'] == request.character_id:
-                    character_context = CharacterContext(
-                        name=char['name'],
-                        description=char['description'],
-                        avatar=char['avatar'],
-                        category=char['category']
-                    )
-                    break
+        # 获取服务端会话、模型实例和角色上下文
+        conversation = await _resolve_conversation(request)
+        chat_history = _chat_history(request, conversation)
+        model, provider, model_name, character_context = _resolve_chat_target(request)
         
         # 调用模型生成响应
         reply = ""
         if character_context:
             # 使用Agent功能，确保角色身份完全融入响应
-            agent_manager = AgentManager.get_instance()
-            agent = agent_manager.get_agent(model, character_context)
-            reply = agent.generate_response(
+            agent = await _get_agent(model, character_context, conversation)
+            reply = await agent.agenerate_response(
                 prompt=request.prompt,
-                chat_history=request.chat_history
+                chat_history=chat_history,
+                llm=model
             )
         else:
             # 标准响应生成
-            reply = model.generate_response(
+            reply = await model.agenerate_response(
                 prompt=request.prompt,
                 character_context=None,
-                chat_history=request.chat_history
+                chat_history=chat_history
             )
         
+        if conversation is not None:
+            conversation_store.append_exchange(conversation, request.prompt, reply)
+        await _sync_shared_state()
+        
         logger.info(f"聊天请求处理完成，回复长度: {len(reply)} 字符")
         
         # 返回响应
@@ -132,9 +145,15 @@ async def send_chat_message(request: ChatRequest):
             reply=reply,
             character_id=request.character_id,
             model_provider=provider,
-            model_name=model_name
+            model_name=model_name,
+            conversation_id=conversation.id if conversation is not None else None
         )
         
+    except HTTPException:
+        raise
+    except AgentBusy as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail="角色正忙，请稍后重试")
     except ValueError as e:
         logger.error(f"模型错误: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
@@ -142,13 +161,248 @@ async def send_chat_message(request: ChatRequest):
         logger.error(f"聊天请求处理失败: {str(e)}")
         raise HTTPException(status_code=500, detail="内部服务器错误")
 
-# 流式聊天接口（暂时不实现）
-@router.post("/stream")
-async def stream_chat_message(request: ChatRequest):
+# 流式聊天接口
+@router.post("/stream", responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
+async def stream_chat_message(request: ChatRequest, http_request: Request):
+    """
+    以Server-Sent Events流式获取AI回复
+    
+    请求参数与 /send 相同，响应为 text/event-stream：
+    - **start**: 开始事件，包含角色ID和模型信息
+    - **delta**: 增量文本，data为 {"content": "..."}
+    - **done**: 结束事件，包含回复长度、token用量和耗时（首字延迟ttft_ms、总耗时total_ms）
+    - **error**: 生成过程中出错
+    
+    上游长时间没有输出时会发送以冒号开头的心跳注释帧；客户端断开后停止生成并关闭上游连接
+    """
+    try:
+        logger.info(f"接收到流式聊天请求，角色ID: {request.character_id}")
+        return await _build_stream_response(request, http_request)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        logger.error(f"模型错误: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"流式聊天请求处理失败: {str(e)}")
+        raise HTTPException(status_code=500, detail="内部服务器错误")
+
+def _resolve_chat_target(request: ChatRequest):
+    """
+    解析聊天请求对应的模型和角色上下文
+    
+    返回:
+        (模型实例, 模型提供商, 模型名称, 角色上下文)
+    """
+    # 获取模型实例（请求开启缓存时使用带响应缓存的包装）
+    model = ModelManager.get_model(request.model_provider, request.model_name, cached=request.use_cache)
+    provider = request.model_provider or env_config.DEFAULT_LLM_PROVIDER
+    model_name = request.model_name or getattr(env_config, f"{provider.upper()}_MODEL", "default")
+    
+    # 获取角色上下文信息
+    character_context = request.character_context
+    
+    # 如果没有直接提供角色上下文但提供了角色ID，使用角色目录中预先构建的上下文
+    if not character_context and request.character_id:
+        character_context = character_registry.context(request.character_id)
+    
+    return model, provider, model_name, character_context
+
+async def _resolve_conversation(request: ChatRequest) -> Optional[Conversation]:
+    """
+    获取请求对应的服务端会话
+    
+    有conversation_id时按ID查找（未带character_id时使用会话的角色，带了其他角色时返回400），
+    否则有session_id时按 (session_id, character_id) 获取或创建会话
+    
+    返回:
+        会话，请求不使用服务端会话时返回None
+    """
+    if request.conversation_id:
+        conversation = await _conversation_for(request.conversation_id, request.character_id)
+        if request.character_id is None:
+            request.character_id = conversation.character_id
+        return conversation
+    if request.session_id:
+        return await conversation_store.aget_or_create(request.session_id, request.character_id)
+    return None
+
+async def _conversation_for(conversation_id: str, character_id: Optional[int]) -> Conversation:
+    """
+    按ID获取会话，并确认会话属于请求的角色
+    
+    参数:
+        conversation_id: 会话ID
+        character_id: 请求的角色ID，None为不限
+    
+    返回:
+        会话；不存在时返回404，属于其他角色时返回400
+    """
+    conversation = await conversation_store.aget(conversation_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="会话不存在或已过期")
+    if character_id is not None and character_id != conversation.character_id:
+        raise HTTPException(status_code=400, detail="会话不属于该角色")
+    return conversation
+
+def _chat_history(request: ChatRequest, conversation: Optional[Conversation]) -> Optional[List[Dict[str, str]]]:
+    """请求带了chat_history时直接使用，否则由服务端会话重建"""
+    if request.chat_history is not None or conversation is None:
+        return request.chat_history
+    return conversation.recent(env_config.CONVERSATION_CONTEXT_MESSAGES)
+
+async def _sync_shared_state():
+    """多个工作进程共享状态时，等待本轮的持久化写入提交后再响应（下一轮请求可能落到其他进程）"""
+    if state_backend.shared and sqlite_store is not None:
+        await sqlite_store.acommitted()
+
+def _agent_model(model):
+    """Agent按实际模型区分，开启和不开启缓存的请求共用同一个Agent（开启缓存的请求不读写其记忆）"""
+    return model.inner if isinstance(model, CachedLLM) else model
+
+async def _get_agent(model, character_context: CharacterContext, conversation: Optional[Conversation]) -> Agent:
     """
-    流式获取AI回复（暂未实现）
+    获取本轮使用的Agent
+    
+    记忆和摘要按服务端会话隔离，同一角色的不同用户互相看不到对方的对话；
+    不使用服务端会话的请求无法区分用户，使用不保留记忆的临时Agent，
+    即记忆召回和对话摘要只对带session_id或conversation_id的客户端生效（前端会带上本地保存的会话标识）
     """
-    raise HTTPException(status_code=400, detail="流式响应暂未实现")
+    if conversation is None:
+        return Agent(_agent_model(model), character_context)
+    return await AgentManager.get_instance().aget_agent(_agent_model(model), character_context, scope=conversation.id)
+
+async def _open_chat_source(
+    model,
+    character_context: Optional[CharacterContext],
+    prompt: str,
+    chat_history: Optional[List[Dict[str, str]]],
+    usage: Dict[str, Any],
+    conversation: Optional[Conversation] = None
+):
+    """
+    打开LLM增量文本流（有角色上下文时通过Agent生成）
+    
+    参数:
+        model: 模型实例
+        character_context: 角色上下文
+        prompt: 用户输入
+        chat_history: 聊天历史
+        usage: 接收token用量的字典
+        conversation: 服务端会话（Agent的记忆按会话隔离）
+    
+    返回:
+        增量文本的异步迭代器
+    """
+    if character_context:
+        # 使用Agent功能，确保角色身份完全融入响应
+        agent = await _get_agent(model, character_context, conversation)
+        return agent.agenerate_streaming_response(
+            prompt=prompt,
+            chat_history=chat_history,
+            usage_sink=usage,
+            llm=model
+        )
+    return model.agenerate_streaming_response(
+        prompt=prompt,
+        character_context=None,
+        chat_history=chat_history,
+        usage_sink=usage
+    )
+
+async def _build_stream_response(request: ChatRequest, http_request: Optional[Request] = None) -> StreamingResponse:
+    """构建聊天请求的SSE流式响应"""
+    conversation = await _resolve_conversation(request)
+    model, provider, model_name, character_context = _resolve_chat_target(request)
+    
+    return StreamingResponse(
+        _chat_event_stream(request, model, provider, model_name, character_context, http_request, conversation),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # 禁止反向代理缓冲，保证增量及时到达
+        }
+    )
+
+async def _chat_event_stream(
+    request: ChatRequest,
+    model,
+    provider: str,
+    model_name: str,
+    character_context: Optional[CharacterContext],
+    http_request: Optional[Request] = None,
+    conversation: Optional[Conversation] = None
+):
+    """
+    生成聊天的SSE事件流
+    
+    客户端断开时（服务器取消响应任务，或轮询到断开）关闭增量文本流，
+    取消会沿Agent和模型的生成器传递到上游，关闭上游连接
+    """
+    started_at = time.perf_counter()
+    first_token_at = None
+    last_check_at = started_at
+    parts: List[str] = []
+    usage: Dict[str, Any] = {}
+    
+    chat_history = _chat_history(request, conversation)
+    source = await _open_chat_source(model, character_context, request.prompt, chat_history, usage, conversation)
+    
+    yield sse_event({
+        "character_id": request.character_id,
+        "model_provider": provider,
+        "model_name": model_name,
+        "conversation_id": conversation.id if conversation is not None else None
+    }, event="start")
+    
+    try:
+        async with aclosing(with_heartbeat(source, env_config.CHAT_STREAM_HEARTBEAT_INTERVAL)) as deltas:
+            async for delta in deltas:
+                now = time.perf_counter()
+                if http_request is not None and now - last_check_at >= env_config.CHAT_DISCONNECT_CHECK_INTERVAL:
+                    last_check_at = now
+                    if await http_request.is_disconnected():
+                        cancellation_tracker.record_cancelled("chat", "".join(parts))
+                        return
+                if delta is None:
+                    yield HEARTBEAT_FRAME
+                    continue
+                if first_token_at is None:
+                    first_token_at = now
+                parts.append(delta)
+                yield sse_event({"content": delta}, event="delta")
+    except (asyncio.CancelledError, GeneratorExit):
+        cancellation_tracker.record_cancelled("chat", "".join(parts))
+        raise
+    except AgentBusy as e:
+        # 响应已经开始，无法再返回503，通过错误事件告知客户端稍后重试
+        logger.warning(str(e))
+        yield sse_event({"detail": "角色正忙，请稍后重试"}, event="error")
+        return
+    except Exception as e:
+        logger.error(f"流式聊天生成失败: {str(e)}")
+        yield sse_event({"detail": "内部服务器错误"}, event="error")
+        return
+    
+    finished_at = time.perf_counter()
+    reply_length = sum(len(part) for part in parts)
+    cancellation_tracker.record_completed("chat", "".join(parts), usage)
+    # 只保存完整生成的回复
+    if conversation is not None:
+        conversation_store.append_exchange(conversation, request.prompt, "".join(parts))
+    await _sync_shared_state()
+    logger.info(f"流式聊天请求处理完成，回复长度: {reply_length} 字符")
+    
+    yield sse_event({
+        "character_id": request.character_id,
+        "reply_length": reply_length,
+        "usage": usage or None,
+        "timing": {
+            "ttft_ms": round((first_token_at - started_at) * 1000, 1) if first_token_at else None,
+            "total_ms": round((finished_at - started_at) * 1000, 1)
+        },
+        "timestamp": datetime.now()
+    }, event="done")
 
 # 为了兼容前端现有的API调用（/chat/send）
 @router.post("/send/legacy", response_model=ChatResponse)
@@ -179,7 +433,10 @@ async def character_chat_message(request: dict):
     """
     角色聊天接口，处理前端发送的角色聊天请求
     
-    前端调用格式：POST /api/chat/character/send { characterId, message, characterContext }
+    前端调用格式：POST /api/chat/character/send { characterId, message, characterContext, sessionId, conversationId }
+    
+    - **sessionId**: 用户或客户端会话标识（可选，提供时使用服务端会话和该会话的Agent记忆）
+    - **conversationId**: 服务端会话ID（可选，优先于sessionId，响应中返回供下一轮使用）
     """
     # 从请求体中获取数据
     character_id = request.get('characterId')
@@ -193,52 +450,80 @@ async def character_chat_message(request: dict):
     chat_request = ChatRequest(
         prompt=message,
         character_id=character_id,
-        character_context=CharacterContext(**character_context_data) if character_context_data else None
+        character_context=CharacterContext(**character_context_data) if character_context_data else None,
+        session_id=request.get('sessionId'),
+        conversation_id=request.get('conversationId')
     )
     
     # 调用主聊天接口
     return await send_chat_message(chat_request)
 
-# 获取聊天历史（模拟实现）
+# 获取聊天历史
 @router.get("/history/{character_id}", response_model=List[Message])
-async def get_chat_history(character_id: int):
+async def get_chat_history(
+    character_id: int,
+    session_id: Optional[str] = None,
+    conversation_id: Optional[str] = None,
+    offset: int = Query(0, ge=0, description="起始消息序号"),
+    limit: int = Query(50, ge=1, le=500, description="最多返回条数")
+):
     """
-    获取与指定角色的聊天历史
+    分页获取与指定角色的聊天历史（从旧到新）
     
     - **character_id**: 角色ID
+    - **session_id**: 用户或客户端会话标识
+    - **conversation_id**: 会话ID（优先于session_id，不存在时返回404，属于其他角色时返回400）
+    - **offset**: 起始消息序号
+    - **limit**: 最多返回条数
     """
-    # 注意：实际应用中应该从数据库或其他存储中获取历史记录
-    # 这里仅返回模拟数据
     logger.info(f"获取角色 {character_id} 的聊天历史")
     
-    # 模拟历史记录（实际应该从数据库获取）
-    return []
+    if conversation_id:
+        conversation = await _conversation_for(conversation_id, character_id)
+    elif session_id:
+        conversation = await conversation_store.afind(session_id, character_id)
+    else:
+        conversation = None
+    if conversation is None:
+        return []
+    
+    return [
+        Message(
+            id=turn.seq,
+            text=turn.content,
+            sender="user" if turn.role == "user" else "ai",
+            timestamp=datetime.fromtimestamp(turn.timestamp)
+        )
+        for turn in await conversation_store.apage(conversation, offset, limit)
+    ]
 
-# 清除聊天历史（模拟实现）
+# 清除聊天历史
 @router.delete("/history/{character_id}")
-async def clear_chat_history(character_id: int):
+async def clear_chat_history(character_id: int, session_id: Optional[str] = None):
     """
     清除与指定角色的聊天历史
     
     - **character_id**: 角色ID
+    - **session_id**: 用户或客户端会话标识（提供时只删除该会话及其Agent记忆，否则清除该角色的全部Agent）
     """
-    # 注意：实际应用中应该从数据库或其他存储中删除历史记录
     logger.info(f"清除角色 {character_id} 的聊天历史")
     
+    scope = None
+    if session_id:
+        conversation = await conversation_store.afind(session_id, character_id)
+        await conversation_store.adelete(session_id, character_id)
+        if conversation is None:
+            return {"status": "success", "message": "聊天历史已清除"}
+        scope = conversation.id
+    
     # 同时清除对应的Agent实例
     agent_manager = AgentManager.get_instance()
     
-    # 根据character_id查找角色名称
-    character_name = None
-    for char in characters_data:
-        if char['id'] == character_id:
-            character_name = char['name']
-            break
-    
-    # 如果找到了角色名称，清除对应的Agent实例
-    if character_name:
-        agent_manager.clear_agent(character_name)
-        logger.info(f"清除角色 {character_name} 的Agent实例")
+    # 根据character_id查找角色，找到时清除对应的Agent实例
+    character = character_registry.get(character_id)
+    if character:
+        await asyncio.to_thread(agent_manager.clear_agent, character["name"], scope)
+        logger.info(f"清除角色 {character['name']} 的Agent实例")
     
     return {"status": "success", "message": "聊天历史已清除"}
 
@@ -248,10 +533,11 @@ async def autonomous_action(request: dict):
     """
     触发角色的自主行动
     
-    前端调用格式：POST /api/chat/agent/autonomous-action { characterId, situation }
+    前端调用格式：POST /api/chat/agent/autonomous-action { characterId, situation, conversationId }
     
     - **characterId**: 角色ID
     - **situation**: 当前情境描述（可选）
+    - **conversationId**: 服务端会话ID（可选，提供时使用并更新该会话的Agent记忆）
     
     响应：
     - **reply**: 角色的自主行动描述
@@ -269,28 +555,23 @@ async def autonomous_action(request: dict):
         
         logger.info(f"触发角色 {character_id} 的自主行动，情境: {situation}")
         
-        # 获取角色信息
-        character = next((char for char in characters_data if char["id"] == character_id), None)
-        if not character:
+        # 获取角色目录中预先构建的角色上下文
+        character_context = character_registry.context(character_id)
+        if not character_context:
             raise HTTPException(status_code=404, detail="角色不存在")
         
-        # 创建角色上下文
-        character_context = CharacterContext(
-            name=character["name"],
-            description=character["description"],
-            avatar=character["avatar"],
-            category=character["category"]
-        )
-        
-        # 获取模型实例
-        model = ModelManager.get_model()
+        # 获取模型实例（相同情境的自主行动复用响应缓存）
+        model = ModelManager.get_model(cached=True)
         provider = env_config.DEFAULT_LLM_PROVIDER
         model_name = getattr(env_config, f"{provider.upper()}_MODEL", "default")
         
-        # 使用Agent执行自主行动
-        agent_manager = AgentManager.get_instance()
-        agent = agent_manager.get_agent(model, character_context)
-        autonomous_reply = agent.autonomous_action(situation)
+        # 使用Agent执行自主行动（记忆按服务端会话隔离）
+        conversation = None
+        if request.get('conversationId'):
+            conversation = await _conversation_for(request['conversationId'], character_id)
+        agent = await _get_agent(model, character_context, conversation)
+        autonomous_reply = await agent.aautonomous_action(situation, llm=model)
+        await _sync_shared_state()
         
         logger.info(f"角色自主行动完成")
         
@@ -303,6 +584,9 @@ async def autonomous_action(request: dict):
         
     except HTTPException as e:
         raise e
+    except AgentBusy as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail="角色正忙，请稍后重试")
     except Exception as e:
         logger.error(f"角色自主行动失败: {str(e)}")
         raise HTTPException(status_code=500, detail="内部服务器错误")
\ No newline at end of file
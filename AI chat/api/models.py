@@ -26,6 +26,9 @@ class ChatRequest(BaseModel):
     stream: bool = Field(False, description="是否使用流式响应")
     model_provider: Optional[str] = Field(None, description="模型提供商")
     model_name: Optional[str] = Field(None, description="模型名称")
+    use_cache: bool = Field(False, description="是否使用响应缓存（相同请求复用回复，并发的相同请求合并）")
+    session_id: Optional[str] = Field(None, description="用户或客户端会话标识，与character_id一起确定服务端保存的会话")
+    conversation_id: Optional[str] = Field(None, description="会话ID，提供时由服务端保存的会话重建聊天历史")
 
 class ChatResponse(BaseModel):
     """聊天响应"""
@@ -34,6 +37,7 @@ class ChatResponse(BaseModel):
     timestamp: datetime = Field(default_factory=datetime.now, description="时间戳")
     model_provider: str = Field(..., description="使用的模型提供商")
     model_name: str = Field(..., description="使用的模型名称")
+    conversation_id: Optional[str] = Field(None, description="服务端保存的会话ID，下一轮请求带上即可只发送新消息")
 
 class SpeechRecognitionRequest(BaseModel):
     """语音识别请求"""
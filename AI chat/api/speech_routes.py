@@ -1,5 +1,5 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form, BackgroundTasks, Request
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response
 import os
 import tempfile
 import logging
@@ -22,7 +22,11 @@ from speech.recognition import speech_recognizer
 from speech.tts import tts_engine
 from speech.audio_utils import audio_utils
 from speech.audio_converter import audio_converter
+from speech.streaming_recognition import recognition_sessions, SessionLimitExceeded
 from api.chat_routes import ModelManager
+from llm.cancellation import cancellation_tracker
+from config import env_config
+from utils.executors import executors, ExecutorSaturated
 
 # 创建路由实例
 router = APIRouter()
@@ -30,8 +34,52 @@ router = APIRouter()
 # 配置日志
 logger = logging.getLogger("ai_chat_service.api.speech")
 
-# 语音识别会话管理
-recognition_sessions: Dict[str, Dict] = {}
+async def _offload(executor_name: str, func, *args, **kwargs):
+    """
+    在专用执行器中运行阻塞的语音处理调用，避免阻塞事件循环
+    
+    参数:
+        executor_name: 执行器名称（asr, tts, audio）
+        func: 要执行的同步函数
+        *args, **kwargs: 函数参数
+    
+    返回:
+        函数返回值；执行器已满时返回503
+    """
+    try:
+        return await executors.run(executor_name, func, *args, **kwargs)
+    except ExecutorSaturated as e:
+        logger.warning(f"语音执行器已满: {e}")
+        raise HTTPException(status_code=503, detail="语音服务繁忙，请稍后重试")
+
+async def _until_disconnected(request: Request, awaitable):
+    """
+    等待awaitable完成，期间按CHAT_DISCONNECT_CHECK_INTERVAL轮询客户端是否断开
+    
+    参数:
+        request: HTTP请求
+        awaitable: 要等待的协程（如模型调用）
+    
+    返回:
+        (结果, 客户端是否已断开)；断开时取消awaitable（关闭上游连接），结果为None
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=env_config.CHAT_DISCONNECT_CHECK_INTERVAL)
+            if done:
+                return task.result(), False
+            if await request.is_disconnected():
+                break
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    return None, True
+
+def _client_gone() -> Response:
+    """客户端已断开时的响应（不会被读取，状态码同nginx的499）"""
+    return Response(status_code=499)
 
 
 # 音频格式转换接口
@@ -62,10 +110,12 @@ async def convert_audio_format(
         if target_format.lower() not in ['wav', 'webm', 'mp3']:
             raise HTTPException(status_code=400, detail=f"不支持的目标格式: {target_format}，支持的格式: wav, webm, mp3")
         
-        # 根据目标格式选择转换方法
+        # 根据目标格式选择转换方法（全部通过ffmpeg管道在内存中完成）
         if target_format.lower() == 'wav':
             # 转换任意格式到WAV
-            converted_path, error = audio_converter.convert_bytes_to_wav(
+            converted_bytes, error = await _offload(
+                "audio",
+                audio_converter.convert_bytes_to_wav_bytes,
                 audio_bytes=audio_bytes,
                 original_filename=file.filename,
                 sample_rate=sample_rate or env_config.AUDIO_SAMPLE_RATE,
@@ -74,56 +124,44 @@ async def convert_audio_format(
         elif target_format.lower() == 'webm':
             # 先转换为WAV，再转换为WebM
             # 第一步：转换为WAV
-            wav_path, error1 = audio_converter.convert_bytes_to_wav(
+            wav_bytes, error1 = await _offload(
+                "audio",
+                audio_converter.convert_bytes_to_wav_bytes,
                 audio_bytes=audio_bytes,
                 original_filename=file.filename,
                 sample_rate=sample_rate or env_config.AUDIO_SAMPLE_RATE,
                 channels=channels or env_config.AUDIO_CHANNELS
             )
             
-            if wav_path:
+            if wav_bytes:
                 # 第二步：转换为WebM
-                converted_path, error2 = audio_converter.wav_to_webm(
-                    input_data=wav_path,
+                converted_bytes, error = await _offload(
+                    "audio",
+                    audio_converter.wav_to_webm_bytes,
+                    input_data=wav_bytes,
                     quality="medium"
                 )
-                error = error2
             else:
-                converted_path = None
+                converted_bytes = None
                 error = error1
         else:  # mp3
-            # 对于MP3格式，直接使用pydub进行转换
-            import tempfile
-            fd, temp_path = tempfile.mkstemp(suffix='.mp3')
-            os.close(fd)
-            
-            try:
-                from pydub import AudioSegment
-                import io
-                
-                # 读取音频数据
-                audio = AudioSegment.from_file(io.BytesIO(audio_bytes))
-                
-                # 应用采样率和声道数设置
-                if sample_rate:
-                    audio = audio.set_frame_rate(sample_rate)
-                if channels:
-                    audio = audio.set_channels(channels)
-                
-                # 导出为MP3
-                audio.export(temp_path, format="mp3", bitrate="128k")
-                converted_path = temp_path
-                error = None
-                
-            except Exception as e:
-                converted_path = None
-                error = f"MP3转换失败: {str(e)}"
+            # 对于MP3格式，直接转码并应用采样率和声道数设置
+            converted_bytes, error = await _offload(
+                "audio",
+                audio_converter.transcode_bytes,
+                audio_bytes=audio_bytes,
+                original_filename=file.filename,
+                target_format="mp3",
+                sample_rate=sample_rate,
+                channels=channels,
+                bitrate="128k"
+            )
         
         if error:
             logger.error(f"音频格式转换失败: {error}")
             raise HTTPException(status_code=400, detail=error)
         
-        logger.info(f"音频格式转换成功: {converted_path}")
+        logger.info(f"音频格式转换成功，大小: {len(converted_bytes)} 字节")
         
         # 根据目标格式设置响应类型
         content_type_map = {
@@ -132,11 +170,12 @@ async def convert_audio_format(
             'mp3': 'audio/mpeg'
         }
         
-        # 返回转换后的音频文件
-        return FileResponse(
-            path=converted_path,
+        # 返回转换后的音频数据
+        filename = f"converted_{file.filename.rsplit('.', 1)[0]}.{target_format}"
+        return Response(
+            content=converted_bytes,
             media_type=content_type_map[target_format.lower()],
-            filename=f"converted_{file.filename.rsplit('.', 1)[0]}.{target_format}"
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
         )
         
     except HTTPException:
@@ -170,7 +209,12 @@ async def recognize_speech(
         audio_bytes = await file.read()
         
         # 调用语音识别模块
-        text, error = speech_recognizer.recognize_from_audio_bytes(audio_bytes)
+        text, error = await _offload(
+            "asr",
+            speech_recognizer.recognize_from_audio_bytes,
+            audio_bytes,
+            file.filename or "audio.unknown"
+        )
         
         if error:
             logger.error(f"语音识别失败: {error}")
@@ -184,6 +228,8 @@ async def recognize_speech(
             language=language
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"语音识别处理失败: {str(e)}")
         raise HTTPException(status_code=500, detail="内部服务器错误")
@@ -205,34 +251,22 @@ async def text_to_speech(
     try:
         logger.info(f"接收到文本转语音请求，文本长度: {len(request.text)} 字符")
         
-        # 创建临时文件保存音频
-        fd, temp_path = tempfile.mkstemp(suffix='.mp3')
-        os.close(fd)
+        # 调用TTS模块（相同文本直接从音频缓存返回）
+        audio_bytes, error = await _offload("tts", tts_engine.text_to_speech_bytes, request.text)
         
-        try:
-            # 调用TTS模块
-            audio_path, error = tts_engine.text_to_speech(
-                text=request.text,
-                save_path=temp_path,
-            )
-            
-            if error:
-                logger.error(f"文本转语音失败: {error}")
-                raise HTTPException(status_code=400, detail=error)
-            
-            # 返回音频文件
-            return FileResponse(
-                path=audio_path,
-                media_type="audio/mpeg",
-                filename=f"tts_output.mp3"
-            )
-            
-        finally:
-            # 注册后台任务清理临时文件
-            # 注意：由于FastAPI的限制，这里不能直接传递temp_path给background_tasks
-            # 实际应用中应该使用一个更复杂的清理机制
-            pass
+        if error:
+            logger.error(f"文本转语音失败: {error}")
+            raise HTTPException(status_code=400, detail=error)
+        
+        # 返回音频数据
+        return Response(
+            content=audio_bytes,
+            media_type="audio/mpeg",
+            headers={"Content-Disposition": 'attachment; filename="tts_output.mp3"'}
+        )
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"文本转语音处理失败: {str(e)}")
         raise HTTPException(status_code=500, detail="内部服务器错误")
@@ -240,6 +274,7 @@ async def text_to_speech(
 # 语音聊天接口（结合语音识别和LLM回复）
 @router.post("/voice-chat", responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
 async def voice_chat(
+    request: Request,
     file: UploadFile = File(...),
     character_id: int = Form(None),
     character_name: str = Form(None),
@@ -256,13 +291,21 @@ async def voice_chat(
     - **language**: 语言代码（默认：zh-CN）
     
     返回：AI回复的语音文件
+    
+    每个阶段之间检查客户端是否断开，模型生成期间按间隔轮询；断开后取消模型调用、
+    跳过语音合成，并计入取消统计
     """
     try:
         logger.info(f"接收到语音聊天请求")
         
         # 1. 语音识别
         audio_bytes = await file.read()
-        text, error = speech_recognizer.recognize_from_audio_bytes(audio_bytes)
+        text, error = await _offload(
+            "asr",
+            speech_recognizer.recognize_from_audio_bytes,
+            audio_bytes,
+            file.filename or "audio.unknown"
+        )
         
         if error:
             logger.error(f"语音识别失败: {error}")
@@ -270,6 +313,11 @@ async def voice_chat(
         
         logger.info(f"语音识别结果: {text}")
         
+        # 识别期间客户端已断开，不再生成回复
+        if await request.is_disconnected():
+            cancellation_tracker.record_cancelled("voice", "", 1)
+            return _client_gone()
+        
         # 2. 构建角色上下文
         character_context = None
         if character_name:
@@ -278,78 +326,130 @@ async def voice_chat(
                 "description": character_description or ""
             }
         
-        # 3. 调用LLM生成回复
+        # 3. 调用LLM生成回复（客户端断开时取消，关闭上游连接）
         model = ModelManager.get_model()
-        reply = model.generate_response(
+        usage = {}
+        reply, disconnected = await _until_disconnected(request, model.agenerate_response(
             prompt=text,
-            character_context=character_context
-        )
+            character_context=character_context,
+            usage_sink=usage
+        ))
+        if disconnected:
+            cancellation_tracker.record_cancelled("voice", "", 1)
+            return _client_gone()
         
         logger.info(f"AI回复生成完成: {reply}")
         
-        # 4. 将回复转换为语音
-        fd, temp_path = tempfile.mkstemp(suffix='.mp3')
-        os.close(fd)
+        # 生成回复后客户端已断开，跳过语音合成
+        if await request.is_disconnected():
+            cancellation_tracker.record_cancelled("voice", reply, 1)
+            return _client_gone()
+        cancellation_tracker.record_completed("voice", reply, usage)
         
-        try:
-            audio_path, error = tts_engine.text_to_speech(
-                text=reply,
-                save_path=temp_path
-            )
-            
-            if error:
-                logger.error(f"文本转语音失败: {error}")
-                raise HTTPException(status_code=400, detail=error)
-            
-            # 返回音频文件
-            return FileResponse(
-                path=audio_path,
-                media_type="audio/mpeg",
-                filename=f"ai_reply.mp3"
-            )
-            
-        finally:
-            # 注册后台任务清理临时文件
-            pass
+        # 4. 将回复转换为语音（相同回复直接从音频缓存返回）
+        audio_bytes, error = await _offload("tts", tts_engine.text_to_speech_bytes, reply)
+        
+        if error:
+            logger.error(f"文本转语音失败: {error}")
+            raise HTTPException(status_code=400, detail=error)
+        
+        # 返回音频数据
+        return Response(
+            content=audio_bytes,
+            media_type="audio/mpeg",
+            headers={"Content-Disposition": 'attachment; filename="ai_reply.mp3"'}
+        )
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"语音聊天处理失败: {str(e)}")
         raise HTTPException(status_code=500, detail="内部服务器错误")
 
 # 语音识别会话接口 - 开始
-@router.post("/start", responses={500: {"model": ErrorResponse}})
-async def start_voice_recognition():
+@router.post("/start", responses={400: {"model": ErrorResponse}, 503: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
+async def start_voice_recognition(audio_format: str = "webm"):
     """
-    开始语音识别会话
+    开始流式语音识别会话
+    
+    - **audio_format**: 音频块格式（查询参数，默认webm；支持webm、ogg、mp3、wav、flac、m4a，为空时自动检测）
+    
+    之后通过 /chunk 边录音边上传音频块，最后调用 /stop 取得识别结果
     
     返回:
     - **id**: 会话ID
     """
     try:
-        # 生成会话ID
-        session_id = str(uuid.uuid4())
-        
-        logger.info(f"开始语音识别会话: {session_id}")
-        
-        # 在实际应用中，这里应该初始化实时语音识别会话
-        # 目前我们只是创建一个会话记录
-        recognition_sessions[session_id] = {
-            "started_at": asyncio.get_event_loop().time(),
-            "status": "active"
-        }
-        
-        return {"id": session_id}
-        
+        input_format = None
+        if audio_format:
+            # 只把白名单中的格式传给ffmpeg
+            input_format = audio_converter.stream_format(audio_format)
+            if input_format is None:
+                supported = ", ".join(audio_converter.format_mapping)
+                raise HTTPException(status_code=400, detail=f"不支持的音频格式: {audio_format}，支持的格式: {supported}")
+        session = await _offload("audio", recognition_sessions.create, input_format)
+        return {"id": session.session_id}
+        
+    except SessionLimitExceeded as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail="语音服务繁忙，请稍后重试")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"启动语音识别会话失败: {str(e)}")
         raise HTTPException(status_code=500, detail="内部服务器错误")
 
+# 语音识别会话接口 - 上传音频块
+@router.post("/chunk", responses={400: {"model": ErrorResponse}, 413: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
+async def push_voice_chunk(request: Request, sessionId: str):
+    """
+    向识别会话追加一块录音
+    
+    - **sessionId**: 会话ID（查询参数）
+    - 请求体: 原始音频块（MediaRecorder的dataavailable数据）
+    
+    返回:
+    - **id**: 会话ID
+    - **text**: 目前已识别出的文本
+    """
+    try:
+        session = recognition_sessions.get(sessionId)
+        if session is None:
+            if not recognition_sessions.is_remote(sessionId):
+                raise HTTPException(status_code=400, detail="无效的会话ID")
+            # 会话在其他工作进程中，转交音频块（同样计入单会话音频上限）
+            chunk = await request.body()
+            text = await asyncio.to_thread(recognition_sessions.feed_remote, sessionId, chunk)
+            return {"id": sessionId, "text": text}
+        
+        chunk = await request.body()
+        if chunk:
+            await _offload("audio", recognition_sessions.feed, session, chunk)
+        return {"id": sessionId, "text": session.text()}
+        
+    except ValueError as e:
+        logger.warning(str(e))
+        await asyncio.to_thread(recognition_sessions.discard, sessionId)
+        raise HTTPException(status_code=413, detail="音频过长")
+    except RuntimeError as e:
+        # 会话已结束，或解码进程已退出（音频无法解码），释放会话占用的名额
+        logger.warning(str(e))
+        await asyncio.to_thread(recognition_sessions.discard, sessionId)
+        raise HTTPException(status_code=400, detail="无效的会话ID或音频无法解码")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"处理音频块失败: {str(e)}")
+        raise HTTPException(status_code=500, detail="内部服务器错误")
+
 # 语音识别会话接口 - 停止
 @router.post("/stop", responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
 async def stop_voice_recognition(request: Request):
     """
     停止语音识别会话并获取识别结果
     
+    前面的语音段在录音过程中已识别完毕，这里只需等待最后一段
+    
     请求体参数:
     - **sessionId**: 会话ID
     
@@ -366,22 +466,20 @@ async def stop_voice_recognition(request: Request):
         
         logger.info(f"停止语音识别会话: {session_id}")
         
-        # 检查会话是否存在
-        if session_id not in recognition_sessions:
+        if recognition_sessions.get(session_id) is None:
+            if not recognition_sessions.is_remote(session_id):
+                raise HTTPException(status_code=400, detail="无效的会话ID")
+            # 会话在其他工作进程中，由其结束会话并返回结果
+            text = await asyncio.to_thread(recognition_sessions.finish_remote, session_id)
+            if text is None:
+                raise HTTPException(status_code=400, detail="无效的会话ID")
+            return {"text": text}
+        
+        text = await _offload("audio", recognition_sessions.finish, session_id)
+        if text is None:
             raise HTTPException(status_code=400, detail="无效的会话ID")
         
-        # 更新会话状态
-        recognition_sessions[session_id]["status"] = "completed"
-        recognition_sessions[session_id]["completed_at"] = asyncio.get_event_loop().time()
-        
-        # 在实际应用中，这里应该获取实时语音识别的结果
-        # 目前我们返回一个模拟的识别结果
-        # 注意：在实际部署时，应该使用真实的语音识别功能
-        simulated_text = "介绍下以自己"
-        
-        logger.info(f"语音识别会话完成，结果: {simulated_text}")
-        
-        return {"text": simulated_text}
+        return {"text": text}
         
     except HTTPException:
         raise
@@ -0,0 +1,272 @@
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from api.models import ChatRequest
+from api.chat_routes import _resolve_chat_target, _resolve_conversation, _chat_history, _open_chat_source, _sync_shared_state
+from config import env_config
+from speech.audio_converter import audio_converter
+from speech.streaming_recognition import RecognitionSession, SessionLimitExceeded, recognition_sessions
+from speech.voice_pipeline import VoiceReplyPipeline
+from speech.tts import tts_engine
+from llm.agent import AgentBusy
+from llm.cancellation import cancellation_tracker
+from storage.conversation_store import conversation_store
+from utils.executors import executors, ExecutorSaturated
+
+# 创建路由实例
+router = APIRouter()
+
+# 配置日志
+logger = logging.getLogger("ai_chat_service.api.voice_ws")
+
+
+async def _synthesize(text: str) -> bytes:
+    """在TTS执行器中合成一句语音"""
+    audio_bytes, error = await executors.run("tts", tts_engine.text_to_speech_bytes, text)
+    if error:
+        raise RuntimeError(error)
+    return audio_bytes
+
+
+class _VoiceChatConnection:
+    """
+    一个全双工语音聊天连接
+
+    客户端 → 服务端：
+    - 文本 {"type": "start", ...}：设置角色和模型（字段同ChatRequest，可选audio_format：webm/ogg/mp3/wav/flac/m4a；带session_id时在服务端保存会话）
+    - 二进制帧：录音音频块（MediaRecorder输出的WebM/Opus）
+    - 文本 {"type": "end"}：本轮说话结束
+    - 文本 {"type": "text", "text": ...}：直接发送文字（跳过识别）
+    - 文本 {"type": "cancel"}：打断当前回复
+
+    服务端 → 客户端：
+    - {"type": "ready"}
+    - {"type": "transcript", "segment": n, "text": ...}：说话过程中每段的识别结果
+    - {"type": "user_text", "text": ...}：本轮完整识别结果
+    - {"type": "delta", "content": ...}：AI回复增量文本
+    - {"type": "sentence", "index": n, "text": ...}：送去合成的句子
+    - {"type": "audio", "index": n, "format": "mp3", "size": ...} 后紧跟一个二进制帧
+    - {"type": "done", "reply": ..., "usage": ..., "timing": ..., "conversation_id": ...}
+    - {"type": "error", "detail": ...}
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.loop = asyncio.get_running_loop()
+        self.outbound: asyncio.Queue = asyncio.Queue()
+        self.settings: Dict[str, Any] = {}
+        self.audio_format = "webm"
+        self.session: Optional[RecognitionSession] = None
+        self.reply_task: Optional[asyncio.Task] = None
+
+    def send(self, message):
+        """排队发送一条消息（字典发送为JSON，字节发送为二进制帧）"""
+        self.outbound.put_nowait(message)
+
+    async def _sender(self):
+        """单一发送协程，保证音频头和音频帧相邻"""
+        while True:
+            message = await self.outbound.get()
+            if isinstance(message, bytes):
+                await self.websocket.send_bytes(message)
+            else:
+                await self.websocket.send_text(json.dumps(message, ensure_ascii=False, default=str))
+
+    def _on_segment(self, index: int, text: Optional[str], error: Optional[str]):
+        """识别线程中的回调，转发到事件循环"""
+        if text:
+            self.loop.call_soon_threadsafe(self.send, {"type": "transcript", "segment": index, "text": text})
+
+    async def serve(self):
+        """处理连接直到客户端断开"""
+        sender = asyncio.ensure_future(self._sender())
+        self.send({"type": "ready"})
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    await self._on_audio(message["bytes"])
+                elif message.get("text") is not None:
+                    await self._on_command(message["text"])
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self._cancel_reply()
+            if self.session is not None:
+                await asyncio.to_thread(recognition_sessions.discard, self.session.session_id)
+                self.session = None
+            sender.cancel()
+            logger.info("语音聊天连接已关闭")
+
+    async def _on_audio(self, chunk: bytes):
+        """收到录音音频块"""
+        try:
+            if self.session is None:
+                # 用户开始说话时打断正在播放的回复
+                self._cancel_reply()
+                # 经会话管理器创建，计入会话数上限、单会话音频上限和空闲回收
+                self.session = await executors.run(
+                    "audio",
+                    recognition_sessions.create,
+                    self.audio_format,
+                    on_segment=self._on_segment
+                )
+            await executors.run("audio", recognition_sessions.feed, self.session, chunk)
+        except (ExecutorSaturated, SessionLimitExceeded):
+            self.send({"type": "error", "detail": "语音服务繁忙，请稍后重试"})
+        except ValueError:
+            # 本轮音频超过单会话上限，丢弃本轮
+            session, self.session = self.session, None
+            if session is not None:
+                await asyncio.to_thread(recognition_sessions.discard, session.session_id)
+            self.send({"type": "error", "detail": "音频过长"})
+        except RuntimeError as e:
+            # 会话已空闲过期或解码进程已退出，释放会话，下一块音频重新开始
+            logger.warning(str(e))
+            session, self.session = self.session, None
+            if session is not None:
+                await asyncio.to_thread(recognition_sessions.discard, session.session_id)
+            self.send({"type": "error", "detail": "识别会话已结束或音频无法解码"})
+        except Exception as e:
+            logger.error(f"处理音频块失败: {str(e)}")
+            self.send({"type": "error", "detail": "音频处理失败"})
+
+    async def _on_command(self, raw: str):
+        """收到文本命令"""
+        try:
+            command = json.loads(raw)
+        except ValueError:
+            self.send({"type": "error", "detail": "无效的消息格式"})
+            return
+
+        command_type = command.get("type")
+        if command_type == "start":
+            settings = {key: value for key, value in command.items() if key != "type"}
+            audio_format = audio_converter.stream_format(settings.pop("audio_format", None) or "webm")
+            if audio_format is None:
+                self.send({"type": "error", "detail": "不支持的音频格式"})
+                return
+            self.audio_format = audio_format
+            # 与/voice-chat一致，也可以直接传角色名称和描述
+            character_name = settings.pop("character_name", None)
+            character_description = settings.pop("character_description", None)
+            if character_name and not settings.get("character_context"):
+                settings["character_context"] = {
+                    "name": character_name,
+                    "description": character_description or ""
+                }
+            self.settings = settings
+            self.send({"type": "ready"})
+        elif command_type == "end":
+            await self._finish_utterance()
+        elif command_type == "text":
+            self._start_reply(command.get("text", ""), asr_ms=None)
+        elif command_type == "cancel":
+            self._cancel_reply()
+        else:
+            self.send({"type": "error", "detail": f"未知的消息类型: {command_type}"})
+
+    async def _finish_utterance(self):
+        """本轮说话结束：取得识别结果并开始回复"""
+        session, self.session = self.session, None
+        if session is None:
+            self.send({"type": "error", "detail": "没有收到音频"})
+            return
+
+        started_at = time.perf_counter()
+        try:
+            text = await executors.run("audio", recognition_sessions.finish, session.session_id)
+        except ExecutorSaturated:
+            await asyncio.to_thread(recognition_sessions.discard, session.session_id)
+            self.send({"type": "error", "detail": "语音服务繁忙，请稍后重试"})
+            return
+        if text is None:
+            self.send({"type": "error", "detail": "识别会话已过期"})
+            return
+        asr_ms = round((time.perf_counter() - started_at) * 1000, 1)
+
+        self.send({"type": "user_text", "text": text})
+        if not text:
+            self.send({"type": "error", "detail": "未识别到语音"})
+            return
+        self._start_reply(text, asr_ms)
+
+    def _start_reply(self, text: str, asr_ms: Optional[float]):
+        if not text.strip():
+            self.send({"type": "error", "detail": "消息不能为空"})
+            return
+        self._cancel_reply()
+        self.reply_task = asyncio.ensure_future(self._reply(text, asr_ms))
+
+    def _cancel_reply(self):
+        if self.reply_task is not None and not self.reply_task.done():
+            self.reply_task.cancel()
+        self.reply_task = None
+
+    async def _reply(self, text: str, asr_ms: Optional[float]):
+        """生成回复并逐句推送音频"""
+        usage: Dict[str, Any] = {}
+        pipeline: Optional[VoiceReplyPipeline] = None
+        try:
+            request = ChatRequest(prompt=text, **self.settings)
+            conversation = await _resolve_conversation(request)
+            model, _, _, character_context = _resolve_chat_target(request)
+            source = await _open_chat_source(
+                model, character_context, text, _chat_history(request, conversation), usage, conversation
+            )
+
+            pipeline = VoiceReplyPipeline(_synthesize, max_parallel=env_config.VOICE_WS_TTS_PARALLEL)
+            async for event in pipeline.run(source):
+                if event["type"] == "audio":
+                    audio = event["audio"]
+                    self.send({"type": "audio", "index": event["index"], "format": "mp3", "size": len(audio)})
+                    self.send(audio)
+                else:
+                    self.send(event)
+
+            cancellation_tracker.record_completed("voice", pipeline.reply, usage)
+            if conversation is not None:
+                conversation_store.append_exchange(conversation, text, pipeline.reply)
+            await _sync_shared_state()
+            timing = pipeline.timing()
+            timing["asr_ms"] = asr_ms
+            logger.info(f"语音回复完成，句子数: {pipeline.sentences}，耗时: {timing}")
+            self.send({
+                "type": "done",
+                "reply": pipeline.reply,
+                "usage": usage or None,
+                "timing": timing,
+                "conversation_id": conversation.id if conversation is not None else None
+            })
+        except asyncio.CancelledError:
+            # 用户打断或断开连接：流水线已关闭LLM流并取消排队的合成任务
+            if pipeline is not None:
+                cancellation_tracker.record_cancelled("voice", pipeline.reply, pipeline.syntheses_cancelled)
+            raise
+        except HTTPException as e:
+            self.send({"type": "error", "detail": e.detail})
+        except AgentBusy as e:
+            logger.warning(str(e))
+            self.send({"type": "error", "detail": "角色正忙，请稍后重试"})
+        except Exception as e:
+            logger.error(f"语音回复生成失败: {str(e)}")
+            self.send({"type": "error", "detail": "内部服务器错误"})
+
+
+# 全双工语音聊天接口
+@router.websocket("/ws")
+async def voice_chat_websocket(websocket: WebSocket):
+    """
+    全双工语音聊天（WebSocket）
+
+    边录音边识别，AI回复按句合成并推送，消息格式见 _VoiceChatConnection
+    """
+    await websocket.accept()
+    logger.info("语音聊天连接已建立")
+    await _VoiceChatConnection(websocket).serve()
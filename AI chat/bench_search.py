@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+角色搜索基准测试
+
+生成大量中英文混合的角色，报告：
+- 建立索引的耗时和增量更新（修改一个角色）的延迟
+- 各类关键词（单字、两字、完整名称、拉丁文字前缀、多个词、分类过滤）的查询p50/p99延迟
+- 与原来逐个角色做子串匹配的线性扫描对比
+
+用法：
+    python bench_search.py [--characters 100000] [--queries 2000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from storage.character_registry import CharacterRegistry
+
+_SURNAMES = "赵钱孙李周吴郑王冯陈褚卫蒋沈韩杨朱秦尤许何吕施张孔曹严华金魏陶姜"
+_GIVEN = "明华强伟芳娜敏静丽军磊洋勇艳杰娟涛超秀霞平刚桂英龙凤云飞雪梅兰竹菊"
+_ROLES = ["剑客", "魔法师", "侦探", "哲学家", "诗人", "将军", "医生", "画家", "商人", "学者", "神仙", "妖怪"]
+_PLACES = ["长安", "江南", "蜀山", "东海", "昆仑", "伦敦", "巴黎", "霍格沃茨", "大漠", "皇宫"]
+_LATIN = ["Arthur", "Merlin", "Sherlock", "Watson", "Alice", "Luna", "Victor", "Elena", "Oscar", "Nova"]
+_CATEGORIES = ["fiction", "historical", "mythology", "anime", "game", "original"]
+
+
+def _character(rng):
+    if rng.random() < 0.3:
+        name = f"{rng.choice(_LATIN)} {rng.choice(_LATIN)}{rng.randrange(1000)}"
+    else:
+        name = rng.choice(_SURNAMES) + "".join(rng.choice(_GIVEN) for _ in range(rng.randint(1, 2)))
+    description = f"来自{rng.choice(_PLACES)}的{rng.choice(_ROLES)}，擅长{rng.choice(_ROLES)}的技艺"
+    return {"name": name, "description": description, "category": rng.choice(_CATEGORIES), "avatar": "🎭"}
+
+
+def _linear_search(characters, q):
+    """原来的实现：逐个角色做子串匹配"""
+    return [
+        char for char in characters
+        if q.lower() in char["name"].lower() or q.lower() in char["description"].lower()
+    ]
+
+
+def _percentile(samples, percentile):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+def _report(name, samples, totals):
+    print(
+        f"{name}: p50 {_percentile(samples, 50) * 1000:.3f}ms, "
+        f"p99 {_percentile(samples, 99) * 1000:.3f}ms, "
+        f"平均匹配 {sum(totals) / len(totals):,.0f} 个"
+    )
+
+
+def run(count: int, queries: int):
+    rng = random.Random(42)
+    characters = [_character(rng) for _ in range(count)]
+
+    started_at = time.perf_counter()
+    registry = CharacterRegistry(characters)
+    print(f"建立 {count} 个角色的目录和索引: {time.perf_counter() - started_at:.2f}s")
+    stats = registry.stats()["search"]
+    print(f"gram数 {stats['grams']:,}，倒排表总长度 {stats['postings']:,}")
+
+    names = [char["name"] for char in registry.all()]
+    workloads = {
+        "单字": lambda: rng.choice(_SURNAMES),
+        "两字": lambda: rng.choice(_SURNAMES) + rng.choice(_GIVEN),
+        "完整名称": lambda: rng.choice(names),
+        "拉丁文字前缀": lambda: rng.choice(_LATIN)[:rng.randint(2, 4)].lower(),
+        "多个词": lambda: f"{rng.choice(_PLACES)} {rng.choice(_ROLES)}",
+        "描述中的常见词": lambda: rng.choice(_ROLES),
+    }
+    for name, make_query in workloads.items():
+        samples, totals = [], []
+        for _ in range(queries):
+            q = make_query()
+            started_at = time.perf_counter()
+            _, total = registry.search(q, limit=20)
+            samples.append(time.perf_counter() - started_at)
+            totals.append(total)
+        _report(name, samples, totals)
+
+    samples, totals = [], []
+    for _ in range(queries):
+        q = rng.choice(_SURNAMES) + rng.choice(_GIVEN)
+        started_at = time.perf_counter()
+        _, total = registry.search(q, categories=[rng.choice(_CATEGORIES)], limit=20)
+        samples.append(time.perf_counter() - started_at)
+        totals.append(total)
+    _report("两字 + 分类过滤", samples, totals)
+
+    samples = []
+    for _ in range(min(queries, 200)):
+        q = rng.choice(_SURNAMES) + rng.choice(_GIVEN)
+        started_at = time.perf_counter()
+        _linear_search(characters, q)
+        samples.append(time.perf_counter() - started_at)
+    print(
+        f"线性扫描（原实现，两字）: p50 {_percentile(samples, 50) * 1000:.3f}ms, "
+        f"p99 {_percentile(samples, 99) * 1000:.3f}ms"
+    )
+
+    samples = []
+    for _ in range(queries):
+        character_id = rng.randrange(1, count + 1)
+        started_at = time.perf_counter()
+        registry.add({**registry.get(character_id), "description": _character(rng)["description"]})
+        samples.append(time.perf_counter() - started_at)
+    print(
+        f"修改一个角色（含索引更新）: p50 {_percentile(samples, 50) * 1000:.3f}ms, "
+        f"p99 {_percentile(samples, 99) * 1000:.3f}ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="角色搜索基准测试")
+    parser.add_argument("--characters", type=int, default=100000, help="角色数")
+    parser.add_argument("--queries", type=int, default=2000, help="每类关键词的查询次数")
+    args = parser.parse_args()
+    run(args.characters, args.queries)
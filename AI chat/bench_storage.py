@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite持久化基准测试
+
+通过ConversationStore向临时数据库写入大量会话消息，报告：
+- 请求路径上的追加速率（只入队）和包含提交的持久化速率
+- 重启后（新的内存存储）延迟加载会话、读取最近消息和分页读取历史的p50/p99延迟
+
+用法：
+    python bench_storage.py [--turns 1000000] [--conversations 1000] [--reads 5000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from storage.conversation_store import ConversationStore
+from storage.sqlite_store import SQLiteStore
+
+
+def _percentile(samples, percentile):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+def _report(name, samples):
+    print(
+        f"{name}: p50 {_percentile(samples, 50) * 1000:.3f}ms, "
+        f"p99 {_percentile(samples, 99) * 1000:.3f}ms, "
+        f"max {max(samples) * 1000:.3f}ms"
+    )
+
+
+def run(turns: int, conversation_count: int, reads: int, batch_size: int):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        store = SQLiteStore(path, batch_size=batch_size)
+        conversations = ConversationStore(max_conversations=conversation_count, max_turns=100, store=store)
+        targets = [conversations.get_or_create(f"user-{i}", i % 50) for i in range(conversation_count)]
+        store.flush()
+
+        text = "今天天气不错，我们去公园散步吧。" * 3
+        started_at = time.perf_counter()
+        for i in range(turns):
+            conversations.append(targets[i % conversation_count], "user" if i % 2 == 0 else "assistant", text)
+        enqueued_at = time.perf_counter()
+        store.flush()
+        flushed_at = time.perf_counter()
+
+        stats = store.stats()
+        print(f"写入 {turns} 条消息到 {conversation_count} 个会话")
+        print(f"追加（请求路径，只入队）: {turns / (enqueued_at - started_at):,.0f} 条/秒")
+        print(f"持久化（包含提交）: {turns / (flushed_at - started_at):,.0f} 条/秒")
+        print(f"提交批次: {stats['batches']}，平均每批 {stats['avg_batch_size']} 个写操作，错误 {stats['errors']}")
+        print(f"数据库大小: {os.path.getsize(path) / 1024 / 1024:.1f} MB（不含WAL）")
+
+        # 模拟重启：内存中没有任何会话，且只能容纳十分之一，多数访问都从数据库延迟加载
+        restarted = ConversationStore(max_conversations=max(1, conversation_count // 10), max_turns=100, store=store)
+        per_conversation = turns // conversation_count
+        load_samples, recent_samples, page_samples = [], [], []
+        for _ in range(reads):
+            target = random.choice(targets)
+
+            started_at = time.perf_counter()
+            conversation = restarted.get(target.id)
+            load_samples.append(time.perf_counter() - started_at)
+
+            started_at = time.perf_counter()
+            conversation.recent(40)
+            recent_samples.append(time.perf_counter() - started_at)
+
+            offset = random.randrange(max(1, per_conversation - 100))
+            started_at = time.perf_counter()
+            restarted.page(conversation, offset, 50)
+            page_samples.append(time.perf_counter() - started_at)
+
+        print(f"读取 {reads} 次（{conversation_count} 个会话随机访问）")
+        _report("获取会话（约90%需从数据库加载）", load_samples)
+        _report("最近40条消息", recent_samples)
+        _report("分页读取历史50条", page_samples)
+        store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite持久化基准测试")
+    parser.add_argument("--turns", type=int, default=1000000, help="写入的消息总数")
+    parser.add_argument("--conversations", type=int, default=1000, help="会话数")
+    parser.add_argument("--reads", type=int, default=5000, help="读取次数")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每个事务最多提交的写操作数")
+    args = parser.parse_args()
+    run(args.turns, args.conversations, args.reads, args.batch_size)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+转码工作进程池基准测试
+
+把同一段WebM/Opus录音解码为16kHz单声道PCM，比较两种方式：
+- 直接在调用线程中启动ffmpeg（ffmpeg_pipe.transcode，即关闭工作进程池时的路径）
+- 提交到常驻转码工作进程池（speech.transcode_pool）
+
+多个线程并发转码，报告吞吐量和p50/p99延迟。主进程可以先占用一块内存，
+模拟常驻内存较大的服务进程（启动子进程的开销与父进程内存有关）。
+
+用法：
+    python bench_transcode.py [--jobs 200] [--concurrency 4] [--workers 2] [--ballast-mb 0] [--seconds 3]
+"""
+
+import argparse
+import math
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from speech import ffmpeg_pipe
+from speech.transcode_pool import TranscodePool
+
+
+def _percentile(samples, percentile):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+def _recording(seconds, sample_rate=48000):
+    """一段正弦波录音，编码为WebM/Opus"""
+    pcm = b"".join(
+        struct.pack("<h", int(8000 * math.sin(2 * math.pi * 440 * i / sample_rate)))
+        for i in range(int(sample_rate * seconds))
+    )
+    return ffmpeg_pipe.encode_pcm(pcm, sample_rate, 1, "webm", codec="libopus")
+
+
+def _run(name, transcode, webm, jobs, concurrency):
+    def one(_):
+        started_at = time.perf_counter()
+        pcm = transcode(webm, input_format="webm", output_format="s16le", sample_rate=16000, channels=1)
+        assert pcm
+        return time.perf_counter() - started_at
+
+    # 预热（工作进程池在此时启动工作进程）
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(one, range(concurrency)))
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        samples = list(executor.map(one, range(jobs)))
+    elapsed = time.perf_counter() - started_at
+    print(
+        f"{name}: {jobs / elapsed:.1f} 次/秒, "
+        f"p50 {_percentile(samples, 50) * 1000:.1f}ms, "
+        f"p99 {_percentile(samples, 99) * 1000:.1f}ms"
+    )
+    return jobs / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="转码工作进程池基准测试")
+    parser.add_argument("--jobs", type=int, default=200, help="转码次数")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发线程数")
+    parser.add_argument("--workers", type=int, default=2, help="工作进程数")
+    parser.add_argument("--ballast-mb", type=int, default=0, help="主进程额外占用的内存（MB）")
+    parser.add_argument("--seconds", type=float, default=3, help="录音时长（秒）")
+    args = parser.parse_args()
+
+    # 写入每一页，保证内存真正计入常驻内存
+    ballast = bytearray(args.ballast_mb * 1024 * 1024)
+    for offset in range(0, len(ballast), 4096):
+        ballast[offset] = 1
+
+    webm = _recording(args.seconds)
+    print(f"录音{args.seconds}秒（{len(webm)}字节），{args.jobs}次，并发{args.concurrency}，主进程额外内存{args.ballast_mb}MB")
+
+    inline = _run("直接启动ffmpeg", ffmpeg_pipe.transcode, webm, args.jobs, args.concurrency)
+    pool = TranscodePool(size=args.workers, max_jobs_per_worker=10 ** 6, queue_size=args.jobs, job_timeout=30)
+    try:
+        pooled = _run(f"工作进程池（{args.workers}个进程）", pool.transcode, webm, args.jobs, args.concurrency)
+    finally:
+        pool.shutdown()
+    print(f"工作进程池吞吐量为直接启动的 {pooled / inline:.2f} 倍")
+
+
+if __name__ == "__main__":
+    main()
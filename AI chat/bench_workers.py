@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多工作进程基准测试
+
+用 uvicorn --workers N 启动只包含聊天路由的服务（共享SQLite状态后端和持久化），
+模拟多个用户各自连续发送多轮消息（只发送新消息，由服务端会话重建历史），报告：
+- 不同工作进程数下的吞吐量和p50/p99延迟
+- 一致性：每个用户的全部轮次都写入了同一个会话（请求轮流落到不同进程）
+
+模型用不调用上游的BenchLLM代替：每次回复先占用CPU一段时间（模拟提示构建、
+分词等进程内计算），再等待一段时间（模拟上游延迟）。
+
+用法：
+    python bench_workers.py [--workers 1 2 4] [--users 32] [--turns 20] [--cpu-ms 5] [--io-ms 50]
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+
+
+def _percentile(samples, percentile):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+def _create_app():
+    """工作进程中导入本模块时创建的应用"""
+    from fastapi import FastAPI
+
+    from llm.base import LLMBase
+    from api.chat_routes import router as chat_router, ModelManager
+    from storage.sqlite_store import sqlite_store
+
+    cpu_seconds = float(os.environ.get("BENCH_CPU_MS", "5")) / 1000
+    io_seconds = float(os.environ.get("BENCH_IO_MS", "50")) / 1000
+
+    class BenchLLM(LLMBase):
+        """不调用上游的模型"""
+
+        model = "bench"
+
+        def generate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+            return f"收到（历史{len(chat_history or [])}条）"
+
+        def generate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+            yield self.generate_response(prompt, character_context, chat_history)
+
+        async def agenerate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+            deadline = time.perf_counter() + cpu_seconds
+            while time.perf_counter() < deadline:
+                pass
+            await asyncio.sleep(io_seconds)
+            return self.generate_response(prompt, character_context, chat_history)
+
+    ModelManager._models["bench"] = BenchLLM()
+
+    bench_app = FastAPI()
+    bench_app.include_router(chat_router, prefix="/api/chat")
+
+    @bench_app.on_event("shutdown")
+    async def shutdown_sqlite_store():
+        if sqlite_store is not None:
+            sqlite_store.close()
+
+    return bench_app
+
+
+if os.environ.get("BENCH_WORKER"):
+    app = _create_app()
+
+
+async def _user(client, index, turns, same_character, latencies):
+    """一个用户连续发送turns轮消息，返回会话ID"""
+    conversation_id = None
+    name = "bench-shared" if same_character else f"bench-{index}"
+    for turn in range(turns):
+        payload = {
+            "prompt": f"第{turn}句",
+            "model_provider": "bench",
+            "character_context": {"name": name},
+            "session_id": f"user-{index}"
+        }
+        if conversation_id:
+            payload["conversation_id"] = conversation_id
+        started_at = time.perf_counter()
+        response = await client.post("/api/chat/send", json=payload)
+        latencies.append(time.perf_counter() - started_at)
+        response.raise_for_status()
+        conversation_id = response.json()["conversation_id"]
+    return conversation_id
+
+
+async def _drive(port, users, turns, same_character):
+    limits = httpx.Limits(max_connections=users)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=300, limits=limits) as client:
+        latencies = []
+        started_at = time.perf_counter()
+        conversation_ids = await asyncio.gather(*[
+            _user(client, i, turns, same_character, latencies) for i in range(users)
+        ])
+        elapsed = time.perf_counter() - started_at
+
+        # 每个会话都应有 2 * turns 条消息
+        consistent = 0
+        for conversation_id in conversation_ids:
+            response = await client.get(
+                "/api/chat/history/0",
+                params={"conversation_id": conversation_id, "limit": 500}
+            )
+            if len(response.json()) == 2 * turns:
+                consistent += 1
+        return elapsed, latencies, consistent
+
+
+async def _wait_ready(port, process):
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+        for _ in range(300):
+            if process.poll() is not None:
+                raise RuntimeError("服务启动失败")
+            try:
+                await client.get("/api/chat/history/0")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("服务启动超时")
+
+
+def run(worker_counts, users, turns, cpu_ms, io_ms, same_character, port):
+    print(f"{users} 个用户 × {turns} 轮，每轮CPU {cpu_ms}ms + 等待 {io_ms}ms，CPU核数 {os.cpu_count()}")
+    for workers in worker_counts:
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(
+                os.environ,
+                BENCH_WORKER="1",
+                BENCH_CPU_MS=str(cpu_ms),
+                BENCH_IO_MS=str(io_ms),
+                STATE_BACKEND="sqlite",
+                STATE_BACKEND_PATH=os.path.join(directory, "state.db"),
+                STORAGE_SQLITE_PATH=os.path.join(directory, "data.db")
+            )
+            process = subprocess.Popen(
+                [
+                    sys.executable, "-m", "uvicorn", "bench_workers:app",
+                    "--workers", str(workers), "--port", str(port), "--log-level", "warning"
+                ],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=env
+            )
+            try:
+                asyncio.run(_wait_ready(port, process))
+                elapsed, latencies, consistent = asyncio.run(_drive(port, users, turns, same_character))
+            finally:
+                process.terminate()
+                process.wait(30)
+
+        print(
+            f"{workers} 个工作进程: {len(latencies) / elapsed:,.1f} 请求/秒，"
+            f"p50 {_percentile(latencies, 50) * 1000:.1f}ms，"
+            f"p99 {_percentile(latencies, 99) * 1000:.1f}ms，"
+            f"会话完整 {consistent}/{users}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多工作进程基准测试")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="依次测试的工作进程数")
+    parser.add_argument("--users", type=int, default=32, help="并发用户数")
+    parser.add_argument("--turns", type=int, default=20, help="每个用户发送的轮数")
+    parser.add_argument("--cpu-ms", type=float, default=5, help="每轮回复占用的CPU时间（毫秒）")
+    parser.add_argument("--io-ms", type=float, default=50, help="每轮回复等待的上游时间（毫秒）")
+    parser.add_argument("--same-character", action="store_true", help="所有用户与同一个角色对话（记忆按会话隔离，各自使用自己的Agent）")
+    parser.add_argument("--port", type=int, default=8765, help="服务端口")
+    args = parser.parse_args()
+    run(args.workers, args.users, args.turns, args.cpu_ms, args.io_ms, args.same_character, args.port)
@@ -9,11 +9,14 @@ class Config:
     HOST = os.getenv('HOST', '0.0.0.0')
     PORT = int(os.getenv('PORT', '8000'))
     DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
+    # 管理接口中会修改状态的操作需要在X-Admin-Token请求头中带上该令牌；为空时只允许本机访问
+    ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
     
     # OpenAI 配置
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
     OPENAI_TEMPERATURE = float(os.getenv('OPENAI_TEMPERATURE', '0.7'))
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
     
     # Ollama 配置（本地模型）
     OLLAMA_BASE_URL = os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
@@ -38,6 +41,27 @@ class Config:
     TTS_MODEL = os.getenv("TTS_MODEL", "tts")
     TTS_LANG = os.getenv("TTS_LANG", "zh-CN")
     TTS_SLOW = os.getenv("TTS_SLOW", "False").lower() == "true"
+    TTS_VOICE_TYPE = os.getenv("TTS_VOICE_TYPE", "zh_male_M392_conversation_wvae_bigtts")
+    TTS_SPEED = float(os.getenv("TTS_SPEED", "1.0"))
+    TTS_REQUEST_TIMEOUT = float(os.getenv("TTS_REQUEST_TIMEOUT", "30"))
+    TTS_PROBE_ON_STARTUP = os.getenv("TTS_PROBE_ON_STARTUP", "True").lower() == "true"
+    TTS_PROBE_TIMEOUT = float(os.getenv("TTS_PROBE_TIMEOUT", "5"))
+    TTS_PROBE_WAIT = float(os.getenv("TTS_PROBE_WAIT", "10"))
+    TTS_FAILURE_TTL = float(os.getenv("TTS_FAILURE_TTL", "300"))
+    TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "True").lower() == "true"
+    TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+    TTS_CACHE_MEMORY_MB = float(os.getenv("TTS_CACHE_MEMORY_MB", "32"))
+    TTS_CACHE_DISK_MB = float(os.getenv("TTS_CACHE_DISK_MB", "1024"))
+    
+    # 流式聊天配置
+    CHAT_STREAM_HEARTBEAT_INTERVAL = float(os.getenv("CHAT_STREAM_HEARTBEAT_INTERVAL", "15"))
+    CHAT_DISCONNECT_CHECK_INTERVAL = float(os.getenv("CHAT_DISCONNECT_CHECK_INTERVAL", "1"))  # 检查客户端是否断开的最小间隔（秒）
+    
+    # 出站HTTP连接池配置
+    HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))
+    HTTP_POOL_HOST_SIZES = os.getenv("HTTP_POOL_HOST_SIZES", "")  # 例如: openai.qiniu.com=32,api.qnaigc.com=8
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+    HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "True").lower() == "true"
     
     # 语音识别配置
     SPEECH_RECOGNITION_LANGUAGE = os.getenv('SPEECH_RECOGNITION_LANGUAGE', 'zh-CN')
@@ -49,6 +73,91 @@ class Config:
     AUDIO_SAMPLE_RATE = 16000
     AUDIO_CHANNELS = 1
     AUDIO_CHUNK_SIZE = 1024
+    AUDIO_TRANSCODE_TIMEOUT = float(os.getenv("AUDIO_TRANSCODE_TIMEOUT", "30"))  # 单次ffmpeg转码超时（秒）
+    
+    # 常驻转码工作进程池配置（默认关闭，开启前先用bench_transcode.py在目标机器上对比）
+    AUDIO_TRANSCODE_POOL_ENABLED = os.getenv("AUDIO_TRANSCODE_POOL_ENABLED", "False").lower() == "true"
+    AUDIO_TRANSCODE_WORKERS = int(os.getenv("AUDIO_TRANSCODE_WORKERS", "2"))
+    AUDIO_TRANSCODE_MAX_JOBS = int(os.getenv("AUDIO_TRANSCODE_MAX_JOBS", "500"))  # 每个工作进程处理多少个任务后重启
+    AUDIO_TRANSCODE_QUEUE_SIZE = int(os.getenv("AUDIO_TRANSCODE_QUEUE_SIZE", "64"))
+    
+    # 语音执行器配置（并发上限 / 排队上限），与文本聊天使用的默认线程池相互隔离
+    ASR_EXECUTOR_WORKERS = int(os.getenv("ASR_EXECUTOR_WORKERS", "4"))
+    ASR_EXECUTOR_QUEUE = int(os.getenv("ASR_EXECUTOR_QUEUE", "16"))
+    TTS_EXECUTOR_WORKERS = int(os.getenv("TTS_EXECUTOR_WORKERS", "4"))
+    TTS_EXECUTOR_QUEUE = int(os.getenv("TTS_EXECUTOR_QUEUE", "16"))
+    AUDIO_EXECUTOR_WORKERS = int(os.getenv("AUDIO_EXECUTOR_WORKERS", "4"))
+    AUDIO_EXECUTOR_QUEUE = int(os.getenv("AUDIO_EXECUTOR_QUEUE", "16"))
+    DSP_PROCESS_WORKERS = int(os.getenv("DSP_PROCESS_WORKERS", "2"))
+    DSP_PROCESS_QUEUE = int(os.getenv("DSP_PROCESS_QUEUE", "32"))
+    
+    # 流式语音识别配置（能量端点检测）
+    STREAMING_ASR_ENERGY_THRESHOLD = float(os.getenv("STREAMING_ASR_ENERGY_THRESHOLD", "300"))
+    STREAMING_ASR_SILENCE_MS = int(os.getenv("STREAMING_ASR_SILENCE_MS", "600"))
+    STREAMING_ASR_MAX_SEGMENT_SECONDS = float(os.getenv("STREAMING_ASR_MAX_SEGMENT_SECONDS", "15"))
+    STREAMING_ASR_SESSION_TTL = float(os.getenv("STREAMING_ASR_SESSION_TTL", "60"))  # 会话空闲多久后回收（秒）
+    STREAMING_ASR_MAX_SESSIONS = int(os.getenv("STREAMING_ASR_MAX_SESSIONS", "100"))
+    STREAMING_ASR_MAX_SESSION_MB = float(os.getenv("STREAMING_ASR_MAX_SESSION_MB", "20"))
+    
+    # WebSocket语音聊天：同时合成的句子数
+    VOICE_WS_TTS_PARALLEL = int(os.getenv("VOICE_WS_TTS_PARALLEL", "2"))
+    
+    # 上下文窗口配置：按token预算裁剪对话历史
+    LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "8192"))  # 未单独配置的模型的上下文长度
+    LLM_MODEL_CONTEXT_TOKENS = os.getenv("LLM_MODEL_CONTEXT_TOKENS", "gpt-3.5-turbo=16385,deepseek/deepseek-v3.1-terminus=131072")
+    LLM_RESERVED_COMPLETION_TOKENS = int(os.getenv("LLM_RESERVED_COMPLETION_TOKENS", "1024"))
+    LLM_MAX_PROMPT_TOKENS = int(os.getenv("LLM_MAX_PROMPT_TOKENS", "6000"))  # 提示token上限，0为只受上下文长度限制
+    LLM_CONTEXT_POLICY = os.getenv("LLM_CONTEXT_POLICY", "drop")  # drop 或 summarize
+    
+    # 上游端点健康跟踪：主URL和备用URL按延迟和错误率选择，故障端点熔断
+    ENDPOINT_EWMA_ALPHA = float(os.getenv("ENDPOINT_EWMA_ALPHA", "0.2"))  # EWMA平滑系数
+    ENDPOINT_FAILURE_THRESHOLD = int(os.getenv("ENDPOINT_FAILURE_THRESHOLD", "3"))  # 连续失败多少次后熔断
+    ENDPOINT_ERROR_RATE_THRESHOLD = float(os.getenv("ENDPOINT_ERROR_RATE_THRESHOLD", "0.5"))
+    ENDPOINT_MIN_SAMPLES = int(os.getenv("ENDPOINT_MIN_SAMPLES", "10"))  # 按错误率熔断前至少需要的请求数
+    ENDPOINT_OPEN_SECONDS = float(os.getenv("ENDPOINT_OPEN_SECONDS", "30"))  # 熔断后多久放行试探请求
+    
+    # 对冲请求：非流式DeepSeek调用超过近期延迟分位数仍未返回时，向下一个端点发出对冲请求
+    LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "True").lower() == "true"
+    LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+    LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.05"))  # 对冲请求占请求总数的比例上限
+    LLM_HEDGE_WINDOW = int(os.getenv("LLM_HEDGE_WINDOW", "200"))  # 计算分位数使用的最近请求数
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+    
+    # LLM响应缓存：相同请求复用结果，并发的相同请求合并为一次上游调用（只对显式开启缓存的路由生效）
+    LLM_RESPONSE_CACHE_ENABLED = os.getenv("LLM_RESPONSE_CACHE_ENABLED", "True").lower() == "true"
+    LLM_RESPONSE_CACHE_SIZE = int(os.getenv("LLM_RESPONSE_CACHE_SIZE", "1000"))
+    LLM_RESPONSE_CACHE_TTL = float(os.getenv("LLM_RESPONSE_CACHE_TTL", "300"))  # 缓存有效期（秒）
+    
+    # 会话存储配置：服务端保存对话，客户端每轮只上传新消息
+    CONVERSATION_MAX_CONVERSATIONS = int(os.getenv("CONVERSATION_MAX_CONVERSATIONS", "10000"))
+    CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "1000"))  # 每个会话在内存中保留的消息数
+    CONVERSATION_CONTEXT_MESSAGES = int(os.getenv("CONVERSATION_CONTEXT_MESSAGES", "40"))  # 重建上下文时取最近的消息数
+    
+    # SQLite持久化配置：保存Agent状态和会话，路径为空时不启用；写入由后台线程成批提交
+    STORAGE_SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", "")
+    STORAGE_SQLITE_BATCH_SIZE = int(os.getenv("STORAGE_SQLITE_BATCH_SIZE", "1000"))  # 每个事务最多提交的写操作数
+    STORAGE_SQLITE_FLUSH_INTERVAL = float(os.getenv("STORAGE_SQLITE_FLUSH_INTERVAL", "0.05"))  # 写入线程空闲时的等待时间（秒）
+    
+    # 共享状态后端：memory为进程内（单进程部署），sqlite为多个工作进程共享同一个数据库文件
+    # 多进程部署时Agent和会话还需要启用SQLite持久化（STORAGE_SQLITE_PATH）
+    STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+    STATE_BACKEND_PATH = os.getenv("STATE_BACKEND_PATH", "data/shared_state.db")
+    
+    # 角色Agent缓存配置：最多保留的Agent数和空闲回收时间（秒）
+    AGENT_MAX_AGENTS = int(os.getenv("AGENT_MAX_AGENTS", "1000"))
+    AGENT_IDLE_TTL = float(os.getenv("AGENT_IDLE_TTL", "1800"))
+    AGENT_MEMORY_SIZE = int(os.getenv("AGENT_MEMORY_SIZE", "500"))  # 每个Agent最多保存的记忆条数
+    AGENT_MEMORY_MAX_KB = float(os.getenv("AGENT_MEMORY_MAX_KB", "0"))  # 每个Agent记忆的字节预算，0为不限制
+    AGENT_MEMORY_RECALL_K = int(os.getenv("AGENT_MEMORY_RECALL_K", "5"))  # 每轮放入提示的相关记忆条数
+    AGENT_TURN_WAIT_TIMEOUT = float(os.getenv("AGENT_TURN_WAIT_TIMEOUT", "30"))  # 等待同一Agent上一轮对话结束的最长时间（秒），超过时返回503
+    
+    # 滚动对话摘要配置：未摘要的轮次达到阈值时，在后台把较早的轮次折叠进摘要
+    AGENT_SUMMARY_ENABLED = os.getenv("AGENT_SUMMARY_ENABLED", "True").lower() == "true"
+    AGENT_SUMMARY_TRIGGER_TURNS = int(os.getenv("AGENT_SUMMARY_TRIGGER_TURNS", "12"))
+    AGENT_SUMMARY_KEEP_TURNS = int(os.getenv("AGENT_SUMMARY_KEEP_TURNS", "4"))  # 保留原文的最近轮次
+    AGENT_SUMMARY_MAX_CHARS = int(os.getenv("AGENT_SUMMARY_MAX_CHARS", "300"))
+    AGENT_SUMMARY_QUEUE_SIZE = int(os.getenv("AGENT_SUMMARY_QUEUE_SIZE", "100"))
+    AGENT_SUMMARY_CONCURRENCY = int(os.getenv("AGENT_SUMMARY_CONCURRENCY", "1"))
 
 # 创建配置实例
 env_config = Config()
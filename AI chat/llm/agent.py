@@ -1,11 +1,33 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncGenerator, Set, Tuple
+from collections import OrderedDict
+from contextlib import aclosing, asynccontextmanager
+import asyncio
+import sqlite3
+import threading
+import time
+import uuid
 import logging
 from llm.base import LLMBase
+from llm.memory import AgentMemory, MemoryRecord
+from llm.response_cache import CachedLLM
+from llm.summarizer import summary_scheduler
+from storage.sqlite_store import SQLiteStore, sqlite_store
+from storage.state_backend import StateBackend, state_backend
 from api.models import CharacterContext
+from config import env_config
 
 # 配置日志
 logger = logging.getLogger("ai_chat_service.llm.agent")
 
+# 多进程共享时对话轮次的跨进程锁租期（秒），持有进程崩溃后最多等待这么久；
+# 持有期间每隔租期的三分之一续租一次
+_TURN_LEASE_SECONDS = 120
+
+
+class AgentBusy(Exception):
+    """等待同一Agent的上一轮对话结束超时"""
+
+
 class Agent:
     """AI角色Agent，用于增强角色的自主性和互动能力"""
     
@@ -21,20 +43,46 @@ class Agent:
         self.character_context = character_context
         
         # 增强的角色属性
-        self.memory: List[Dict[str, Any]] = []  # 角色记忆
+        self.memory = AgentMemory(
+            capacity=env_config.AGENT_MEMORY_SIZE,
+            max_bytes=int(env_config.AGENT_MEMORY_MAX_KB * 1024) or None
+        )  # 角色记忆（环形缓冲区）
         self.goals: List[str] = []  # 角色目标
         self.behavior_patterns: Dict[str, str] = {}  # 行为模式
         self.emotional_state: Dict[str, float] = {}  # 情感状态
         self.background_story: str = ""  # 背景故事
         
+        # 滚动摘要：较早的对话折叠为摘要，放入系统消息
+        self.summary: str = ""
+        self.summary_seq = -1  # 已折叠进摘要的最后一条记忆序号
+        self.resets = 0  # 记忆被其他进程清除后重置的次数，进行中的摘要据此丢弃
+        
+        # 同一Agent的对话轮次串行执行，避免并发请求交错写入记忆
+        self.turn_lock = asyncio.Lock()
+        
+        # 记忆和摘要所属的服务端会话（由AgentManager设置），None为同一角色共用
+        self.scope: Optional[str] = None
+        # 已从AgentManager中移除（清除、淘汰或重新加载），之后的访问会得到新的实例
+        self.detached = False
+        
+        # 持久化存储和键（由AgentManager在启用持久化时设置）
+        self.store: Optional[SQLiteStore] = None
+        self.store_key: Optional[str] = None
+        # 多进程共享时，本进程载入的状态对应的版本号（其他进程修改后版本号变化）
+        self.backend: Optional[StateBackend] = None
+        self.state_version = 0
+        
         # 从角色上下文初始化
         self._initialize_from_context()
         
+        # 角色设定不变，系统提示只构建一次
+        self.system_prompt = self._build_system_prompt()
+        
     def _initialize_from_context(self):
         """从角色上下文初始化Agent的属性"""
         if hasattr(self.character_context, 'other_info') and self.character_context.other_info:
             other_info = self.character_context.other_info
-            self.memory = other_info.get('memory', [])
+            self.memory.extend(other_info.get('memory', []))
             self.goals = other_info.get('goals', [])
             self.behavior_patterns = other_info.get('behavior_patterns', {})
             self.emotional_state = other_info.get('emotional_state', {})
@@ -51,34 +99,13 @@ class Agent:
         返回:
             角色的响应文本
         """
-        # 构建增强的提示，确保角色身份完全融入响应
-        enhanced_prompt = f"""
-你现在需要完全扮演{self.character_context.name}这个角色，用{self.character_context.name}的身份、语气和思维方式来回应。
-
-角色背景：{self.character_context.description}
-
-请记住，你的所有回应都必须严格符合这个角色的特点，不要以任何方式偏离角色设定。
-
-用户的问题：{prompt}
-
-请以{self.character_context.name}的身份直接回答，不要添加任何额外的解释或说明。
-"""
-        
         logger.info(f"生成{self.character_context.name}的响应")
         
-        # 将CharacterContext对象转换为字典格式，以便LLM模型使用
-        character_context_dict = {
-            'name': self.character_context.name,
-            'description': self.character_context.description,
-            'avatar': self.character_context.avatar,
-            'category': self.character_context.category
-        }
-        
         # 调用LLM生成响应
         response = self.llm.generate_response(
-            prompt=enhanced_prompt,
-            character_context=character_context_dict,
-            chat_history=chat_history
+            prompt=self._build_response_prompt(prompt),
+            character_context=self._character_context_dict(),
+            chat_history=self._history_tail(chat_history)
         )
         
         # 更新记忆
@@ -86,6 +113,86 @@ class Agent:
         
         return response
     
+    async def agenerate_response(
+        self, 
+        prompt: str, 
+        chat_history: List[Dict[str, str]] = None,
+        llm: Optional[LLMBase] = None
+    ) -> str:
+        """
+        异步生成角色响应，融合Agent特性
+        
+        参数:
+            prompt: 用户输入的提示文本
+            chat_history: 聊天历史记录
+            llm: 本次调用使用的模型（如带响应缓存的包装），默认为Agent自身的模型；
+                 使用响应缓存时不读写记忆和摘要（见 _stateless）
+        
+        返回:
+            角色的响应文本
+        """
+        logger.info(f"生成{self.character_context.name}的响应")
+        stateless = self._stateless(llm)
+        
+        async with self._turn():
+            # 调用LLM生成响应
+            response = await (llm or self.llm).agenerate_response(
+                prompt=self._build_response_prompt(prompt, recall=not stateless),
+                character_context=self._character_context_dict(with_summary=not stateless),
+                chat_history=self._history_tail(chat_history)
+            )
+            
+            # 更新记忆
+            if not stateless:
+                self._update_memory(prompt, response)
+        
+        return response
+    
+    async def agenerate_streaming_response(
+        self, 
+        prompt: str, 
+        chat_history: List[Dict[str, str]] = None,
+        usage_sink: Optional[Dict[str, Any]] = None,
+        llm: Optional[LLMBase] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        以流式方式生成角色响应，完整输出后更新记忆
+        
+        参数:
+            prompt: 用户输入的提示文本
+            chat_history: 聊天历史记录
+            usage_sink: 用于接收上游token用量的字典（可选）
+            llm: 本次调用使用的模型（如带响应缓存的包装），默认为Agent自身的模型；
+                 使用响应缓存时不读写记忆和摘要（见 _stateless）
+        
+        返回:
+            增量文本的异步生成器
+        """
+        logger.info(f"流式生成{self.character_context.name}的响应")
+        stateless = self._stateless(llm)
+        
+        kwargs = {}
+        if usage_sink is not None:
+            kwargs["usage_sink"] = usage_sink
+        
+        async with self._turn():
+            parts = []
+            # 调用方提前关闭（客户端断开）时同时关闭模型的流，释放上游连接
+            source = (llm or self.llm).agenerate_streaming_response(
+                prompt=self._build_response_prompt(prompt, recall=not stateless),
+                character_context=self._character_context_dict(with_summary=not stateless),
+                chat_history=self._history_tail(chat_history),
+                **kwargs
+            )
+            async with aclosing(source):
+                async for delta in source:
+                    parts.append(delta)
+                    yield delta
+            
+            # 只有完整生成的回复才写入记忆
+            if not stateless:
+                self._update_memory(prompt, "".join(parts))
+    
     def autonomous_action(self, situation: str = "") -> str:
         """
         角色自主行动，不需要用户直接输入
@@ -96,23 +203,12 @@ class Agent:
         返回:
             角色的自主行动描述或思考
         """
-        # 构建自主行动的提示
-        action_prompt = self._build_autonomous_prompt(situation)
-        
         logger.info(f"{self.character_context.name}正在进行自主行动")
         
         # 生成自主行动
         action = self.llm.generate_response(
-            prompt=action_prompt,
-            character_context={
-                "name": self.character_context.name,
-                "description": self.character_context.description,
-                "background_story": self.background_story,
-                "behavior_patterns": self.behavior_patterns,
-                "current_emotion": self._get_current_emotion(),
-                "goals": self.goals,
-                "memory": self.memory[-5:]  # 最近的几条记忆
-            }
+            prompt=self._build_autonomous_prompt(situation),
+            character_context=self._autonomous_context(situation)
         )
         
         # 更新记忆
@@ -120,7 +216,183 @@ class Agent:
         
         return action
     
-    def _build_autonomous_prompt(self, situation: str) -> str:
+    async def aautonomous_action(self, situation: str = "", llm: Optional[LLMBase] = None) -> str:
+        """
+        异步执行角色自主行动
+        
+        参数:
+            situation: 当前情境描述
+            llm: 本次调用使用的模型（如带响应缓存的包装），默认为Agent自身的模型；
+                 使用响应缓存时不读写记忆和摘要（见 _stateless）
+        
+        返回:
+            角色的自主行动描述或思考
+        """
+        logger.info(f"{self.character_context.name}正在进行自主行动")
+        stateless = self._stateless(llm)
+        
+        async with self._turn():
+            # 生成自主行动
+            action = await (llm or self.llm).agenerate_response(
+                prompt=self._build_autonomous_prompt(situation, with_memories=not stateless),
+                character_context=self._autonomous_context(situation, with_state=not stateless)
+            )
+            
+            # 更新记忆
+            if not stateless:
+                self._update_memory("[自主行动]", action)
+        
+        return action
+    
+    @staticmethod
+    def _stateless(llm: Optional[LLMBase]) -> bool:
+        """
+        本次调用是否使用响应缓存
+        
+        缓存键由完整的消息列表计算，注入的记忆和摘要每轮都在变化，相同的请求永远不会命中；
+        命中时再写入记忆还会重复记录同一条回复。因此使用缓存的调用只用角色设定、
+        请求本身和聊天历史构建提示，也不把结果写入记忆
+        """
+        return isinstance(llm, CachedLLM)
+    
+    @asynccontextmanager
+    async def _turn(self):
+        """
+        一轮对话的互斥区
+        
+        同一进程内由turn_lock串行；多进程共享状态时还要持有该Agent的跨进程锁，
+        进入后先载入其他进程的更新，离开前等待本轮写入提交，保证记忆序号不会在进程间冲突。
+        状态后端的读写在线程中执行；持有跨进程锁期间定期续租，长时间的流式回复不会因租期到期失去互斥；
+        等待上一轮超过AGENT_TURN_WAIT_TIMEOUT秒时抛出AgentBusy
+        """
+        timeout = env_config.AGENT_TURN_WAIT_TIMEOUT
+        deadline = time.monotonic() + timeout
+        if not self.turn_lock.locked():
+            # 空闲时直接取得，不经过wait_for创建的任务
+            await self.turn_lock.acquire()
+        else:
+            try:
+                await asyncio.wait_for(self.turn_lock.acquire(), timeout)
+            except asyncio.TimeoutError:
+                raise AgentBusy(f"{self.character_context.name}的上一轮对话仍在进行")
+        try:
+            # 本轮进行中Agent可能被清除（不再持久化），使用进入时的存储和后端
+            store, backend, store_key = self.store, self.backend, self.store_key
+            if backend is None:
+                yield
+                return
+            
+            owner = uuid.uuid4().hex
+            await self._acquire_lease(backend, store_key, owner, deadline)
+            renewal = asyncio.ensure_future(self._renew_lease(backend, store_key, owner))
+            try:
+                if not self.detached and await asyncio.to_thread(backend.version, "agent", store_key) != self.state_version:
+                    await asyncio.to_thread(self._reload)
+                yield
+                await store.acommitted()
+            finally:
+                renewal.cancel()
+                await asyncio.to_thread(backend.unlock, "agent_turn", store_key, owner)
+        finally:
+            self.turn_lock.release()
+    
+    async def _acquire_lease(self, backend: StateBackend, store_key: str, owner: str, deadline: float):
+        """获取该Agent的跨进程锁，等待间隔逐步加长，超过deadline时抛出AgentBusy"""
+        delay = 0.02
+        while not await asyncio.to_thread(backend.try_lock, "agent_turn", store_key, owner, _TURN_LEASE_SECONDS):
+            if time.monotonic() + delay > deadline:
+                raise AgentBusy(f"{self.character_context.name}的上一轮对话仍在其他工作进程中进行")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+    
+    async def _renew_lease(self, backend: StateBackend, store_key: str, owner: str):
+        """持有跨进程锁期间每隔租期的三分之一续租一次（同一持有者再次加锁即延长租期）"""
+        while True:
+            await asyncio.sleep(_TURN_LEASE_SECONDS / 3)
+            if not await asyncio.to_thread(backend.try_lock, "agent_turn", store_key, owner, _TURN_LEASE_SECONDS):
+                logger.error(f"{self.character_context.name}的跨进程锁已被其他进程取得，本轮不再互斥")
+                return
+    
+    def _recall_memories(self, query: str) -> List[MemoryRecord]:
+        """
+        召回与查询相关的记忆，按时间从旧到新排列
+        
+        参数:
+            query: 查询文本
+        
+        返回:
+            最多AGENT_MEMORY_RECALL_K条记忆
+        """
+        records = self.memory.recall(query, env_config.AGENT_MEMORY_RECALL_K)
+        return sorted(records, key=lambda record: record.seq)
+    
+    def _format_memories(self, records: List[MemoryRecord]) -> str:
+        """把记忆格式化为提示中的文本段落"""
+        if not records:
+            return ""
+        lines = ["相关记忆："]
+        for record in records:
+            lines.append(f"- 用户：{record.user_input}")
+            lines.append(f"  {self.character_context.name}：{record.agent_response}")
+        return "\n".join(lines) + "\n"
+    
+    def _build_system_prompt(self) -> str:
+        """
+        构建角色的系统提示（角色设定和规则）
+        
+        同一角色每轮都相同，作为稳定前缀命中上游的提示缓存；
+        相关记忆、当前问题等每轮变化的内容只放在最后的用户消息中
+        """
+        name = self.character_context.name
+        return (
+            f"你现在需要完全扮演{name}这个角色，用{name}的身份、语气和思维方式来回应。\n\n"
+            f"角色背景：{self.character_context.description}\n\n"
+            f"请记住，你的所有回应都必须严格符合这个角色的特点，不要以任何方式偏离角色设定。"
+            f"请以{name}的身份直接回答，不要添加任何额外的解释或说明。"
+        )
+    
+    def _build_response_prompt(self, prompt: str, recall: bool = True) -> str:
+        """构建本轮的用户消息：相关记忆在前（recall为False时不召回），当前问题在最后"""
+        memories = self._format_memories(self._recall_memories(prompt)) if recall else ""
+        if memories:
+            return f"{memories}\n用户的问题：{prompt}"
+        return prompt
+    
+    def _character_context_dict(self, with_summary: bool = True) -> Dict[str, Any]:
+        """将CharacterContext对象转换为字典格式，以便LLM模型使用（with_summary为False时不带对话摘要）"""
+        context = {
+            'name': self.character_context.name,
+            'description': self.character_context.description,
+            'system_prompt': self.system_prompt,
+            'avatar': self.character_context.avatar,
+            'category': self.character_context.category
+        }
+        if with_summary and self.summary:
+            context['summary'] = self.summary
+        return context
+    
+    def _autonomous_memories(self, situation: str) -> List[MemoryRecord]:
+        """自主行动使用的记忆：按情境召回，没有情境或没有相关记忆时取最近几条"""
+        records = self._recall_memories(situation) if situation else []
+        return records or self.memory.last(env_config.AGENT_MEMORY_RECALL_K)
+    
+    def _autonomous_context(self, situation: str = "", with_state: bool = True) -> Dict[str, Any]:
+        """构建自主行动使用的角色上下文（with_state为False时不带对话摘要和记忆）"""
+        context = {
+            "name": self.character_context.name,
+            "description": self.character_context.description,
+            "background_story": self.background_story,
+            "system_prompt": self.system_prompt,
+            "behavior_patterns": self.behavior_patterns,
+            "current_emotion": self._get_current_emotion(),
+            "goals": self.goals
+        }
+        if with_state:
+            context["summary"] = self.summary
+            context["memory"] = [record.to_dict() for record in self._autonomous_memories(situation)]  # 相关的几条记忆
+        return context
+    
+    def _build_autonomous_prompt(self, situation: str, with_memories: bool = True) -> str:
         """构建自主行动的提示文本"""
         prompt_parts = []
         
@@ -129,24 +401,160 @@ class Agent:
         if situation:
             prompt_parts.append(f"在当前情境下：{situation}，")
         
+        memories = self._format_memories(self._autonomous_memories(situation)) if with_memories else ""
+        if memories:
+            prompt_parts.append(f"\n{memories}")
+        
         prompt_parts.append("你会主动做什么或想什么？")
         prompt_parts.append("请用符合你性格和背景的方式表达。")
         
         return "".join(prompt_parts)
     
     def _update_memory(self, user_input: str, agent_response: str):
-        """更新角色记忆"""
-        memory_item = {
-            "timestamp": "now",
-            "user_input": user_input,
-            "agent_response": agent_response
-        }
+        """更新角色记忆（环形缓冲区满时自动覆盖最旧的记忆）"""
+        record = self.memory.append(user_input, agent_response)
+        if self.store is not None:
+            self.store.append_memory(self.store_key, record.seq, record.user_input, record.agent_response)
+            # 每写满一轮缓冲区，删除数据库中已被覆盖的记忆
+            if record.seq and record.seq % self.memory.capacity == 0:
+                self.store.prune_memory(self.store_key, self.memory[0].seq)
+            self._persist_state()
+        self._maybe_schedule_summary()
+    
+    def _persist_state(self):
+        """保存目标、情感状态和摘要（写入排队，不等待磁盘）"""
+        if self.store is None:
+            return
+        self.store.save_agent_state(
+            self.store_key,
+            self.character_context.name,
+            self.goals,
+            self.emotional_state,
+            self.summary,
+            self.summary_seq
+        )
+        if self.backend is not None:
+            # 写入提交后再更新版本号，其他进程看到新版本时一定能读到新数据
+            self.store.after_commit(self._publish_version)
+    
+    def detach(self, forget: bool = False):
+        """
+        标记Agent已从AgentManager中移除
         
-        self.memory.append(memory_item)
+        参数:
+            forget: 是否同时停止持久化（角色被清除时，进行中的对话不再把已删除的记忆写回数据库）
+        """
+        self.detached = True
+        if forget:
+            self.store = None
+            self.backend = None
+    
+    def _publish_version(self):
+        """通知其他工作进程该角色的状态已更新（在持久化写入线程中执行）"""
+        self.state_version = self.backend.bump("agent", self.store_key)
+    
+    def attach_store(self, store: SQLiteStore, store_key: str, backend: Optional[StateBackend] = None):
+        """
+        启用持久化：数据库中有该Agent时恢复其状态，否则保存当前状态（含角色设定中预置的记忆）
         
-        # 限制记忆长度，避免过多消耗
-        if len(self.memory) > 50:
-            self.memory = self.memory[-50:]
+        参数:
+            store: SQLite持久化存储
+            store_key: Agent持久化键
+            backend: 多进程共享的状态后端，None为单进程部署
+        """
+        try:
+            # 先读版本号再读数据，读取期间的修改会在下次访问时重新加载
+            version = backend.version("agent", store_key) if backend is not None else 0
+            saved = store.load_agent(store_key, self.character_context.name, self.memory.capacity)
+        except sqlite3.Error as e:
+            logger.error(f"读取{self.character_context.name}的持久化状态失败，本次只保存在内存中: {str(e)}")
+            return
+        self.store = store
+        self.store_key = store_key
+        self.backend = backend
+        self.state_version = version
+        if saved is None:
+            for record in self.memory:
+                store.append_memory(store_key, record.seq, record.user_input, record.agent_response)
+            self._persist_state()
+            return
+        
+        self._apply_saved(saved)
+        logger.info(f"已从数据库恢复{self.character_context.name}的状态，记忆{len(self.memory)}条")
+    
+    def _reload(self):
+        """其他工作进程更新了该Agent的状态，在本轮开始前重新载入"""
+        self.state_version = self.backend.version("agent", self.store_key)
+        saved = self.store.load_agent(self.store_key, self.character_context.name, self.memory.capacity)
+        if saved is None:
+            # 已在其他进程中清除，回到角色设定的初始状态
+            self.resets += 1
+            self.memory.clear()
+            self.summary = ""
+            self.summary_seq = -1
+            self._initialize_from_context()
+            return
+        self._apply_saved(saved)
+        logger.info(f"{self.character_context.name}的状态已被其他进程更新，重新载入记忆{len(self.memory)}条")
+    
+    def _apply_saved(self, saved: Dict[str, Any]):
+        """用数据库中保存的状态替换当前状态"""
+        self.goals = saved["goals"]
+        self.emotional_state = saved["emotional_state"]
+        self.summary = saved["summary"]
+        self.summary_seq = saved["summary_seq"]
+        self.memory.restore(saved["memory"])
+    
+    def _history_tail(self, chat_history: Optional[List[Dict[str, str]]]) -> Optional[List[Dict[str, str]]]:
+        """已有摘要时，聊天历史只保留最近几轮原文，更早的内容由摘要代替"""
+        if not self.summary or not chat_history:
+            return chat_history
+        keep = env_config.AGENT_SUMMARY_KEEP_TURNS * 2
+        return chat_history[-keep:] if keep > 0 else []
+    
+    def _maybe_schedule_summary(self):
+        """未摘要的轮次达到阈值时，提交后台摘要任务"""
+        if not env_config.AGENT_SUMMARY_ENABLED:
+            return
+        if self.memory.last_seq - self.summary_seq >= env_config.AGENT_SUMMARY_TRIGGER_TURNS:
+            summary_scheduler.submit(self, self.arefresh_summary)
+    
+    async def arefresh_summary(self):
+        """
+        把较早的未摘要轮次折叠进滚动摘要（在后台摘要队列中执行）
+        
+        最近AGENT_SUMMARY_KEEP_TURNS轮保留原文；生成期间写入的新记忆不受影响。
+        生成摘要时不占用对话轮次，写回时再进入轮次互斥区（多进程时持有跨进程锁并载入最新状态），
+        期间Agent被清除或移出缓存、摘要已被更新或记忆已被清除时丢弃本次结果
+        """
+        if self.detached:
+            return
+        base_seq, resets = self.summary_seq, self.resets
+        last_seq = self.memory.last_seq - env_config.AGENT_SUMMARY_KEEP_TURNS
+        records = [
+            record for record in self.memory.last(self.memory.last_seq - self.summary_seq)
+            if self.summary_seq < record.seq <= last_seq
+        ]
+        if not records:
+            return
+        
+        lines = [f"用户：{record.user_input}\n{self.character_context.name}：{record.agent_response}" for record in records]
+        prompt = (
+            f"请把下面的对话合并进已有摘要，以第三人称简要概括{self.character_context.name}和用户之间发生的事情、"
+            f"用户透露的信息和约定，不超过{env_config.AGENT_SUMMARY_MAX_CHARS}字，只输出摘要本身。\n\n"
+            f"已有摘要：{self.summary or '无'}\n\n"
+            f"新的对话：\n" + "\n".join(lines)
+        )
+        summary = await self.llm.agenerate_response(prompt=prompt)
+        
+        async with self._turn():
+            if self.detached or self.summary_seq != base_seq or self.resets != resets:
+                logger.info(f"{self.character_context.name}的状态在生成摘要期间已变化，丢弃本次摘要")
+                return
+            self.summary = (summary or "").strip()[:env_config.AGENT_SUMMARY_MAX_CHARS * 2]
+            self.summary_seq = records[-1].seq
+            self._persist_state()
+        logger.info(f"{self.character_context.name}的对话摘要已更新，折叠{len(records)}轮对话")
     
     def _get_current_emotion(self) -> str:
         """获取角色当前的情感状态描述"""
@@ -174,46 +582,290 @@ class Agent:
         return f"{intensity}{strongest_emotion[0]}"
 
 class AgentManager:
-    """管理多个Agent实例"""
+    """
+    管理多个Agent实例
+    
+    Agent按最近使用顺序保存在有序字典中：
+    - 超过容量时淘汰最久未使用的Agent（O(1)）
+    - 空闲超过TTL的Agent在访问时从最旧一端回收
+    - 正在进行对话的Agent不会被淘汰
+    - 按服务端会话区分时（scope），同一角色的不同用户各自使用一个Agent，记忆和摘要互不可见
+    - 启用持久化时，被回收的Agent在下次访问时从数据库恢复；请求路径使用aget_agent，
+      在线程中加载且不持有管理器的锁，同一Agent的并发请求只加载一次
+    - 多进程共享状态时，其他工作进程更新了角色状态后，本进程在下次访问时重新加载
+    """
     _instance = None
-    _agents = {}
+    
+    def __init__(
+        self,
+        max_agents: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        store: Optional[SQLiteStore] = None,
+        backend: Optional[StateBackend] = None
+    ):
+        """
+        初始化Agent管理器
+        
+        参数:
+            max_agents: 最多保留的Agent数，默认读取配置
+            idle_ttl: Agent空闲多久后回收（秒），默认读取配置
+            store: SQLite持久化存储，None为只保存在内存中
+            backend: 状态后端，为多进程共享的后端且启用了持久化时在进程间同步Agent状态
+        """
+        self.max_agents = max(1, max_agents if max_agents is not None else env_config.AGENT_MAX_AGENTS)
+        self.idle_ttl = idle_ttl if idle_ttl is not None else env_config.AGENT_IDLE_TTL
+        self.store = store
+        self.backend = backend if store is not None and backend is not None and backend.shared else None
+        if backend is not None and backend.shared and store is None:
+            logger.warning("共享状态后端需要同时启用SQLite持久化才能在进程间同步Agent状态")
+        
+        # agent_key -> (Agent, 最近使用时间)，按最近使用顺序排列
+        self._agents: "OrderedDict[str, List[Any]]" = OrderedDict()
+        # 角色名称 -> agent_key集合，用于按角色清除
+        self._keys_by_name: Dict[str, Set[str]] = {}
+        # 正在从数据库加载的agent_key -> (加载完成时完成的future, 角色名称, 会话)，清除时移除，加载结果作废
+        self._loading: Dict[str, Tuple[asyncio.Future, str, Optional[str]]] = {}
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.reloads = 0
     
     @classmethod
     def get_instance(cls):
         """单例模式获取实例"""
         if cls._instance is None:
-            cls._instance = cls()
+            cls._instance = cls(store=sqlite_store, backend=state_backend)
         return cls._instance
     
-    def get_agent(self, llm: LLMBase, character_context: CharacterContext) -> Agent:
+    def get_agent(self, llm: LLMBase, character_context: CharacterContext, scope: Optional[str] = None) -> Agent:
         """
-        获取或创建Agent实例
+        获取或创建Agent实例（同步版本，持有锁加载持久化状态，供事件循环之外使用）
         
         参数:
             llm: LLM模型实例
             character_context: 角色上下文信息
+            scope: 记忆所属的服务端会话ID，None为同一角色共用一个Agent
         
         返回:
             Agent实例
         """
+        agent_key = self._agent_key(llm, character_context, scope)
+        now = time.monotonic()
+        
+        with self._lock:
+            self._expire(now)
+            
+            entry = self._agents.get(agent_key)
+            if entry is not None and self._is_stale(entry[0]):
+                # 其他工作进程更新了该角色的状态，丢弃本进程的副本重新加载
+                self._remove(agent_key)
+                self.reloads += 1
+                entry = None
+            if entry is not None:
+                entry[1] = now
+                self._agents.move_to_end(agent_key)
+                self.hits += 1
+                return entry[0]
+            
+            self.misses += 1
+            agent = self._load(llm, character_context, scope)
+            self._insert(agent_key, agent, now)
+            return agent
+    
+    async def aget_agent(self, llm: LLMBase, character_context: CharacterContext, scope: Optional[str] = None) -> Agent:
+        """
+        异步获取或创建Agent实例（请求路径使用）
+        
+        命中时不访问数据库，其他工作进程的更新由Agent._turn在本轮开始前载入；
+        未命中时在线程中加载持久化状态，加载期间不持有管理器的锁，
+        同一Agent的并发请求等待同一次加载
+        
+        参数:
+            llm: LLM模型实例
+            character_context: 角色上下文信息
+            scope: 记忆所属的服务端会话ID，None为同一角色共用一个Agent
+        
+        返回:
+            Agent实例
+        """
+        agent_key = self._agent_key(llm, character_context, scope)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._expire(now)
+                entry = self._agents.get(agent_key)
+                if entry is not None:
+                    entry[1] = now
+                    self._agents.move_to_end(agent_key)
+                    self.hits += 1
+                    return entry[0]
+                pending = self._loading.get(agent_key)
+                if pending is None:
+                    self.misses += 1
+                    loading = asyncio.get_running_loop().create_future()
+                    self._loading[agent_key] = (loading, character_context.name, scope)
+                    owner = True
+                else:
+                    loading = pending[0]
+                    owner = False
+            
+            if not owner:
+                # 等待其他请求的加载完成后重新查找（单个等待方取消时不影响加载）
+                await asyncio.shield(loading)
+                continue
+            
+            try:
+                agent = await asyncio.to_thread(self._load, llm, character_context, scope)
+                with self._lock:
+                    if self._loading.get(agent_key, (None,))[0] is loading:
+                        del self._loading[agent_key]
+                        self._insert(agent_key, agent, time.monotonic())
+                        return agent
+                # 加载期间该Agent被清除，读到的可能是清除前的状态，作废后重新加载
+                agent.detach(forget=True)
+            finally:
+                with self._lock:
+                    if self._loading.get(agent_key, (None,))[0] is loading:
+                        del self._loading[agent_key]
+                if not loading.done():
+                    loading.set_result(None)
+    
+    @staticmethod
+    def _agent_key(llm: LLMBase, character_context: CharacterContext, scope: Optional[str] = None) -> str:
+        """内存中的Agent键"""
         # 使用角色名称作为标识，因为CharacterContext没有id属性
         agent_key = f"{character_context.name}:{id(llm)}"
+        return f"{agent_key}:{scope}" if scope is not None else agent_key
+    
+    def _load(self, llm: LLMBase, character_context: CharacterContext, scope: Optional[str]) -> Agent:
+        """创建Agent并载入持久化状态（读取数据库，可能等待该Agent未提交的写入）"""
+        agent = Agent(llm, character_context)
+        agent.scope = scope
+        if self.store is not None:
+            agent.attach_store(self.store, self._store_key(llm, character_context, scope), self.backend)
+        return agent
+    
+    def _insert(self, agent_key: str, agent: Agent, now: float):
+        """放入Agent并淘汰超出容量的Agent（调用方持有锁）"""
+        self._agents[agent_key] = [agent, now]
+        self._keys_by_name.setdefault(agent.character_context.name, set()).add(agent_key)
+        self._evict_overflow()
+    
+    def _is_stale(self, agent: Agent) -> bool:
+        """多进程共享时，检查Agent是否已被其他工作进程更新（正在对话的Agent不重新加载）"""
+        if self.backend is None or agent.backend is None or agent.turn_lock.locked():
+            return False
+        return self.backend.version("agent", agent.store_key) != agent.state_version
+    
+    @staticmethod
+    def _store_key(llm: LLMBase, character_context: CharacterContext, scope: Optional[str] = None) -> str:
+        """Agent持久化键：角色名称、模型和会话在重启后保持不变（内存中的键含id(llm)，每次启动都不同）"""
+        key = f"{character_context.name}:{type(llm).__name__}:{getattr(llm, 'model', '')}"
+        return f"{key}:{scope}" if scope is not None else key
+    
+    def _remove(self, agent_key: str):
+        """删除一个Agent（调用方持有锁）"""
+        entry = self._agents.pop(agent_key, None)
+        if entry is None:
+            return
+        entry[0].detach()
+        name = entry[0].character_context.name
+        keys = self._keys_by_name.get(name)
+        if keys is not None:
+            keys.discard(agent_key)
+            if not keys:
+                del self._keys_by_name[name]
+    
+    def _expire(self, now: float):
+        """从最久未使用的一端回收空闲超时的Agent（调用方持有锁）"""
+        while self._agents:
+            agent_key, (agent, last_used) = next(iter(self._agents.items()))
+            if now - last_used <= self.idle_ttl:
+                break
+            if agent.turn_lock.locked():
+                # 长时间的对话仍在进行，视为刚使用过
+                self._agents[agent_key][1] = now
+                self._agents.move_to_end(agent_key)
+                continue
+            self._remove(agent_key)
+            self.expirations += 1
+    
+    def _evict_overflow(self):
+        """
+        超过容量时淘汰最久未使用的空闲Agent（调用方持有锁）
         
-        if agent_key not in self._agents:
-            self._agents[agent_key] = Agent(llm, character_context)
-        
-        return self._agents[agent_key]
+        正在对话的Agent和刚创建的Agent不淘汰，全部忙碌时暂时超出容量
+        """
+        newest = next(reversed(self._agents))
+        skipped = []
+        while len(self._agents) > self.max_agents:
+            agent_key, (agent, _) = next(iter(self._agents.items()))
+            if agent_key == newest:
+                break
+            if agent.turn_lock.locked():
+                # 暂时挪开忙碌的Agent，结束后按原顺序放回最旧一端
+                skipped.append(agent_key)
+                self._agents.move_to_end(agent_key)
+                continue
+            self._remove(agent_key)
+            self.evictions += 1
+        for agent_key in reversed(skipped):
+            self._agents.move_to_end(agent_key, last=False)
     
-    def clear_agent(self, character_name: str):
+    def clear_agent(self, character_name: str, scope: Optional[str] = None):
         """清除指定角色的Agent实例
         
         参数:
             character_name: 角色名称
+            scope: 只清除该服务端会话的Agent，None为清除该角色的全部Agent
         """
-        keys_to_remove = [key for key in self._agents.keys() if key.startswith(f"{character_name}:")]
-        for key in keys_to_remove:
-            del self._agents[key]
+        with self._lock:
+            for key in list(self._keys_by_name.get(character_name, ())):
+                agent = self._agents[key][0]
+                if scope is None or agent.scope == scope:
+                    # 在排队删除之前停止持久化，进行中的对话结束时不会写回已删除的记录
+                    agent.detach(forget=True)
+                    self._remove(key)
+            # 进行中的加载可能读到删除前的状态，作废后由加载方重新加载
+            for key, (_, name, loading_scope) in list(self._loading.items()):
+                if name == character_name and (scope is None or loading_scope == scope):
+                    del self._loading[key]
+        if self.store is not None:
+            # 先列出要删除的持久化键，删除提交后逐个通知其他工作进程
+            store_keys = self.store.agent_keys(character_name, scope) if self.backend is not None else []
+            self.store.delete_agents(character_name, scope)
+            if store_keys:
+                backend = self.backend
+                self.store.after_commit(lambda: [backend.bump("agent", key) for key in store_keys])
     
     def clear_all_agents(self):
         """清除所有Agent实例"""
-        self._agents.clear()
\ No newline at end of file
+        with self._lock:
+            for agent, _ in self._agents.values():
+                agent.detach()
+            self._agents.clear()
+            self._keys_by_name.clear()
+            self._loading.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取Agent缓存统计"""
+        with self._lock:
+            self._expire(time.monotonic())
+            live = len(self._agents)
+            busy = sum(1 for agent, _ in self._agents.values() if agent.turn_lock.locked())
+        return {
+            "live_agents": live,
+            "busy_agents": busy,
+            "max_agents": self.max_agents,
+            "idle_ttl": self.idle_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "reloads": self.reloads,
+            "persistent": self.store is not None,
+            "shared": self.backend is not None
+        }
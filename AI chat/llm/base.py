@@ -1,5 +1,13 @@
+import asyncio
+import logging
+import threading
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncGenerator
+
+from llm.context_window import context_window
+from llm.prompt_cache import prompt_cache
+
+logger = logging.getLogger("ai_chat_service.llm.base")
 
 class LLMBase(ABC):
     """LLM模型的基础接口类"""
@@ -19,7 +27,7 @@ class LLMBase(ABC):
             prompt: 用户输入的提示文本
             character_context: 角色上下文信息
             chat_history: 聊天历史记录
-            **kwargs: 其他参数
+            **kwargs: 其他参数；usage_sink为可选的字典，用于接收上游返回的token用量
         
         返回:
             模型生成的响应文本
@@ -48,6 +56,163 @@ class LLMBase(ABC):
         """
         pass
     
+    async def agenerate_response(
+        self, 
+        prompt: str, 
+        character_context: Dict[str, Any] = None,
+        chat_history: List[Dict[str, str]] = None,
+        **kwargs
+    ) -> str:
+        """
+        异步生成模型响应
+        
+        默认实现把同步的generate_response放到线程池中执行，避免阻塞事件循环；
+        支持原生异步客户端的子类应覆盖此方法
+        
+        参数:
+            prompt: 用户输入的提示文本
+            character_context: 角色上下文信息
+            chat_history: 聊天历史记录
+            **kwargs: 其他参数
+        
+        返回:
+            模型生成的响应文本
+        """
+        return await asyncio.to_thread(
+            self.generate_response,
+            prompt,
+            character_context,
+            chat_history,
+            **kwargs
+        )
+    
+    async def agenerate_streaming_response(
+        self, 
+        prompt: str, 
+        character_context: Dict[str, Any] = None,
+        chat_history: List[Dict[str, str]] = None,
+        **kwargs
+    ) -> AsyncGenerator[str, None]:
+        """
+        异步生成流式响应
+        
+        默认实现在线程中逐块迭代同步生成器；支持原生异步客户端的子类应覆盖此方法
+        
+        参数:
+            prompt: 用户输入的提示文本
+            character_context: 角色上下文信息
+            chat_history: 聊天历史记录
+            **kwargs: 其他参数
+        
+        返回:
+            异步流式响应生成器
+        """
+        generator = self.generate_streaming_response(
+            prompt,
+            character_context,
+            chat_history,
+            **kwargs
+        )
+        sentinel = object()
+        # 同一时间只有一个线程操作同步生成器
+        lock = threading.Lock()
+        
+        def step():
+            with lock:
+                return next(generator, sentinel)
+        
+        def close():
+            with lock:
+                generator.close()
+        
+        try:
+            while True:
+                chunk = await asyncio.to_thread(step)
+                if chunk is sentinel:
+                    break
+                yield chunk
+        finally:
+            if lock.acquire(blocking=False):
+                try:
+                    generator.close()
+                finally:
+                    lock.release()
+            else:
+                # 被取消时线程仍在读取上游：读取结束后在线程中关闭生成器（释放上游连接），不阻塞事件循环
+                asyncio.get_running_loop().run_in_executor(None, close)
+    
+    @staticmethod
+    def build_messages(
+        prompt: str, 
+        character_context: Dict[str, Any] = None,
+        chat_history: List[Dict[str, str]] = None
+    ) -> List[Dict[str, str]]:
+        """
+        构建Chat Completions格式的messages列表
+        
+        参数:
+            prompt: 用户输入的提示文本
+            character_context: 角色上下文信息
+            chat_history: 聊天历史记录
+        
+        返回:
+            messages列表
+        """
+        messages = []
+        
+        # 添加系统消息（角色上下文）
+        # 系统消息在同一角色的各轮对话中保持逐字节不变，便于命中上游的提示缓存
+        if character_context:
+            system_content = character_context.get('system_prompt')
+            if not system_content:
+                system_content = f"你是{character_context.get('name', 'AI')}"
+                if 'description' in character_context:
+                    system_content += f": {character_context['description']}"
+            if character_context.get('summary'):
+                system_content += f"\n\n之前的对话摘要：{character_context['summary']}"
+            messages.append({"role": "system", "content": system_content})
+        
+        # 添加聊天历史
+        if chat_history:
+            for message in chat_history:
+                role = message.get('role', 'user')
+                content = message.get('content', '')
+                messages.append({"role": role, "content": content})
+        
+        # 添加用户消息
+        messages.append({"role": "user", "content": prompt})
+        
+        return messages
+    
+    def prepare_messages(
+        self,
+        prompt: str,
+        character_context: Dict[str, Any] = None,
+        chat_history: List[Dict[str, str]] = None
+    ) -> List[Dict[str, str]]:
+        """
+        构建messages并按模型的token预算裁剪对话历史
+        
+        参数:
+            prompt: 用户输入的提示文本
+            character_context: 角色上下文信息
+            chat_history: 聊天历史记录
+        
+        返回:
+            裁剪后的messages列表
+        """
+        messages = self.build_messages(prompt, character_context, chat_history)
+        messages = context_window.fit(messages, getattr(self, "model", None)).messages
+        prompt_cache.observe(messages)
+        return messages
+    
+    @staticmethod
+    def _sink_usage(usage_sink: Optional[Dict[str, Any]], usage: Dict[str, Any]):
+        """把上游返回的用量写入usage_sink，并计入提示缓存命中统计"""
+        prompt_cache.record_usage(usage)
+        if usage_sink is not None:
+            usage_sink.update(usage)
+    
     @staticmethod
     def create_prompt(
         prompt: str, 
@@ -0,0 +1,98 @@
+"""
+客户端断开统计
+客户端关闭聊天页面或打断语音回复时，路由停止生成并关闭上游连接。
+这里记录被取消的回复数，并估算节省的token数：
+节省量 = 近期完整回复的平均completion token数 - 取消前已生成的token数
+"""
+
+import threading
+import logging
+from typing import Any, Dict, Optional
+
+from llm.context_window import estimate_tokens
+
+logger = logging.getLogger("ai_chat_service.llm.cancellation")
+
+
+class CancellationTracker:
+    """统计完整生成和中途取消的回复"""
+
+    def __init__(self, alpha: float = 0.1):
+        """
+        初始化统计
+
+        参数:
+            alpha: 完整回复token数EWMA的平滑系数
+        """
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._expected_tokens: Optional[float] = None
+
+        self.completed: Dict[str, int] = {}
+        self.cancelled: Dict[str, int] = {}
+        self.generated_tokens_before_cancel = 0
+        self.tokens_saved = 0
+        self.syntheses_cancelled = 0
+
+    @staticmethod
+    def completion_tokens(text: str, usage: Optional[Dict[str, Any]] = None) -> int:
+        """上游返回的completion token数，没有时按文本估算"""
+        if usage and usage.get("completion_tokens"):
+            return usage["completion_tokens"]
+        return estimate_tokens(text or "")
+
+    def record_completed(self, kind: str, text: str, usage: Optional[Dict[str, Any]] = None):
+        """
+        记录一次完整生成的回复
+
+        参数:
+            kind: 回复类型（chat、voice）
+            text: 回复文本
+            usage: 上游返回的用量信息
+        """
+        tokens = self.completion_tokens(text, usage)
+        with self._lock:
+            self.completed[kind] = self.completed.get(kind, 0) + 1
+            if self._expected_tokens is None:
+                self._expected_tokens = float(tokens)
+            else:
+                self._expected_tokens += self.alpha * (tokens - self._expected_tokens)
+
+    def record_cancelled(self, kind: str, text: str, syntheses: int = 0) -> int:
+        """
+        记录一次中途取消的回复
+
+        参数:
+            kind: 回复类型（chat、voice）
+            text: 取消前已生成的文本
+            syntheses: 取消的语音合成任务数
+
+        返回:
+            估算节省的token数
+        """
+        generated = self.completion_tokens(text)
+        with self._lock:
+            expected = self._expected_tokens or 0.0
+            saved = max(0, round(expected - generated))
+            self.cancelled[kind] = self.cancelled.get(kind, 0) + 1
+            self.generated_tokens_before_cancel += generated
+            self.tokens_saved += saved
+            self.syntheses_cancelled += syntheses
+        logger.info(f"客户端断开，已停止生成（{kind}），已生成约{generated} tokens，估算节省{saved} tokens")
+        return saved
+
+    def stats(self) -> Dict[str, Any]:
+        """获取取消统计"""
+        with self._lock:
+            return {
+                "completed": dict(self.completed),
+                "cancelled": dict(self.cancelled),
+                "expected_completion_tokens": round(self._expected_tokens, 1) if self._expected_tokens is not None else None,
+                "generated_tokens_before_cancel": self.generated_tokens_before_cancel,
+                "tokens_saved": self.tokens_saved,
+                "syntheses_cancelled": self.syntheses_cancelled
+            }
+
+
+# 创建全局实例
+cancellation_tracker = CancellationTracker()
@@ -0,0 +1,254 @@
+"""
+上下文窗口管理
+按模型的token预算裁剪发送给上游的messages：
+- 本地估算token数，按消息内容缓存，同一条历史消息不会重复计算
+- 预算 = min(模型上下文长度 - 预留的回复token数, 提示token上限)
+- 超出预算时从最早的对话轮次开始丢弃（或折叠为一条简短摘要），
+  系统消息和当前问题始终保留
+"""
+
+import re
+import math
+import threading
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from config import env_config
+
+logger = logging.getLogger("ai_chat_service.llm.context_window")
+
+# 每条消息的格式开销（角色、分隔符）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+@lru_cache(maxsize=16384)
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数（按内容哈希缓存）
+
+    中文字符和全角标点约每字1个token，其余字符约每4个字符1个token
+
+    参数:
+        text: 文本
+
+    返回:
+        估算的token数
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """估算一条消息的token数（含格式开销）"""
+    return estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+def _parse_model_tokens(spec: str) -> Dict[str, int]:
+    """
+    解析按模型配置的上下文长度
+
+    参数:
+        spec: 形如 "gpt-3.5-turbo=16385,gpt-4o=128000" 的配置字符串
+
+    返回:
+        模型名称到上下文长度的映射
+    """
+    sizes = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        model, size = item.rsplit("=", 1)
+        try:
+            sizes[model.strip()] = int(size)
+        except ValueError:
+            logger.warning(f"无效的模型上下文长度配置: {item}")
+    return sizes
+
+
+class ContextWindowResult:
+    """裁剪结果"""
+
+    __slots__ = ("messages", "budget", "tokens_before", "tokens_after", "dropped_messages", "summarized")
+
+    def __init__(self, messages, budget, tokens_before, tokens_after, dropped_messages=0, summarized=False):
+        self.messages: List[Dict[str, Any]] = messages
+        self.budget: int = budget
+        self.tokens_before: int = tokens_before
+        self.tokens_after: int = tokens_after
+        self.dropped_messages: int = dropped_messages
+        self.summarized: bool = summarized
+
+    @property
+    def tokens_saved(self) -> int:
+        """裁剪节省的token数"""
+        return self.tokens_before - self.tokens_after
+
+
+class ContextWindow:
+    """按token预算裁剪对话历史"""
+
+    def __init__(
+        self,
+        default_context_tokens: int = 8192,
+        model_context_tokens: Optional[Dict[str, int]] = None,
+        reserved_completion_tokens: int = 1024,
+        max_prompt_tokens: int = 0,
+        policy: str = "drop",
+        summary_max_chars: int = 300
+    ):
+        """
+        初始化上下文窗口管理器
+
+        参数:
+            default_context_tokens: 未单独配置的模型的上下文长度
+            model_context_tokens: 按模型名称配置的上下文长度
+            reserved_completion_tokens: 为模型回复预留的token数
+            max_prompt_tokens: 提示token上限（控制成本），0为只受上下文长度限制
+            policy: 超出预算时的处理方式，drop为丢弃最早的轮次，summarize为折叠成一条摘要
+            summary_max_chars: summarize策略下摘要的最大字符数
+        """
+        self.default_context_tokens = default_context_tokens
+        self.model_context_tokens = model_context_tokens or {}
+        self.reserved_completion_tokens = reserved_completion_tokens
+        self.max_prompt_tokens = max_prompt_tokens
+        self.policy = policy if policy in ("drop", "summarize") else "drop"
+        self.summary_max_chars = summary_max_chars
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.trimmed_requests = 0
+        self.tokens_saved = 0
+        self.dropped_messages = 0
+
+    def budget(self, model: Optional[str] = None) -> int:
+        """
+        获取模型的提示token预算
+
+        参数:
+            model: 模型名称
+
+        返回:
+            提示部分可用的token数
+        """
+        context_tokens = self.model_context_tokens.get(model or "", self.default_context_tokens)
+        budget = context_tokens - self.reserved_completion_tokens
+        if self.max_prompt_tokens > 0:
+            budget = min(budget, self.max_prompt_tokens)
+        return max(budget, 0)
+
+    def fit(
+        self,
+        messages: List[Dict[str, Any]],
+        model: Optional[str] = None,
+        budget: Optional[int] = None
+    ) -> ContextWindowResult:
+        """
+        把messages裁剪到预算以内
+
+        参数:
+            messages: Chat Completions格式的消息列表（最后一条为当前问题）
+            model: 模型名称，用于确定预算
+            budget: 直接指定预算，优先于model
+
+        返回:
+            裁剪结果（消息列表、节省的token数等）
+        """
+        budget = self.budget(model) if budget is None else budget
+        counts = [message_tokens(message) for message in messages]
+        total = sum(counts)
+
+        result = ContextWindowResult(messages, budget, total, total)
+        if total > budget and len(messages) > 2:
+            result = self._trim(messages, counts, budget, total)
+
+        with self._lock:
+            self.requests += 1
+            if result.tokens_saved > 0:
+                self.trimmed_requests += 1
+                self.tokens_saved += result.tokens_saved
+                self.dropped_messages += result.dropped_messages
+        return result
+
+    def _trim(self, messages, counts, budget, total) -> ContextWindowResult:
+        """从最早的对话轮次开始丢弃，直到满足预算"""
+        # 开头的系统消息和最后的当前问题不参与裁剪
+        head = 0
+        while head < len(messages) - 1 and messages[head].get("role") == "system":
+            head += 1
+        tail = len(messages) - 1
+
+        start = head
+        remaining = total
+        summary = None
+        while start < tail:
+            # 以"用户+助手"为一轮整体丢弃，避免历史以助手消息开头
+            end = start + 1
+            if messages[start].get("role") == "user" and end < tail and messages[end].get("role") == "assistant":
+                end += 1
+            remaining -= sum(counts[start:end])
+            start = end
+
+            if self.policy == "summarize":
+                summary = self._summarize(messages[head:start])
+                summary_tokens = message_tokens(summary)
+            else:
+                summary_tokens = 0
+            if remaining + summary_tokens <= budget:
+                break
+
+        kept = list(messages[:head])
+        if summary is not None:
+            kept.append(summary)
+        kept.extend(messages[start:])
+        tokens_after = sum(message_tokens(message) for message in kept)
+        dropped = start - head
+
+        logger.info(f"对话历史超出预算（{total} > {budget} tokens），丢弃最早的{dropped}条消息，节省{total - tokens_after} tokens")
+        return ContextWindowResult(kept, budget, total, tokens_after, dropped, summary is not None)
+
+    def _summarize(self, dropped: List[Dict[str, Any]]) -> Dict[str, str]:
+        """把丢弃的消息折叠为一条简短摘要（只保留每条消息的开头，最新的优先）"""
+        lines = []
+        length = 0
+        for message in reversed(dropped):
+            speaker = "用户" if message.get("role") == "user" else "助手"
+            line = f"{speaker}：{(message.get('content') or '')[:40]}"
+            if length + len(line) > self.summary_max_chars:
+                break
+            lines.append(line)
+            length += len(line)
+        lines.reverse()
+        return {"role": "system", "content": "较早的对话摘要：\n" + "\n".join(lines)}
+
+    def stats(self) -> Dict[str, Any]:
+        """获取裁剪统计"""
+        cache = estimate_tokens.cache_info()
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "default_context_tokens": self.default_context_tokens,
+                "model_context_tokens": dict(self.model_context_tokens),
+                "reserved_completion_tokens": self.reserved_completion_tokens,
+                "max_prompt_tokens": self.max_prompt_tokens,
+                "requests": self.requests,
+                "trimmed_requests": self.trimmed_requests,
+                "tokens_saved": self.tokens_saved,
+                "dropped_messages": self.dropped_messages,
+                "token_cache_hits": cache.hits,
+                "token_cache_misses": cache.misses
+            }
+
+
+# 创建全局实例
+context_window = ContextWindow(
+    default_context_tokens=env_config.LLM_CONTEXT_TOKENS,
+    model_context_tokens=_parse_model_tokens(env_config.LLM_MODEL_CONTEXT_TOKENS),
+    reserved_completion_tokens=env_config.LLM_RESERVED_COMPLETION_TOKENS,
+    max_prompt_tokens=env_config.LLM_MAX_PROMPT_TOKENS,
+    policy=env_config.LLM_CONTEXT_POLICY
+)
@@ -1,9 +1,14 @@
-from typing import List, Dict, Any, Optional, Generator
+from typing import List, Dict, Any, Optional, Generator, AsyncGenerator
 import requests
+import httpx
 from llm.base import LLMBase
 from config import env_config
+from utils.http_pool import http_pool
+from utils.endpoint_health import endpoint_health
+from llm.hedging import hedged_requests
 import logging
 import json
+import time
 
 logger = logging.getLogger("ai_chat_service.llm.deeplseek")
 
@@ -17,10 +22,56 @@ class DeepSeekLLM(LLMBase):
         self.temperature = env_config.DEEPSEEK_TEMPERATURE
         self.api_base_url = env_config.DEEPSEEK_BASE_URL + "/chat/completions"
         self.backup_api_base_url = env_config.DEEPSEEK_BACKUP_BASE_URL + "/chat/completions"
+        # 主URL和备用URL的健康状态（按延迟和错误率选择，故障端点熔断）
+        self.endpoints = endpoint_health.group("deepseek", [self.api_base_url, self.backup_api_base_url])
         
         if not self.api_key:
             logger.error("DeepSeek API密钥未配置")
             raise ValueError("DeepSeek API密钥未配置")
+    
+    def _headers(self) -> Dict[str, str]:
+        """构建请求头"""
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+    
+    @staticmethod
+    def _parse_stream_line(line: str):
+        """
+        解析一行SSE流式响应
+        
+        参数:
+            line: 已解码的响应行
+        
+        返回:
+            (是否结束, 增量文本, 用量信息)
+        """
+        # 移除前缀 "data: "
+        if line.startswith('data: '):
+            line = line[6:]
+        
+        # 检查是否为结束标志
+        if line == '[DONE]':
+            return True, None, None
+        
+        try:
+            # 解析JSON
+            chunk = json.loads(line)
+        except json.JSONDecodeError:
+            logger.warning(f"无法解析流式响应: {line}")
+            return False, None, None
+        
+        # 最后一个数据块可能携带用量信息（stream_options.include_usage）
+        usage = chunk.get('usage')
+        
+        # 提取内容
+        if ('choices' in chunk and 
+            chunk['choices'] and 
+            'delta' in chunk['choices'][0] and 
+            'content' in chunk['choices'][0]['delta']):
+            return False, chunk['choices'][0]['delta']['content'], usage
+        return False, None, usage
             
     def generate_response(
         self, 
@@ -33,25 +84,11 @@ class DeepSeekLLM(LLMBase):
         生成DeepSeek模型的响应
         """
         try:
-            # 构建messages格式
-            messages = []
-            
-            # 添加系统消息（角色上下文）
-            if character_context:
-                system_content = f"你是{character_context.get('name', 'AI')}"
-                if 'description' in character_context:
-                    system_content += f": {character_context['description']}"
-                messages.append({"role": "system", "content": system_content})
-            
-            # 添加聊天历史
-            if chat_history:
-                for message in chat_history:
-                    role = message.get('role', 'user')
-                    content = message.get('content', '')
-                    messages.append({"role": role, "content": content})
-            
-            # 添加用户消息
-            messages.append({"role": "user", "content": prompt})
+            # 用量信息输出（可选），不属于请求参数
+            usage_sink = kwargs.pop("usage_sink", None)
+            
+            # 构建messages格式（按token预算裁剪历史）
+            messages = self.prepare_messages(prompt, character_context, chat_history)
             
             # 构建请求体
             request_body = {
@@ -62,19 +99,17 @@ class DeepSeekLLM(LLMBase):
             }
             
             # 设置请求头
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+            headers = self._headers()
             
-            # 调用DeepSeek API，带备用URL重试逻辑
+            # 调用DeepSeek API，按端点健康状态依次尝试
             response = None
-            api_urls = [self.api_base_url, self.backup_api_base_url]
+            api_urls = self.endpoints.order()
             
             for url in api_urls:
                 try:
                     logger.info(f"尝试调用DeepSeek API: {url}")
-                    response = requests.post(
+                    started_at = time.perf_counter()
+                    response = http_pool.post(
                         url,
                         headers=headers,
                         json=request_body,
@@ -83,15 +118,19 @@ class DeepSeekLLM(LLMBase):
                     
                     # 检查响应状态
                     response.raise_for_status()
+                    self.endpoints.record_success(url, time.perf_counter() - started_at)
                     logger.info(f"DeepSeek API调用成功: {url}")
                     break
                 except requests.exceptions.RequestException as e:
+                    self.endpoints.record_failure(url, time.perf_counter() - started_at)
                     logger.warning(f"DeepSeek API调用失败({url}): {str(e)}")
                     if url == api_urls[-1]:  # 如果是最后一个URL，抛出异常
                         raise
             
             # 解析响应
             response_json = response.json()
+            if response_json.get("usage"):
+                self._sink_usage(usage_sink, response_json["usage"])
             
             # 返回生成的文本
             return response_json["choices"][0]["message"]["content"]
@@ -120,25 +159,11 @@ class DeepSeekLLM(LLMBase):
         生成DeepSeek模型的流式响应
         """
         try:
-            # 构建messages格式
-            messages = []
-            
-            # 添加系统消息（角色上下文）
-            if character_context:
-                system_content = f"你是{character_context.get('name', 'AI')}"
-                if 'description' in character_context:
-                    system_content += f": {character_context['description']}"
-                messages.append({"role": "system", "content": system_content})
-            
-            # 添加聊天历史
-            if chat_history:
-                for message in chat_history:
-                    role = message.get('role', 'user')
-                    content = message.get('content', '')
-                    messages.append({"role": role, "content": content})
-            
-            # 添加用户消息
-            messages.append({"role": "user", "content": prompt})
+            # 用量信息输出（可选），不属于请求参数
+            usage_sink = kwargs.pop("usage_sink", None)
+            
+            # 构建messages格式（按token预算裁剪历史）
+            messages = self.prepare_messages(prompt, character_context, chat_history)
             
             # 构建请求体（启用流式）
             request_body = {
@@ -148,21 +173,21 @@ class DeepSeekLLM(LLMBase):
                 "stream": True,
                 **kwargs
             }
+            if usage_sink is not None:
+                request_body.setdefault("stream_options", {"include_usage": True})
             
             # 设置请求头
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+            headers = self._headers()
             
-            # 调用DeepSeek API的流式响应，带备用URL重试逻辑
+            # 调用DeepSeek API的流式响应，按端点健康状态依次尝试
             response = None
-            api_urls = [self.api_base_url, self.backup_api_base_url]
+            api_urls = self.endpoints.order()
             
             for url in api_urls:
                 try:
                     logger.info(f"尝试调用DeepSeek流式API: {url}")
-                    response = requests.post(
+                    started_at = time.perf_counter()
+                    response = http_pool.post(
                         url,
                         headers=headers,
                         json=request_body,
@@ -170,11 +195,13 @@ class DeepSeekLLM(LLMBase):
                         timeout=30
                     )
                     
-                    # 检查响应状态
+                    # 检查响应状态（流式请求按收到响应头的耗时计延迟）
                     response.raise_for_status()
+                    self.endpoints.record_success(url, time.perf_counter() - started_at)
                     logger.info(f"DeepSeek流式API调用成功: {url}")
                     break
                 except requests.exceptions.RequestException as e:
+                    self.endpoints.record_failure(url, time.perf_counter() - started_at)
                     logger.warning(f"DeepSeek流式API调用失败({url}): {str(e)}")
                     if url == api_urls[-1]:  # 如果是最后一个URL，抛出异常
                         raise
@@ -183,32 +210,15 @@ class DeepSeekLLM(LLMBase):
                 
                 # 处理流式响应
                 for line in response.iter_lines():
-                    if line:
-                        # 移除前缀 "data: "
-                        line = line.decode('utf-8')
-                        if line.startswith('data: '):
-                            line = line[6:]
-                            
-                        # 检查是否为结束标志
-                        if line == '[DONE]':
-                            break
-                        
-                        try:
-                            # 解析JSON
-                            chunk = json.loads(line)
-                            
-                            # 提取内容
-                            if ('choices' in chunk and 
-                                chunk['choices'] and 
-                                'delta' in chunk['choices'][0] and 
-                                'content' in chunk['choices'][0]['delta']):
-                                
-                                content = chunk['choices'][0]['delta']['content']
-                                if content:
-                                    yield content
-                        except json.JSONDecodeError:
-                            logger.warning(f"无法解析流式响应: {line}")
-                            continue
+                    if not line:
+                        continue
+                    done, content, usage = self._parse_stream_line(line.decode('utf-8'))
+                    if done:
+                        break
+                    if usage and usage_sink is not None:
+                        self._sink_usage(usage_sink, usage)
+                    if content:
+                        yield content
                             
         except requests.exceptions.RequestException as e:
             logger.error(f"DeepSeek流式API调用失败: {str(e)}")
@@ -221,4 +231,142 @@ class DeepSeekLLM(LLMBase):
             raise
         except Exception as e:
             logger.error(f"DeepSeek模型流式处理异常: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+    
+    async def agenerate_response(
+        self, 
+        prompt: str, 
+        character_context: Dict[str, Any] = None,
+        chat_history: List[Dict[str, str]] = None,
+        **kwargs
+    ) -> str:
+        """
+        异步生成DeepSeek模型的响应
+        """
+        try:
+            # 用量信息输出（可选），不属于请求参数
+            usage_sink = kwargs.pop("usage_sink", None)
+            
+            # 构建messages格式（按token预算裁剪历史）
+            messages = self.prepare_messages(prompt, character_context, chat_history)
+            
+            # 构建请求体
+            request_body = {
+                "model": self.model,
+                "messages": messages,
+                "temperature": self.temperature,
+                **kwargs
+            }
+            
+            # 调用DeepSeek API，按端点健康状态排序；主请求慢于近期延迟分位数时对冲下一个端点
+            api_urls = self.endpoints.order()
+            # 只对冲到未熔断的端点；主请求是半开试探时不对冲，试探结果只由该端点决定
+            hedge = len(api_urls) > 1 and all(self.endpoints.is_available(url) for url in api_urls[:2])
+            response = await hedged_requests.run([
+                lambda url=url: self._apost(url, request_body) for url in api_urls
+            ], hedge=hedge)
+            
+            # 解析响应
+            response_json = response.json()
+            if response_json.get("usage"):
+                self._sink_usage(usage_sink, response_json["usage"])
+            
+            # 返回生成的文本
+            return response_json["choices"][0]["message"]["content"]
+            
+        except httpx.HTTPStatusError as e:
+            logger.error(f"DeepSeek API调用失败: {str(e)}")
+            logger.error(f"响应内容: {e.response.text}")
+            raise
+        except Exception as e:
+            logger.error(f"DeepSeek模型处理异常: {str(e)}")
+            raise
+    
+    async def _apost(self, url: str, request_body: Dict[str, Any]) -> httpx.Response:
+        """
+        向一个端点发送非流式请求并记录端点健康状态
+        
+        参数:
+            url: 端点URL
+            request_body: 请求体
+        
+        返回:
+            状态码正常的响应
+        """
+        logger.info(f"尝试调用DeepSeek API(异步): {url}")
+        started_at = time.perf_counter()
+        try:
+            response = await http_pool.apost(url, headers=self._headers(), json=request_body, timeout=30)
+            
+            # 检查响应状态
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            self.endpoints.record_failure(url, time.perf_counter() - started_at)
+            logger.warning(f"DeepSeek API调用失败({url}): {str(e)}")
+            raise
+        self.endpoints.record_success(url, time.perf_counter() - started_at)
+        logger.info(f"DeepSeek API调用成功(异步): {url}")
+        return response
+    
+    async def agenerate_streaming_response(
+        self, 
+        prompt: str, 
+        character_context: Dict[str, Any] = None,
+        chat_history: List[Dict[str, str]] = None,
+        **kwargs
+    ) -> AsyncGenerator[str, None]:
+        """
+        异步生成DeepSeek模型的流式响应
+        """
+        # 用量信息输出（可选），不属于请求参数
+        usage_sink = kwargs.pop("usage_sink", None)
+        
+        # 构建messages格式（按token预算裁剪历史）
+        messages = self.prepare_messages(prompt, character_context, chat_history)
+        
+        # 构建请求体（启用流式）
+        request_body = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": self.temperature,
+            "stream": True,
+            **kwargs
+        }
+        if usage_sink is not None:
+            request_body.setdefault("stream_options", {"include_usage": True})
+        
+        api_urls = self.endpoints.order()
+        yielded = False
+        
+        for url in api_urls:
+            try:
+                logger.info(f"尝试调用DeepSeek流式API(异步): {url}")
+                started_at = time.perf_counter()
+                connected = False
+                async with http_pool.astream("POST", url, headers=self._headers(), json=request_body, timeout=30) as response:
+                    # 检查响应状态（流式请求按收到响应头的耗时计延迟）
+                    response.raise_for_status()
+                    self.endpoints.record_success(url, time.perf_counter() - started_at)
+                    connected = True
+                    logger.info(f"DeepSeek流式API调用成功(异步): {url}")
+                    
+                    # 处理流式响应
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        done, content, usage = self._parse_stream_line(line)
+                        if done:
+                            break
+                        if usage and usage_sink is not None:
+                            self._sink_usage(usage_sink, usage)
+                        if content:
+                            yielded = True
+                            yield content
+                return
+            except httpx.HTTPError as e:
+                self.endpoints.record_failure(url, None if connected else time.perf_counter() - started_at)
+                logger.warning(f"DeepSeek流式API调用失败({url}): {str(e)}")
+                # 已经输出过内容时不能切换URL重试，否则会产生重复内容
+                if yielded or url == api_urls[-1]:
+                    logger.error(f"DeepSeek流式API调用失败: {str(e)}")
+                    raise
@@ -0,0 +1,163 @@
+"""
+对冲请求
+非流式调用的尾延迟往往来自某个慢的上游节点：主请求超过近期延迟的某个分位数
+仍未返回时，向下一个端点再发一个对冲请求，采用先返回的结果并取消另一个。
+对冲请求数按主请求数的比例限额，避免上游整体变慢时请求量翻倍
+"""
+
+import asyncio
+import math
+import threading
+import time
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import env_config
+
+logger = logging.getLogger("ai_chat_service.llm.hedging")
+
+
+class HedgedRequests:
+    """按延迟分位数触发对冲请求，并限制对冲比例"""
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        budget: float = 0.05,
+        window: int = 200,
+        min_samples: int = 20,
+        enabled: bool = True
+    ):
+        """
+        初始化对冲策略
+
+        参数:
+            percentile: 触发对冲的延迟分位数（0-100）
+            budget: 对冲请求占请求总数的比例上限
+            window: 计算分位数使用的最近请求数
+            min_samples: 样本少于该数时不对冲
+            enabled: 是否启用对冲（关闭时只按顺序故障转移）
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = max(1, min_samples)
+        self.enabled = enabled
+
+        self._latencies = deque(maxlen=max(1, window))
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.hedges_skipped = 0
+        self.failovers = 0
+
+    def delay(self) -> Optional[float]:
+        """
+        获取触发对冲前的等待时间
+
+        返回:
+            近期延迟的分位数（秒），样本不足时返回None
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, max(0, math.ceil(self.percentile / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def _acquire(self) -> bool:
+        """在对冲比例限额内占用一个对冲名额"""
+        with self._lock:
+            if self.hedges_fired + 1 > self.budget * self.requests:
+                self.hedges_skipped += 1
+                return False
+            self.hedges_fired += 1
+            return True
+
+    def _record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    async def run(self, attempts: List[Callable[[], Awaitable[Any]]], hedge: bool = True) -> Any:
+        """
+        执行请求：先发主请求，超过延迟分位数仍未返回时对冲第二个端点，
+        全部失败时依次尝试剩余端点
+
+        参数:
+            attempts: 按端点顺序排列的无参协程函数，第一个为主请求
+            hedge: 是否允许对冲（主请求是熔断恢复试探或第二个端点未正常服务时传False，只按顺序故障转移）
+
+        返回:
+            先成功的请求结果；全部失败时抛出最后一个异常
+        """
+        pending = list(attempts)
+        tasks: Dict[asyncio.Future, str] = {}
+
+        def launch(kind: str):
+            tasks[asyncio.ensure_future(pending.pop(0)())] = kind
+
+        with self._lock:
+            self.requests += 1
+        started_at = time.perf_counter()
+        error: Optional[BaseException] = None
+        launch("primary")
+
+        try:
+            delay = self.delay() if self.enabled and hedge and pending else None
+            if delay is not None:
+                done, _ = await asyncio.wait(list(tasks), timeout=delay)
+                if not done and self._acquire():
+                    logger.info(f"主请求超过{delay * 1000:.0f}ms未返回，发出对冲请求")
+                    launch("hedge")
+
+            while tasks:
+                done, _ = await asyncio.wait(list(tasks), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    kind = tasks.pop(task)
+                    if task.exception() is None:
+                        if kind == "hedge":
+                            with self._lock:
+                                self.hedges_won += 1
+                        self._record(time.perf_counter() - started_at)
+                        return task.result()
+                    error = task.exception()
+                # 进行中的请求都失败了，依次尝试剩余端点
+                if not tasks and pending:
+                    with self._lock:
+                        self.failovers += 1
+                    launch("failover")
+            raise error
+        finally:
+            # 取消落后的请求（关闭其上游连接）
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取对冲统计"""
+        delay = self.delay()
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "percentile": self.percentile,
+                "budget": self.budget,
+                "hedge_delay_ms": round(delay * 1000, 1) if delay is not None else None,
+                "samples": len(self._latencies),
+                "requests": self.requests,
+                "hedges_fired": self.hedges_fired,
+                "hedges_won": self.hedges_won,
+                "hedges_skipped": self.hedges_skipped,
+                "hedge_rate": round(self.hedges_fired / self.requests, 4) if self.requests else 0.0,
+                "failovers": self.failovers
+            }
+
+
+# 创建全局实例
+hedged_requests = HedgedRequests(
+    percentile=env_config.LLM_HEDGE_PERCENTILE,
+    budget=env_config.LLM_HEDGE_BUDGET,
+    window=env_config.LLM_HEDGE_WINDOW,
+    min_samples=env_config.LLM_HEDGE_MIN_SAMPLES,
+    enabled=env_config.LLM_HEDGE_ENABLED
+)
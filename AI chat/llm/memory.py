@@ -0,0 +1,311 @@
+"""
+角色记忆
+固定容量的环形缓冲区，写入新记忆时覆盖最旧的一条，不再每轮复制整个列表；
+可选按字节预算限制总大小，适合每个进程同时存在大量Agent的场景
+
+每个记忆附带倒排索引（中文按相邻字二元组切词），支持按BM25相关度召回，
+提示中只放入与当前问题相关的几条记忆
+"""
+
+import heapq
+import math
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 连续的中日韩文字，或连续的字母数字
+_TOKEN_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[A-Za-z0-9]+")
+_CJK_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+
+def tokenize_terms(text: str) -> List[str]:
+    """
+    切分检索词：中文取相邻字二元组（单字词保留单字），英文和数字按词小写
+
+    参数:
+        text: 文本
+
+    返回:
+        检索词列表（可能重复）
+    """
+    terms = []
+    for run in _TOKEN_PATTERN.findall(text or ""):
+        if _CJK_PATTERN.match(run):
+            if len(run) == 1:
+                terms.append(run)
+            else:
+                terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run.lower())
+    return terms
+
+
+class MemoryIndex:
+    """记忆的倒排索引，使用BM25打分"""
+
+    __slots__ = ("k1", "b", "_postings", "_lengths", "_records", "_total_length")
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        初始化索引
+
+        参数:
+            k1: BM25词频饱和参数
+            b: BM25文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        # 检索词 -> {记录序号: 词频}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._lengths: Dict[int, int] = {}
+        self._records: Dict[int, "MemoryRecord"] = {}
+        self._total_length = 0
+
+    def add(self, record: "MemoryRecord"):
+        """把一条记忆加入索引"""
+        counts = Counter(tokenize_terms(record.user_input) + tokenize_terms(record.agent_response))
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[record.seq] = tf
+        length = sum(counts.values())
+        self._lengths[record.seq] = length
+        self._records[record.seq] = record
+        self._total_length += length
+
+    def remove(self, record: "MemoryRecord"):
+        """从索引中删除一条记忆"""
+        if self._records.pop(record.seq, None) is None:
+            return
+        for term in set(tokenize_terms(record.user_input) + tokenize_terms(record.agent_response)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(record.seq, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(record.seq)
+
+    def clear(self):
+        """清空索引"""
+        self._postings.clear()
+        self._lengths.clear()
+        self._records.clear()
+        self._total_length = 0
+
+    def search(self, query: str, k: int) -> List[Tuple["MemoryRecord", float]]:
+        """
+        按BM25相关度检索
+
+        参数:
+            query: 查询文本
+            k: 返回条数
+
+        返回:
+            (记录, 得分) 列表，按得分从高到低，同分时较新的在前
+        """
+        count = len(self._records)
+        if not count or k <= 0:
+            return []
+        average_length = self._total_length / count or 1.0
+
+        scores: Dict[int, float] = {}
+        for term in set(tokenize_terms(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            for seq, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[seq] / average_length)
+                scores[seq] = scores.get(seq, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], item[0]))
+        return [(self._records[seq], score) for seq, score in ranked]
+
+
+class MemoryRecord:
+    """一条记忆（使用__slots__减少每条记录的内存占用）"""
+
+    __slots__ = ("seq", "timestamp", "user_input", "agent_response", "size")
+
+    def __init__(self, user_input: str, agent_response: str, timestamp: Optional[float] = None, seq: int = 0):
+        """
+        初始化记忆记录
+
+        参数:
+            user_input: 用户输入
+            agent_response: 角色回复
+            timestamp: 单调时钟时间戳，默认为当前时间
+            seq: 记录在所属记忆中的序号（递增）
+        """
+        self.seq = seq
+        self.timestamp = time.monotonic() if timestamp is None else timestamp
+        self.user_input = user_input
+        self.agent_response = agent_response
+        self.size = len(user_input.encode("utf-8")) + len(agent_response.encode("utf-8"))
+
+    def __getitem__(self, key: str) -> Any:
+        """兼容按字典方式读取字段"""
+        if key not in ("timestamp", "user_input", "agent_response"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典，用于放入提示上下文"""
+        return {
+            "timestamp": self.timestamp,
+            "user_input": self.user_input,
+            "agent_response": self.agent_response
+        }
+
+    def __repr__(self) -> str:
+        return f"MemoryRecord({self.user_input!r}, {self.agent_response!r})"
+
+
+class AgentMemory:
+    """环形缓冲区实现的角色记忆"""
+
+    __slots__ = ("capacity", "max_bytes", "index", "_slots", "_start", "_count", "_bytes", "_next_seq")
+
+    def __init__(self, capacity: int = 50, max_bytes: Optional[int] = None, indexed: bool = True):
+        """
+        初始化记忆
+
+        参数:
+            capacity: 最多保存的记忆条数
+            max_bytes: 记忆文本的总字节预算，超出时丢弃最旧的记忆，None为不限制
+            indexed: 是否维护倒排索引以支持相关度召回
+        """
+        self.capacity = max(1, capacity)
+        self.max_bytes = max_bytes
+        self.index = MemoryIndex() if indexed else None
+        self._slots: List[Optional[MemoryRecord]] = [None] * self.capacity
+        self._start = 0
+        self._count = 0
+        self._bytes = 0
+        self._next_seq = 0
+
+    def append(self, user_input: str, agent_response: str, timestamp: Optional[float] = None) -> MemoryRecord:
+        """
+        写入一条记忆
+
+        参数:
+            user_input: 用户输入
+            agent_response: 角色回复
+            timestamp: 时间戳，默认为当前时间
+
+        返回:
+            新写入的记录
+        """
+        record = MemoryRecord(user_input, agent_response, timestamp, self._next_seq)
+        self._next_seq += 1
+        if self._count == self.capacity:
+            self._drop_oldest()
+        self._slots[(self._start + self._count) % self.capacity] = record
+        self._count += 1
+        self._bytes += record.size
+        if self.index is not None:
+            self.index.add(record)
+
+        # 按字节预算丢弃最旧的记忆，至少保留最新的一条
+        if self.max_bytes is not None:
+            while self._bytes > self.max_bytes and self._count > 1:
+                self._drop_oldest()
+        return record
+
+    def _drop_oldest(self):
+        record = self._slots[self._start]
+        self._slots[self._start] = None
+        self._start = (self._start + 1) % self.capacity
+        self._count -= 1
+        self._bytes -= record.size
+        if self.index is not None:
+            self.index.remove(record)
+
+    def last(self, n: int) -> List[MemoryRecord]:
+        """
+        获取最近的n条记忆（按时间从旧到新），只复制这n条
+
+        参数:
+            n: 条数
+
+        返回:
+            记忆记录列表
+        """
+        n = max(0, min(n, self._count))
+        first = self._start + self._count - n
+        return [self._slots[(first + i) % self.capacity] for i in range(n)]
+
+    def recall(self, query: str, k: int) -> List[MemoryRecord]:
+        """
+        召回与查询最相关的k条记忆
+
+        参数:
+            query: 查询文本（如用户问题或当前情境）
+            k: 最多返回条数
+
+        返回:
+            记忆记录列表，按得分从高到低；没有相关记忆时为空列表
+        """
+        if self.index is None:
+            return self.last(k)
+        return [record for record, _ in self.index.search(query, k)]
+
+    def extend(self, items: List[Dict[str, Any]]):
+        """
+        从字典列表批量载入记忆（如角色设定中预置的记忆）
+
+        参数:
+            items: 包含user_input和agent_response的字典列表
+        """
+        for item in items:
+            timestamp = item.get("timestamp")
+            self.append(
+                str(item.get("user_input", "")),
+                str(item.get("agent_response", "")),
+                timestamp if isinstance(timestamp, (int, float)) else None
+            )
+
+    def restore(self, rows: List[Tuple[int, str, str]]):
+        """
+        用持久化的记忆替换当前记忆，保留原来的序号
+
+        参数:
+            rows: (序号, 用户输入, 角色回复) 列表，按序号从旧到新
+        """
+        self.clear()
+        for seq, user_input, agent_response in rows:
+            self._next_seq = seq
+            self.append(user_input, agent_response)
+
+    def clear(self):
+        """清空记忆"""
+        self._slots = [None] * self.capacity
+        self._start = 0
+        self._count = 0
+        self._bytes = 0
+        if self.index is not None:
+            self.index.clear()
+
+    @property
+    def last_seq(self) -> int:
+        """最新一条记忆的序号，没有写入过记忆时为-1"""
+        return self._next_seq - 1
+
+    @property
+    def total_bytes(self) -> int:
+        """当前记忆文本的总字节数"""
+        return self._bytes
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[MemoryRecord]:
+        for i in range(self._count):
+            yield self._slots[(self._start + i) % self.capacity]
+
+    def __getitem__(self, index: int) -> MemoryRecord:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("记忆索引超出范围")
+        return self._slots[(self._start + index) % self.capacity]
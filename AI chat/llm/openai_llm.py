@@ -1,8 +1,9 @@
-from typing import List, Dict, Any, Optional, Generator
+from typing import List, Dict, Any, Optional, Generator, AsyncGenerator
 import openai
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from llm.base import LLMBase
 from config import env_config
+from utils.http_pool import http_pool
 import logging
 
 logger = logging.getLogger("ai_chat_service.llm.openai")
@@ -12,11 +13,16 @@ class OpenAILLM(LLMBase):
     
     def __init__(self):
         # 初始化OpenAI客户端
+        # 通过共享连接池访问OpenAI API
+        self.base_url = env_config.OPENAI_BASE_URL
+        client_kwargs = {
+            "base_url": self.base_url
+        }
         if env_config.OPENAI_API_KEY:
-            self.client = OpenAI(api_key=env_config.OPENAI_API_KEY)
-        else:
-            # 如果没有API密钥，尝试使用环境变量或默认配置
-            self.client = OpenAI()
+            client_kwargs["api_key"] = env_config.OPENAI_API_KEY
+        # 如果没有API密钥，SDK会尝试使用环境变量或默认配置
+        self.client = OpenAI(http_client=http_pool.sync_client(self.base_url), **client_kwargs)
+        self.async_client = AsyncOpenAI(http_client=http_pool.async_client(self.base_url), **client_kwargs)
             
         self.model = env_config.OPENAI_MODEL
         self.temperature = env_config.OPENAI_TEMPERATURE
@@ -32,25 +38,11 @@ class OpenAILLM(LLMBase):
         生成OpenAI模型的响应
         """
         try:
-            # 构建messages格式
-            messages = []
-            
-            # 添加系统消息（角色上下文）
-            if character_context:
-                system_content = f"你是{character_context.get('name', 'AI')}"
-                if 'description' in character_context:
-                    system_content += f": {character_context['description']}"
-                messages.append({"role": "system", "content": system_content})
-            
-            # 添加聊天历史
-            if chat_history:
-                for message in chat_history:
-                    role = message.get('role', 'user')
-                    content = message.get('content', '')
-                    messages.append({"role": role, "content": content})
-            
-            # 添加用户消息
-            messages.append({"role": "user", "content": prompt})
+            # 用量信息输出（可选），不属于请求参数
+            usage_sink = kwargs.pop("usage_sink", None)
+            
+            # 构建messages格式（按token预算裁剪历史）
+            messages = self.prepare_messages(prompt, character_context, chat_history)
             
             # 调用OpenAI API
             response = self.client.chat.completions.create(
@@ -60,6 +52,9 @@ class OpenAILLM(LLMBase):
                 **kwargs
             )
             
+            if response.usage:
+                self._sink_usage(usage_sink, response.usage.model_dump())
+            
             # 返回生成的文本
             return response.choices[0].message.content
             
@@ -78,25 +73,11 @@ class OpenAILLM(LLMBase):
         生成OpenAI模型的流式响应
         """
         try:
-            # 构建messages格式
-            messages = []
-            
-            # 添加系统消息（角色上下文）
-            if character_context:
-                system_content = f"你是{character_context.get('name', 'AI')}"
-                if 'description' in character_context:
-                    system_content += f": {character_context['description']}"
-                messages.append({"role": "system", "content": system_content})
-            
-            # 添加聊天历史
-            if chat_history:
-                for message in chat_history:
-                    role = message.get('role', 'user')
-                    content = message.get('content', '')
-                    messages.append({"role": role, "content": content})
-            
-            # 添加用户消息
-            messages.append({"role": "user", "content": prompt})
+            # 用量信息输出（可选），不属于请求参数
+            usage_sink = kwargs.pop("usage_sink", None)
+            
+            # 构建messages格式（按token预算裁剪历史）
+            messages = self.prepare_messages(prompt, character_context, chat_history)
             
             # 调用OpenAI API的流式响应
             stream = self.client.chat.completions.create(
@@ -104,14 +85,90 @@ class OpenAILLM(LLMBase):
                 messages=messages,
                 temperature=self.temperature,
                 stream=True,
+                **({"stream_options": {"include_usage": True}} if usage_sink is not None else {}),
                 **kwargs
             )
             
             # 流式返回生成的文本
             for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
+                if getattr(chunk, "usage", None) and usage_sink is not None:
+                    self._sink_usage(usage_sink, chunk.usage.model_dump())
+                if chunk.choices and chunk.choices[0].delta.content is not None:
                     yield chunk.choices[0].delta.content
                     
         except Exception as e:
             logger.error(f"OpenAI流式API调用失败: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+    
+    async def agenerate_response(
+        self, 
+        prompt: str, 
+        character_context: Dict[str, Any] = None,
+        chat_history: List[Dict[str, str]] = None,
+        **kwargs
+    ) -> str:
+        """
+        异步生成OpenAI模型的响应
+        """
+        try:
+            # 用量信息输出（可选），不属于请求参数
+            usage_sink = kwargs.pop("usage_sink", None)
+            
+            # 构建messages格式（按token预算裁剪历史）
+            messages = self.prepare_messages(prompt, character_context, chat_history)
+            
+            # 调用OpenAI API
+            response = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                **kwargs
+            )
+            
+            if response.usage:
+                self._sink_usage(usage_sink, response.usage.model_dump())
+            
+            # 返回生成的文本
+            return response.choices[0].message.content
+            
+        except Exception as e:
+            logger.error(f"OpenAI API调用失败: {str(e)}")
+            raise
+    
+    async def agenerate_streaming_response(
+        self, 
+        prompt: str, 
+        character_context: Dict[str, Any] = None,
+        chat_history: List[Dict[str, str]] = None,
+        **kwargs
+    ) -> AsyncGenerator[str, None]:
+        """
+        异步生成OpenAI模型的流式响应
+        """
+        try:
+            # 用量信息输出（可选），不属于请求参数
+            usage_sink = kwargs.pop("usage_sink", None)
+            
+            # 构建messages格式（按token预算裁剪历史）
+            messages = self.prepare_messages(prompt, character_context, chat_history)
+            
+            # 调用OpenAI API的流式响应
+            stream = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                stream=True,
+                **({"stream_options": {"include_usage": True}} if usage_sink is not None else {}),
+                **kwargs
+            )
+            
+            # 流式返回生成的文本
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) and usage_sink is not None:
+                    self._sink_usage(usage_sink, chunk.usage.model_dump())
+                if chunk.choices and chunk.choices[0].delta.content is not None:
+                    yield chunk.choices[0].delta.content
+                    
+        except Exception as e:
+            logger.error(f"OpenAI流式API调用失败: {str(e)}")
+            raise
@@ -0,0 +1,110 @@
+"""
+提示前缀复用统计
+上游的提示缓存（KV缓存）只对逐字节相同的前缀生效。这里记录每次请求开头的
+系统消息哈希，统计前缀复用率，并汇总上游返回的缓存命中token数，
+用于确认提示布局确实命中了缓存
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+def prefix_hash(messages: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    计算开头连续系统消息的哈希
+
+    参数:
+        messages: Chat Completions格式的消息列表
+
+    返回:
+        十六进制哈希，没有系统消息时返回None
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    found = False
+    for message in messages:
+        if message.get("role") != "system":
+            break
+        digest.update((message.get("content") or "").encode("utf-8"))
+        digest.update(b"\x00")
+        found = True
+    return digest.hexdigest() if found else None
+
+
+class PrefixCacheTracker:
+    """统计提示前缀复用和上游缓存命中"""
+
+    def __init__(self, max_prefixes: int = 4096):
+        """
+        初始化统计
+
+        参数:
+            max_prefixes: 最多记住的前缀数（按最近使用淘汰）
+        """
+        self.max_prefixes = max_prefixes
+        self._prefixes: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.prefix_reuses = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def observe(self, messages: List[Dict[str, Any]]) -> Optional[str]:
+        """
+        记录一次请求的前缀
+
+        参数:
+            messages: 发送给上游的消息列表
+
+        返回:
+            前缀哈希
+        """
+        digest = prefix_hash(messages)
+        if digest is None:
+            return None
+        with self._lock:
+            self.requests += 1
+            if digest in self._prefixes:
+                self._prefixes[digest] += 1
+                self._prefixes.move_to_end(digest)
+                self.prefix_reuses += 1
+            else:
+                self._prefixes[digest] = 1
+                if len(self._prefixes) > self.max_prefixes:
+                    self._prefixes.popitem(last=False)
+        return digest
+
+    def record_usage(self, usage: Optional[Dict[str, Any]]):
+        """
+        汇总上游返回的用量（OpenAI的prompt_tokens_details.cached_tokens，
+        DeepSeek的prompt_cache_hit_tokens）
+
+        参数:
+            usage: 上游返回的usage字典
+        """
+        if not usage:
+            return
+        details = usage.get("prompt_tokens_details") or {}
+        cached = details.get("cached_tokens") or usage.get("prompt_cache_hit_tokens") or 0
+        with self._lock:
+            self.prompt_tokens += usage.get("prompt_tokens") or 0
+            self.cached_tokens += cached
+
+    def stats(self) -> Dict[str, Any]:
+        """获取前缀复用统计"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "distinct_prefixes": len(self._prefixes),
+                "prefix_reuses": self.prefix_reuses,
+                "prefix_reuse_rate": round(self.prefix_reuses / self.requests, 4) if self.requests else 0.0,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cached_token_ratio": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0
+            }
+
+
+# 创建全局实例
+prompt_cache = PrefixCacheTracker()
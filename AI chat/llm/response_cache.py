@@ -0,0 +1,317 @@
+"""
+LLM响应缓存
+相同的请求（相同的提供商、模型、温度和完整消息列表）直接复用结果：
+- 结果按TTL和最近使用淘汰，条数有上限
+- 并发的相同请求合并为一次上游调用（single-flight）
+- 流式请求合并后，所有调用方收到同一份增量文本流
+只包装按路由显式开启缓存的模型（见 ModelManager.get_model 的cached参数）。
+多个工作进程共享状态后端时，本进程未命中的请求再查共享缓存，写入时同时写入共享缓存
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+from config import env_config
+from llm.base import LLMBase
+from storage.state_backend import StateBackend, state_backend
+
+logger = logging.getLogger("ai_chat_service.llm.response_cache")
+
+
+class _SharedStream:
+    """一次上游流式调用的增量文本，供多个调用方各自从头读取"""
+
+    def __init__(self):
+        self.deltas: List[str] = []
+        self.usage: Dict[str, Any] = {}
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def push(self, delta: str):
+        self.deltas.append(delta)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        index = 0
+        while True:
+            if index < len(self.deltas):
+                index += 1
+                yield self.deltas[index - 1]
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class ResponseCache:
+    """带TTL和LRU淘汰的响应缓存，以及进行中请求的合并表"""
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 300, backend: Optional[StateBackend] = None):
+        """
+        初始化缓存
+
+        参数:
+            max_entries: 本进程最多缓存的响应数
+            ttl: 响应的有效期（秒）
+            backend: 状态后端，为多进程共享的后端时作为第二级缓存
+        """
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.backend = backend if backend is not None and backend.shared else None
+
+        # 键 -> (过期时间, 回复文本)
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 进行中的请求（只在事件循环线程中访问）
+        self.inflight: Dict[str, asyncio.Task] = {}
+        self.inflight_streams: Dict[str, _SharedStream] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stores = 0
+        self.evictions = 0
+        self.shared_hits = 0
+
+    @staticmethod
+    def make_key(provider: str, model: str, temperature: Any, messages: List[Dict[str, Any]], options: Dict[str, Any]) -> str:
+        """
+        计算请求的规范化哈希
+
+        参数:
+            provider: 模型提供商
+            model: 模型名称
+            temperature: 温度
+            messages: 完整消息列表
+            options: 其他请求参数
+
+        返回:
+            十六进制哈希
+        """
+        canonical = json.dumps(
+            {"provider": provider, "model": model, "temperature": temperature, "messages": messages, "options": options},
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(",", ":"),
+            default=str
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """读取未过期的缓存响应"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, text = entry
+                if expires_at >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return text
+                del self._entries[key]
+
+        # 其他工作进程缓存的响应
+        text = self.backend.get("llm_response", key) if self.backend is not None else None
+        with self._lock:
+            if text is None:
+                self.misses += 1
+                return None
+            self._store_local(key, text)
+            self.hits += 1
+            self.shared_hits += 1
+            return text
+
+    def put(self, key: str, text: str):
+        """写入响应（空回复不缓存）"""
+        if not text:
+            return
+        with self._lock:
+            self._store_local(key, text)
+            self.stores += 1
+        if self.backend is not None:
+            self.backend.set("llm_response", key, text, ttl=self.ttl)
+
+    def _store_local(self, key: str, text: str):
+        """写入本进程缓存（调用方持有锁）"""
+        self._entries[key] = (time.monotonic() + self.ttl, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "shared": self.backend is not None,
+                "shared_hits": self.shared_hits,
+                "coalesced": self.coalesced,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "inflight": len(self.inflight) + len(self.inflight_streams)
+            }
+
+
+class CachedLLM(LLMBase):
+    """在模型前加一层响应缓存和请求合并"""
+
+    def __init__(self, inner: LLMBase, provider: str, cache: "ResponseCache"):
+        """
+        初始化缓存包装
+
+        参数:
+            inner: 实际的模型实例
+            provider: 模型提供商（参与缓存键）
+            cache: 响应缓存
+        """
+        self.inner = inner
+        self.provider = provider
+        self.cache = cache
+
+    def __getattr__(self, name):
+        # model、temperature等属性沿用实际模型的
+        return getattr(self.inner, name)
+
+    def _key(self, prompt, character_context, chat_history, options: Dict[str, Any]) -> str:
+        messages = self.inner.build_messages(prompt, character_context, chat_history)
+        return self.cache.make_key(
+            self.provider,
+            getattr(self.inner, "model", None),
+            getattr(self.inner, "temperature", None),
+            messages,
+            options
+        )
+
+    def generate_response(self, prompt, character_context=None, chat_history=None, **kwargs) -> str:
+        usage_sink = kwargs.pop("usage_sink", None)
+        key = self._key(prompt, character_context, chat_history, kwargs)
+        text = self.cache.get(key)
+        if text is not None:
+            return text
+        if usage_sink is not None:
+            kwargs["usage_sink"] = usage_sink
+        text = self.inner.generate_response(prompt, character_context, chat_history, **kwargs)
+        self.cache.put(key, text)
+        return text
+
+    def generate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        # 同步流式调用不经过缓存
+        return self.inner.generate_streaming_response(prompt, character_context, chat_history, **kwargs)
+
+    async def agenerate_response(self, prompt, character_context=None, chat_history=None, **kwargs) -> str:
+        usage_sink = kwargs.pop("usage_sink", None)
+        key = self._key(prompt, character_context, chat_history, kwargs)
+        text = self.cache.get(key)
+        if text is not None:
+            return text
+
+        task = self.cache.inflight.get(key)
+        if task is not None:
+            self.cache.coalesced += 1
+        else:
+            usage: Dict[str, Any] = {}
+
+            async def call():
+                try:
+                    result = await self.inner.agenerate_response(
+                        prompt, character_context, chat_history, usage_sink=usage, **kwargs
+                    )
+                    self.cache.put(key, result)
+                    return result, usage
+                finally:
+                    self.cache.inflight.pop(key, None)
+
+            task = asyncio.ensure_future(call())
+            self.cache.inflight[key] = task
+
+        # 单个调用方取消时不影响其他等待同一结果的调用方
+        text, usage = await asyncio.shield(task)
+        if usage_sink is not None:
+            usage_sink.update(usage)
+        return text
+
+    async def agenerate_streaming_response(
+        self, prompt, character_context=None, chat_history=None, **kwargs
+    ) -> AsyncGenerator[str, None]:
+        usage_sink = kwargs.pop("usage_sink", None)
+        key = self._key(prompt, character_context, chat_history, kwargs)
+        text = self.cache.get(key)
+        if text is not None:
+            yield text
+            return
+
+        stream = self.cache.inflight_streams.get(key)
+        if stream is not None:
+            self.cache.coalesced += 1
+        else:
+            stream = _SharedStream()
+            self.cache.inflight_streams[key] = stream
+
+            async def produce():
+                try:
+                    async for delta in self.inner.agenerate_streaming_response(
+                        prompt, character_context, chat_history, usage_sink=stream.usage, **kwargs
+                    ):
+                        stream.push(delta)
+                    self.cache.put(key, "".join(stream.deltas))
+                    stream.finish()
+                except asyncio.CancelledError:
+                    stream.finish(asyncio.CancelledError())
+                    raise
+                except Exception as e:
+                    stream.finish(e)
+                finally:
+                    self.cache.inflight_streams.pop(key, None)
+
+            stream.task = asyncio.ensure_future(produce())
+
+        stream.subscribers += 1
+        try:
+            async for delta in stream.subscribe():
+                yield delta
+            if usage_sink is not None:
+                usage_sink.update(stream.usage)
+        finally:
+            stream.subscribers -= 1
+            # 所有调用方都离开后停止上游生成
+            if stream.subscribers == 0 and not stream.done and stream.task is not None:
+                stream.task.cancel()
+
+
+# 创建全局实例
+response_cache = ResponseCache(
+    max_entries=env_config.LLM_RESPONSE_CACHE_SIZE,
+    ttl=env_config.LLM_RESPONSE_CACHE_TTL,
+    backend=state_backend
+)
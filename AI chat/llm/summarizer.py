@@ -0,0 +1,123 @@
+"""
+对话摘要调度
+长对话中较早的轮次折叠为滚动摘要，摘要在请求路径之外异步生成：
+- 摘要任务进入独立的低优先级队列，由少量后台协程依次处理，不占用交互请求的并发
+- 同一个Agent同时最多排队一个摘要任务
+- 队列满时直接丢弃，下一轮对话会再次触发
+"""
+
+import asyncio
+import time
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set
+
+from config import env_config
+
+logger = logging.getLogger("ai_chat_service.llm.summarizer")
+
+
+class SummaryScheduler:
+    """低优先级的摘要任务队列"""
+
+    def __init__(self, max_pending: int = 100, concurrency: int = 1):
+        """
+        初始化调度器
+
+        参数:
+            max_pending: 最多排队的摘要任务数
+            concurrency: 同时执行的摘要任务数
+        """
+        self.max_pending = max(1, max_pending)
+        self.concurrency = max(1, concurrency)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        self._pending: Set[Hashable] = set()
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self._total_run = 0.0
+
+    def _ensure_workers(self, loop: asyncio.AbstractEventLoop):
+        """在当前事件循环中启动后台协程（事件循环变化时重建）"""
+        if self._loop is loop and self._workers:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._pending.clear()
+        self._workers = [loop.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    def submit(self, key: Hashable, job: Callable[[], Awaitable[Any]]) -> bool:
+        """
+        提交一个摘要任务（不等待执行）
+
+        参数:
+            key: 去重键（通常为Agent），同一键同时只排队一个任务
+            job: 无参数的协程函数
+
+        返回:
+            是否已入队；没有运行中的事件循环、重复提交或队列已满时返回False
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        self._ensure_workers(loop)
+
+        if key in self._pending:
+            return False
+        try:
+            self._queue.put_nowait((key, job))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("摘要队列已满，跳过本次摘要")
+            return False
+        self._pending.add(key)
+        self.submitted += 1
+        return True
+
+    async def _worker(self):
+        while True:
+            key, job = await self._queue.get()
+            started_at = time.perf_counter()
+            try:
+                await job()
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"生成对话摘要失败: {e}")
+            finally:
+                self._total_run += time.perf_counter() - started_at
+                self._pending.discard(key)
+                self._queue.task_done()
+
+    async def join(self):
+        """等待当前排队的摘要任务全部完成"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取摘要任务统计"""
+        finished = self.completed + self.failed
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_pending": self.max_pending,
+            "concurrency": self.concurrency,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "avg_run_ms": round(self._total_run / finished * 1000, 1) if finished else 0.0
+        }
+
+
+# 创建全局实例
+summary_scheduler = SummaryScheduler(
+    max_pending=env_config.AGENT_SUMMARY_QUEUE_SIZE,
+    concurrency=env_config.AGENT_SUMMARY_CONCURRENCY
+)
@@ -28,6 +28,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count"],  # 前端分页读取角色搜索的匹配总数
 )
 
 # 导入并配置日志
@@ -47,12 +48,54 @@ async def global_exception_handler(request: Request, exc: Exception):
 from api.chat_routes import router as chat_router
 from api.speech_routes import router as speech_router
 from api.character_routes import router as character_router
+from api.admin_routes import router as admin_router
+from api.voice_ws_routes import router as voice_ws_router
 
 app.include_router(chat_router, prefix="/api/chat", tags=["聊天"])
 app.include_router(speech_router, prefix="/api/speech", tags=["语音"])
 app.include_router(speech_router, prefix="/api/voice", tags=["语音"])
 app.include_router(speech_router, prefix="/voice", tags=["语音"])
+app.include_router(voice_ws_router, prefix="/api/voice", tags=["语音"])
+app.include_router(voice_ws_router, prefix="/voice", tags=["语音"])
 app.include_router(character_router, prefix="/api", tags=["角色"])
+app.include_router(admin_router, prefix="/api/admin", tags=["管理"])
+
+# 启动时在后台探测TTS API端点
+@app.on_event("startup")
+async def warm_up_tts():
+    from speech.tts import tts_engine
+    tts_engine.warm_up()
+
+# 关闭时释放出站连接
+@app.on_event("shutdown")
+async def shutdown_http_pool():
+    from utils.http_pool import http_pool
+    await http_pool.aclose()
+
+# 关闭时停止常驻转码工作进程
+@app.on_event("shutdown")
+async def shutdown_transcode_pool():
+    from speech.transcode_pool import transcode_pool
+    transcode_pool.shutdown()
+
+# 关闭时结束流式识别会话
+@app.on_event("shutdown")
+async def shutdown_recognition_sessions():
+    from speech.streaming_recognition import recognition_sessions
+    recognition_sessions.shutdown()
+
+# 关闭时释放语音执行器
+@app.on_event("shutdown")
+async def shutdown_executors():
+    from utils.executors import executors
+    executors.shutdown()
+
+# 关闭时提交排队中的持久化写入
+@app.on_event("shutdown")
+async def shutdown_sqlite_store():
+    from storage.sqlite_store import sqlite_store
+    if sqlite_store is not None:
+        sqlite_store.close()
 
 # 测试接口
 @app.get("/")
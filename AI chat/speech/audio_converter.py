@@ -14,12 +14,15 @@ import io
 try:
     from pydub import AudioSegment
     from pydub.utils import mediainfo
+    from speech.audio_dsp import process_for_tts, preprocess_pcm_to_wav
     PYDUB_AVAILABLE = True
 except ImportError:
     PYDUB_AVAILABLE = False
     logging.warning("pydub未安装，音频格式转换功能将不可用")
 
 from config import env_config
+from speech.transcode_pool import transcode_pool
+from utils.executors import executors
 
 logger = logging.getLogger("ai_chat_service.speech.audio_converter")
 
@@ -44,6 +47,32 @@ class AudioConverter:
             'm4a': ['audio/mp4', 'audio/m4a']
         }
         
+        # 文件扩展名到ffmpeg输入格式的映射
+        self.format_mapping = {
+            'webm': 'webm',
+            'mp3': 'mp3', 
+            'wav': 'wav',
+            'ogg': 'ogg',
+            'flac': 'flac',
+            'm4a': 'mp4'
+        }
+        
+        # 目标格式对应的ffmpeg容器格式和编码器
+        self.output_codecs = {
+            'wav': ('wav', 'pcm_s16le'),
+            'mp3': ('mp3', 'libmp3lame'),
+            'webm': ('webm', 'libvorbis'),
+            'ogg': ('ogg', 'libvorbis')
+        }
+        
+        # WebM压缩质量对应的Vorbis VBR等级
+        # （固定码率在16kHz单声道下超出Vorbis允许范围，会导致编码器无法打开）
+        self.quality_levels = {
+            "low": "2",
+            "medium": "4",
+            "high": "6"
+        }
+        
         logger.info("音频格式转换器初始化完成")
     
     def _setup_ffmpeg(self):
@@ -76,75 +105,19 @@ class AudioConverter:
         返回:
             (输出文件路径, 错误信息)
         """
+        logger.info("开始WebM到WAV转换")
         try:
-            logger.info("开始WebM到WAV转换")
-            
-            # 确定输出路径
-            if output_path is None:
-                fd, temp_path = tempfile.mkstemp(suffix='.wav')
-                os.close(fd)
-                output_path = temp_path
-            else:
-                # 确保输出目录存在
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            
-            # 如果输入是字节数据，转换为临时文件
-            input_file_path = None
-            if isinstance(input_data, bytes):
-                fd, input_file_path = tempfile.mkstemp(suffix='.webm')
-                os.close(fd)
-                with open(input_file_path, 'wb') as f:
-                    f.write(input_data)
-                input_data = input_file_path
-            
-            logger.info(f"正在转换文件: {input_data}")
-            
-            # 首先尝试使用pydub直接处理
-            try:
-                # 读取WebM文件
-                audio = AudioSegment.from_file(input_data, format="webm")
-                logger.info(f"WebM文件读取成功，原始参数: 采样率={audio.frame_rate}Hz, 声道数={audio.channels}, 时长={len(audio)/1000:.2f}秒")
-            except Exception as e:
-                # 如果直接webm格式失败，尝试自动检测
-                logger.warning(f"使用webm格式读取失败，尝试自动检测格式: {e}")
-                try:
-                    audio = AudioSegment.from_file(input_data)
-                    logger.info(f"自动检测格式成功，原始参数: 采样率={audio.frame_rate}Hz, 声道数={audio.channels}")
-                except Exception as e2:
-                    raise Exception(f"无法读取音频文件: {e2}")
-            
-            # 应用音频处理参数
-            processed_audio = self._process_audio_for_tts(
-                audio, 
-                target_sample_rate=sample_rate or env_config.AUDIO_SAMPLE_RATE,
-                target_channels=channels or env_config.AUDIO_CHANNELS
-            )
-            
-            # 导出为WAV格式
-            processed_audio.export(
-                output_path, 
-                format="wav",
-                parameters=["-acodec", "pcm_s16le"]  # 确保使用标准PCM编码
-            )
-            
-            logger.info(f"WAV文件导出成功: {output_path}")
-            logger.info(f"转换后参数: 采样率={processed_audio.frame_rate}Hz, 声道数={processed_audio.channels}, 时长={len(processed_audio)/1000:.2f}秒")
-            
-            return output_path, None
-            
+            wav_bytes = self._to_wav_bytes(input_data, "webm", sample_rate, channels)
         except Exception as e:
-            error = f"WebM到WAV转换失败: {str(e)}"
-            logger.error(error)
-            logger.exception("转换异常详细信息")
-            return None, error
-        
-        finally:
-            # 清理临时输入文件
-            if input_file_path and os.path.exists(input_file_path):
-                try:
-                    os.remove(input_file_path)
-                except:
-                    pass
+            # 如果按webm格式解码失败，尝试自动检测
+            logger.warning(f"使用webm格式读取失败，尝试自动检测格式: {e}")
+            try:
+                wav_bytes = self._to_wav_bytes(input_data, None, sample_rate, channels)
+            except Exception as e2:
+                error = f"WebM到WAV转换失败: 无法读取音频文件: {e2}"
+                logger.error(error)
+                return None, error
+        return self._write_output(wav_bytes, output_path, ".wav", "WebM到WAV转换失败")
     
     def any_to_wav(
         self, 
@@ -167,73 +140,37 @@ class AudioConverter:
         返回:
             (输出文件路径, 错误信息)
         """
+        wav_bytes, error = self.any_to_wav_bytes(input_data, input_format, sample_rate, channels)
+        if error:
+            return None, error
+        return self._write_output(wav_bytes, output_path, ".wav", "音频格式转换失败")
+    
+    def any_to_wav_bytes(
+        self,
+        input_data: Union[bytes, str],
+        input_format: Optional[str] = None,
+        sample_rate: Optional[int] = None,
+        channels: Optional[int] = None
+    ) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        将任意音频格式转换为WAV字节数据，全程在内存中完成
+        
+        参数:
+            input_data: 输入音频文件路径或字节数据
+            input_format: 输入格式（webm, mp3, wav等），如果为None则自动检测
+            sample_rate: 目标采样率
+            channels: 目标声道数
+        
+        返回:
+            (WAV字节数据, 错误信息)
+        """
         try:
             logger.info(f"开始音频格式转换，源格式: {input_format or '自动检测'}")
-            
-            # 确定输出路径
-            if output_path is None:
-                fd, temp_path = tempfile.mkstemp(suffix='.wav')
-                os.close(fd)
-                output_path = temp_path
-            else:
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            
-            # 如果输入是字节数据，转换为临时文件
-            input_file_path = None
-            if isinstance(input_data, bytes):
-                # 根据输入格式确定临时文件扩展名
-                ext = f".{input_format}" if input_format else ".tmp"
-                fd, input_file_path = tempfile.mkstemp(suffix=ext)
-                os.close(fd)
-                with open(input_file_path, 'wb') as f:
-                    f.write(input_data)
-                input_data = input_file_path
-            
-            # 读取音频文件
-            try:
-                if input_format:
-                    logger.info(f"使用指定格式读取: {input_format}")
-                    audio = AudioSegment.from_file(input_data, format=input_format)
-                else:
-                    logger.info("自动检测音频格式")
-                    audio = AudioSegment.from_file(input_data)
-                
-                # 获取音频信息
-                info = mediainfo(input_data)
-                logger.info(f"音频文件信息: {info}")
-                
-            except Exception as e:
-                raise Exception(f"无法读取音频文件: {str(e)}")
-            
-            # 应用音频处理参数
-            processed_audio = self._process_audio_for_tts(
-                audio, 
-                target_sample_rate=sample_rate or env_config.AUDIO_SAMPLE_RATE,
-                target_channels=channels or env_config.AUDIO_CHANNELS
-            )
-            
-            # 导出为WAV格式
-            processed_audio.export(
-                output_path, 
-                format="wav",
-                parameters=["-acodec", "pcm_s16le"]
-            )
-            
-            logger.info(f"音频转换成功: {output_path}")
-            return output_path, None
-            
+            return self._to_wav_bytes(input_data, input_format, sample_rate, channels), None
         except Exception as e:
             error = f"音频格式转换失败: {str(e)}"
             logger.error(error)
             return None, error
-        
-        finally:
-            # 清理临时文件
-            if input_file_path and os.path.exists(input_file_path):
-                try:
-                    os.remove(input_file_path)
-                except:
-                    pass
     
     def wav_to_webm(
         self, 
@@ -252,65 +189,167 @@ class AudioConverter:
         返回:
             (输出文件路径, 错误信息)
         """
+        webm_bytes, error = self.wav_to_webm_bytes(input_data, quality)
+        if error:
+            return None, error
+        return self._write_output(webm_bytes, output_path, ".webm", "WAV到WebM转换失败")
+    
+    def wav_to_webm_bytes(
+        self,
+        input_data: Union[bytes, str],
+        quality: str = "medium"
+    ) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        将WAV编码为WebM，结果直接以字节返回
+        
+        参数:
+            input_data: WAV文件路径或字节数据
+            quality: 压缩质量 (low, medium, high)
+        
+        返回:
+            (WebM字节数据, 错误信息)
+        """
         try:
             logger.info("开始WAV到WebM转换")
-            
-            # 确定输出路径
-            if output_path is None:
-                fd, temp_path = tempfile.mkstemp(suffix='.webm')
-                os.close(fd)
-                output_path = temp_path
-            else:
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            
-            # 如果输入是字节数据，转换为临时文件
-            input_file_path = None
-            if isinstance(input_data, bytes):
-                fd, input_file_path = tempfile.mkstemp(suffix='.wav')
-                os.close(fd)
-                with open(input_file_path, 'wb') as f:
-                    f.write(input_data)
-                input_data = input_file_path
-            
-            # 读取WAV文件
-            audio = AudioSegment.from_file(input_data, format="wav")
-            logger.info(f"WAV文件读取成功，参数: 采样率={audio.frame_rate}Hz, 声道数={audio.channels}")
-            
-            # 根据质量设置导出参数
-            quality_settings = {
-                "low": {"bitrate": "64k"},
-                "medium": {"bitrate": "128k"},
-                "high": {"bitrate": "192k"}
-            }
-            
-            export_params = quality_settings.get(quality, quality_settings["medium"])
-            
-            # 导出为WebM格式
-            audio.export(
-                output_path, 
-                format="webm",
+            level = self.quality_levels.get(quality, self.quality_levels["medium"])
+            webm_bytes = transcode_pool.transcode(
+                input_data,
+                input_format="wav",
+                output_format="webm",
                 codec="libvorbis",
-                bitrate=export_params["bitrate"]
+                output_args=["-q:a", level],
+                timeout=env_config.AUDIO_TRANSCODE_TIMEOUT
             )
-            
-            logger.info(f"WebM文件导出成功: {output_path}")
-            return output_path, None
-            
+            logger.info(f"WebM编码成功，大小: {len(webm_bytes)} 字节")
+            return webm_bytes, None
         except Exception as e:
             error = f"WAV到WebM转换失败: {str(e)}"
             logger.error(error)
             return None, error
+    
+    def transcode_bytes(
+        self,
+        audio_bytes: bytes,
+        original_filename: str,
+        target_format: str,
+        sample_rate: Optional[int] = None,
+        channels: Optional[int] = None,
+        bitrate: str = "128k"
+    ) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        直接转码为目标格式（不做TTS预处理），结果以字节返回
+        
+        参数:
+            audio_bytes: 音频字节数据
+            original_filename: 原始文件名（用于检测格式）
+            target_format: 目标格式（mp3, webm, wav等）
+            sample_rate: 目标采样率，None为保持不变
+            channels: 目标声道数，None为保持不变
+            bitrate: 有损格式的码率
         
-        finally:
-            if input_file_path and os.path.exists(input_file_path):
-                try:
-                    os.remove(input_file_path)
-                except:
-                    pass
+        返回:
+            (转码后的字节数据, 错误信息)
+        """
+        try:
+            output_format, codec = self.output_codecs.get(target_format, (target_format, None))
+            data = transcode_pool.transcode(
+                audio_bytes,
+                input_format=self._input_format(original_filename),
+                output_format=output_format,
+                sample_rate=sample_rate,
+                channels=channels,
+                codec=codec,
+                bitrate=None if target_format == "wav" else bitrate,
+                timeout=env_config.AUDIO_TRANSCODE_TIMEOUT
+            )
+            return data, None
+        except Exception as e:
+            error = f"{target_format.upper()}转换失败: {str(e)}"
+            logger.error(error)
+            return None, error
+    
+    def _to_wav_bytes(
+        self,
+        input_data: Union[bytes, str],
+        input_format: Optional[str],
+        sample_rate: Optional[int],
+        channels: Optional[int]
+    ) -> bytes:
+        """
+        通过ffmpeg管道解码为PCM，预处理后封装为WAV字节数据，全程不写磁盘
+        
+        参数:
+            input_data: 音频文件路径或字节数据
+            input_format: 输入格式，None为自动检测
+            sample_rate: 目标采样率
+            channels: 目标声道数
+        
+        返回:
+            WAV字节数据
+        """
+        target_sample_rate = sample_rate or env_config.AUDIO_SAMPLE_RATE
+        target_channels = channels or env_config.AUDIO_CHANNELS
+        
+        # ffmpeg直接输出目标采样率和声道数的PCM，省去pydub的二次重采样
+        pcm = transcode_pool.decode_to_pcm(
+            input_data,
+            input_format=input_format,
+            sample_rate=target_sample_rate,
+            channels=target_channels,
+            timeout=env_config.AUDIO_TRANSCODE_TIMEOUT
+        )
+        logger.info(f"音频解码成功，参数: 采样率={target_sample_rate}Hz, 声道数={target_channels}, 时长={len(pcm) / (2 * target_channels * target_sample_rate):.2f}秒")
+        
+        # 音量标准化、淡入淡出等CPU密集的处理放到进程池中执行
+        return executors.call("dsp", preprocess_pcm_to_wav, pcm, target_sample_rate, target_channels)
+    
+    @staticmethod
+    def _write_output(
+        data: bytes,
+        output_path: Optional[str],
+        suffix: str,
+        error_prefix: str
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """把转换结果写入输出文件（兼容返回文件路径的旧接口）"""
+        try:
+            if output_path is None:
+                fd, output_path = tempfile.mkstemp(suffix=suffix)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+            else:
+                # 确保输出目录存在
+                output_dir = os.path.dirname(output_path)
+                if output_dir:
+                    os.makedirs(output_dir, exist_ok=True)
+                with open(output_path, 'wb') as f:
+                    f.write(data)
+            logger.info(f"音频文件导出成功: {output_path}")
+            return output_path, None
+        except Exception as e:
+            error = f"{error_prefix}: {str(e)}"
+            logger.error(error)
+            return None, error
+    
+    def stream_format(self, audio_format: str) -> Optional[str]:
+        """
+        客户端声明的音频块格式对应的ffmpeg输入格式
+        
+        参数:
+            audio_format: 格式名称（如webm、m4a）
+        
+        返回:
+            ffmpeg输入格式，不支持的格式返回None
+        """
+        return self.format_mapping.get((audio_format or "").lower())
+    
+    def _input_format(self, original_filename: str) -> Optional[str]:
+        """根据文件扩展名确定ffmpeg输入格式，未知扩展名返回None（自动检测）"""
+        file_ext = Path(original_filename or "").suffix.lower().lstrip('.')
+        return self.format_mapping.get(file_ext)
     
     def _process_audio_for_tts(self, audio: AudioSegment, target_sample_rate: int, target_channels: int) -> AudioSegment:
         """
-        处理音频以适合TTS处理
+        处理音频以适合TTS处理（实现见speech.audio_dsp.process_for_tts）
         
         参数:
             audio: 输入音频
@@ -320,52 +359,7 @@ class AudioConverter:
         返回:
             处理后的音频
         """
-        try:
-            logger.info(f"开始音频预处理，目标参数: 采样率={target_sample_rate}Hz, 声道数={target_channels}")
-            
-            # 1. 标准化声道数
-            if target_channels == 1 and audio.channels > 1:
-                audio = audio.set_channels(1)
-                logger.info("音频转换为单声道")
-            elif target_channels == 2 and audio.channels == 1:
-                audio = audio.set_channels(2)
-                logger.info("音频转换为立体声")
-            
-            # 2. 标准化采样率
-            if audio.frame_rate != target_sample_rate:
-                audio = audio.set_frame_rate(target_sample_rate)
-                logger.info(f"采样率转换为 {target_sample_rate}Hz")
-            
-            # 3. 音量标准化（避免过大或过小的音量）
-            # 计算RMS音量
-            rms = audio.rms
-            if rms == 0:
-                logger.warning("音频文件音量过小，可能为空或损坏")
-                return audio
-            
-            # 标准化音量到合适范围
-            target_rms = 1000  # 目标RMS音量
-            if abs(rms - target_rms) > 300:  # 如果音量差异较大
-                volume_change = target_rms - rms
-                if volume_change > 0:
-                    # 放大音量
-                    audio = audio + (volume_change / 1000.0)
-                else:
-                    # 降低音量
-                    audio = audio + (volume_change / 1000.0)
-                logger.info(f"音量标准化完成，原始RMS={rms}, 目标RMS={target_rms}")
-            
-            # 4. 添加轻微的淡入淡出以避免点击声
-            fade_duration = min(50, len(audio) // 10)  # 淡入淡出时长（毫秒）
-            audio = audio.fade_in(fade_duration).fade_out(fade_duration)
-            logger.info(f"添加淡入淡出效果，时长={fade_duration}毫秒")
-            
-            logger.info("音频预处理完成")
-            return audio
-            
-        except Exception as e:
-            logger.warning(f"音频预处理部分失败，返回原始音频: {e}")
-            return audio
+        return process_for_tts(audio, target_sample_rate, target_channels)
     
     def convert_bytes_to_wav(
         self, 
@@ -388,33 +382,36 @@ class AudioConverter:
         返回:
             (输出文件路径, 错误信息)
         """
-        try:
-            # 根据文件扩展名确定输入格式
-            file_ext = Path(original_filename).suffix.lower().lstrip('.')
-            format_mapping = {
-                'webm': 'webm',
-                'mp3': 'mp3', 
-                'wav': 'wav',
-                'ogg': 'ogg',
-                'flac': 'flac',
-                'm4a': 'mp4'
-            }
-            
-            input_format = format_mapping.get(file_ext)
-            
-            # 使用any_to_wav方法转换
-            return self.any_to_wav(
-                input_data=audio_bytes,
-                input_format=input_format,
-                output_path=output_path,
-                sample_rate=sample_rate,
-                channels=channels
-            )
-            
-        except Exception as e:
-            error = f"字节数据转换失败: {str(e)}"
-            logger.error(error)
+        wav_bytes, error = self.convert_bytes_to_wav_bytes(audio_bytes, original_filename, sample_rate, channels)
+        if error:
             return None, error
+        return self._write_output(wav_bytes, output_path, ".wav", "字节数据转换失败")
+    
+    def convert_bytes_to_wav_bytes(
+        self,
+        audio_bytes: bytes,
+        original_filename: str,
+        sample_rate: Optional[int] = None,
+        channels: Optional[int] = None
+    ) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        将音频字节数据转换为WAV字节数据，全程在内存中完成
+        
+        参数:
+            audio_bytes: 音频字节数据
+            original_filename: 原始文件名（用于检测格式）
+            sample_rate: 目标采样率
+            channels: 目标声道数
+        
+        返回:
+            (WAV字节数据, 错误信息)
+        """
+        return self.any_to_wav_bytes(
+            input_data=audio_bytes,
+            input_format=self._input_format(original_filename),
+            sample_rate=sample_rate,
+            channels=channels
+        )
     
     def get_audio_info(self, audio_path: str) -> Optional[dict]:
         """
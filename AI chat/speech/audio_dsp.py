@@ -0,0 +1,95 @@
+"""
+音频信号处理
+供进程池调用的纯函数：只依赖pydub，不依赖全局实例和配置，
+参数和返回值都是可序列化的字节数据，可以安全地在子进程中执行
+"""
+
+import logging
+
+from pydub import AudioSegment
+
+from speech.ffmpeg_pipe import pcm_to_wav
+
+logger = logging.getLogger("ai_chat_service.speech.audio_dsp")
+
+
+def process_for_tts(audio: AudioSegment, target_sample_rate: int, target_channels: int) -> AudioSegment:
+    """
+    处理音频以适合TTS处理
+    
+    参数:
+        audio: 输入音频
+        target_sample_rate: 目标采样率
+        target_channels: 目标声道数
+    
+    返回:
+        处理后的音频
+    """
+    try:
+        logger.info(f"开始音频预处理，目标参数: 采样率={target_sample_rate}Hz, 声道数={target_channels}")
+        
+        # 1. 标准化声道数
+        if target_channels == 1 and audio.channels > 1:
+            audio = audio.set_channels(1)
+            logger.info("音频转换为单声道")
+        elif target_channels == 2 and audio.channels == 1:
+            audio = audio.set_channels(2)
+            logger.info("音频转换为立体声")
+        
+        # 2. 标准化采样率
+        if audio.frame_rate != target_sample_rate:
+            audio = audio.set_frame_rate(target_sample_rate)
+            logger.info(f"采样率转换为 {target_sample_rate}Hz")
+        
+        # 3. 音量标准化（避免过大或过小的音量）
+        # 计算RMS音量
+        rms = audio.rms
+        if rms == 0:
+            logger.warning("音频文件音量过小，可能为空或损坏")
+            return audio
+        
+        # 标准化音量到合适范围
+        target_rms = 1000  # 目标RMS音量
+        if abs(rms - target_rms) > 300:  # 如果音量差异较大
+            volume_change = target_rms - rms
+            if volume_change > 0:
+                # 放大音量
+                audio = audio + (volume_change / 1000.0)
+            else:
+                # 降低音量
+                audio = audio + (volume_change / 1000.0)
+            logger.info(f"音量标准化完成，原始RMS={rms}, 目标RMS={target_rms}")
+        
+        # 4. 添加轻微的淡入淡出以避免点击声
+        fade_duration = min(50, len(audio) // 10)  # 淡入淡出时长（毫秒）
+        audio = audio.fade_in(fade_duration).fade_out(fade_duration)
+        logger.info(f"添加淡入淡出效果，时长={fade_duration}毫秒")
+        
+        logger.info("音频预处理完成")
+        return audio
+        
+    except Exception as e:
+        logger.warning(f"音频预处理部分失败，返回原始音频: {e}")
+        return audio
+
+
+def preprocess_pcm_to_wav(pcm: bytes, sample_rate: int, channels: int) -> bytes:
+    """
+    对16位PCM做TTS预处理并封装为WAV
+
+    参数:
+        pcm: 16位小端PCM字节数据
+        sample_rate: 采样率
+        channels: 声道数
+
+    返回:
+        WAV字节数据
+    """
+    audio = AudioSegment(data=pcm, sample_width=2, frame_rate=sample_rate, channels=channels)
+    processed_audio = process_for_tts(audio, target_sample_rate=sample_rate, target_channels=channels)
+    return pcm_to_wav(
+        processed_audio.raw_data,
+        sample_rate=processed_audio.frame_rate,
+        channels=processed_audio.channels,
+        sample_width=processed_audio.sample_width
+    )
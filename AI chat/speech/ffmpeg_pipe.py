@@ -0,0 +1,251 @@
+"""
+基于管道的ffmpeg转码
+通过ffmpeg的stdin/stdout直接在内存中转码，不产生任何临时文件：
+- 任意格式解码为PCM（s16le）
+- PCM/WAV编码为webm、mp3等格式
+- PCM封装为WAV字节数据
+
+注意：mp4/m4a等容器的索引可能位于文件末尾，无法从管道读取，这类输入会退回到临时文件
+"""
+
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+import logging
+from typing import List, Optional, Union
+
+logger = logging.getLogger("ai_chat_service.speech.ffmpeg_pipe")
+
+# ffmpeg可执行文件，可通过环境变量指定
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY") or shutil.which("ffmpeg") or shutil.which("avconv") or "ffmpeg"
+
+# 需要可随机访问输入的容器格式
+SEEKABLE_INPUT_FORMATS = {"mp4", "m4a", "mov", "3gp"}
+
+# 默认转码超时（秒）
+DEFAULT_TIMEOUT = 60
+
+
+class TranscodeError(Exception):
+    """ffmpeg转码失败"""
+
+
+def build_command(
+    input_format: Optional[str] = None,
+    output_format: str = "s16le",
+    sample_rate: Optional[int] = None,
+    channels: Optional[int] = None,
+    codec: Optional[str] = None,
+    bitrate: Optional[str] = None,
+    input_path: str = "pipe:0",
+    input_args: Optional[List[str]] = None,
+    output_args: Optional[List[str]] = None
+) -> List[str]:
+    """
+    构建ffmpeg命令行
+
+    参数:
+        input_format: 输入格式，None为自动检测
+        output_format: 输出容器格式（s16le为裸PCM）
+        sample_rate: 目标采样率
+        channels: 目标声道数
+        codec: 音频编码器
+        bitrate: 码率，例如 "128k"
+        input_path: 输入路径，默认从stdin读取
+        input_args: 输入选项（放在-i之前）
+        output_args: 额外的输出选项
+
+    返回:
+        命令行参数列表
+    """
+    command = [FFMPEG_BINARY, "-hide_banner", "-loglevel", "error"]
+    if input_path != "pipe:0":
+        # 从文件读取时不需要stdin，避免ffmpeg等待交互输入
+        command.append("-nostdin")
+    if input_args:
+        command += input_args
+    if input_format:
+        command += ["-f", input_format]
+    command += ["-i", input_path, "-vn"]
+    if sample_rate:
+        command += ["-ar", str(sample_rate)]
+    if channels:
+        command += ["-ac", str(channels)]
+    if codec:
+        command += ["-acodec", codec]
+    elif output_format == "s16le":
+        command += ["-acodec", "pcm_s16le"]
+    if bitrate:
+        command += ["-b:a", bitrate]
+    if output_args:
+        command += output_args
+    command += ["-f", output_format, "pipe:1"]
+    return command
+
+
+def transcode(
+    source: Union[bytes, str],
+    input_format: Optional[str] = None,
+    output_format: str = "s16le",
+    sample_rate: Optional[int] = None,
+    channels: Optional[int] = None,
+    codec: Optional[str] = None,
+    bitrate: Optional[str] = None,
+    input_args: Optional[List[str]] = None,
+    output_args: Optional[List[str]] = None,
+    timeout: Optional[float] = DEFAULT_TIMEOUT
+) -> bytes:
+    """
+    转码音频，输入输出都在内存中
+
+    参数:
+        source: 音频字节数据或文件路径
+        input_format: 输入格式，None为自动检测
+        output_format: 输出容器格式（s16le为裸PCM）
+        sample_rate: 目标采样率
+        channels: 目标声道数
+        codec: 音频编码器
+        bitrate: 码率
+        input_args: 额外的输入选项（放在-i之前）
+        output_args: 额外的输出选项
+        timeout: 超时时间（秒）
+
+    返回:
+        转码后的字节数据
+    """
+    options = dict(input_args=input_args, output_args=output_args)
+    temp_path = None
+    try:
+        if isinstance(source, str):
+            command = build_command(input_format, output_format, sample_rate, channels, codec, bitrate,
+                                    input_path=source, **options)
+            stdin_data = None
+        elif input_format in SEEKABLE_INPUT_FORMATS:
+            # 此类容器无法从管道解析，只能落盘
+            fd, temp_path = tempfile.mkstemp(suffix=f".{input_format}")
+            with os.fdopen(fd, "wb") as f:
+                f.write(source)
+            command = build_command(input_format, output_format, sample_rate, channels, codec, bitrate,
+                                    input_path=temp_path, **options)
+            stdin_data = None
+        else:
+            command = build_command(input_format, output_format, sample_rate, channels, codec, bitrate,
+                                    **options)
+            stdin_data = source
+
+        try:
+            result = subprocess.run(
+                command,
+                input=stdin_data,
+                stdin=subprocess.DEVNULL if stdin_data is None else None,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=timeout
+            )
+        except FileNotFoundError:
+            raise TranscodeError(f"找不到ffmpeg: {FFMPEG_BINARY}")
+        except subprocess.TimeoutExpired:
+            raise TranscodeError(f"ffmpeg转码超时（{timeout}秒）")
+
+        if result.returncode != 0:
+            stderr = result.stderr.decode("utf-8", "ignore").strip()
+            raise TranscodeError(f"ffmpeg转码失败({result.returncode}): {stderr[-500:]}")
+        if not result.stdout:
+            raise TranscodeError("ffmpeg没有输出任何数据")
+        return result.stdout
+    finally:
+        if temp_path:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+
+def decode_to_pcm(
+    source: Union[bytes, str],
+    input_format: Optional[str] = None,
+    sample_rate: int = 16000,
+    channels: int = 1,
+    timeout: Optional[float] = DEFAULT_TIMEOUT
+) -> bytes:
+    """
+    解码为16位小端PCM
+
+    参数:
+        source: 音频字节数据或文件路径
+        input_format: 输入格式，None为自动检测
+        sample_rate: 目标采样率
+        channels: 目标声道数
+        timeout: 超时时间（秒）
+
+    返回:
+        PCM字节数据
+    """
+    return transcode(
+        source,
+        input_format=input_format,
+        output_format="s16le",
+        sample_rate=sample_rate,
+        channels=channels,
+        timeout=timeout
+    )
+
+
+def encode_pcm(
+    pcm: bytes,
+    sample_rate: int,
+    channels: int,
+    output_format: str,
+    codec: Optional[str] = None,
+    bitrate: Optional[str] = None,
+    timeout: Optional[float] = DEFAULT_TIMEOUT
+) -> bytes:
+    """
+    把16位PCM编码为指定格式
+
+    参数:
+        pcm: PCM字节数据
+        sample_rate: 采样率
+        channels: 声道数
+        output_format: 输出容器格式（webm、mp3等）
+        codec: 音频编码器
+        bitrate: 码率
+        timeout: 超时时间（秒）
+
+    返回:
+        编码后的字节数据
+    """
+    return transcode(
+        pcm,
+        input_format="s16le",
+        output_format=output_format,
+        codec=codec,
+        bitrate=bitrate,
+        input_args=["-ar", str(sample_rate), "-ac", str(channels)],
+        timeout=timeout
+    )
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int, channels: int, sample_width: int = 2) -> bytes:
+    """
+    把PCM封装为WAV字节数据（不调用ffmpeg）
+
+    参数:
+        pcm: PCM字节数据
+        sample_rate: 采样率
+        channels: 声道数
+        sample_width: 采样字节数
+
+    返回:
+        WAV字节数据
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(sample_width)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+    return buffer.getvalue()
@@ -2,7 +2,6 @@ import speech_recognition as sr
 import pyaudio
 import wave
 import io
-import tempfile
 import os
 import hashlib
 import logging
@@ -92,35 +91,35 @@ class SpeechRecognizer:
             (识别的文本, 错误信息)
         """
         try:
-            # 检查是否需要格式转换
-            actual_file_path = file_path
-            file_extension = os.path.splitext(file_path)[1].lower()
-            
-            if auto_convert and file_extension in ('.webm', '.mp3', '.ogg', '.flac', '.m4a'):
-                logger.info(f"检测到需要格式转换的音频文件: {file_path} (格式: {file_extension})")
-                converted_path, error = audio_converter.webm_to_wav(file_path)
-                if converted_path:
-                    actual_file_path = converted_path
-                    logger.info(f"音频格式转换成功: {actual_file_path}")
-                else:
-                    logger.error(f"音频格式转换失败，使用原始文件: {error}")
-            
             # 检查文件是否存在
-            if not os.path.exists(actual_file_path):
-                error = f"音频文件不存在: {actual_file_path}"
+            if not os.path.exists(file_path):
+                error = f"音频文件不存在: {file_path}"
                 logger.error(error)
                 return None, error
             
             # 检查文件大小
-            file_size = os.path.getsize(actual_file_path)
+            file_size = os.path.getsize(file_path)
             logger.info(f"音频文件大小: {file_size} 字节")
             
             if file_size < 1000:  # 小于1KB的音频文件可能无法识别
                 logger.warning(f"音频文件过小 ({file_size} 字节)，可能识别效果不佳")
             
+            # 检查是否需要格式转换（ffmpeg直接读取源文件，转换结果保留在内存中）
+            audio_source = file_path
+            file_extension = os.path.splitext(file_path)[1].lower()
+            
+            if auto_convert and file_extension in ('.webm', '.mp3', '.ogg', '.flac', '.m4a'):
+                logger.info(f"检测到需要格式转换的音频文件: {file_path} (格式: {file_extension})")
+                wav_bytes, error = audio_converter.any_to_wav_bytes(file_path)
+                if wav_bytes:
+                    audio_source = io.BytesIO(wav_bytes)
+                    logger.info(f"音频格式转换成功，WAV大小: {len(wav_bytes)} 字节")
+                else:
+                    logger.error(f"音频格式转换失败，使用原始文件: {error}")
+            
             try:
-                with sr.AudioFile(actual_file_path) as source:
-                    logger.info(f"正在识别音频文件: {actual_file_path}")
+                with sr.AudioFile(audio_source) as source:
+                    logger.info(f"正在识别音频文件: {file_path}")
                     audio_data = self.recognizer.record(source)
                     logger.info(f"读取音频数据长度: {len(audio_data.get_raw_data())} 字节")
                     
@@ -147,6 +146,35 @@ class SpeechRecognizer:
             logger.error(error)
             return None, error
     
+    def recognize_from_pcm(
+        self,
+        pcm: bytes,
+        sample_rate: int,
+        sample_width: int = 2
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        识别一段PCM语音（流式识别会话中已切好的语音段）
+        
+        参数:
+            pcm: 单声道PCM字节数据
+            sample_rate: 采样率
+            sample_width: 采样字节数
+        
+        返回:
+            (识别的文本, 错误信息)
+        """
+        try:
+            audio_data = sr.AudioData(pcm, sample_rate, sample_width)
+            text = self.recognizer.recognize_google(audio_data, language=self.language)
+            logger.info(f"语音段识别成功: {text}")
+            return text, None
+        except sr.UnknownValueError:
+            return None, "无法识别语音"
+        except Exception as e:
+            error = f"语音段识别出错: {str(e)}"
+            logger.error(error)
+            return None, error
+    
     def recognize_from_audio_bytes(
         self, 
         audio_bytes: bytes, 
@@ -165,29 +193,21 @@ class SpeechRecognizer:
             (识别的文本, 错误信息)
         """
         try:
-            # 检查是否需要格式转换
+            # 检查是否需要格式转换（通过ffmpeg管道在内存中完成，不落盘）
             actual_audio_bytes = audio_bytes
-            converted_file_path = None
             
             if auto_convert and any(file_ext in original_filename.lower() for file_ext in ['.webm', '.mp3', '.ogg', '.flac', '.m4a']):
                 logger.info(f"检测到需要格式转换的音频文件: {original_filename}")
-                converted_file_path, error = audio_converter.convert_bytes_to_wav(
+                wav_bytes, error = audio_converter.convert_bytes_to_wav_bytes(
                     audio_bytes=audio_bytes,
                     original_filename=original_filename,
                     sample_rate=env_config.AUDIO_SAMPLE_RATE,
                     channels=env_config.AUDIO_CHANNELS
                 )
                 
-                if converted_file_path:
-                    logger.info(f"音频格式转换成功: {converted_file_path}")
-                    # 读取转换后的文件
-                    try:
-                        with open(converted_file_path, 'rb') as f:
-                            actual_audio_bytes = f.read()
-                    except Exception as e:
-                        logger.error(f"读取转换后的文件失败: {e}")
-                        logger.info("使用原始音频数据")
-                        actual_audio_bytes = audio_bytes
+                if wav_bytes:
+                    logger.info(f"音频格式转换成功，WAV大小: {len(wav_bytes)} 字节")
+                    actual_audio_bytes = wav_bytes
                 else:
                     logger.error(f"音频格式转换失败，使用原始数据: {error}")
             
@@ -204,17 +224,6 @@ class SpeechRecognizer:
             error = f"从字节数据识别语音出错: {str(e)}"
             logger.error(error)
             return None, error
-        
-        finally:
-            # 清理临时转换文件
-            if converted_file_path and converted_file_path.startswith(tempfile.gettempdir()):
-                try:
-                    import os
-                    if os.path.exists(converted_file_path):
-                        os.remove(converted_file_path)
-                        logger.info(f"清理临时转换文件: {converted_file_path}")
-                except Exception as e:
-                    logger.warning(f"清理临时文件失败: {e}")
 
 # 创建全局实例
 speech_recognizer = SpeechRecognizer()
\ No newline at end of file
@@ -0,0 +1,108 @@
+"""
+流式分句
+把LLM逐段输出的增量文本切分成完整的句子，每凑齐一句就可以送去TTS，
+而不必等待整段回复生成完毕
+"""
+
+import re
+from typing import List, Optional
+
+# 句末标点（中文标点直接断句，英文句号等需后跟空白才断句，避免切开小数和缩写）
+_CJK_TERMINATORS = "。！？；…\n"
+_ASCII_TERMINATORS = ".!?;"
+# 句子过长时允许在这些标点处提前断开
+_SOFT_BREAKS = "，、,：:"
+# 断句后可以跟随的右引号和右括号
+_CLOSERS = "”’」』）)】\"'"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class SentenceSplitter:
+    """增量分句器"""
+
+    def __init__(self, min_chars: int = 4, max_chars: int = 80):
+        """
+        初始化分句器
+
+        参数:
+            min_chars: 句子的最少字符数，过短的句子与下一句合并，减少零碎的TTS请求
+            max_chars: 句子的最多字符数，超过时在逗号等处提前断开
+        """
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """
+        输入一段增量文本
+
+        参数:
+            text: LLM输出的增量文本
+
+        返回:
+            本次凑齐的完整句子列表
+        """
+        self._buffer += text
+        sentences = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            sentence = self._clean(self._buffer[:cut])
+            self._buffer = self._buffer[cut:]
+            if sentence:
+                sentences.append(sentence)
+        return sentences
+
+    def flush(self) -> Optional[str]:
+        """
+        取出缓冲区中剩余的文本（回复结束时调用）
+
+        返回:
+            最后一句，没有剩余文本时返回None
+        """
+        sentence = self._clean(self._buffer)
+        self._buffer = ""
+        return sentence or None
+
+    @staticmethod
+    def _clean(text: str) -> str:
+        return _WHITESPACE.sub(" ", text).strip()
+
+    def _find_cut(self) -> Optional[int]:
+        """查找缓冲区中第一个满足长度要求的断句位置"""
+        buffer = self._buffer
+        length = len(buffer)
+        for i, char in enumerate(buffer):
+            if char in _CJK_TERMINATORS:
+                end = i + 1
+            elif char in _ASCII_TERMINATORS:
+                # 英文标点需要确认后面是空白，缓冲区末尾时等待更多文本
+                if i + 1 >= length:
+                    return self._soft_cut()
+                if not buffer[i + 1].isspace():
+                    continue
+                end = i + 1
+            else:
+                continue
+
+            # 连续的句末标点和右引号归入当前句
+            while end < length and (buffer[end] in _CJK_TERMINATORS or buffer[end] in _ASCII_TERMINATORS
+                                    or buffer[end] in _CLOSERS):
+                end += 1
+            if end >= length and buffer[end - 1] in _ASCII_TERMINATORS:
+                return None
+            if len(self._clean(buffer[:end])) >= self.min_chars:
+                return end
+        return self._soft_cut()
+
+    def _soft_cut(self) -> Optional[int]:
+        """缓冲区超过最大长度时，在最后一个逗号处断开，没有逗号则硬切"""
+        if len(self._buffer) < self.max_chars:
+            return None
+        window = self._buffer[:self.max_chars]
+        for i in range(len(window) - 1, 0, -1):
+            if window[i] in _SOFT_BREAKS:
+                return i + 1
+        return self.max_chars
@@ -0,0 +1,787 @@
+"""
+流式语音识别
+客户端边说边上传音频块，服务端增量处理：
+- 每个会话一个常驻ffmpeg进程，把陆续到达的WebM/Opus块解码为16kHz单声道PCM
+- 按能量做端点检测，把PCM切成一段段语音，缓冲区有上限
+- 每段语音结束后立即提交到ASR执行器识别，停止录音时只需处理最后一段
+- 会话管理器限制会话数量，空闲超时的会话自动回收
+- 多个工作进程共享状态后端时，发往其他进程的音频块和停止请求经后端转交给会话所在的进程
+"""
+
+import os
+import subprocess
+import threading
+import time
+import uuid
+import logging
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from config import env_config
+from speech.ffmpeg_pipe import build_command
+from storage.state_backend import StateBackend, state_backend
+from utils.executors import executors, ExecutorSaturated
+
+logger = logging.getLogger("ai_chat_service.speech.streaming_recognition")
+
+# 识别函数：输入(PCM, 采样率)，返回(文本, 错误信息)
+RecognizeFunc = Callable[[bytes, int], Tuple[Optional[str], Optional[str]]]
+
+
+def _default_recognize(pcm: bytes, sample_rate: int) -> Tuple[Optional[str], Optional[str]]:
+    """默认使用全局语音识别器（延迟导入，避免没有麦克风依赖的环境无法加载本模块）"""
+    from speech.recognition import speech_recognizer
+    return speech_recognizer.recognize_from_pcm(pcm, sample_rate)
+
+
+class EnergySegmenter:
+    """基于短时能量的语音端点检测"""
+
+    def __init__(
+        self,
+        sample_rate: int = 16000,
+        frame_ms: int = 30,
+        energy_threshold: float = 300,
+        silence_ms: int = 600,
+        min_speech_ms: int = 300,
+        max_segment_ms: int = 15000,
+        pre_roll_ms: int = 300
+    ):
+        """
+        初始化端点检测
+
+        参数:
+            sample_rate: PCM采样率（16位单声道）
+            frame_ms: 分析帧长度（毫秒）
+            energy_threshold: 判定为语音的RMS阈值
+            silence_ms: 语音后连续静音多久视为一段结束
+            min_speech_ms: 短于此时长的语音段视为噪声丢弃
+            max_segment_ms: 单段最长时长，超过时强制切段（同时是缓冲区上限）
+            pre_roll_ms: 语音开始前保留的静音，避免吞掉首字
+        """
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.frame_bytes = sample_rate * frame_ms // 1000 * 2
+        self.energy_threshold = energy_threshold
+        self.silence_ms = silence_ms
+        self.min_speech_ms = min_speech_ms
+        self.max_segment_ms = max_segment_ms
+
+        self._pending = bytearray()
+        self._segment = bytearray()
+        self._pre_roll = deque(maxlen=max(1, pre_roll_ms // frame_ms))
+        self._in_speech = False
+        self._speech_ms = 0
+        self._silence_run_ms = 0
+
+    def _rms(self, frame: bytes) -> float:
+        samples = np.frombuffer(frame, dtype="<i2").astype(np.float32)
+        return float(np.sqrt(np.mean(samples * samples))) if samples.size else 0.0
+
+    def feed(self, pcm: bytes) -> List[bytes]:
+        """
+        输入PCM数据
+
+        参数:
+            pcm: 16位单声道PCM
+
+        返回:
+            本次结束的语音段列表
+        """
+        self._pending.extend(pcm)
+        closed = []
+        while len(self._pending) >= self.frame_bytes:
+            frame = bytes(self._pending[:self.frame_bytes])
+            del self._pending[:self.frame_bytes]
+            segment = self._process_frame(frame)
+            if segment:
+                closed.append(segment)
+        return closed
+
+    def _process_frame(self, frame: bytes) -> Optional[bytes]:
+        voiced = self._rms(frame) >= self.energy_threshold
+
+        if not self._in_speech:
+            if not voiced:
+                self._pre_roll.append(frame)
+                return None
+            self._in_speech = True
+            self._segment = bytearray(b"".join(self._pre_roll))
+            self._pre_roll.clear()
+            self._speech_ms = 0
+            self._silence_run_ms = 0
+
+        self._segment.extend(frame)
+        if voiced:
+            self._speech_ms += self.frame_ms
+            self._silence_run_ms = 0
+        else:
+            self._silence_run_ms += self.frame_ms
+
+        segment_ms = len(self._segment) * 1000 // (self.sample_rate * 2)
+        if self._silence_run_ms >= self.silence_ms or segment_ms >= self.max_segment_ms:
+            return self._close()
+        return None
+
+    def _close(self) -> Optional[bytes]:
+        segment = bytes(self._segment)
+        speech_ms = self._speech_ms
+        self._segment = bytearray()
+        self._in_speech = False
+        self._speech_ms = 0
+        self._silence_run_ms = 0
+        if speech_ms < self.min_speech_ms:
+            return None
+        return segment
+
+    def flush(self) -> Optional[bytes]:
+        """
+        结束输入，返回尚未结束的最后一段
+
+        返回:
+            语音段，没有时返回None
+        """
+        if self._pending and self._in_speech:
+            self._segment.extend(self._pending)
+        self._pending = bytearray()
+        if not self._in_speech:
+            return None
+        return self._close()
+
+    @property
+    def buffered_bytes(self) -> int:
+        """当前缓冲的PCM字节数"""
+        return len(self._pending) + len(self._segment) + sum(len(frame) for frame in self._pre_roll)
+
+
+class StreamingDecoder:
+    """常驻ffmpeg进程，增量解码到达的音频块"""
+
+    def __init__(
+        self,
+        on_pcm: Callable[[bytes], None],
+        input_format: Optional[str] = "webm",
+        sample_rate: int = 16000,
+        read_size: int = 8192
+    ):
+        """
+        初始化解码器
+
+        参数:
+            on_pcm: 收到PCM数据时的回调（在读取线程中调用）
+            input_format: 输入格式，None为自动检测
+            sample_rate: 输出采样率
+            read_size: 每次从ffmpeg读取的字节数
+        """
+        self.on_pcm = on_pcm
+        self.sample_rate = sample_rate
+        self.read_size = read_size
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+        command = build_command(input_format, "s16le", sample_rate, 1, output_args=["-flush_packets", "1"])
+        self._process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        self._reader = threading.Thread(target=self._read_loop, name="streaming-decoder", daemon=True)
+        self._reader.start()
+
+    def _read_loop(self):
+        stdout = self._process.stdout
+        while True:
+            chunk = stdout.read1(self.read_size)
+            if not chunk:
+                break
+            self.bytes_out += len(chunk)
+            try:
+                self.on_pcm(chunk)
+            except Exception as e:
+                logger.error(f"处理解码数据失败: {e}")
+
+    def feed(self, data: bytes):
+        """
+        写入一块编码后的音频
+
+        参数:
+            data: 音频块
+
+        异常:
+            RuntimeError: 解码进程已退出（通常是音频格式与声明的不符）
+        """
+        self.bytes_in += len(data)
+        try:
+            self._process.stdin.write(data)
+            self._process.stdin.flush()
+        except (OSError, ValueError) as e:
+            # 管道已断开（BrokenPipeError）或已关闭
+            raise RuntimeError(f"解码进程已退出: {e}")
+
+    def close(self, timeout: float = 10):
+        """结束输入并等待剩余数据解码完毕"""
+        try:
+            self._process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self._reader.join(timeout)
+        try:
+            self._process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+
+    def kill(self):
+        """立即结束解码进程"""
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        self._reader.join(1)
+
+
+class RecognitionSession:
+    """一个流式识别会话"""
+
+    def __init__(
+        self,
+        session_id: str,
+        input_format: Optional[str] = "webm",
+        recognize: Optional[RecognizeFunc] = None,
+        on_segment: Optional[Callable[[int, Optional[str], Optional[str]], None]] = None,
+        max_bytes: Optional[int] = None
+    ):
+        """
+        初始化会话并启动解码进程
+
+        参数:
+            session_id: 会话ID
+            input_format: 音频块格式
+            recognize: 识别函数，默认使用全局语音识别器
+            on_segment: 每段识别完成时的回调 (段序号, 文本, 错误信息)
+            max_bytes: 单个会话最多接收的音频字节数，None为不限制
+        """
+        self.session_id = session_id
+        self.sample_rate = env_config.AUDIO_SAMPLE_RATE
+        self.recognize = recognize or _default_recognize
+        self.on_segment = on_segment
+        self.max_bytes = max_bytes
+        self.created_at = time.monotonic()
+        self.last_active = self.created_at
+        self.status = "active"
+
+        self.segmenter = EnergySegmenter(
+            sample_rate=self.sample_rate,
+            energy_threshold=env_config.STREAMING_ASR_ENERGY_THRESHOLD,
+            silence_ms=env_config.STREAMING_ASR_SILENCE_MS,
+            max_segment_ms=int(env_config.STREAMING_ASR_MAX_SEGMENT_SECONDS * 1000)
+        )
+        self._lock = threading.Lock()
+        # 保证本进程收到的和其他进程转交的音频块按顺序写入
+        self.feed_lock = threading.Lock()
+        self._results: Dict[int, str] = {}
+        self._futures: List[Future] = []
+        self._segments = 0
+        self.errors = 0
+
+        self.decoder = StreamingDecoder(self._on_pcm, input_format=input_format, sample_rate=self.sample_rate)
+
+    def _on_pcm(self, pcm: bytes):
+        with self._lock:
+            segments = self.segmenter.feed(pcm)
+        for segment in segments:
+            self._submit(segment)
+
+    def _submit(self, segment: bytes):
+        """把结束的语音段提交到ASR执行器"""
+        with self._lock:
+            index = self._segments
+            self._segments += 1
+        try:
+            future = executors.get("asr").submit(self.recognize, segment, self.sample_rate)
+        except ExecutorSaturated as e:
+            logger.warning(f"会话{self.session_id}第{index}段识别被拒绝: {e}")
+            self._record(index, None, "语音服务繁忙")
+            return
+        future.add_done_callback(lambda f: self._on_recognized(index, f))
+        with self._lock:
+            self._futures.append(future)
+
+    def _on_recognized(self, index: int, future: Future):
+        try:
+            text, error = future.result()
+        except Exception as e:
+            text, error = None, str(e)
+        self._record(index, text, error)
+
+    def _record(self, index: int, text: Optional[str], error: Optional[str]):
+        with self._lock:
+            if text:
+                self._results[index] = text
+            else:
+                self.errors += 1
+        if error:
+            logger.info(f"会话{self.session_id}第{index}段未识别: {error}")
+        if self.on_segment:
+            try:
+                self.on_segment(index, text, error)
+            except Exception as e:
+                logger.error(f"识别结果回调失败: {e}")
+
+    def feed(self, chunk: bytes):
+        """
+        写入一块音频
+
+        参数:
+            chunk: 音频块
+        """
+        if self.status != "active":
+            raise RuntimeError(f"会话{self.session_id}已结束")
+        if self.max_bytes is not None and self.decoder.bytes_in + len(chunk) > self.max_bytes:
+            raise ValueError(f"会话{self.session_id}的音频超过上限（{self.max_bytes}字节）")
+        self.last_active = time.monotonic()
+        self.decoder.feed(chunk)
+
+    def finish(self, timeout: float = 30) -> str:
+        """
+        结束会话：解码剩余音频，识别最后一段，并等待所有段识别完成
+
+        参数:
+            timeout: 等待识别完成的最长时间（秒）
+
+        返回:
+            按顺序拼接的识别文本
+        """
+        self.status = "finishing"
+        self.last_active = time.monotonic()
+        self.decoder.close()
+        with self._lock:
+            last = self.segmenter.flush()
+        if last:
+            self._submit(last)
+
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            try:
+                future.result(max(0.0, deadline - time.monotonic()))
+            except Exception:
+                pass
+
+        self.status = "completed"
+        return self.text()
+
+    def text(self) -> str:
+        """已识别的文本（按段序号拼接）"""
+        with self._lock:
+            return "".join(self._results[index] for index in sorted(self._results))
+
+    def abort(self):
+        """放弃会话，立即结束解码进程"""
+        self.status = "aborted"
+        self.decoder.kill()
+
+    def info(self) -> Dict[str, Any]:
+        """会话状态"""
+        with self._lock:
+            pending = sum(1 for future in self._futures if not future.done())
+            return {
+                "id": self.session_id,
+                "status": self.status,
+                "segments": self._segments,
+                "recognized_segments": len(self._results),
+                "pending_segments": pending,
+                "bytes_in": self.decoder.bytes_in,
+                "pcm_bytes": self.decoder.bytes_out,
+                "buffered_bytes": self.segmenter.buffered_bytes,
+                "age_seconds": round(time.monotonic() - self.created_at, 1)
+            }
+
+
+class SessionLimitExceeded(Exception):
+    """同时进行的识别会话数达到上限"""
+
+
+# 跨进程转交时会话归属和中间结果的有效期（秒）
+_REMOTE_TTL = 3600
+
+# 转交队列中的控制标记：结束会话并发布结果 / 丢弃会话
+_STOP = None
+_DISCARD = "discard"
+
+
+class RecognitionSessionManager:
+    """
+    流式识别会话管理：数量上限和空闲过期
+
+    解码进程只存在于创建会话的工作进程中。共享状态后端时：
+    - 创建会话时登记会话所在的进程
+    - 其他进程收到的音频块放入该会话的队列，并递增所在进程的收件版本号
+    - 所在进程的转交线程发现版本号变化后取出音频块写入会话，并发布目前的识别文本
+    - 其他进程收到停止请求时放入停止标记，等待所在进程发布最终结果
+    - 会话已接收的音频字节数记在共享后端中，任一进程收到的音频块都计入单会话上限
+    """
+
+    def __init__(
+        self,
+        idle_ttl: float,
+        max_sessions: int,
+        max_session_bytes: int,
+        sweep_interval: float = 10,
+        backend: Optional[StateBackend] = None,
+        relay_interval: float = 0.05
+    ):
+        """
+        初始化会话管理器
+
+        参数:
+            idle_ttl: 会话空闲多久后自动回收（秒）
+            max_sessions: 同时存在的最大会话数
+            max_session_bytes: 单个会话最多接收的音频字节数
+            sweep_interval: 后台检查过期会话的间隔（秒）
+            backend: 状态后端，为多进程共享的后端时在进程间转交音频块
+            relay_interval: 检查转交音频块的间隔（秒）
+        """
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_session_bytes = max_session_bytes
+        self.sweep_interval = sweep_interval
+        self.backend = backend if backend is not None and backend.shared else None
+        self.relay_interval = relay_interval
+        self.worker_id = str(os.getpid())
+
+        self._sessions: Dict[str, RecognitionSession] = {}
+        self._lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+        self._relay: Optional[threading.Thread] = None
+
+        self.created = 0
+        self.completed = 0
+        self.expired = 0
+        self.rejected = 0
+        self.relayed_chunks = 0
+        self.remote_chunks = 0
+
+    def create(
+        self,
+        input_format: Optional[str] = "webm",
+        recognize: Optional[RecognizeFunc] = None,
+        on_segment: Optional[Callable[[int, Optional[str], Optional[str]], None]] = None
+    ) -> RecognitionSession:
+        """
+        创建会话（启动解码进程）
+
+        参数:
+            input_format: 音频块格式
+            recognize: 识别函数，默认使用全局语音识别器
+            on_segment: 每段识别完成时的回调 (段序号, 文本, 错误信息)
+
+        返回:
+            新会话
+        """
+        self._ensure_sweeper()
+        self.sweep()
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                self.rejected += 1
+                raise SessionLimitExceeded(f"识别会话数已达上限（{self.max_sessions}）")
+            session_id = str(uuid.uuid4())
+            # 先占位，避免并发创建超过上限
+            self._sessions[session_id] = None
+        try:
+            session = RecognitionSession(
+                session_id,
+                input_format=input_format,
+                recognize=recognize,
+                on_segment=on_segment,
+                max_bytes=self.max_session_bytes
+            )
+        except Exception:
+            with self._lock:
+                self._sessions.pop(session_id, None)
+            raise
+        with self._lock:
+            self._sessions[session_id] = session
+            self.created += 1
+        if self.backend is not None:
+            self.backend.set("asr_owner", session_id, self.worker_id, ttl=_REMOTE_TTL)
+        logger.info(f"开始流式识别会话: {session_id}")
+        return session
+
+    def get(self, session_id: str) -> Optional[RecognitionSession]:
+        """获取进行中的会话，不存在或已过期时返回None"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None or self._is_expired(session, time.monotonic()):
+            return None
+        return session
+
+    def finish(self, session_id: str) -> Optional[str]:
+        """
+        结束会话并返回识别文本
+
+        参数:
+            session_id: 会话ID
+
+        返回:
+            识别文本，会话不存在时返回None
+        """
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return None
+        if self.backend is not None:
+            with session.feed_lock:
+                self._drain(session)
+        text = session.finish()
+        self._forget(session_id)
+        self.completed += 1
+        logger.info(f"流式识别会话完成: {session_id}，识别结果: {text}")
+        return text
+
+    def discard(self, session_id: str):
+        """丢弃会话，不再识别剩余音频（会话在其他进程中时请求所在进程丢弃）"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.abort()
+            self._forget(session_id)
+        elif self.is_remote(session_id):
+            self.backend.push("asr_chunks", session_id, _DISCARD)
+            self._notify(session_id)
+
+    def feed(self, session: RecognitionSession, chunk: bytes):
+        """
+        向本进程的会话写入一块音频（先写入其他进程转交的、更早到达的音频块）
+
+        参数:
+            session: 会话
+            chunk: 音频块
+        """
+        with session.feed_lock:
+            if self.backend is not None:
+                self._drain(session)
+                self._reserve(session.session_id, len(chunk))
+            session.feed(chunk)
+
+    def is_remote(self, session_id: str) -> bool:
+        """会话是否在其他工作进程中"""
+        if self.backend is None:
+            return False
+        owner = self.backend.get("asr_owner", session_id)
+        return owner is not None and owner != self.worker_id
+
+    def feed_remote(self, session_id: str, chunk: bytes) -> str:
+        """
+        把音频块转交给会话所在的工作进程
+
+        参数:
+            session_id: 会话ID
+            chunk: 音频块
+
+        返回:
+            所在进程最近发布的识别文本
+        
+        异常:
+            ValueError: 会话的音频超过上限
+        """
+        if chunk:
+            self._reserve(session_id, len(chunk))
+            self.backend.push("asr_chunks", session_id, chunk)
+            self._notify(session_id)
+            self.remote_chunks += 1
+        return self.backend.get("asr_text", session_id) or ""
+
+    def finish_remote(self, session_id: str, timeout: float = 30) -> Optional[str]:
+        """
+        请求会话所在的工作进程结束会话，并等待识别结果
+
+        参数:
+            session_id: 会话ID
+            timeout: 最长等待时间（秒）
+
+        返回:
+            识别文本，会话不存在或超时时返回None
+        """
+        self.backend.push("asr_chunks", session_id, _STOP)
+        if not self._notify(session_id):
+            return None
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            text = self.backend.get("asr_result", session_id)
+            if text is not None:
+                self.backend.delete("asr_result", session_id)
+                return text
+            time.sleep(self.relay_interval)
+        logger.warning(f"等待其他工作进程结束识别会话超时: {session_id}")
+        return None
+
+    def _reserve(self, session_id: str, size: int):
+        """
+        把音频块计入共享后端中会话已接收的字节数（原子相加，多个进程同时计入不会漏算）
+
+        异常:
+            ValueError: 计入后超过单会话上限（此时退回本次计入）
+        """
+        received = self.backend.add("asr_bytes", session_id, size)
+        if received > self.max_session_bytes:
+            self.backend.add("asr_bytes", session_id, -size)
+            raise ValueError(f"会话{session_id}的音频超过上限（{self.max_session_bytes}字节）")
+
+    def _notify(self, session_id: str) -> bool:
+        """递增会话所在进程的收件版本号，会话不存在时返回False"""
+        owner = self.backend.get("asr_owner", session_id)
+        if owner is None:
+            return False
+        self.backend.bump("asr_inbox", owner)
+        return True
+
+    def _drain(self, session: RecognitionSession) -> Optional[str]:
+        """
+        把其他进程转交的音频块写入会话（调用方持有session.feed_lock）
+
+        返回:
+            收到的控制请求："stop"（结束）、"discard"（丢弃），没有时为None
+        """
+        control = None
+        chunks = self.backend.drain("asr_chunks", session.session_id)
+        for chunk in chunks:
+            if chunk is _STOP:
+                control = control or "stop"
+            elif chunk == _DISCARD:
+                control = "discard"
+            elif session.status == "active":
+                try:
+                    session.feed(chunk)
+                    self.relayed_chunks += 1
+                except (ValueError, RuntimeError) as e:
+                    logger.warning(f"写入转交的音频块失败: {e}")
+        if chunks:
+            self.backend.set("asr_text", session.session_id, session.text(), ttl=_REMOTE_TTL)
+        return control
+
+    def _relay_once(self):
+        """处理本进程所有会话收到的转交音频块和停止请求"""
+        with self._lock:
+            sessions = [session for session in self._sessions.values() if session is not None]
+        for session in sessions:
+            with session.feed_lock:
+                control = self._drain(session)
+            if control == "discard":
+                self.discard(session.session_id)
+            elif control == "stop":
+                text = self.finish(session.session_id)
+                if text is not None:
+                    self.backend.set("asr_result", session.session_id, text, ttl=_REMOTE_TTL)
+
+    def _forget(self, session_id: str):
+        """删除会话在共享后端中的登记"""
+        if self.backend is None:
+            return
+        self.backend.delete("asr_owner", session_id)
+        self.backend.delete("asr_text", session_id)
+        self.backend.delete("asr_chunks", session_id)
+        self.backend.delete("asr_bytes", session_id)
+
+    def _is_expired(self, session: RecognitionSession, now: float) -> bool:
+        return session.status == "active" and now - session.last_active > self.idle_ttl
+
+    def sweep(self) -> int:
+        """
+        回收空闲过期的会话
+
+        返回:
+            回收的会话数
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                session_id for session_id, session in self._sessions.items()
+                if session is not None and self._is_expired(session, now)
+            ]
+            sessions = [self._sessions.pop(session_id) for session_id in expired]
+        for session in sessions:
+            try:
+                session.abort()
+                self._forget(session.session_id)
+            except Exception as e:
+                logger.warning(f"结束过期会话失败: {e}")
+            logger.info(f"流式识别会话空闲过期: {session.session_id}")
+        self.expired += len(sessions)
+        return len(sessions)
+
+    def _ensure_sweeper(self):
+        """首次创建会话时启动后台回收线程"""
+        if self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(self.sweep_interval)
+                    try:
+                        self.sweep()
+                    except Exception as e:
+                        logger.error(f"回收过期会话失败: {e}")
+
+            self._sweeper = threading.Thread(target=run, name="recognition-session-sweeper", daemon=True)
+            self._sweeper.start()
+
+            if self.backend is not None:
+                self._relay = threading.Thread(target=self._relay_loop, name="recognition-session-relay", daemon=True)
+                self._relay.start()
+
+    def _relay_loop(self):
+        """转交线程：本进程的收件版本号变化时处理转交的音频块"""
+        seen = self.backend.version("asr_inbox", self.worker_id)
+        while True:
+            time.sleep(self.relay_interval)
+            try:
+                version = self.backend.version("asr_inbox", self.worker_id)
+                if version != seen:
+                    seen = version
+                    self._relay_once()
+            except Exception as e:
+                logger.error(f"处理转交的音频块失败: {e}")
+
+    def shutdown(self):
+        """结束所有会话（服务关闭时调用）"""
+        with self._lock:
+            sessions = [session for session in self._sessions.values() if session is not None]
+            self._sessions.clear()
+        for session in sessions:
+            session.abort()
+            self._forget(session.session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取会话统计"""
+        with self._lock:
+            sessions = [session for session in self._sessions.values() if session is not None]
+        return {
+            "active_sessions": len(sessions),
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "created": self.created,
+            "completed": self.completed,
+            "expired": self.expired,
+            "rejected": self.rejected,
+            "shared": self.backend is not None,
+            "relayed_chunks": self.relayed_chunks,
+            "remote_chunks": self.remote_chunks,
+            "buffered_bytes": sum(session.segmenter.buffered_bytes for session in sessions)
+        }
+
+
+# 创建全局实例
+recognition_sessions = RecognitionSessionManager(
+    idle_ttl=env_config.STREAMING_ASR_SESSION_TTL,
+    max_sessions=env_config.STREAMING_ASR_MAX_SESSIONS,
+    max_session_bytes=int(env_config.STREAMING_ASR_MAX_SESSION_MB * 1024 * 1024),
+    backend=state_backend
+)
@@ -0,0 +1,356 @@
+"""
+转码工作进程池
+维护固定数量的常驻转码工作进程（speech.transcode_worker），所有音频转码都提交到这里：
+- 有界任务队列，队列满时立即拒绝，避免请求无限堆积
+- 单个任务超时后杀掉对应工作进程并重启
+- 每个工作进程处理N个任务后在空闲时平滑重启，防止内存缓慢增长
+- 队列深度、等待时间、执行时间等统计
+
+默认关闭（AUDIO_TRANSCODE_POOL_ENABLED），转码直接在调用线程中启动ffmpeg：
+bench_transcode.py 的测量中工作进程池没有比直接启动更快，开启前先在目标机器上对比
+"""
+
+import os
+import sys
+import queue
+import subprocess
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from typing import Dict, Any, Optional, Union
+
+from config import env_config
+from speech.ffmpeg_pipe import transcode as transcode_inline, TranscodeError
+from speech.transcode_worker import read_frame, write_frame
+
+logger = logging.getLogger("ai_chat_service.speech.transcode_pool")
+
+# 项目根目录，工作进程以此为工作目录启动
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 超过任务超时后再等待工作进程的宽限时间（秒）
+KILL_GRACE = 5
+
+
+class TranscodeJob:
+    """一个排队中的转码任务"""
+
+    __slots__ = ("kwargs", "timeout", "future", "enqueued_at")
+
+    def __init__(self, kwargs: Dict[str, Any], timeout: float):
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class _Worker:
+    """一个常驻工作进程及其调度线程"""
+
+    def __init__(self, pool: "TranscodePool", index: int):
+        self.pool = pool
+        self.index = index
+        self.process: Optional[subprocess.Popen] = None
+        self.jobs_done = 0
+        self.busy = False
+        self.timed_out = False
+        self.thread = threading.Thread(target=self.run, name=f"transcode-worker-{index}", daemon=True)
+
+    def _spawn(self):
+        """启动工作进程"""
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "speech.transcode_worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=PROJECT_ROOT
+        )
+        self.jobs_done = 0
+        self.pool._count("spawns")
+        logger.info(f"转码工作进程{self.index}已启动，PID: {self.process.pid}")
+
+    def _alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def _kill(self):
+        """超时时强制结束工作进程"""
+        process = self.process
+        if process is not None and process.poll() is None:
+            self.timed_out = True
+            process.kill()
+
+    def stop(self, graceful: bool = True):
+        """
+        停止工作进程
+
+        参数:
+            graceful: 为True时关闭stdin让工作进程自行退出，否则直接结束
+        """
+        process, self.process = self.process, None
+        if process is None:
+            return
+        try:
+            if graceful and process.poll() is None:
+                process.stdin.close()
+                process.wait(timeout=KILL_GRACE)
+        except Exception:
+            pass
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        for stream in (process.stdin, process.stdout):
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def run(self):
+        """调度线程：从共享队列取任务交给工作进程"""
+        while True:
+            job = self.pool._queue.get()
+            if job is None:
+                self.stop()
+                return
+            if not job.future.set_running_or_notify_cancel():
+                continue
+
+            self.busy = True
+            started_at = time.monotonic()
+            self.pool._record_wait(started_at - job.enqueued_at)
+            try:
+                job.future.set_result(self._execute(job))
+                self.pool._count("completed")
+            except Exception as e:
+                self.pool._count("failed")
+                job.future.set_exception(e)
+            finally:
+                self.pool._record_run(time.monotonic() - started_at)
+                self.busy = False
+
+            # 处理满N个任务后平滑重启（此时没有进行中的任务）
+            if self.jobs_done >= self.pool.max_jobs_per_worker:
+                logger.info(f"转码工作进程{self.index}已处理{self.jobs_done}个任务，重启")
+                self.stop()
+                self.pool._count("recycles")
+
+    def _execute(self, job: TranscodeJob) -> bytes:
+        """在工作进程中执行一个任务"""
+        if not self._alive():
+            self.stop(graceful=False)
+            self._spawn()
+
+        self.timed_out = False
+        timer = threading.Timer(job.timeout + KILL_GRACE, self._kill)
+        timer.start()
+        try:
+            write_frame(self.process.stdin, dict(job.kwargs, timeout=job.timeout))
+            reply = read_frame(self.process.stdout)
+        except (BrokenPipeError, OSError):
+            reply = None
+        finally:
+            timer.cancel()
+
+        self.jobs_done += 1
+        if reply is None:
+            # 工作进程崩溃或被超时杀掉，丢弃后在下一个任务时重启
+            self.stop(graceful=False)
+            if self.timed_out:
+                self.pool._count("timeouts")
+                raise TranscodeError(f"转码任务超时（{job.timeout}秒），工作进程已重启")
+            self.pool._count("crashes")
+            raise TranscodeError("转码工作进程异常退出")
+
+        if not reply["ok"]:
+            raise TranscodeError(reply["error"])
+        return reply["data"]
+
+
+class TranscodePool:
+    """常驻转码工作进程池"""
+
+    def __init__(
+        self,
+        size: int,
+        max_jobs_per_worker: int,
+        queue_size: int,
+        job_timeout: float,
+        enabled: bool = True
+    ):
+        """
+        初始化工作进程池（工作进程在首次提交任务时启动）
+
+        参数:
+            size: 工作进程数量
+            max_jobs_per_worker: 每个工作进程处理多少个任务后重启
+            queue_size: 等待队列的最大长度
+            job_timeout: 单个任务的默认超时时间（秒）
+            enabled: 为False时直接在调用线程中转码
+        """
+        self.size = max(1, size)
+        self.max_jobs_per_worker = max(1, max_jobs_per_worker)
+        self.queue_size = queue_size
+        self.job_timeout = job_timeout
+        self.enabled = enabled
+
+        self._queue: "queue.Queue[Optional[TranscodeJob]]" = queue.Queue(maxsize=queue_size)
+        self._workers = []
+        self._lock = threading.Lock()
+        self._started = False
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.spawns = 0
+        self.recycles = 0
+        self.peak_queue_depth = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+        self._run_count = 0
+        self._stats_lock = threading.Lock()
+
+    def start(self):
+        """启动调度线程（工作进程在收到第一个任务时启动）"""
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._workers = [_Worker(self, index) for index in range(self.size)]
+            for worker in self._workers:
+                worker.thread.start()
+            self._started = True
+            logger.info(f"转码工作进程池已启动，工作进程数: {self.size}，队列长度: {self.queue_size}")
+
+    def submit(self, source: Union[bytes, str], timeout: Optional[float] = None, **kwargs) -> Future:
+        """
+        提交转码任务
+
+        参数:
+            source: 音频字节数据或文件路径
+            timeout: 任务超时时间（秒），None为默认值
+            **kwargs: 传给ffmpeg_pipe.transcode的其余参数
+
+        返回:
+            结果为转码后字节数据的Future
+        """
+        self.start()
+        job = TranscodeJob(dict(kwargs, source=source), timeout or self.job_timeout)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._count("rejected")
+            raise TranscodeError(f"转码队列已满（{self.queue_size}），请稍后重试")
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self.submitted += 1
+            if depth > self.peak_queue_depth:
+                self.peak_queue_depth = depth
+        return job.future
+
+    def transcode(self, source: Union[bytes, str], timeout: Optional[float] = None, **kwargs) -> bytes:
+        """
+        同步转码，参数与ffmpeg_pipe.transcode相同
+
+        返回:
+            转码后的字节数据
+        """
+        if not self.enabled:
+            return transcode_inline(source, timeout=timeout or self.job_timeout, **kwargs)
+        return self.submit(source, timeout=timeout, **kwargs).result()
+
+    def decode_to_pcm(
+        self,
+        source: Union[bytes, str],
+        input_format: Optional[str] = None,
+        sample_rate: int = 16000,
+        channels: int = 1,
+        timeout: Optional[float] = None
+    ) -> bytes:
+        """解码为16位小端PCM（经由工作进程）"""
+        return self.transcode(
+            source,
+            input_format=input_format,
+            output_format="s16le",
+            sample_rate=sample_rate,
+            channels=channels,
+            timeout=timeout
+        )
+
+    def _count(self, name: str):
+        """计数加一（调度线程和提交线程并发更新，统一在统计锁内进行）"""
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _record_wait(self, seconds: float):
+        with self._stats_lock:
+            self._wait_total += seconds
+
+    def _record_run(self, seconds: float):
+        with self._stats_lock:
+            self._run_total += seconds
+            self._run_count += 1
+
+    def shutdown(self):
+        """停止所有工作进程，未开始的任务会被取消"""
+        if not self._started:
+            return
+        with self._lock:
+            while True:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job.future.cancel()
+            for _ in self._workers:
+                self._queue.put(None)
+            for worker in self._workers:
+                worker.thread.join(timeout=KILL_GRACE * 2)
+            self._workers = []
+            self._started = False
+        logger.info("转码工作进程池已关闭")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取工作进程池统计"""
+        with self._stats_lock:
+            runs = self._run_count
+            avg_wait_ms = round(self._wait_total / runs * 1000, 2) if runs else 0.0
+            avg_run_ms = round(self._run_total / runs * 1000, 2) if runs else 0.0
+            counters = {
+                "peak_queue_depth": self.peak_queue_depth,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "crashes": self.crashes,
+                "spawns": self.spawns,
+                "recycles": self.recycles
+            }
+        workers = list(self._workers)
+        return {
+            "enabled": self.enabled,
+            "workers": self.size,
+            "alive_workers": sum(1 for worker in workers if worker._alive()),
+            "busy_workers": sum(1 for worker in workers if worker.busy),
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self.queue_size,
+            **counters,
+            "max_jobs_per_worker": self.max_jobs_per_worker,
+            "avg_wait_ms": avg_wait_ms,
+            "avg_run_ms": avg_run_ms
+        }
+
+
+# 创建全局实例
+transcode_pool = TranscodePool(
+    size=env_config.AUDIO_TRANSCODE_WORKERS,
+    max_jobs_per_worker=env_config.AUDIO_TRANSCODE_MAX_JOBS,
+    queue_size=env_config.AUDIO_TRANSCODE_QUEUE_SIZE,
+    job_timeout=env_config.AUDIO_TRANSCODE_TIMEOUT,
+    enabled=env_config.AUDIO_TRANSCODE_POOL_ENABLED
+)
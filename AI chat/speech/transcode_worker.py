@@ -0,0 +1,86 @@
+"""
+常驻转码工作进程
+由speech.transcode_pool以 `python -m speech.transcode_worker` 启动，常驻处理转码任务：
+- 从stdin读取长度前缀帧（4字节大端长度 + pickle数据），内容为transcode的参数
+- 在本进程中调用ffmpeg管道转码，结果按同样的帧格式写回stdout
+- stdin关闭时退出
+
+工作进程只导入ffmpeg_pipe，常驻内存很小，由它来启动ffmpeg比从主服务进程fork开销小得多
+"""
+
+import pickle
+import struct
+import sys
+
+from speech.ffmpeg_pipe import transcode
+
+# 帧头：4字节大端无符号长度
+FRAME_HEADER = struct.Struct(">I")
+
+
+def read_frame(stream):
+    """
+    读取一帧
+
+    参数:
+        stream: 二进制输入流
+
+    返回:
+        反序列化后的对象，流结束时返回None
+    """
+    header = _read_exact(stream, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    payload = _read_exact(stream, length)
+    if payload is None:
+        return None
+    return pickle.loads(payload)
+
+
+def write_frame(stream, obj):
+    """
+    写入一帧
+
+    参数:
+        stream: 二进制输出流
+        obj: 要发送的对象
+    """
+    payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(FRAME_HEADER.pack(len(payload)))
+    stream.write(payload)
+    stream.flush()
+
+
+def _read_exact(stream, size):
+    """读取恰好size字节，流提前结束时返回None"""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def main():
+    """工作进程主循环"""
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    # 协议独占stdout，任何意外的print都改写到stderr
+    sys.stdout = sys.stderr
+
+    while True:
+        job = read_frame(stdin)
+        if job is None:
+            break
+        try:
+            write_frame(stdout, {"ok": True, "data": transcode(**job)})
+        except Exception as e:
+            write_frame(stdout, {"ok": False, "error": str(e)})
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,17 @@
+import io
 import logging
 import os
 import tempfile
 from typing import Optional, Tuple
 
-import requests
 from gtts import gTTS
 from pydub import AudioSegment
 from pydub.playback import play
 
 from config import env_config
 from speech.audio_converter import audio_converter
+from speech.tts_endpoint import TTSEndpointDiscovery
+from speech.tts_cache import TTSAudioCache
 
 logger = logging.getLogger("ai_chat_service.speech.tts")
 
@@ -27,6 +29,29 @@ class TextToSpeech:
         self.api_base_url = env_config.TTS_BASE_URL
         self.api_backup_base_url = env_config.TTS_BACKUP_BASE_URL
         self.api_model = env_config.TTS_MODEL
+        self.voice_type = env_config.TTS_VOICE_TYPE
+        self.speed = env_config.TTS_SPEED
+        
+        # API端点发现：探测一次并缓存可用的 (URL, 请求体格式) 组合
+        self.endpoint_discovery = TTSEndpointDiscovery(
+            api_key=self.api_key,
+            base_urls=[self.api_base_url, self.api_backup_base_url],
+            model=self.api_model,
+            voice_type=self.voice_type,
+            speed=self.speed,
+            request_timeout=env_config.TTS_REQUEST_TIMEOUT,
+            probe_timeout=env_config.TTS_PROBE_TIMEOUT,
+            failure_ttl=env_config.TTS_FAILURE_TTL,
+            probe_wait=env_config.TTS_PROBE_WAIT
+        )
+        
+        # 合成结果缓存：内存保存热点，其余保存在磁盘
+        self.cache = TTSAudioCache(
+            cache_dir=env_config.TTS_CACHE_DIR,
+            memory_max_bytes=int(env_config.TTS_CACHE_MEMORY_MB * 1024 * 1024),
+            disk_max_bytes=int(env_config.TTS_CACHE_DISK_MB * 1024 * 1024),
+            enabled=env_config.TTS_CACHE_ENABLED
+        )
         
         logger.info(f"初始化TTS引擎: {self.tts_engine}")
         logger.info(f"TTS API配置 - 基础URL: {self.api_base_url}, 模型: {self.api_model}")
@@ -60,22 +85,13 @@ class TextToSpeech:
                 # 确保目录存在
                 os.makedirs(os.path.dirname(save_path), exist_ok=True)
             
-            # 优先使用API，但如果API不可用，确保gTTS能工作
-            if self.tts_engine == "api" and self.api_key:
-                # 使用API转换
-                success = self._text_to_speech_api(text, save_path)
-                if success:
-                    logger.info(f"语音文件保存成功(API): {save_path}")
-                    return save_path, None
-                else:
-                    # API失败，回退到gTTS
-                    logger.warning("TTS API调用失败，回退到gTTS")
-                    
-            # 强制使用gTTS作为备选
-            logger.info(f"使用gTTS转换文本，语言: {self.lang}, 语速: {'慢速' if self.slow else '正常'}")
-            tts = gTTS(text=text, lang=self.lang, slow=self.slow)
-            tts.save(save_path)
-            logger.info(f"语音文件保存成功(gTTS): {save_path}")
+            audio_bytes, error = self.text_to_speech_bytes(text)
+            if error:
+                raise Exception(error)
+            
+            with open(save_path, 'wb') as f:
+                f.write(audio_bytes)
+            logger.info(f"语音文件保存成功: {save_path}")
             
             return save_path, None
             
@@ -91,137 +107,13 @@ class TextToSpeech:
                     pass
             return None, error
     
-    def _text_to_speech_api(self, text: str, save_path: str) -> bool:
-        """
-        使用TTS API将文本转换为语音
-        
-        参数:
-            text: 要转换的文本
-            save_path: 保存路径
-            
-        返回:
-            是否成功
-        """
-        try:
-            # 构建请求参数
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            # 尝试不同的参数格式
-            request_bodies = [
-                # 格式1: 用户提供的七牛TTS API格式
-                {
-                    "audio": {
-                        "voice_type": "zh_male_M392_conversation_wvae_bigtts",
-                        "encoding": "mp3",
-                        "speed_ratio": 1.0
-                    },
-                    "request": {
-                        "text": text
-                    }
-                },
-                # 格式2: 标准OpenAI格式
-                {
-                    "model": self.api_model,
-                    "input": text,
-                    "voice": "female",
-                    "response_format": "mp3",
-                    "speed": 1.0
-                },
-                # 格式3: 可能的DeepSeek TTS格式
-                {
-                    "text": text,
-                    "model": self.api_model
-                },
-                # 格式4: 简化版参数
-                {
-                    "text": text
-                }
-            ]
-            
-            # 尝试不同的API端点格式
-            base_urls = [self.api_base_url, self.api_backup_base_url]
-            endpoint_paths = [
-                "/voice/tts",  # 用户提供的七牛API端点
-                "/audio/speech",
-                "/speech/generate",
-                "/tts/generate",
-                "/tts",
-                "/api/tts",
-                "/api/speech"
-            ]
-            
-            # 生成所有可能的API URL组合
-            api_urls = []
-            for base in base_urls:
-                for path in endpoint_paths:
-                    api_urls.append(base + path)
-            
-            # 去重
-            api_urls = list(set(api_urls))
-            logger.info(f"尝试所有可能的API URL组合，共{len(api_urls)}个URL")
-            
-            # 尝试所有URL和参数组合
-            for url in api_urls:
-                for request_body in request_bodies:
-                    try:
-                        logger.info(f"尝试调用TTS API: {url}，参数格式: {list(request_body.keys())}")
-                        
-                        # 发送请求
-                        response = requests.post(
-                            url,
-                            headers=headers,
-                            json=request_body,
-                            timeout=30
-                        )
-                        
-                        # 检查响应状态
-                        if response.status_code == 200:
-                            logger.info(f"TTS API调用成功: {url}")
-                            
-                            # 保存音频文件
-                            with open(save_path, 'wb') as f:
-                                f.write(response.content)
-                            
-                            return True
-                        else:
-                            status_code = response.status_code
-                            logger.warning(f"TTS API调用失败({url}): {status_code} - {response.reason}")
-                            try:
-                                error_detail = response.json()
-                                logger.warning(f"API错误详情: {error_detail}")
-                            except:
-                                logger.warning(f"API错误响应: {response.text}")
-                        
-                    except requests.exceptions.RequestException as e:
-                        status_code = e.response.status_code if hasattr(e, 'response') and e.response else 'N/A'
-                        logger.warning(f"TTS API调用异常({url}): {status_code} - {str(e)}")
-                        if hasattr(e, 'response') and e.response is not None:
-                            try:
-                                error_detail = e.response.json()
-                                logger.warning(f"API错误详情: {error_detail}")
-                            except:
-                                logger.warning(f"API错误响应: {e.response.text}")
-                        
-                        # 继续尝试下一个组合
-                        continue
-            
-            # 所有组合都尝试失败
-            logger.error(f"所有TTS API调用组合都失败，共尝试了{len(api_urls) * len(request_bodies)}种组合")
-            logger.error(f"请检查TTS API配置是否正确: 基础URL={self.api_base_url}, 模型={self.api_model}")
-            return False
-            
-        except Exception as e:
-            logger.error(f"TTS API处理异常: {str(e)}")
-            logger.exception("TTS API异常详细信息")
-            return False
-    
     def text_to_speech_bytes(self, text: str) -> Tuple[Optional[bytes], Optional[str]]:
         """
         将文本转换为语音并返回字节数据
         
+        相同的 (文本, 引擎, 音色, 语速, 语言) 直接从音频缓存返回；
+        API已知不可用时按gTTS的缓存键查找（回退合成的结果按gTTS保存）
+        
         参数:
             text: 要转换的文本
         
@@ -231,29 +123,15 @@ class TextToSpeech:
         try:
             logger.info(f"正在将文本转换为语音字节数据，文本长度: {len(text)} 字符，引擎: {self.tts_engine}")
             
-            # 创建临时文件
-            fd, temp_path = tempfile.mkstemp(suffix='.mp3')
-            os.close(fd)
+            audio_bytes = self.cache.get(self._cache_key(text, self._resolve_engine()))
+            if audio_bytes is not None:
+                logger.info(f"命中TTS音频缓存，大小: {len(audio_bytes)} 字节")
+                return audio_bytes, None
             
-            try:
-                # 使用text_to_speech方法转换
-                result, error = self.text_to_speech(text, temp_path)
-                
-                if result:
-                    # 读取文件内容为字节数据
-                    with open(temp_path, 'rb') as f:
-                        audio_bytes = f.read()
-                    logger.info(f"成功获取语音字节数据，大小: {len(audio_bytes)} 字节")
-                    return audio_bytes, None
-                else:
-                    return None, error
-            finally:
-                # 清理临时文件
-                if os.path.exists(temp_path):
-                    try:
-                        os.remove(temp_path)
-                    except:
-                        pass
+            audio_bytes, engine = self._synthesize(text)
+            self.cache.put(self._cache_key(text, engine), audio_bytes)
+            logger.info(f"成功获取语音字节数据({engine})，大小: {len(audio_bytes)} 字节")
+            return audio_bytes, None
             
         except Exception as e:
             error = f"文本转语音（字节数据）失败: {str(e)}"
@@ -261,10 +139,70 @@ class TextToSpeech:
             logger.exception("文本转语音字节数据异常详细信息")
             return None, error
     
+    def _synthesize(self, text: str) -> Tuple[bytes, str]:
+        """
+        合成语音
+        
+        参数:
+            text: 要转换的文本
+        
+        返回:
+            (音频字节数据, 实际使用的引擎)
+        """
+        # 优先使用API，但如果API不可用，确保gTTS能工作
+        if self.tts_engine == "api" and self.api_key:
+            audio_bytes = self._text_to_speech_bytes_api(text)
+            if audio_bytes:
+                return audio_bytes, "api"
+            # API失败，回退到gTTS
+            logger.warning("TTS API调用失败，回退到gTTS")
+        
+        # 强制使用gTTS作为备选
+        logger.info(f"使用gTTS转换文本，语言: {self.lang}, 语速: {'慢速' if self.slow else '正常'}")
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=self.lang, slow=self.slow).write_to_fp(buffer)
+        return buffer.getvalue(), "gtts"
+    
+    def _resolve_engine(self) -> str:
+        """本次合成实际会使用的引擎：配置了API且端点发现认为可用时为api，否则为gtts"""
+        if self.tts_engine == "api" and self.api_key and self.endpoint_discovery.available():
+            return "api"
+        return "gtts"
+    
+    def _cache_key(self, text: str, engine: str) -> str:
+        """计算音频缓存键，不同引擎的音色和语速参数不同"""
+        if engine == "api":
+            voice_type, speed = self.voice_type, self.speed
+        else:
+            voice_type, speed = "gtts", 0.5 if self.slow else 1.0
+        return self.cache.make_key(text, engine, voice_type, speed, self.lang)
+    
+    def _text_to_speech_api(self, text: str, save_path: str) -> bool:
+        """
+        使用TTS API将文本转换为语音
+        
+        参数:
+            text: 要转换的文本
+            save_path: 保存路径
+            
+        返回:
+            是否成功
+        """
+        audio_bytes = self._text_to_speech_bytes_api(text)
+        if not audio_bytes:
+            return False
+        
+        # 保存音频文件
+        with open(save_path, 'wb') as f:
+            f.write(audio_bytes)
+        return True
+    
     def _text_to_speech_bytes_api(self, text: str) -> Optional[bytes]:
         """
         使用TTS API将文本转换为语音字节数据
         
+        通过端点发现使用已探测到的 (URL, 请求体格式) 组合，而不是每次遍历所有组合
+        
         参数:
             text: 要转换的文本
             
@@ -272,113 +210,17 @@ class TextToSpeech:
             音频字节数据，如果失败则返回None
         """
         try:
-            # 构建请求参数
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            # 尝试不同的参数格式
-            request_bodies = [
-                # 格式1: 用户提供的七牛TTS API格式
-                {
-                    "audio": {
-                        "voice_type": "zh_male_M392_conversation_wvae_bigtts",
-                        "encoding": "mp3",
-                        "speed_ratio": 1.0
-                    },
-                    "request": {
-                        "text": text
-                    }
-                },
-                # 格式2: 标准OpenAI格式
-                {
-                    "model": self.api_model,
-                    "input": text,
-                    "voice": "female",
-                    "response_format": "mp3",
-                    "speed": 1.0
-                },
-                # 格式3: 可能的DeepSeek TTS格式
-                {
-                    "text": text,
-                    "model": self.api_model
-                },
-                # 格式4: 简化版参数
-                {
-                    "text": text
-                }
-            ]
-            
-            # 尝试不同的API端点格式
-            base_urls = [self.api_base_url, self.api_backup_base_url]
-            endpoint_paths = [
-                "/voice/tts",  # 用户提供的七牛API端点
-                "/audio/speech",
-                "/speech/generate",
-                "/tts/generate",
-                "/tts",
-                "/api/tts",
-                "/api/speech"
-            ]
-            
-            # 生成所有可能的API URL组合
-            api_urls = []
-            for base in base_urls:
-                for path in endpoint_paths:
-                    api_urls.append(base + path)
-            
-            # 去重
-            api_urls = list(set(api_urls))
-            
-            # 尝试所有URL和参数组合
-            for url in api_urls:
-                for request_body in request_bodies:
-                    try:
-                        logger.info(f"尝试调用TTS API: {url}，参数格式: {list(request_body.keys())}")
-                        
-                        # 发送请求
-                        response = requests.post(
-                            url,
-                            headers=headers,
-                            json=request_body,
-                            timeout=30
-                        )
-                        
-                        # 检查响应状态
-                        if response.status_code == 200:
-                            logger.info(f"TTS API调用成功: {url}")
-                            return response.content
-                        else:
-                            status_code = response.status_code
-                            logger.warning(f"TTS API调用失败({url}): {status_code} - {response.reason}")
-                            try:
-                                error_detail = response.json()
-                                logger.warning(f"API错误详情: {error_detail}")
-                            except:
-                                logger.warning(f"API错误响应: {response.text}")
-                        
-                    except requests.exceptions.RequestException as e:
-                        status_code = e.response.status_code if hasattr(e, 'response') and e.response else 'N/A'
-                        logger.warning(f"TTS API调用异常({url}): {status_code} - {str(e)}")
-                        if hasattr(e, 'response') and e.response is not None:
-                            try:
-                                error_detail = e.response.json()
-                                logger.warning(f"API错误详情: {error_detail}")
-                            except:
-                                logger.warning(f"API错误响应: {e.response.text}")
-                        
-                        # 继续尝试下一个组合
-                        continue
-            
-            # 所有组合都尝试失败
-            logger.error(f"所有TTS API调用组合都失败")
-            return None
-            
+            return self.endpoint_discovery.synthesize(text)
         except Exception as e:
             logger.error(f"TTS API处理异常: {str(e)}")
+            logger.exception("TTS API异常详细信息")
             return None
     
+    def warm_up(self):
+        """启动时在后台探测TTS API端点"""
+        if self.tts_engine == "api" and self.api_key and env_config.TTS_PROBE_ON_STARTUP:
+            self.endpoint_discovery.start_background_probe()
+    
     def speak(self, text: str) -> Tuple[bool, Optional[str]]:
         """
         将文本转换为语音并播放
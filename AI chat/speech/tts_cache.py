@@ -0,0 +1,271 @@
+"""
+TTS音频缓存
+以 (规范化文本, 引擎, 音色, 语速, 语言) 的哈希为键缓存合成好的音频：
+- 热点条目保存在内存中
+- 其余条目保存在按哈希前缀分片的磁盘目录中
+- 内存和磁盘分别按字节数做LRU淘汰
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger("ai_chat_service.speech.tts_cache")
+
+
+class TTSAudioCache:
+    """内容寻址的TTS音频缓存"""
+
+    def __init__(
+        self,
+        cache_dir: str,
+        memory_max_bytes: int,
+        disk_max_bytes: int,
+        enabled: bool = True,
+        extension: str = ".mp3"
+    ):
+        """
+        初始化缓存
+
+        参数:
+            cache_dir: 磁盘缓存目录
+            memory_max_bytes: 内存缓存的字节上限
+            disk_max_bytes: 磁盘缓存的字节上限
+            enabled: 是否启用缓存
+            extension: 缓存文件扩展名
+        """
+        self.cache_dir = cache_dir
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.enabled = enabled
+        self.extension = extension
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_index: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._disk_loaded = False
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """规范化文本：统一Unicode形式、合并空白、去掉首尾空白"""
+        text = unicodedata.normalize("NFKC", text or "")
+        return re.sub(r"\s+", " ", text).strip()
+
+    def make_key(self, text: str, engine: str, voice_type: str, speed: float, lang: str) -> str:
+        """
+        计算缓存键
+
+        参数:
+            text: 要合成的文本
+            engine: TTS引擎
+            voice_type: 音色
+            speed: 语速
+            lang: 语言
+
+        返回:
+            SHA-256十六进制摘要
+        """
+        payload = json.dumps(
+            [self.normalize_text(text), engine, voice_type, float(speed), (lang or "").lower()],
+            ensure_ascii=False,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        """分片存储路径: <cache_dir>/ab/cd/<key>.mp3"""
+        return os.path.join(self.cache_dir, key[:2], key[2:4], key + self.extension)
+
+    def _load_disk_index(self):
+        """首次使用时扫描磁盘目录，按修改时间重建LRU顺序"""
+        if self._disk_loaded:
+            return
+        self._disk_loaded = True
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(self.extension):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name[:-len(self.extension)], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+        logger.info(f"TTS磁盘缓存索引加载完成，共{len(self._disk_index)}条，{self._disk_bytes}字节")
+        self._evict_disk()
+
+    def _remember(self, key: str, audio: bytes):
+        """放入内存缓存，超过字节上限时淘汰最久未使用的条目"""
+        # 过大的条目不进入内存，避免一次性挤掉所有热点
+        if len(audio) > self.memory_max_bytes // 4:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.memory_max_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.memory_evictions += 1
+
+    def _evict_disk(self):
+        """磁盘缓存超过字节上限时淘汰最久未使用的文件"""
+        while self._disk_bytes > self.disk_max_bytes and self._disk_index:
+            key, size = self._disk_index.popitem(last=False)
+            self._disk_bytes -= size
+            self.disk_evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        读取缓存
+
+        参数:
+            key: 缓存键
+
+        返回:
+            音频字节数据，未命中返回None
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                if key in self._disk_index:
+                    self._disk_index.move_to_end(key)
+                self.memory_hits += 1
+                return audio
+
+            self._load_disk_index()
+            if key not in self._disk_index:
+                self.misses += 1
+                return None
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            # 更新修改时间，重启后仍能保持LRU顺序
+            os.utime(path, None)
+        except OSError:
+            with self._lock:
+                size = self._disk_index.pop(key, None)
+                if size is not None:
+                    self._disk_bytes -= size
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key in self._disk_index:
+                self._disk_index.move_to_end(key)
+            self._remember(key, audio)
+            self.disk_hits += 1
+        return audio
+
+    def put(self, key: str, audio: bytes):
+        """
+        写入缓存
+
+        参数:
+            key: 缓存键
+            audio: 音频字节数据
+        """
+        if not self.enabled or not audio:
+            return
+
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再替换，避免并发读到半个文件
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入TTS磁盘缓存失败: {e}")
+            path = None
+
+        with self._lock:
+            self._remember(key, audio)
+            if path is None:
+                return
+            self._load_disk_index()
+            old_size = self._disk_index.pop(key, None)
+            if old_size is not None:
+                self._disk_bytes -= old_size
+            self._disk_index[key] = len(audio)
+            self._disk_bytes += len(audio)
+            self._evict_disk()
+
+    def purge(self) -> Dict[str, int]:
+        """
+        清空内存和磁盘缓存
+
+        返回:
+            清除的条目数和字节数
+        """
+        with self._lock:
+            self._load_disk_index()
+            removed_entries = len(self._disk_index)
+            removed_bytes = self._disk_bytes
+            for key in list(self._disk_index.keys()):
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self._disk_index.clear()
+            self._disk_bytes = 0
+            self._memory.clear()
+            self._memory_bytes = 0
+
+        logger.info(f"TTS缓存已清空，删除{removed_entries}条，{removed_bytes}字节")
+        return {"removed_entries": removed_entries, "removed_bytes": removed_bytes}
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        with self._lock:
+            self._load_disk_index()
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "memory_max_bytes": self.memory_max_bytes,
+                "disk_entries": len(self._disk_index),
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "memory_evictions": self.memory_evictions,
+                "disk_evictions": self.disk_evictions
+            }
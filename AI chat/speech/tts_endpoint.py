@@ -0,0 +1,372 @@
+"""
+TTS端点发现
+在候选的 (URL, 请求体格式) 组合中探测出可用的一组并缓存下来：
+- 启动时或首次调用时探测一次，按固定顺序尝试
+- 记住可用的组合，失败的组合带TTL缓存，避免重复尝试
+- 只有当缓存的组合开始失败时，才在后台重新探测
+- 主URL和备用URL提供相同的接口，合成时按端点健康状态（延迟、错误率、熔断）
+  选择基础URL，路径和请求体格式沿用缓存的组合
+"""
+
+import base64
+import threading
+import time
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+from utils.http_pool import http_pool
+from utils.endpoint_health import endpoint_health
+
+logger = logging.getLogger("ai_chat_service.speech.tts_endpoint")
+
+# 候选的API端点路径，按优先级排列
+ENDPOINT_PATHS = [
+    "/voice/tts",  # 七牛API端点
+    "/audio/speech",
+    "/speech/generate",
+    "/tts/generate",
+    "/tts",
+    "/api/tts",
+    "/api/speech"
+]
+
+# 候选的请求体格式，按优先级排列
+BODY_SCHEMAS = ["qiniu", "openai", "text_model", "text"]
+
+# 探测时使用的短文本
+PROBE_TEXT = "你好"
+
+
+class TTSEndpointDiscovery:
+    """TTS端点发现与缓存"""
+
+    def __init__(
+        self,
+        api_key: str,
+        base_urls: List[str],
+        model: str,
+        voice_type: str,
+        speed: float,
+        request_timeout: float = 30,
+        probe_timeout: float = 5,
+        failure_ttl: float = 300,
+        probe_wait: float = 10
+    ):
+        """
+        初始化端点发现
+
+        参数:
+            api_key: TTS API密钥
+            base_urls: 基础URL列表（主URL在前）
+            model: TTS模型名称
+            voice_type: 音色
+            speed: 语速
+            request_timeout: 正常合成请求的超时时间（秒）
+            probe_timeout: 探测单个组合的超时时间（秒）
+            failure_ttl: 失败组合的缓存时间（秒）
+            probe_wait: 调用方等待进行中探测的最长时间（秒）
+        """
+        self.api_key = api_key
+        self.base_urls = [url for url in base_urls if url]
+        self.health = endpoint_health.group("tts", self.base_urls)
+        self.model = model
+        self.voice_type = voice_type
+        self.speed = speed
+        self.request_timeout = request_timeout
+        self.probe_timeout = probe_timeout
+        self.failure_ttl = failure_ttl
+        self.probe_wait = probe_wait
+
+        self._endpoint: Optional[Tuple[str, str]] = None
+        self._failures: Dict[Tuple[str, str], float] = {}
+        self._last_probe_at: Optional[float] = None
+        self._probe_running = threading.Lock()
+        self._probe_done = threading.Event()
+        self._probe_done.set()
+
+        self.probes = 0
+        self.probe_requests = 0
+        self.calls = 0
+        self.call_failures = 0
+
+    def candidates(self) -> List[Tuple[str, str]]:
+        """
+        按固定优先级生成所有 (URL, 请求体格式) 组合
+
+        返回:
+            去重后的候选组合列表
+        """
+        urls = []
+        for base in self.base_urls:
+            for path in ENDPOINT_PATHS:
+                urls.append(base + path)
+        # 保序去重
+        urls = list(dict.fromkeys(urls))
+        return [(url, schema) for url in urls for schema in BODY_SCHEMAS]
+
+    def build_body(self, schema: str, text: str) -> Dict[str, Any]:
+        """
+        按格式构建请求体
+
+        参数:
+            schema: 请求体格式名称
+            text: 要合成的文本
+
+        返回:
+            请求体字典
+        """
+        if schema == "qiniu":
+            # 七牛TTS API格式
+            return {
+                "audio": {
+                    "voice_type": self.voice_type,
+                    "encoding": "mp3",
+                    "speed_ratio": self.speed
+                },
+                "request": {
+                    "text": text
+                }
+            }
+        if schema == "openai":
+            # 标准OpenAI格式
+            return {
+                "model": self.model,
+                "input": text,
+                "voice": "female",
+                "response_format": "mp3",
+                "speed": self.speed
+            }
+        if schema == "text_model":
+            return {
+                "text": text,
+                "model": self.model
+            }
+        # 简化版参数
+        return {
+            "text": text
+        }
+
+    @staticmethod
+    def _extract_audio(response) -> Optional[bytes]:
+        """
+        从响应中提取音频数据
+
+        有的服务直接返回音频二进制，有的返回包含base64音频的JSON
+        """
+        content_type = response.headers.get("Content-Type", "")
+        if "json" not in content_type:
+            return response.content or None
+
+        try:
+            payload = response.json()
+        except ValueError:
+            return None
+        data = payload.get("data") if isinstance(payload, dict) else None
+        if isinstance(data, str) and data:
+            try:
+                return base64.b64decode(data)
+            except ValueError:
+                return None
+        return None
+
+    def _split(self, url: str) -> Tuple[Optional[str], str]:
+        """把完整URL拆分为 (基础URL, 路径)"""
+        for base in self.base_urls:
+            if url.startswith(base):
+                return base, url[len(base):]
+        return None, url
+
+    def _call(self, endpoint: Tuple[str, str], text: str, timeout: float, track: bool = False) -> Optional[bytes]:
+        """
+        调用一个组合，成功返回音频数据
+
+        track为True时把结果记入基础URL的健康状态（探测时组合不匹配造成的失败不计入）
+        """
+        url, schema = endpoint
+        base = self._split(url)[0] if track else None
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        started_at = time.perf_counter()
+        try:
+            response = http_pool.post(
+                url,
+                headers=headers,
+                json=self.build_body(schema, text),
+                timeout=timeout
+            )
+        except Exception as e:
+            logger.warning(f"TTS API调用异常({url}, {schema}): {str(e)}")
+            if base:
+                self.health.record_failure(base, time.perf_counter() - started_at)
+            return None
+
+        if response.status_code != 200:
+            logger.warning(f"TTS API调用失败({url}, {schema}): {response.status_code} - {response.reason}")
+            if base:
+                self.health.record_failure(base, time.perf_counter() - started_at)
+            return None
+
+        audio = self._extract_audio(response)
+        if not audio:
+            logger.warning(f"TTS API响应中没有音频数据({url}, {schema})")
+        if base:
+            if audio:
+                self.health.record_success(base, time.perf_counter() - started_at)
+            else:
+                self.health.record_failure(base)
+        return audio
+
+    def _routes(self, endpoint: Tuple[str, str]) -> List[Tuple[str, str]]:
+        """按端点健康状态排列缓存组合在各个基础URL上的对应组合"""
+        base, path = self._split(endpoint[0])
+        if base is None:
+            return [endpoint]
+        now = time.monotonic()
+        routes = [(candidate_base + path, endpoint[1]) for candidate_base in self.health.order()]
+        return [route for route in routes if route == endpoint or not self._is_failed(route, now)]
+
+    def _is_failed(self, endpoint: Tuple[str, str], now: float) -> bool:
+        failed_at = self._failures.get(endpoint)
+        return failed_at is not None and now - failed_at < self.failure_ttl
+
+    def _mark_failed(self, endpoint: Tuple[str, str]):
+        self._failures[endpoint] = time.monotonic()
+
+    def probe(self) -> Optional[Tuple[str, str]]:
+        """
+        按顺序探测候选组合，跳过仍在失败TTL内的组合；已有探测进行中时等待其结果
+
+        返回:
+            可用的 (URL, 请求体格式)，全部失败时返回None
+        """
+        if not self._probe_running.acquire(blocking=False):
+            self._probe_done.wait()
+            return self._endpoint
+        self._probe_done.clear()
+        try:
+            return self._run_probe()
+        finally:
+            self._probe_done.set()
+            self._probe_running.release()
+
+    def start_background_probe(self) -> bool:
+        """
+        在后台线程中探测，已有探测进行中时不重复启动
+
+        返回:
+            是否启动了新的探测
+        """
+        if not self._probe_running.acquire(blocking=False):
+            return False
+        self._probe_done.clear()
+
+        def run():
+            try:
+                self._run_probe()
+            finally:
+                self._probe_done.set()
+                self._probe_running.release()
+
+        threading.Thread(target=run, name="tts-endpoint-probe", daemon=True).start()
+        return True
+
+    def _run_probe(self) -> Optional[Tuple[str, str]]:
+        """执行一轮探测"""
+        self.probes += 1
+        self._last_probe_at = time.monotonic()
+        candidates = self.candidates()
+        logger.info(f"开始探测TTS API端点，共{len(candidates)}种组合")
+
+        for endpoint in candidates:
+            if self._is_failed(endpoint, time.monotonic()):
+                continue
+            self.probe_requests += 1
+            if self._call(endpoint, PROBE_TEXT, self.probe_timeout):
+                logger.info(f"TTS API端点探测成功: {endpoint[0]}，参数格式: {endpoint[1]}")
+                self._endpoint = endpoint
+                return endpoint
+            self._mark_failed(endpoint)
+
+        logger.error(f"所有TTS API组合探测失败，请检查TTS API配置: 基础URL={self.base_urls}, 模型={self.model}")
+        self._endpoint = None
+        return None
+
+    def _ensure_endpoint(self) -> Optional[Tuple[str, str]]:
+        """获取可用组合，必要时等待或发起探测"""
+        endpoint = self._endpoint
+        if endpoint and not self._is_failed(endpoint, time.monotonic()):
+            return endpoint
+
+        # 探测进行中，最多等待probe_wait秒
+        if not self._probe_done.is_set():
+            self._probe_done.wait(self.probe_wait)
+            endpoint = self._endpoint
+            if endpoint and not self._is_failed(endpoint, time.monotonic()):
+                return endpoint
+            return None
+
+        # 从未探测过，或上次探测全部失败且失败缓存已过期，则同步探测一次
+        now = time.monotonic()
+        if self._last_probe_at is None or now - self._last_probe_at >= self.failure_ttl:
+            return self.probe()
+        return None
+
+    def available(self) -> bool:
+        """
+        现在调用synthesize是否会尝试请求API
+
+        上次探测全部失败（或缓存的组合已失败）且未到重新探测的时间时为False，此时synthesize直接返回None
+        """
+        now = time.monotonic()
+        endpoint = self._endpoint
+        if endpoint and not self._is_failed(endpoint, now):
+            return True
+        if not self._probe_done.is_set():
+            return True
+        return self._last_probe_at is None or now - self._last_probe_at >= self.failure_ttl
+
+    def synthesize(self, text: str) -> Optional[bytes]:
+        """
+        使用缓存的组合合成语音
+
+        参数:
+            text: 要合成的文本
+
+        返回:
+            音频字节数据，失败时返回None
+        """
+        endpoint = self._ensure_endpoint()
+        if not endpoint:
+            return None
+
+        self.calls += 1
+        for route in self._routes(endpoint):
+            audio = self._call(route, text, self.request_timeout, track=True)
+            if audio:
+                return audio
+
+        # 缓存的组合开始失败：记入失败缓存并在后台重新探测
+        self.call_failures += 1
+        self._mark_failed(endpoint)
+        logger.warning(f"缓存的TTS API端点调用失败，后台重新探测: {endpoint[0]}")
+        self.start_background_probe()
+        return None
+
+    def status(self) -> Dict[str, Any]:
+        """获取端点发现状态"""
+        now = time.monotonic()
+        return {
+            "endpoint": {"url": self._endpoint[0], "schema": self._endpoint[1]} if self._endpoint else None,
+            "probing": not self._probe_done.is_set(),
+            "probes": self.probes,
+            "probe_requests": self.probe_requests,
+            "calls": self.calls,
+            "call_failures": self.call_failures,
+            "failed_candidates": [
+                {"url": url, "schema": schema, "expires_in": round(self.failure_ttl - (now - failed_at), 1)}
+                for (url, schema), failed_at in list(self._failures.items())
+                if now - failed_at < self.failure_ttl
+            ]
+        }
@@ -0,0 +1,150 @@
+"""
+语音回复流水线
+把LLM的流式输出、分句和TTS重叠执行：
+- LLM增量文本一到就转发，同时送入分句器
+- 每凑齐一句立即开始合成，后面的句子仍在生成中
+- 合成好的音频按句子顺序推送
+
+首个音频的等待时间从"整条流水线"缩短到大约"生成并合成一句"
+"""
+
+import asyncio
+import time
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, Any, Optional
+
+from speech.sentence_splitter import SentenceSplitter
+
+logger = logging.getLogger("ai_chat_service.speech.voice_pipeline")
+
+# 合成函数：输入一句文本，返回音频字节数据
+SynthesizeFunc = Callable[[str], Awaitable[bytes]]
+
+# 结束标记
+_END = object()
+
+
+class VoiceReplyPipeline:
+    """LLM → 分句 → TTS 重叠流水线"""
+
+    def __init__(self, synthesize: SynthesizeFunc, max_parallel: int = 2, splitter: Optional[SentenceSplitter] = None):
+        """
+        初始化流水线
+
+        参数:
+            synthesize: 异步合成函数
+            max_parallel: 同时合成的句子数
+            splitter: 分句器，默认使用SentenceSplitter
+        """
+        self.synthesize = synthesize
+        self.max_parallel = max(1, max_parallel)
+        self.splitter = splitter or SentenceSplitter()
+
+        self.started_at = time.perf_counter()
+        self.first_delta_at: Optional[float] = None
+        self.first_audio_at: Optional[float] = None
+        self.reply = ""
+        self.sentences = 0
+        self.syntheses_cancelled = 0
+
+    async def run(self, deltas: AsyncIterator[str]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        执行流水线
+
+        参数:
+            deltas: LLM增量文本
+
+        返回:
+            事件流：
+            {"type": "delta", "content": ...}
+            {"type": "sentence", "index": ..., "text": ...}
+            {"type": "audio", "index": ..., "audio": bytes}
+            {"type": "audio_error", "index": ..., "detail": ...}
+        """
+        events: asyncio.Queue = asyncio.Queue()
+        tasks: asyncio.Queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(self.max_parallel)
+
+        async def synthesize_one(text: str) -> bytes:
+            async with semaphore:
+                return await self.synthesize(text)
+
+        def schedule(text: str):
+            index = self.sentences
+            self.sentences += 1
+            events.put_nowait({"type": "sentence", "index": index, "text": text})
+            tasks.put_nowait((index, asyncio.ensure_future(synthesize_one(text))))
+
+        async def produce():
+            try:
+                async for delta in deltas:
+                    if not delta:
+                        continue
+                    if self.first_delta_at is None:
+                        self.first_delta_at = time.perf_counter()
+                    self.reply += delta
+                    events.put_nowait({"type": "delta", "content": delta})
+                    for sentence in self.splitter.feed(delta):
+                        schedule(sentence)
+                last = self.splitter.flush()
+                if last:
+                    schedule(last)
+            finally:
+                tasks.put_nowait(_END)
+                aclose = getattr(deltas, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+
+        async def deliver():
+            # 按句子顺序等待合成结果，保证音频顺序与文本一致
+            while True:
+                item = await tasks.get()
+                if item is _END:
+                    break
+                index, task = item
+                try:
+                    audio = await task
+                except Exception as e:
+                    logger.warning(f"第{index}句合成失败: {e}")
+                    events.put_nowait({"type": "audio_error", "index": index, "detail": str(e)})
+                    continue
+                if self.first_audio_at is None:
+                    self.first_audio_at = time.perf_counter()
+                events.put_nowait({"type": "audio", "index": index, "audio": audio})
+
+        producer = asyncio.ensure_future(produce())
+        deliverer = asyncio.ensure_future(deliver())
+        finished = asyncio.ensure_future(asyncio.gather(producer, deliverer))
+        finished.add_done_callback(lambda _: events.put_nowait(_END))
+
+        try:
+            while True:
+                event = await events.get()
+                if event is _END:
+                    break
+                yield event
+            # 抛出生产或合成过程中的异常
+            await finished
+        finally:
+            # 客户端断开或出错时，取消仍在进行的生成和合成
+            for task in (producer, deliverer):
+                if not task.done():
+                    task.cancel()
+            while not tasks.empty():
+                item = tasks.get_nowait()
+                if item is not _END and item[1].cancel():
+                    self.syntheses_cancelled += 1
+            try:
+                await finished
+            except BaseException:
+                pass
+
+    def timing(self) -> Dict[str, Optional[float]]:
+        """流水线各阶段耗时（毫秒）"""
+        def since_start(at):
+            return round((at - self.started_at) * 1000, 1) if at else None
+        return {
+            "first_delta_ms": since_start(self.first_delta_at),
+            "first_audio_ms": since_start(self.first_audio_at),
+            "total_ms": since_start(time.perf_counter())
+        }
@@ -0,0 +1 @@
+# 存储模块初始化
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+角色目录
+按ID和名称索引全部角色，查找为O(1)：
+- 每个角色的CharacterContext在加入目录时构建一次，为不可变对象，所有请求共用
+- 目录每次变化（新增、修改、删除）版本号加一，调用方可据此判断缓存的派生数据是否过期
+- 角色数据按整体替换，不在原对象上修改，已取出的角色和列表快照不受后续修改影响
+- 名称和描述的搜索索引随目录增量更新（见 storage.character_search）
+"""
+
+import threading
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pydantic import ConfigDict
+
+from api.models import CharacterContext
+from storage.character_search import CharacterSearchIndex
+
+logger = logging.getLogger("ai_chat_service.storage.character_registry")
+
+# 内置角色（实际应用中应该从数据库获取）
+DEFAULT_CHARACTERS = [
+    {"id": 1, "name": "哈利波特", "avatar": "🧙‍♂️", "description": "魔法世界的传奇巫师", "category": "fiction"},
+    {"id": 2, "name": "苏格拉底", "avatar": "👨‍🏫", "description": "古希腊著名哲学家", "category": "historical"},
+    {"id": 3, "name": "爱因斯坦", "avatar": "🧠", "description": "著名物理学家，相对论提出者", "category": "historical"},
+    {"id": 4, "name": "林黛玉", "avatar": "💃", "description": "《红楼梦》中的经典人物", "category": "fiction"},
+    {"id": 5, "name": "莎士比亚", "avatar": "📝", "description": "英国著名剧作家和诗人", "category": "historical"},
+    {"id": 6, "name": "哪吒", "avatar": "👶", "description": "中国古代神话中的神童", "category": "mythology"},
+    {"id": 7, "name": "牛顿", "avatar": "🍎", "description": "万有引力定律的发现者", "category": "historical"},
+    {"id": 8, "name": "孙悟空", "avatar": "🐒", "description": "《西游记》中的齐天大圣", "category": "mythology"},
+]
+
+
+class FrozenCharacterContext(CharacterContext):
+    """目录中角色的上下文（不可变，可在请求间共用）"""
+
+    model_config = ConfigDict(frozen=True)
+
+
+class CharacterRegistry:
+    """按ID和名称索引的角色目录"""
+
+    def __init__(self, characters: Optional[List[Dict[str, Any]]] = None):
+        """
+        初始化角色目录
+
+        参数:
+            characters: 初始角色列表，每个角色为含id、name、avatar、description、category的字典
+        """
+        self._by_id: Dict[int, Dict[str, Any]] = {}
+        # 同名角色按加入顺序排列，按名称查找时返回最早加入的一个
+        self._by_name: Dict[str, List[int]] = {}
+        self._contexts: Dict[int, FrozenCharacterContext] = {}
+        self._search_index = CharacterSearchIndex()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+        # 角色列表快照，目录变化后下次访问时重建
+        self._snapshot: Optional[List[Dict[str, Any]]] = None
+        self.version = 0
+
+        for character in characters or []:
+            self.add(character)
+
+    def add(self, character: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        新增或替换角色
+
+        参数:
+            character: 角色数据，没有id时自动分配；id已存在时替换原角色
+
+        返回:
+            加入目录的角色数据（副本）
+        """
+        context = FrozenCharacterContext(
+            name=character["name"],
+            description=character.get("description", ""),
+            avatar=character.get("avatar", "🎭"),
+            category=character.get("category", "")
+        )
+        with self._lock:
+            character_id = character.get("id")
+            if character_id is None:
+                character_id = self._next_id
+            entry = {
+                "id": character_id,
+                "name": context.name,
+                "avatar": context.avatar,
+                "description": context.description,
+                "category": context.category
+            }
+            if character_id in self._by_id:
+                self._unindex(self._by_id[character_id])
+            self._by_id[character_id] = entry
+            self._by_name.setdefault(entry["name"], []).append(character_id)
+            self._contexts[character_id] = context
+            self._search_index.add(entry)
+            self._next_id = max(self._next_id, character_id + 1)
+            self._changed()
+        return entry
+
+    def remove(self, character_id: int) -> bool:
+        """
+        删除角色
+
+        参数:
+            character_id: 角色ID
+
+        返回:
+            角色是否存在
+        """
+        with self._lock:
+            entry = self._by_id.pop(character_id, None)
+            if entry is None:
+                return False
+            self._unindex(entry)
+            del self._contexts[character_id]
+            self._search_index.remove(character_id)
+            self._changed()
+        return True
+
+    def _unindex(self, entry: Dict[str, Any]):
+        """从名称索引中移除角色（需持有锁）"""
+        ids = self._by_name[entry["name"]]
+        ids.remove(entry["id"])
+        if not ids:
+            del self._by_name[entry["name"]]
+
+    def _changed(self):
+        """目录已变化（需持有锁）"""
+        self.version += 1
+        self._snapshot = None
+
+    def get(self, character_id: int) -> Optional[Dict[str, Any]]:
+        """按ID获取角色数据，不存在时返回None"""
+        return self._by_id.get(character_id)
+
+    def get_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        """按名称获取角色数据（同名时返回最早加入的），不存在时返回None"""
+        ids = self._by_name.get(name)
+        return self._by_id.get(ids[0]) if ids else None
+
+    def context(self, character_id: int) -> Optional[CharacterContext]:
+        """获取角色预先构建的上下文，不存在时返回None"""
+        return self._contexts.get(character_id)
+
+    def all(self) -> List[Dict[str, Any]]:
+        """按ID顺序返回全部角色（目录未变化时复用同一个列表，调用方不应修改）"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                snapshot = [self._by_id[character_id] for character_id in sorted(self._by_id)]
+                self._snapshot = snapshot
+        return snapshot
+
+    def search(
+        self,
+        query: Optional[str],
+        categories: Optional[Iterable[str]] = None,
+        limit: int = 50,
+        offset: int = 0
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        按名称和描述搜索角色
+
+        参数:
+            query: 关键词（空格分隔的多个词需全部匹配），为空时按ID顺序返回
+            categories: 只返回这些分类的角色，None为不限
+            limit: 最多返回条数
+            offset: 跳过的条数
+
+        返回:
+            (按相关度排序的角色列表, 匹配的角色总数)
+        """
+        if not (query or "").strip() and categories is None:
+            snapshot = self.all()
+            return snapshot[offset:offset + limit], len(snapshot)
+        with self._lock:
+            ids, total = self._search_index.search(query or "", categories, limit, offset)
+            return [self._by_id[character_id] for character_id in ids], total
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __contains__(self, character_id: int) -> bool:
+        return character_id in self._by_id
+
+    def stats(self) -> Dict[str, Any]:
+        """获取目录统计"""
+        with self._lock:
+            return {
+                "characters": len(self._by_id),
+                "names": len(self._by_name),
+                "version": self.version,
+                "search": self._search_index.stats()
+            }
+
+
+# 创建全局实例
+character_registry = CharacterRegistry(DEFAULT_CHARACTERS)
@@ -0,0 +1,198 @@
+"""
+角色搜索索引
+对角色名称和描述建立内存中的n-gram倒排索引，中文和拉丁文字统一按字符切分：
+- 文本先做NFKC规范化并转为小写（全角字母、大小写不影响匹配）
+- 每个角色索引其文本中所有的单字和相邻两字，关键词为两个字符以上时取其中的两字组合，
+  从倒排表最短的开始求交集得到候选角色，再逐个确认关键词确实是名称或描述的子串，
+  结果与逐个扫描做子串匹配一致，但只检查包含全部两字组合的少量角色
+- 关键词可用空格分隔为多个词，每个词都要匹配
+- 按匹配位置排序：名称完全相同 > 名称以关键词开头 > 名称包含关键词 > 仅描述包含，同分时名称较短的在前
+- 角色新增、修改、删除时只更新该角色的倒排表
+"""
+
+import heapq
+import unicodedata
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger("ai_chat_service.storage.character_search")
+
+# 各匹配位置的得分
+_SCORE_NAME_EXACT = 100
+_SCORE_NAME_PREFIX = 50
+_SCORE_NAME = 30
+_SCORE_DESCRIPTION = 10
+
+
+def normalize(text: str) -> str:
+    """规范化文本：NFKC（全角转半角）后转为小写"""
+    return unicodedata.normalize("NFKC", text or "").casefold()
+
+
+def _grams(text: str) -> Set[str]:
+    """文本中所有的单字和相邻两字"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    grams.discard(" ")
+    return grams
+
+
+def _query_grams(term: str) -> Set[str]:
+    """查询一个词时需要命中的倒排表：单字词用单字，否则用其中的全部两字组合"""
+    if len(term) == 1:
+        return {term}
+    return {term[i:i + 2] for i in range(len(term) - 1)}
+
+
+class CharacterSearchIndex:
+    """角色名称和描述的n-gram倒排索引"""
+
+    def __init__(self):
+        self._postings: Dict[str, Set[int]] = {}
+        self._by_category: Dict[str, Set[int]] = {}
+        # 角色ID -> (规范化名称, 规范化描述, 分类, 该角色的全部gram)
+        self._documents: Dict[int, Tuple[str, str, str, Set[str]]] = {}
+
+        self.queries = 0
+        self.candidates = 0
+
+    def add(self, character: Dict[str, Any]):
+        """
+        加入或更新一个角色
+
+        参数:
+            character: 角色数据（含id、name、description、category）
+        """
+        character_id = character["id"]
+        if character_id in self._documents:
+            self.remove(character_id)
+        name = normalize(character.get("name", ""))
+        description = normalize(character.get("description", ""))
+        category = character.get("category", "")
+        grams = _grams(name) | _grams(description)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(character_id)
+        self._by_category.setdefault(category, set()).add(character_id)
+        self._documents[character_id] = (name, description, category, grams)
+
+    def remove(self, character_id: int):
+        """
+        移除一个角色
+
+        参数:
+            character_id: 角色ID
+        """
+        document = self._documents.pop(character_id, None)
+        if document is None:
+            return
+        _, _, category, grams = document
+        for gram in grams:
+            postings = self._postings[gram]
+            postings.discard(character_id)
+            if not postings:
+                del self._postings[gram]
+        members = self._by_category[category]
+        members.discard(character_id)
+        if not members:
+            del self._by_category[category]
+
+    def search(
+        self,
+        query: str,
+        categories: Optional[Iterable[str]] = None,
+        limit: int = 50,
+        offset: int = 0
+    ) -> Tuple[List[int], int]:
+        """
+        搜索角色
+
+        参数:
+            query: 关键词（空格分隔的多个词需全部匹配），为空时按ID顺序返回全部角色
+            categories: 只返回这些分类的角色，None为不限
+            limit: 最多返回条数
+            offset: 跳过的条数
+
+        返回:
+            (按相关度排序的角色ID列表, 匹配的角色总数)
+        """
+        self.queries += 1
+        terms = normalize(query).split()
+
+        # 分类过滤：多个分类时不合并集合，逐个检查候选角色是否属于其中之一
+        allowed = None
+        if categories is not None:
+            allowed = [self._by_category[category] for category in set(categories) if category in self._by_category]
+
+        if not terms:
+            if allowed is None:
+                matched = self._documents.keys()
+            else:
+                matched = set().union(*allowed)
+            return sorted(matched)[offset:offset + limit], len(matched)
+
+        candidates = self._candidates(terms)
+        if allowed is not None:
+            if len(allowed) == 1:
+                candidates &= allowed[0]
+            else:
+                candidates = {i for i in candidates if any(i in members for members in allowed)}
+        self.candidates += len(candidates)
+
+        documents = self._documents
+        score = self._score
+        ranked = []
+        for character_id in candidates:
+            document = documents[character_id]
+            total = score(document[0], document[1], terms)
+            if total:
+                ranked.append((-total, len(document[0]), character_id))
+        top = heapq.nsmallest(offset + limit, ranked)
+        return [character_id for _, _, character_id in top[offset:]], len(ranked)
+
+    def _candidates(self, terms: List[str]) -> Set[int]:
+        """求全部查询gram倒排表的交集（从最短的开始，为空时提前结束）"""
+        grams = set()
+        for term in terms:
+            grams |= _query_grams(term)
+        postings = []
+        for gram in grams:
+            ids = self._postings.get(gram)
+            if not ids:
+                return set()
+            postings.append(ids)
+        postings.sort(key=len)
+
+        candidates = set(postings[0])
+        for ids in postings[1:]:
+            candidates &= ids
+            if not candidates:
+                break
+        return candidates
+
+    @staticmethod
+    def _score(name: str, description: str, terms: List[str]) -> int:
+        """按匹配位置计算得分，有词不匹配时为0"""
+        total = 0
+        for term in terms:
+            if name == term:
+                total += _SCORE_NAME_EXACT
+            elif name.startswith(term):
+                total += _SCORE_NAME_PREFIX
+            elif term in name:
+                total += _SCORE_NAME
+            elif term in description:
+                total += _SCORE_DESCRIPTION
+            else:
+                return 0
+        return total
+
+    def stats(self) -> Dict[str, Any]:
+        """获取索引统计"""
+        return {
+            "documents": len(self._documents),
+            "grams": len(self._postings),
+            "postings": sum(len(ids) for ids in self._postings.values()),
+            "categories": len(self._by_category),
+            "queries": self.queries,
+            "avg_candidates": round(self.candidates / self.queries, 1) if self.queries else 0
+        }
@@ -0,0 +1,438 @@
+"""
+会话存储
+服务端按 (用户/会话, 角色ID) 保存对话，客户端每轮只需上传新消息：
+- 每个会话的消息只追加写入，序号递增
+- 按偏移量分页读取历史
+- 生成回复时由服务端取最近的若干条消息重建上下文
+会话数有上限，超出时淘汰最久未使用的会话；单个会话在内存中只保留最近的消息。
+启用SQLite持久化时，新会话和消息同时写入数据库，被淘汰或重启后丢失的会话在下次访问时从数据库加载，
+早于内存中最早一条的历史消息也从数据库分页读取。
+多个工作进程共享状态后端时，会话更新后递增版本号，其他进程发现版本变化时从数据库重新加载。
+路由使用a开头的异步方法：需要读取数据库或状态后端时在线程中执行，不阻塞事件循环
+"""
+
+import asyncio
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import env_config
+from storage.sqlite_store import SQLiteStore, sqlite_store
+from storage.state_backend import StateBackend, state_backend
+
+logger = logging.getLogger("ai_chat_service.storage.conversation_store")
+
+
+class ConversationTurn:
+    """一条会话消息"""
+
+    __slots__ = ("seq", "role", "content", "timestamp")
+
+    def __init__(self, seq: int, role: str, content: str, timestamp: Optional[float] = None):
+        """
+        初始化消息
+
+        参数:
+            seq: 消息在会话中的序号（从0开始递增）
+            role: user 或 assistant
+            content: 消息文本
+            timestamp: Unix时间戳，默认为当前时间
+        """
+        self.seq = seq
+        self.role = role
+        self.content = content
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def to_message(self) -> Dict[str, str]:
+        """转换为Chat Completions格式的消息"""
+        return {"role": self.role, "content": self.content}
+
+
+class Conversation:
+    """一个会话：属于某个用户/会话与某个角色"""
+
+    __slots__ = ("id", "owner", "character_id", "created_at", "updated_at", "_turns", "_base_seq", "max_turns", "lock", "version")
+
+    def __init__(self, conversation_id: str, owner: str, character_id: Optional[int], max_turns: int = 1000):
+        """
+        初始化会话
+
+        参数:
+            conversation_id: 会话ID
+            owner: 用户或客户端会话标识
+            character_id: 角色ID
+            max_turns: 内存中最多保留的消息数
+        """
+        self.id = conversation_id
+        self.owner = owner
+        self.character_id = character_id
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.max_turns = max(2, max_turns)
+        self.lock = threading.Lock()
+        self._turns: List[ConversationTurn] = []
+        # _turns[0]的序号（较早的消息被裁掉后大于0）
+        self._base_seq = 0
+        # 多进程共享时本进程载入的版本号
+        self.version = 0
+
+    @property
+    def total(self) -> int:
+        """会话的消息总数（包括已不在内存中的较早消息）"""
+        return self._base_seq + len(self._turns)
+
+    def append(self, role: str, content: str, timestamp: Optional[float] = None) -> ConversationTurn:
+        """
+        追加一条消息
+
+        参数:
+            role: user 或 assistant
+            content: 消息文本
+            timestamp: Unix时间戳，默认为当前时间
+
+        返回:
+            追加的消息
+        """
+        with self.lock:
+            turn = ConversationTurn(self.total, role, content, timestamp)
+            self._turns.append(turn)
+            self.updated_at = turn.timestamp
+            # 超出上限时多裁掉上限的10%，摊销列表搬移的开销
+            overflow = len(self._turns) - self.max_turns
+            if overflow > 0:
+                drop = min(len(self._turns) - 1, overflow + self.max_turns // 10)
+                del self._turns[:drop]
+                self._base_seq += drop
+            return turn
+
+    def _restore(self, turns: List[ConversationTurn], total: int):
+        """载入从数据库读取的最近消息，total为会话的消息总数"""
+        with self.lock:
+            self._turns = list(turns)
+            self._base_seq = max(0, total - len(self._turns))
+
+    def page(self, offset: int = 0, limit: int = 50) -> List[ConversationTurn]:
+        """
+        按序号分页读取消息（从旧到新）
+
+        参数:
+            offset: 起始序号
+            limit: 最多返回条数
+
+        返回:
+            消息列表
+        """
+        with self.lock:
+            start = max(0, offset - self._base_seq)
+            return self._turns[start:start + max(0, limit)]
+
+    def recent(self, n: int) -> List[Dict[str, str]]:
+        """
+        获取最近的n条消息，用于重建对话上下文
+
+        参数:
+            n: 条数
+
+        返回:
+            Chat Completions格式的消息列表（从旧到新）
+        """
+        with self.lock:
+            turns = self._turns[-n:] if n > 0 else []
+            return [turn.to_message() for turn in turns]
+
+
+class ConversationStore:
+    """内存中的会话存储"""
+
+    def __init__(
+        self,
+        max_conversations: int = 10000,
+        max_turns: int = 1000,
+        store: Optional[SQLiteStore] = None,
+        backend: Optional[StateBackend] = None
+    ):
+        """
+        初始化会话存储
+
+        参数:
+            max_conversations: 内存中最多保留的会话数
+            max_turns: 每个会话在内存中最多保留的消息数
+            store: SQLite持久化存储，None为只保存在内存中
+            backend: 状态后端，为多进程共享的后端且启用了持久化时在进程间同步会话
+        """
+        self.max_conversations = max(1, max_conversations)
+        self.max_turns = max_turns
+        self.store = store
+        self.backend = backend if store is not None and backend is not None and backend.shared else None
+
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._ids_by_key: Dict[Tuple[str, Optional[int]], str] = {}
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.appended = 0
+        self.evictions = 0
+        self.loaded = 0
+        self.reloads = 0
+
+    def get(self, conversation_id: str) -> Optional[Conversation]:
+        """按ID获取会话（内存中没有时从数据库加载），不存在时返回None"""
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is not None:
+                self._conversations.move_to_end(conversation_id)
+        if conversation is not None:
+            if not self._is_stale(conversation):
+                return conversation
+            # 其他工作进程更新了会话，丢弃本进程的副本重新加载
+            self._discard(conversation)
+        if self.store is None:
+            return None
+        version = self.backend.version("conversation", conversation_id) if self.backend is not None else 0
+        row = self.store.load_conversation(conversation_id)
+        if not row:
+            return None
+        conversation = self._from_row(row)
+        conversation.version = version
+        return self._adopt(conversation)
+
+    async def aget(self, conversation_id: str) -> Optional[Conversation]:
+        """get的异步版本：内存中命中且不需要检查其他进程的更新时直接返回，否则在线程中执行"""
+        if self.backend is None:
+            with self._lock:
+                conversation = self._conversations.get(conversation_id)
+                if conversation is not None:
+                    self._conversations.move_to_end(conversation_id)
+                    return conversation
+            if self.store is None:
+                return None
+        return await asyncio.to_thread(self.get, conversation_id)
+
+    def _cached(self, owner: str, character_id: Optional[int]) -> Optional[Conversation]:
+        """单进程部署时直接从内存中取用户与角色的会话，需要访问数据库或状态后端时返回None"""
+        if self.backend is not None:
+            return None
+        with self._lock:
+            conversation_id = self._ids_by_key.get((owner, character_id))
+            if conversation_id is None:
+                return None
+            self._conversations.move_to_end(conversation_id)
+            return self._conversations[conversation_id]
+
+    def _is_stale(self, conversation: Conversation) -> bool:
+        """多进程共享时，检查会话是否已被其他工作进程更新"""
+        if self.backend is None:
+            return False
+        return self.backend.version("conversation", conversation.id) != conversation.version
+
+    def _discard(self, conversation: Conversation):
+        """从内存中移除会话（数据库中的数据不受影响）"""
+        with self._lock:
+            if self._conversations.get(conversation.id) is conversation:
+                del self._conversations[conversation.id]
+                if self._ids_by_key.get((conversation.owner, conversation.character_id)) == conversation.id:
+                    del self._ids_by_key[(conversation.owner, conversation.character_id)]
+                self.reloads += 1
+
+    def _publish(self, conversation: Conversation):
+        """写入提交后递增会话版本号，通知其他工作进程"""
+        if self.backend is None:
+            return
+        backend = self.backend
+
+        def bump():
+            conversation.version = backend.bump("conversation", conversation.id)
+
+        self.store.after_commit(bump)
+
+    def find(self, owner: str, character_id: Optional[int]) -> Optional[Conversation]:
+        """查找用户与角色的会话（内存中没有时从数据库加载），不存在时返回None"""
+        with self._lock:
+            conversation_id = self._ids_by_key.get((owner, character_id))
+        if conversation_id is not None:
+            conversation = self.get(conversation_id)
+            if conversation is not None:
+                return conversation
+        if self.store is None:
+            return None
+        conversation_id = self.store.find_conversation(owner, character_id)
+        return self.get(conversation_id) if conversation_id else None
+
+    async def afind(self, owner: str, character_id: Optional[int]) -> Optional[Conversation]:
+        """find的异步版本"""
+        conversation = self._cached(owner, character_id)
+        if conversation is not None or self.store is None:
+            return conversation
+        return await asyncio.to_thread(self.find, owner, character_id)
+
+    def _from_row(self, row: tuple) -> Conversation:
+        """由数据库中的会话记录和最近的消息重建会话"""
+        conversation_id, owner, character_id, created_at, total = row
+        conversation = Conversation(conversation_id, owner, character_id, self.max_turns)
+        conversation.created_at = created_at
+        turns = [ConversationTurn(*turn) for turn in self.store.last_turns(conversation_id, self.max_turns)]
+        conversation.updated_at = turns[-1].timestamp if turns else created_at
+        conversation._restore(turns, total)
+        return conversation
+
+    def _adopt(self, conversation: Conversation) -> Conversation:
+        """把从数据库加载的会话放入内存（并发加载同一会话时保留先放入的）"""
+        with self._lock:
+            existing = self._conversations.get(conversation.id)
+            if existing is not None:
+                self._conversations.move_to_end(conversation.id)
+                return existing
+            self._insert(conversation)
+            self.loaded += 1
+            return conversation
+
+    def _insert(self, conversation: Conversation):
+        """放入会话并淘汰超出上限的会话（调用方持有锁）"""
+        self._conversations[conversation.id] = conversation
+        self._ids_by_key[(conversation.owner, conversation.character_id)] = conversation.id
+        while len(self._conversations) > self.max_conversations:
+            _, evicted = self._conversations.popitem(last=False)
+            if self._ids_by_key.get((evicted.owner, evicted.character_id)) == evicted.id:
+                del self._ids_by_key[(evicted.owner, evicted.character_id)]
+            self.evictions += 1
+
+    def get_or_create(self, owner: str, character_id: Optional[int]) -> Conversation:
+        """
+        获取用户与角色的会话，不存在时创建
+
+        参数:
+            owner: 用户或客户端会话标识
+            character_id: 角色ID
+
+        返回:
+            会话
+        """
+        conversation = self.find(owner, character_id)
+        if conversation is not None:
+            return conversation
+
+        with self._lock:
+            # 加锁后再检查一次，避免并发请求各自创建会话
+            conversation_id = self._ids_by_key.get((owner, character_id))
+            if conversation_id is not None:
+                self._conversations.move_to_end(conversation_id)
+                return self._conversations[conversation_id]
+
+            conversation = Conversation(uuid.uuid4().hex, owner, character_id, self.max_turns)
+            self._insert(conversation)
+            self.created += 1
+        if self.store is not None:
+            self.store.save_conversation(conversation.id, owner, character_id, conversation.created_at)
+            self._publish(conversation)
+        return conversation
+
+    async def aget_or_create(self, owner: str, character_id: Optional[int]) -> Conversation:
+        """get_or_create的异步版本"""
+        conversation = self._cached(owner, character_id)
+        if conversation is not None:
+            return conversation
+        if self.store is None:
+            return self.get_or_create(owner, character_id)
+        return await asyncio.to_thread(self.get_or_create, owner, character_id)
+
+    def append(self, conversation: Conversation, role: str, content: str) -> ConversationTurn:
+        """
+        向会话追加一条消息
+
+        参数:
+            conversation: 会话
+            role: user 或 assistant
+            content: 消息文本
+
+        返回:
+            追加的消息
+        """
+        turn = conversation.append(role, content)
+        if self.store is not None:
+            self.store.append_turn(conversation.id, turn.seq, turn.role, turn.content, turn.timestamp)
+            self._publish(conversation)
+        with self._lock:
+            self.appended += 1
+        return turn
+
+    def page(self, conversation: Conversation, offset: int = 0, limit: int = 50) -> List[ConversationTurn]:
+        """
+        按序号分页读取会话消息（从旧到新），早于内存中最早一条的消息从数据库读取
+
+        参数:
+            conversation: 会话
+            offset: 起始序号
+            limit: 最多返回条数
+
+        返回:
+            消息列表
+        """
+        if self.store is not None and offset < conversation._base_seq:
+            rows = self.store.load_turns(conversation.id, offset, limit)
+            return [ConversationTurn(*row) for row in rows]
+        return conversation.page(offset, limit)
+
+    async def apage(self, conversation: Conversation, offset: int = 0, limit: int = 50) -> List[ConversationTurn]:
+        """page的异步版本：只有需要从数据库读取较早的消息时才在线程中执行"""
+        if self.store is not None and offset < conversation._base_seq:
+            return await asyncio.to_thread(self.page, conversation, offset, limit)
+        return conversation.page(offset, limit)
+
+    def append_exchange(self, conversation: Conversation, user_text: str, reply: str):
+        """追加一轮完整的对话（用户消息和角色回复）"""
+        self.append(conversation, "user", user_text)
+        self.append(conversation, "assistant", reply)
+
+    def delete(self, owner: str, character_id: Optional[int]) -> bool:
+        """
+        删除用户与角色的会话
+
+        返回:
+            是否删除了会话
+        """
+        with self._lock:
+            conversation_id = self._ids_by_key.pop((owner, character_id), None)
+            if conversation_id is not None:
+                self._conversations.pop(conversation_id, None)
+        if self.store is not None:
+            if conversation_id is None:
+                conversation_id = self.store.find_conversation(owner, character_id)
+            if conversation_id is not None:
+                self.store.delete_conversation(conversation_id, owner, character_id)
+                if self.backend is not None:
+                    backend = self.backend
+                    self.store.after_commit(lambda: backend.bump("conversation", conversation_id))
+        return conversation_id is not None
+
+    async def adelete(self, owner: str, character_id: Optional[int]) -> bool:
+        """delete的异步版本（内存中没有该会话时需要查询数据库）"""
+        if self.store is None:
+            return self.delete(owner, character_id)
+        return await asyncio.to_thread(self.delete, owner, character_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取会话存储统计"""
+        with self._lock:
+            return {
+                "conversations": len(self._conversations),
+                "max_conversations": self.max_conversations,
+                "persistent": self.store is not None,
+                "shared": self.backend is not None,
+                "created": self.created,
+                "appended": self.appended,
+                "evictions": self.evictions,
+                "loaded": self.loaded,
+                "reloads": self.reloads
+            }
+
+
+# 创建全局实例
+conversation_store = ConversationStore(
+    max_conversations=env_config.CONVERSATION_MAX_CONVERSATIONS,
+    max_turns=env_config.CONVERSATION_MAX_TURNS,
+    store=sqlite_store,
+    backend=state_backend
+)
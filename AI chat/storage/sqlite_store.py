@@ -0,0 +1,501 @@
+"""
+SQLite持久化
+把Agent状态（记忆、目标、情感状态、摘要）和服务端会话保存到本地SQLite数据库，
+重启或发布后可以恢复：
+- 数据库使用WAL模式，读写互不阻塞
+- 写入先进入队列，由后台线程成批在一个事务中提交（write-behind），
+  请求路径只入队，不等待磁盘；整批提交失败时按语句组重试，只丢弃失败的写操作
+- 读取用于内存中没有的Agent/会话的延迟加载；该对象仍有未提交的写入时先等待其落盘，
+  读取会阻塞调用线程，请求路径在线程池中调用（见 AgentManager.aget_agent、ConversationStore.aget）
+"""
+
+import asyncio
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from config import env_config
+
+logger = logging.getLogger("ai_chat_service.storage.sqlite_store")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS agent_state (
+    agent_key TEXT PRIMARY KEY,
+    character TEXT NOT NULL,
+    goals TEXT NOT NULL,
+    emotional_state TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    summary_seq INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS agent_memory (
+    agent_key TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    user_input TEXT NOT NULL,
+    agent_response TEXT NOT NULL,
+    PRIMARY KEY (agent_key, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    character_id INTEGER,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_owner ON conversations (owner, character_id);
+CREATE TABLE IF NOT EXISTS conversation_turns (
+    conversation_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    PRIMARY KEY (conversation_id, seq)
+) WITHOUT ROWID;
+"""
+
+# 队列中的写操作：(SQL, 参数, 所属对象的键)；SQL为None时参数为提交后执行的回调
+_Write = Tuple[Optional[str], Any, Tuple[Hashable, ...]]
+
+
+class SQLiteStore:
+    """WAL模式的SQLite存储，写入由后台线程成批提交"""
+
+    def __init__(self, path: str, batch_size: int = 1000, flush_interval: float = 0.05):
+        """
+        初始化存储并启动写入线程
+
+        参数:
+            path: 数据库文件路径（所在目录不存在时自动创建）
+            batch_size: 每个事务最多提交的写操作数
+            flush_interval: 队列为空时写入线程的等待时间（秒）
+        """
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        # 写连接在初始化后只由写入线程使用；读连接在请求路径上使用，由锁保护
+        self._writer = self._connect()
+        self._writer.executescript(_SCHEMA)
+        self._writer.commit()
+        self._reader = self._connect()
+        self._read_lock = threading.Lock()
+
+        self._queue: "queue.Queue[Optional[_Write]]" = queue.Queue()
+        # 各对象尚未提交的写操作数，延迟加载前据此等待
+        self._pending: Dict[Hashable, int] = {}
+        self._pending_cond = threading.Condition()
+        self._closed = False
+
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_batch_size = 0
+        self.last_batch_ms = 0.0
+        self.reads = 0
+        self.read_waits = 0
+
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"SQLite持久化已启用: {path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # WAL模式下NORMAL只在检查点时同步磁盘，提交不等待fsync
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    # ---- 写入 ----
+
+    def _enqueue(self, sql: str, params: Sequence[Any], *keys: Hashable):
+        """把写操作放入队列（不阻塞），keys为写操作所属对象的键"""
+        if self._closed:
+            logger.warning("SQLite存储已关闭，丢弃写操作")
+            return
+        if keys:
+            with self._pending_cond:
+                for key in keys:
+                    self._pending[key] = self._pending.get(key, 0) + 1
+        self.enqueued += 1
+        self._queue.put((sql, params, keys))
+
+    def after_commit(self, callback: Callable[[], None]):
+        """
+        在此前排队的写操作全部提交后，于写入线程中执行回调
+        （如通知其他工作进程对象已更新，保证它们重新加载时能读到新数据）
+        """
+        if self._closed:
+            return
+        self._queue.put((None, callback, ()))
+
+    def _run(self):
+        """写入线程：取出队列中已有的写操作，在一个事务中提交"""
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch: List[Optional[_Write]] = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            items = [item for item in batch if item is not None]
+            if items:
+                self._commit(items)
+            for _ in batch:
+                self._queue.task_done()
+            if len(items) < len(batch):
+                # 收到关闭信号
+                return
+
+    def _commit(self, batch: List[_Write]):
+        started_at = time.perf_counter()
+        writes = [item for item in batch if item[0] is not None]
+        callbacks = [item[1] for item in batch if item[0] is None]
+        # 连续的同一语句合并为一组，用一次executemany执行
+        groups: List[Tuple[str, List[Sequence[Any]]]] = []
+        for sql, params, _ in writes:
+            if groups and groups[-1][0] == sql:
+                groups[-1][1].append(params)
+            else:
+                groups.append((sql, [params]))
+        try:
+            try:
+                with self._writer:
+                    for sql, params_list in groups:
+                        self._writer.executemany(sql, params_list)
+                written = len(writes)
+            except sqlite3.Error as e:
+                logger.warning(f"SQLite批量写入失败，按语句组重试: {str(e)}")
+                written = self._commit_groups(groups)
+            if writes:
+                self.written += written
+                self.batches += 1
+                self.last_batch_size = len(writes)
+                self.last_batch_ms = round((time.perf_counter() - started_at) * 1000, 2)
+        finally:
+            # 提交失败时也执行回调，避免等待提交的请求一直挂起
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"提交后回调执行失败: {str(e)}")
+            with self._pending_cond:
+                for _, _, keys in writes:
+                    for key in keys:
+                        remaining = self._pending.get(key, 0) - 1
+                        if remaining > 0:
+                            self._pending[key] = remaining
+                        else:
+                            self._pending.pop(key, None)
+                self._pending_cond.notify_all()
+
+    def _commit_groups(self, groups: List[Tuple[str, List[Sequence[Any]]]]) -> int:
+        """
+        整批提交失败后，按顺序逐组提交；组内仍失败时逐条提交，只丢弃失败的写操作
+
+        返回:
+            成功提交的写操作数
+        """
+        written = 0
+        for sql, params_list in groups:
+            try:
+                with self._writer:
+                    self._writer.executemany(sql, params_list)
+                written += len(params_list)
+                continue
+            except sqlite3.Error:
+                pass
+            for params in params_list:
+                try:
+                    with self._writer:
+                        self._writer.execute(sql, params)
+                    written += 1
+                except sqlite3.Error as e:
+                    self.errors += 1
+                    logger.error(f"SQLite写操作失败，已丢弃: {str(e)}")
+        return written
+
+    def flush(self):
+        """等待队列中的写操作全部提交"""
+        self._queue.join()
+
+    async def acommitted(self):
+        """
+        等待此前排队的写操作提交（不阻塞事件循环）
+
+        多个工作进程共享状态时，在返回响应前调用，保证同一用户的下一轮请求
+        落到其他进程时能读到本轮写入的数据
+        """
+        if self._closed:
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve():
+            if not future.done():
+                future.set_result(None)
+
+        self.after_commit(lambda: loop.call_soon_threadsafe(resolve))
+        await future
+
+    def close(self):
+        """提交剩余的写操作并关闭数据库"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._writer.close()
+        with self._read_lock:
+            self._reader.close()
+        logger.info("SQLite存储已关闭")
+
+    # ---- 读取 ----
+
+    def _read(self, sql: str, params: Sequence[Any], keys: Sequence[Hashable] = ()) -> List[tuple]:
+        """执行查询；keys对应的对象仍有未提交的写入时先等待其落盘"""
+        with self._pending_cond:
+            if any(self._pending.get(key) for key in keys):
+                self.read_waits += 1
+                self._pending_cond.wait_for(lambda: not any(self._pending.get(key) for key in keys), timeout=5)
+        with self._read_lock:
+            self.reads += 1
+            return self._reader.execute(sql, params).fetchall()
+
+    # ---- Agent状态 ----
+
+    def save_agent_state(
+        self,
+        agent_key: str,
+        character: str,
+        goals: List[str],
+        emotional_state: Dict[str, float],
+        summary: str,
+        summary_seq: int
+    ):
+        """保存Agent的目标、情感状态和摘要（覆盖）"""
+        self._enqueue(
+            "INSERT OR REPLACE INTO agent_state VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                agent_key,
+                character,
+                json.dumps(goals, ensure_ascii=False),
+                json.dumps(emotional_state, ensure_ascii=False),
+                summary,
+                summary_seq,
+                time.time()
+            ),
+            ("agent", agent_key),
+            ("character", character)
+        )
+
+    def append_memory(self, agent_key: str, seq: int, user_input: str, agent_response: str):
+        """追加一条Agent记忆"""
+        self._enqueue(
+            "INSERT OR REPLACE INTO agent_memory VALUES (?, ?, ?, ?)",
+            (agent_key, seq, user_input, agent_response),
+            ("agent", agent_key)
+        )
+
+    def prune_memory(self, agent_key: str, before_seq: int):
+        """删除序号小于before_seq的Agent记忆（已被环形缓冲区覆盖的部分）"""
+        self._enqueue(
+            "DELETE FROM agent_memory WHERE agent_key = ? AND seq < ?",
+            (agent_key, before_seq),
+            ("agent", agent_key)
+        )
+
+    def load_agent(self, agent_key: str, character: str, limit: int) -> Optional[Dict[str, Any]]:
+        """
+        读取Agent状态和最近的记忆
+
+        参数:
+            agent_key: Agent持久化键
+            character: 角色名称
+            limit: 最多读取的记忆条数
+
+        返回:
+            包含goals、emotional_state、summary、summary_seq和memory（(序号, 用户输入, 角色回复)列表，
+            从旧到新）的字典，没有保存过时返回None
+        """
+        keys = (("agent", agent_key), ("character", character))
+        rows = self._read(
+            "SELECT goals, emotional_state, summary, summary_seq FROM agent_state WHERE agent_key = ?",
+            (agent_key,),
+            keys
+        )
+        if not rows:
+            return None
+        goals, emotional_state, summary, summary_seq = rows[0]
+        memory = self._read(
+            "SELECT seq, user_input, agent_response FROM agent_memory WHERE agent_key = ? ORDER BY seq DESC LIMIT ?",
+            (agent_key, limit)
+        )
+        memory.reverse()
+        return {
+            "goals": json.loads(goals),
+            "emotional_state": json.loads(emotional_state),
+            "summary": summary,
+            "summary_seq": summary_seq,
+            "memory": memory
+        }
+
+    def agent_keys(self, character: str, scope: Optional[str] = None) -> List[str]:
+        """
+        列出某个角色已保存的Agent持久化键
+
+        参数:
+            character: 角色名称
+            scope: 只列出该服务端会话的Agent（持久化键以 ":会话ID" 结尾），None为全部
+        """
+        if scope is None:
+            rows = self._read(
+                "SELECT agent_key FROM agent_state WHERE character = ?",
+                (character,),
+                (("character", character),)
+            )
+        else:
+            rows = self._read(
+                "SELECT agent_key FROM agent_state WHERE character = ? AND substr(agent_key, -?) = ?",
+                (character, len(scope) + 1, f":{scope}"),
+                (("character", character),)
+            )
+        return [row[0] for row in rows]
+
+    def delete_agents(self, character: str, scope: Optional[str] = None):
+        """
+        删除某个角色的Agent状态和记忆
+
+        参数:
+            character: 角色名称
+            scope: 只删除该服务端会话的Agent，None为删除全部
+        """
+        key = ("character", character)
+        condition = "character = ?"
+        params: Tuple[Any, ...] = (character,)
+        if scope is not None:
+            condition += " AND substr(agent_key, -?) = ?"
+            params += (len(scope) + 1, f":{scope}")
+        self._enqueue(
+            f"DELETE FROM agent_memory WHERE agent_key IN (SELECT agent_key FROM agent_state WHERE {condition})",
+            params,
+            key
+        )
+        self._enqueue(f"DELETE FROM agent_state WHERE {condition}", params, key)
+
+    # ---- 会话 ----
+
+    def save_conversation(self, conversation_id: str, owner: str, character_id: Optional[int], created_at: float):
+        """保存新建的会话"""
+        self._enqueue(
+            "INSERT OR IGNORE INTO conversations VALUES (?, ?, ?, ?)",
+            (conversation_id, owner, character_id, created_at),
+            ("conversation", conversation_id),
+            ("owner", owner, character_id)
+        )
+
+    def append_turn(self, conversation_id: str, seq: int, role: str, content: str, timestamp: float):
+        """追加一条会话消息"""
+        self._enqueue(
+            "INSERT OR REPLACE INTO conversation_turns VALUES (?, ?, ?, ?, ?)",
+            (conversation_id, seq, role, content, timestamp),
+            ("conversation", conversation_id)
+        )
+
+    def delete_conversation(self, conversation_id: str, owner: str, character_id: Optional[int]):
+        """删除会话及其消息"""
+        keys = (("conversation", conversation_id), ("owner", owner, character_id))
+        self._enqueue("DELETE FROM conversation_turns WHERE conversation_id = ?", (conversation_id,), *keys)
+        self._enqueue("DELETE FROM conversations WHERE id = ?", (conversation_id,), *keys)
+
+    def load_conversation(self, conversation_id: str) -> Optional[tuple]:
+        """
+        读取会话
+
+        返回:
+            (id, owner, character_id, created_at, 消息总数)，不存在时返回None
+        """
+        rows = self._read(
+            "SELECT id, owner, character_id, created_at, "
+            "(SELECT COALESCE(MAX(seq) + 1, 0) FROM conversation_turns WHERE conversation_id = id) "
+            "FROM conversations WHERE id = ?",
+            (conversation_id,),
+            (("conversation", conversation_id),)
+        )
+        return rows[0] if rows else None
+
+    def find_conversation(self, owner: str, character_id: Optional[int]) -> Optional[str]:
+        """按用户和角色查找最近创建的会话，返回会话ID"""
+        rows = self._read(
+            "SELECT id FROM conversations WHERE owner = ? AND character_id IS ? ORDER BY created_at DESC LIMIT 1",
+            (owner, character_id),
+            (("owner", owner, character_id),)
+        )
+        return rows[0][0] if rows else None
+
+    def load_turns(self, conversation_id: str, offset: int, limit: int) -> List[tuple]:
+        """
+        按序号分页读取会话消息
+
+        返回:
+            (序号, 角色, 内容, 时间戳) 列表，从旧到新
+        """
+        return self._read(
+            "SELECT seq, role, content, timestamp FROM conversation_turns "
+            "WHERE conversation_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+            (conversation_id, offset, limit),
+            (("conversation", conversation_id),)
+        )
+
+    def last_turns(self, conversation_id: str, n: int) -> List[tuple]:
+        """读取最近的n条会话消息，返回值同load_turns"""
+        rows = self._read(
+            "SELECT seq, role, content, timestamp FROM conversation_turns "
+            "WHERE conversation_id = ? ORDER BY seq DESC LIMIT ?",
+            (conversation_id, n),
+            (("conversation", conversation_id),)
+        )
+        rows.reverse()
+        return rows
+
+    def stats(self) -> Dict[str, Any]:
+        """获取存储统计"""
+        with self._pending_cond:
+            pending_keys = len(self._pending)
+        return {
+            "path": self.path,
+            "queued": self._queue.qsize(),
+            "pending_objects": pending_keys,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "avg_batch_size": round(self.written / self.batches, 1) if self.batches else 0.0,
+            "last_batch_size": self.last_batch_size,
+            "last_batch_ms": self.last_batch_ms,
+            "errors": self.errors,
+            "reads": self.reads,
+            "read_waits": self.read_waits
+        }
+
+
+# 创建全局实例（未配置数据库路径时不启用持久化）
+sqlite_store: Optional[SQLiteStore] = (
+    SQLiteStore(
+        env_config.STORAGE_SQLITE_PATH,
+        batch_size=env_config.STORAGE_SQLITE_BATCH_SIZE,
+        flush_interval=env_config.STORAGE_SQLITE_FLUSH_INTERVAL
+    )
+    if env_config.STORAGE_SQLITE_PATH else None
+)
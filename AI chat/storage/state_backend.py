@@ -0,0 +1,377 @@
+"""
+共享状态后端
+用 uvicorn --workers N 运行多个工作进程时，同一用户的请求会落到不同进程，
+进程内的Agent、会话和缓存彼此不可见。这里提供可替换的状态后端：
+- memory：进程内实现（单进程部署，默认）
+- sqlite：多个工作进程共享同一个本地SQLite文件（WAL模式）
+
+后端提供四类操作：
+- 带过期时间的键值（跨进程共享的缓存、识别会话的中间结果）
+- 版本号（进程内缓存的Agent/会话在其他进程修改后失效并重新加载）
+- 带租期的锁（同一角色的对话轮次在所有进程间串行）
+- 队列（把发往其他进程的识别音频块转交给会话所在的进程）
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import logging
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import env_config
+
+logger = logging.getLogger("ai_chat_service.storage.state_backend")
+
+
+class StateBackend:
+    """状态后端接口"""
+
+    # 是否在多个进程之间共享
+    shared = False
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """读取值，不存在或已过期时返回None"""
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        """
+        写入值
+
+        参数:
+            namespace: 命名空间
+            key: 键
+            value: 值（需可序列化）
+            ttl: 有效期（秒），None为不过期
+        """
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str):
+        """删除值（同一命名空间和键的队列和计数器一并删除）"""
+        raise NotImplementedError
+
+    def version(self, namespace: str, key: str) -> int:
+        """读取对象的版本号，从未修改过时为0"""
+        raise NotImplementedError
+
+    def bump(self, namespace: str, key: str) -> int:
+        """把对象的版本号加一，返回新版本号"""
+        return self.add(namespace, key, 1)
+
+    def add(self, namespace: str, key: str, amount: int) -> int:
+        """
+        原子地给计数器加上amount（与版本号共用存储）
+
+        参数:
+            namespace: 命名空间
+            key: 键
+            amount: 增量，可为负数
+
+        返回:
+            相加后的值
+        """
+        raise NotImplementedError
+
+    def try_lock(self, namespace: str, key: str, owner: str, ttl: float) -> bool:
+        """
+        尝试获取锁（持有者崩溃时锁在租期后自动失效）
+
+        参数:
+            namespace: 命名空间
+            key: 键
+            owner: 持有者标识（释放时校验）
+            ttl: 租期（秒）
+
+        返回:
+            是否获取成功
+        """
+        raise NotImplementedError
+
+    def unlock(self, namespace: str, key: str, owner: str):
+        """释放由owner持有的锁"""
+        raise NotImplementedError
+
+    def push(self, namespace: str, key: str, value: Any):
+        """向队列末尾追加一个值"""
+        raise NotImplementedError
+
+    def drain(self, namespace: str, key: str) -> List[Any]:
+        """取出并删除队列中的全部值（按追加顺序）"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        """获取后端统计"""
+        raise NotImplementedError
+
+
+class InProcessBackend(StateBackend):
+    """进程内状态后端"""
+
+    shared = False
+
+    def __init__(self):
+        self._values: Dict[Tuple[str, str], Tuple[Any, Optional[float]]] = {}
+        self._versions: Dict[Tuple[str, str], int] = {}
+        self._queues: Dict[Tuple[str, str], deque] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._values.get((namespace, key))
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._values[(namespace, key)]
+                return None
+            return value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._values[(namespace, key)] = (value, time.time() + ttl if ttl is not None else None)
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._values.pop((namespace, key), None)
+            self._queues.pop((namespace, key), None)
+            self._versions.pop((namespace, key), None)
+
+    def version(self, namespace: str, key: str) -> int:
+        with self._lock:
+            return self._versions.get((namespace, key), 0)
+
+    def add(self, namespace: str, key: str, amount: int) -> int:
+        with self._lock:
+            value = self._versions.get((namespace, key), 0) + amount
+            self._versions[(namespace, key)] = value
+            return value
+
+    def try_lock(self, namespace: str, key: str, owner: str, ttl: float) -> bool:
+        with self._lock:
+            entry = self._values.get(("lock:" + namespace, key))
+            if entry is not None and entry[0] != owner and entry[1] > time.time():
+                return False
+            self._values[("lock:" + namespace, key)] = (owner, time.time() + ttl)
+            return True
+
+    def unlock(self, namespace: str, key: str, owner: str):
+        with self._lock:
+            entry = self._values.get(("lock:" + namespace, key))
+            if entry is not None and entry[0] == owner:
+                del self._values[("lock:" + namespace, key)]
+
+    def push(self, namespace: str, key: str, value: Any):
+        with self._lock:
+            self._queues.setdefault((namespace, key), deque()).append(value)
+
+    def drain(self, namespace: str, key: str) -> List[Any]:
+        with self._lock:
+            queue = self._queues.pop((namespace, key), None)
+        return list(queue) if queue else []
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "shared": False,
+                "values": len(self._values),
+                "versions": len(self._versions),
+                "queues": len(self._queues)
+            }
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS versions (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_queue_key ON queue (namespace, key, id);
+"""
+
+
+class SQLiteBackend(StateBackend):
+    """
+    多进程共享的SQLite状态后端
+
+    每个线程使用自己的连接，每个操作是一个独立的小事务（WAL模式下提交不等待fsync），
+    其他进程提交后立即可见。值用pickle序列化，数据库文件只应由本服务的进程访问
+    """
+
+    shared = True
+
+    def __init__(self, path: str, sweep_every: int = 1000):
+        """
+        初始化后端
+
+        参数:
+            path: 数据库文件路径（所在目录不存在时自动创建），所有工作进程使用同一个路径
+            sweep_every: 每写入多少次清理一次过期的键值
+        """
+        self.path = path
+        self.sweep_every = max(1, sweep_every)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        self.reads = 0
+        self.writes = 0
+        self.swept = 0
+
+        with self._connection() as connection:
+            connection.executescript(_SCHEMA)
+        logger.info(f"共享状态后端: SQLite {path}（进程 {os.getpid()}）")
+
+    def _connection(self) -> sqlite3.Connection:
+        """当前线程的连接（自动提交模式）"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _count(self, write: bool):
+        with self._lock:
+            if not write:
+                self.reads += 1
+                return False
+            self.writes += 1
+            self._writes += 1
+            return self._writes % self.sweep_every == 0
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        self._count(write=False)
+        row = self._connection().execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time())
+        ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        sweep = self._count(write=True)
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO kv VALUES (?, ?, ?, ?)",
+            (namespace, key, pickle.dumps(value), time.time() + ttl if ttl is not None else None)
+        )
+        if sweep:
+            removed = connection.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),)).rowcount
+            with self._lock:
+                self.swept += removed
+
+    def delete(self, namespace: str, key: str):
+        self._count(write=True)
+        connection = self._connection()
+        connection.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+        connection.execute("DELETE FROM queue WHERE namespace = ? AND key = ?", (namespace, key))
+        connection.execute("DELETE FROM versions WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def version(self, namespace: str, key: str) -> int:
+        self._count(write=False)
+        row = self._connection().execute(
+            "SELECT version FROM versions WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def add(self, namespace: str, key: str, amount: int) -> int:
+        self._count(write=True)
+        # 单条语句完成读取和更新，多个进程同时相加不会丢失增量
+        return self._connection().execute(
+            "INSERT INTO versions VALUES (?, ?, ?) "
+            "ON CONFLICT (namespace, key) DO UPDATE SET version = version + excluded.version RETURNING version",
+            (namespace, key, amount)
+        ).fetchone()[0]
+
+    def try_lock(self, namespace: str, key: str, owner: str, ttl: float) -> bool:
+        self._count(write=True)
+        now = time.time()
+        # 锁不存在、已过期或本来就由owner持有时写入成功
+        cursor = self._connection().execute(
+            "INSERT INTO kv VALUES (?, ?, ?, ?) ON CONFLICT (namespace, key) DO UPDATE "
+            "SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE kv.expires_at <= ? OR kv.value = excluded.value",
+            ("lock:" + namespace, key, owner.encode("utf-8"), now + ttl, now)
+        )
+        return cursor.rowcount == 1
+
+    def unlock(self, namespace: str, key: str, owner: str):
+        self._count(write=True)
+        self._connection().execute(
+            "DELETE FROM kv WHERE namespace = ? AND key = ? AND value = ?",
+            ("lock:" + namespace, key, owner.encode("utf-8"))
+        )
+
+    def push(self, namespace: str, key: str, value: Any):
+        self._count(write=True)
+        self._connection().execute(
+            "INSERT INTO queue (namespace, key, value) VALUES (?, ?, ?)",
+            (namespace, key, pickle.dumps(value))
+        )
+
+    def drain(self, namespace: str, key: str) -> List[Any]:
+        self._count(write=True)
+        rows = self._connection().execute(
+            "DELETE FROM queue WHERE namespace = ? AND key = ? RETURNING id, value",
+            (namespace, key)
+        ).fetchall()
+        # RETURNING不保证顺序，按自增ID排序
+        return [pickle.loads(value) for _, value in sorted(rows)]
+
+    def stats(self) -> Dict[str, Any]:
+        connection = self._connection()
+        values = connection.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+        queued = connection.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+        with self._lock:
+            return {
+                "backend": "sqlite",
+                "shared": True,
+                "path": self.path,
+                "values": values,
+                "queued": queued,
+                "reads": self.reads,
+                "writes": self.writes,
+                "swept": self.swept
+            }
+
+
+def create_state_backend(kind: str, path: str) -> StateBackend:
+    """
+    按配置创建状态后端
+
+    参数:
+        kind: memory 或 sqlite
+        path: sqlite后端的数据库文件路径
+
+    返回:
+        状态后端
+    """
+    if kind == "sqlite":
+        return SQLiteBackend(path)
+    if kind != "memory":
+        logger.warning(f"未知的状态后端: {kind}，使用进程内后端")
+    return InProcessBackend()
+
+
+# 创建全局实例
+state_backend = create_state_backend(env_config.STATE_BACKEND, env_config.STATE_BACKEND_PATH)
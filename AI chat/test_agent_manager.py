@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Agent管理器测试
+
+验证按容量淘汰最久未使用的Agent、空闲过期回收、按角色清除，
+以及同一Agent的并发对话不会交错写入记忆
+"""
+
+import os
+import sys
+import time
+import asyncio
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from api.models import CharacterContext
+from llm.base import LLMBase
+from llm.agent import AgentManager
+
+
+class EchoLLM(LLMBase):
+    """逐字输出、中间让出事件循环的测试模型"""
+
+    def generate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        return "ok"
+
+    def generate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        yield "ok"
+
+    async def agenerate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        await asyncio.sleep(0.01)
+        return prompt.strip().splitlines()[-3]
+
+    async def agenerate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        for char in "回复":
+            await asyncio.sleep(0.01)
+            yield char
+
+
+def _character(name):
+    return CharacterContext(name=name, description=f"{name}的描述")
+
+
+def test_lru_eviction():
+    llm = EchoLLM()
+    manager = AgentManager(max_agents=2, idle_ttl=60)
+    a = manager.get_agent(llm, _character("A"))
+    manager.get_agent(llm, _character("B"))
+    # 访问A之后，B成为最久未使用
+    assert manager.get_agent(llm, _character("A")) is a
+    manager.get_agent(llm, _character("C"))
+
+    stats = manager.stats()
+    assert stats["live_agents"] == 2
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 1 and stats["misses"] == 3
+    assert manager.get_agent(llm, _character("A")) is a
+
+    manager.clear_agent("A")
+    assert manager.stats()["live_agents"] == 1
+    assert manager.get_agent(llm, _character("A")) is not a
+
+
+def test_idle_expiry():
+    llm = EchoLLM()
+    manager = AgentManager(max_agents=10, idle_ttl=0.1)
+    for name in "ABC":
+        manager.get_agent(llm, _character(name))
+    time.sleep(0.2)
+    stats = manager.stats()
+    assert stats["live_agents"] == 0
+    assert stats["expirations"] == 3
+
+
+def test_concurrent_turns_serialized():
+    llm = EchoLLM()
+    manager = AgentManager(max_agents=1, idle_ttl=60)
+    agent = manager.get_agent(llm, _character("A"))
+
+    async def stream_turn(prompt):
+        return "".join([delta async for delta in agent.agenerate_streaming_response(prompt)])
+
+    async def scenario():
+        replies = await asyncio.gather(*(stream_turn(f"问题{i}") for i in range(5)))
+        # 对话进行中的Agent不会因容量不足被淘汰
+        busy_turn = asyncio.ensure_future(stream_turn("问题5"))
+        await asyncio.sleep(0)
+        manager.get_agent(llm, _character("B"))
+        assert manager.stats()["evictions"] == 0
+        assert manager.stats()["live_agents"] == 2
+        await busy_turn
+        return replies
+
+    replies = asyncio.run(scenario())
+    assert replies == ["回复"] * 5
+    inputs = [item["user_input"] for item in agent.memory]
+    assert inputs == [f"问题{i}" for i in range(6)]
+    assert all(item["agent_response"] == "回复" for item in agent.memory)
+
+
+if __name__ == "__main__":
+    test_lru_eviction()
+    test_idle_expiry()
+    test_concurrent_turns_serialized()
+    print("Agent管理器测试通过")
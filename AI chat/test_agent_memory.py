@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+角色记忆测试
+
+验证环形缓冲区覆盖最旧记忆、最近N条视图、字节预算、Agent载入预置记忆，
+以及按BM25相关度召回记忆
+"""
+
+import os
+import sys
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm.memory import AgentMemory, MemoryRecord, tokenize_terms
+
+
+def test_ring_buffer_wraps():
+    memory = AgentMemory(capacity=3)
+    for i in range(5):
+        memory.append(f"问{i}", f"答{i}")
+
+    assert len(memory) == 3
+    assert [record.user_input for record in memory] == ["问2", "问3", "问4"]
+    assert [record.user_input for record in memory.last(2)] == ["问3", "问4"]
+    assert memory.last(10) == list(memory)
+    assert memory.last(0) == []
+    # 兼容按下标和字段名读取
+    assert memory[-1]["agent_response"] == "答4"
+    assert memory[0].user_input == "问2"
+    assert memory[-1].timestamp >= memory[0].timestamp
+    assert memory[-1].timestamp <= time.monotonic()
+
+
+def test_byte_budget():
+    memory = AgentMemory(capacity=100, max_bytes=30)
+    for i in range(10):
+        memory.append("你好", f"回复{i}")  # 每条 6 + 7 = 13 字节
+    assert len(memory) == 2
+    assert memory.total_bytes == 26
+    assert [record.agent_response for record in memory] == ["回复8", "回复9"]
+
+    # 单条超出预算时仍保留最新一条
+    memory.append("长" * 20, "")
+    assert len(memory) == 1 and memory.total_bytes == 60
+
+
+def test_records_are_compact():
+    record = MemoryRecord("问", "答")
+    assert not hasattr(record, "__dict__")
+    assert record.to_dict()["user_input"] == "问"
+
+
+def test_agent_loads_preset_memory():
+    from api.models import CharacterContext
+    from llm.agent import Agent
+    from test_async_llm import EchoLLM
+
+    context = CharacterContext(
+        name="测试角色",
+        description="描述",
+        other_info={"memory": [{"user_input": "以前的问题", "agent_response": "以前的回答"}]}
+    )
+    agent = Agent(EchoLLM(), context)
+    assert len(agent.memory) == 1
+    agent._update_memory("新问题", "新回答")
+    memory = agent._autonomous_context()["memory"]
+    assert [item["user_input"] for item in memory] == ["以前的问题", "新问题"]
+
+
+def test_tokenize_terms():
+    assert tokenize_terms("喜欢苹果 I like Apple 好") == ["喜欢", "欢苹", "苹果", "i", "like", "apple", "好"]
+
+
+def test_recall_ranks_by_relevance():
+    memory = AgentMemory(capacity=4)
+    memory.append("我最喜欢吃苹果", "苹果又脆又甜")
+    memory.append("今天天气怎么样", "今天是晴天")
+    memory.append("你叫什么名字", "我叫小明")
+    memory.append("周末去爬山吧", "好呀，一起去爬山")
+
+    assert [record.user_input for record in memory.recall("你还记得我喜欢吃的水果吗", 1)] == ["我最喜欢吃苹果"]
+    assert memory.recall("宇宙飞船", 3) == []
+
+    # 被环形缓冲区覆盖的记忆同时从索引中删除
+    memory.append("明天下雨吗", "明天有雨")
+    assert memory.recall("苹果", 3) == []
+    assert len(memory.index.search("天气 下雨 名字 爬山", 10)) == 4
+
+
+def test_prompt_includes_only_relevant_memories():
+    from api.models import CharacterContext
+    from llm.agent import Agent
+    from test_async_llm import EchoLLM
+
+    agent = Agent(EchoLLM(), CharacterContext(name="小明", description="学生"))
+    for i in range(100):
+        agent._update_memory(f"第{i}次闲聊", "嗯嗯")
+    agent._update_memory("我的猫叫咪咪", "咪咪真可爱")
+
+    prompt = agent._build_response_prompt("我的猫叫什么")
+    assert "我的猫叫咪咪" in prompt
+    assert prompt.count("- 用户：") <= 5
+    assert "第0次闲聊" not in prompt
+
+
+if __name__ == "__main__":
+    test_ring_buffer_wraps()
+    test_byte_budget()
+    test_records_are_compact()
+    test_agent_loads_preset_memory()
+    test_tokenize_terms()
+    test_recall_ranks_by_relevance()
+    test_prompt_includes_only_relevant_memories()
+    print("角色记忆测试通过")
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+滚动对话摘要测试
+
+验证未摘要轮次达到阈值后在后台生成摘要、摘要进入系统消息，
+生成摘要后每轮提示大小不再随对话长度增长，以及生成期间Agent被清除或摘要已更新时丢弃结果
+"""
+
+import os
+import sys
+import asyncio
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from api.models import CharacterContext
+from config import env_config
+from llm.base import LLMBase
+from llm.agent import Agent, AgentManager
+from llm.context_window import message_tokens
+from llm.summarizer import SummaryScheduler, summary_scheduler
+from storage.sqlite_store import SQLiteStore
+
+
+class RecordingLLM(LLMBase):
+    """记录每次请求的messages，摘要请求返回固定摘要"""
+
+    def __init__(self):
+        self.requests = []
+        self.summary_calls = 0
+
+    def generate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        return "好的"
+
+    def generate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        yield "好的"
+
+    async def agenerate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        if character_context is None:
+            self.summary_calls += 1
+            await asyncio.sleep(0.01)
+            return f"用户和小明聊了第{self.summary_calls}批话题"
+        self.requests.append(self.build_messages(prompt, character_context, chat_history))
+        return "好的"
+
+
+def test_scheduler_dedupes_and_drops():
+    async def scenario():
+        scheduler = SummaryScheduler(max_pending=1, concurrency=1)
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_job():
+            started.set()
+            await release.wait()
+
+        assert scheduler.submit("a", slow_job)
+        assert not scheduler.submit("a", slow_job)  # 同一键不重复排队
+        await started.wait()
+        assert scheduler.submit("b", slow_job)
+        assert not scheduler.submit("c", slow_job)  # 队列已满
+        release.set()
+        await scheduler.join()
+        return scheduler.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["completed"] == 2
+    assert stats["dropped"] == 1
+    # 没有事件循环时不提交
+    assert not SummaryScheduler().submit("a", lambda: None)
+
+
+def test_rolling_summary_keeps_prompt_flat():
+    trigger = env_config.AGENT_SUMMARY_TRIGGER_TURNS
+    keep = env_config.AGENT_SUMMARY_KEEP_TURNS
+
+    async def scenario():
+        llm = RecordingLLM()
+        agent = Agent(llm, CharacterContext(name="小明", description="学生"))
+        history = []
+        sizes = []
+        for i in range(trigger * 4):
+            question = f"第{i}个问题，我们继续聊聊天气和学习"
+            await agent.agenerate_response(question, chat_history=list(history))
+            history += [{"role": "user", "content": question}, {"role": "assistant", "content": "好的"}]
+            sizes.append(sum(message_tokens(m) for m in llm.requests[-1]))
+            await summary_scheduler.join()
+        return llm, agent, sizes
+
+    llm, agent, sizes = asyncio.run(scenario())
+    assert llm.summary_calls >= 3
+    assert agent.summary.startswith("用户和小明聊了")
+    assert agent.memory.last_seq - agent.summary_seq <= trigger
+    assert agent.memory.last_seq - agent.summary_seq >= keep
+
+    # 系统消息带有摘要，聊天历史只保留最近几轮
+    last_request = llm.requests[-1]
+    assert "之前的对话摘要：" in last_request[0]["content"]
+    assert len(last_request) <= 2 + keep * 2
+    # 有摘要之后提示大小不随轮次增长
+    after = sizes[trigger * 2:]
+    assert max(after) - min(after) < 60
+    assert sizes[-1] < sizes[trigger] + 60
+
+
+def _fill_memory(agent, turns):
+    for i in range(turns):
+        agent.memory.append(f"第{i}个问题", "好的")
+
+
+def test_stale_summary_dropped():
+    turns = env_config.AGENT_SUMMARY_KEEP_TURNS + 3
+
+    async def cleared_during_summary(store):
+        manager = AgentManager(store=store)
+        agent = manager.get_agent(RecordingLLM(), CharacterContext(name="小明"))
+        _fill_memory(agent, turns)
+        job = asyncio.ensure_future(agent.arefresh_summary())
+        await asyncio.sleep(0)
+        manager.clear_agent("小明")
+        await job
+        return agent
+
+    async def summarized_elsewhere():
+        agent = Agent(RecordingLLM(), CharacterContext(name="小明"))
+        _fill_memory(agent, turns)
+        job = asyncio.ensure_future(agent.arefresh_summary())
+        await asyncio.sleep(0)
+        agent.summary, agent.summary_seq = "更新的摘要", 1
+        await job
+        return agent
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteStore(os.path.join(directory, "test.db"), flush_interval=0.01)
+        agent = asyncio.run(cleared_during_summary(store))
+        store.flush()
+        # 清除后不再写回，数据库中没有被重新创建的记录
+        assert agent.summary == ""
+        assert store.agent_keys("小明") == []
+        store.close()
+
+    agent = asyncio.run(summarized_elsewhere())
+    assert (agent.summary, agent.summary_seq) == ("更新的摘要", 1)
+
+
+if __name__ == "__main__":
+    test_scheduler_dedupes_and_drops()
+    test_rolling_summary_keeps_prompt_flat()
+    test_stale_summary_dropped()
+    print("滚动对话摘要测试通过")
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步LLM接口测试
+
+验证LLMBase的异步默认实现以及Agent的异步调用路径，不依赖外部API
+"""
+
+import os
+import sys
+import asyncio
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm.base import LLMBase
+from llm.agent import Agent
+from api.models import CharacterContext
+
+
+class EchoLLM(LLMBase):
+    """测试用的回显模型"""
+    
+    def generate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        return f"echo:{prompt.strip()[-10:]}"
+    
+    def generate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        for part in ["你", "好", "！"]:
+            yield part
+
+
+def test_default_async_fallback():
+    """默认异步实现应在线程中调用同步方法"""
+    llm = EchoLLM()
+    reply = asyncio.run(llm.agenerate_response("hello"))
+    assert reply == "echo:hello"
+
+
+def test_default_async_streaming():
+    """默认异步流式实现应按顺序产出所有片段"""
+    llm = EchoLLM()
+    
+    async def collect():
+        return [chunk async for chunk in llm.agenerate_streaming_response("hi")]
+    
+    assert asyncio.run(collect()) == ["你", "好", "！"]
+
+
+def test_agent_async_updates_memory():
+    """Agent的异步响应应与同步路径一样更新记忆"""
+    agent = Agent(EchoLLM(), CharacterContext(name="测试角色", description="测试"))
+    reply = asyncio.run(agent.agenerate_response("你好"))
+    assert reply.startswith("echo:")
+    assert agent.memory[-1]["user_input"] == "你好"
+    
+    action = asyncio.run(agent.aautonomous_action("下雨了"))
+    assert action.startswith("echo:")
+    assert agent.memory[-1]["user_input"] == "[自主行动]"
+
+
+if __name__ == "__main__":
+    test_default_async_fallback()
+    test_default_async_streaming()
+    test_agent_async_updates_memory()
+    print("异步LLM接口测试通过")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+角色目录测试
+
+验证按ID和名称查找、预先构建的不可变角色上下文、目录变化时版本号递增，
+以及数万个角色时查找不随角色数增长
+"""
+
+import os
+import sys
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pydantic import ValidationError
+
+from storage.character_registry import CharacterRegistry, DEFAULT_CHARACTERS, character_registry
+
+
+def test_lookup_by_id_and_name():
+    assert len(character_registry) == len(DEFAULT_CHARACTERS)
+    assert character_registry.get(8)["name"] == "孙悟空"
+    assert character_registry.get_by_name("林黛玉")["id"] == 4
+    assert character_registry.get(999) is None
+    assert character_registry.get_by_name("不存在") is None
+    assert [char["id"] for char in character_registry.all()] == list(range(1, 9))
+
+
+def test_contexts_are_shared_and_immutable():
+    registry = CharacterRegistry(DEFAULT_CHARACTERS)
+    context = registry.context(1)
+    assert context is registry.context(1)
+    assert context.name == "哈利波特" and context.category == "fiction"
+    try:
+        context.name = "伏地魔"
+        assert False, "角色上下文应不可修改"
+    except ValidationError:
+        pass
+
+
+def test_version_changes_with_catalog():
+    registry = CharacterRegistry(DEFAULT_CHARACTERS)
+    version = registry.version
+    snapshot = registry.all()
+    assert registry.all() is snapshot
+
+    created = registry.add({"name": "新角色", "description": "用户创建"})
+    assert created["id"] == 9
+    assert registry.version == version + 1
+    assert registry.all() is not snapshot and len(registry.all()) == 9
+
+    # 同ID替换：名称索引和上下文一起更新
+    registry.add({"id": 9, "name": "改名角色"})
+    assert registry.get_by_name("新角色") is None
+    assert registry.context(9).name == "改名角色"
+
+    # 同名角色按加入顺序查找
+    registry.add({"name": "哪吒", "description": "另一个哪吒"})
+    assert registry.get_by_name("哪吒")["id"] == 6
+    assert registry.remove(6)
+    assert registry.get_by_name("哪吒")["id"] == 10
+    assert not registry.remove(6)
+    assert registry.context(6) is None
+    assert registry.version == version + 4
+
+
+def test_lookup_scales_to_large_catalog():
+    registry = CharacterRegistry(
+        [{"name": f"角色{i}", "description": f"第{i}个用户创建的角色"} for i in range(50000)]
+    )
+    assert len(registry) == 50000
+    started_at = time.perf_counter()
+    for i in range(1, 50001):
+        assert registry.context(i) is not None
+        registry.get_by_name(f"角色{i - 1}")
+    # 每次查找远小于线性扫描五万个角色的耗时
+    assert (time.perf_counter() - started_at) / 50000 < 0.0001
+
+
+if __name__ == "__main__":
+    test_lookup_by_id_and_name()
+    test_contexts_are_shared_and_immutable()
+    test_version_changes_with_catalog()
+    test_lookup_scales_to_large_catalog()
+    print("角色目录测试通过")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+角色搜索测试
+
+验证n-gram索引的结果与逐个子串匹配一致（中文、拉丁文字、全角字符），
+按相关度排序、分类过滤、分页（接口在X-Total-Count中返回匹配总数），
+以及角色新增、修改、删除后索引增量更新
+"""
+
+import os
+import random
+import sys
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.character_routes import router as character_router
+from storage.character_registry import CharacterRegistry, DEFAULT_CHARACTERS
+from storage.character_search import CharacterSearchIndex, normalize
+
+
+def _names(characters):
+    return [char["name"] for char in characters]
+
+
+def test_matches_substring_scan():
+    index = CharacterSearchIndex()
+    words = ["魔法", "巫师", "Harry", "Potter", "哲学", "诗人", "神话", "Wizard", "童", "a"]
+    documents = {}
+    for i in range(500):
+        character = {
+            "id": i,
+            "name": "".join(random.sample(words, 2)),
+            "description": " ".join(random.sample(words, 3)),
+            "category": random.choice(["fiction", "historical"])
+        }
+        documents[i] = character
+        index.add(character)
+
+    for query in ["魔", "魔法", "法巫", "harry", "ARD", "otter 哲学", "诗人童", "不存在", "ｈａｒｒｙ"]:
+        terms = normalize(query).split()
+        expected = {
+            i for i, char in documents.items()
+            if all(term in normalize(char["name"]) or term in normalize(char["description"]) for term in terms)
+        }
+        ids, total = index.search(query, limit=1000)
+        assert set(ids) == expected, query
+        assert total == len(expected)
+
+
+def test_ranking_filters_and_paging():
+    registry = CharacterRegistry(DEFAULT_CHARACTERS)
+    registry.add({"name": "小哪吒", "description": "动画角色", "category": "fiction"})
+    registry.add({"name": "太乙真人", "description": "哪吒的师父", "category": "mythology"})
+    registry.add({"name": "哪吒闹海", "description": "", "category": "mythology"})
+
+    results, total = registry.search("哪吒")
+    assert total == 4
+    # 完全相同 > 名称开头 > 名称包含 > 仅描述包含
+    assert _names(results) == ["哪吒", "哪吒闹海", "小哪吒", "太乙真人"]
+
+    results, total = registry.search("哪吒", categories=["mythology"])
+    assert _names(results) == ["哪吒", "哪吒闹海", "太乙真人"] and total == 3
+    results, _ = registry.search("哪吒", categories=["fiction", "historical"])
+    assert _names(results) == ["小哪吒"]
+
+    results, total = registry.search("哪吒", limit=2, offset=1)
+    assert _names(results) == ["哪吒闹海", "小哪吒"] and total == 4
+
+    # 无关键词时按ID顺序返回，可按分类过滤
+    results, total = registry.search("", limit=3)
+    assert [char["id"] for char in results] == [1, 2, 3] and total == 11
+    results, total = registry.search(None, categories=["mythology"])
+    assert _names(results) == ["哪吒", "孙悟空", "太乙真人", "哪吒闹海"]
+
+
+def test_search_route_returns_total():
+    app = FastAPI()
+    app.include_router(character_router, prefix="/api")
+    client = TestClient(app)
+
+    response = client.get("/api/characters/search", params={"q": "著名", "limit": 1})
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+    assert response.headers["X-Total-Count"] == "3"
+
+    # 无关键词时默认最多返回50条，总数仍为全部角色
+    response = client.get("/api/characters/search", params={"q": ""})
+    assert len(response.json()) == len(DEFAULT_CHARACTERS)
+    assert response.headers["X-Total-Count"] == str(len(DEFAULT_CHARACTERS))
+
+
+def test_incremental_updates():
+    registry = CharacterRegistry(DEFAULT_CHARACTERS)
+    assert registry.search("wizard")[1] == 0
+
+    created = registry.add({"name": "Gandalf", "description": "A wandering Wizard", "category": "fiction"})
+    assert _names(registry.search("wizard")[0]) == ["Gandalf"]
+
+    registry.add({**created, "description": "A grey pilgrim"})
+    assert registry.search("wizard")[1] == 0
+    assert _names(registry.search("PILGRIM")[0]) == ["Gandalf"]
+
+    registry.remove(created["id"])
+    assert registry.search("pilgrim")[1] == 0
+    assert registry.search("gandalf", categories=["fiction"])[1] == 0
+    assert registry.stats()["search"]["documents"] == len(DEFAULT_CHARACTERS)
+
+
+if __name__ == "__main__":
+    test_matches_substring_scan()
+    test_ranking_filters_and_paging()
+    test_search_route_returns_total()
+    test_incremental_updates()
+    print("角色搜索测试通过")
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式聊天接口测试
+
+使用本地假模型验证 /api/chat/stream 和 stream=True 的 /api/chat/send 返回SSE事件流
+"""
+
+import os
+import sys
+import json
+import asyncio
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from llm.base import LLMBase
+from api.chat_routes import router as chat_router, ModelManager, _chat_event_stream
+from api.models import ChatRequest, CharacterContext
+from config import env_config
+from llm.cancellation import cancellation_tracker
+from utils.sse import sse_event, with_heartbeat
+
+
+class FakeStreamingLLM(LLMBase):
+    """测试用的流式模型"""
+    
+    def generate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        return "你好"
+    
+    def generate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        yield from ["你", "好"]
+    
+    async def agenerate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        usage_sink = kwargs.get("usage_sink")
+        for part in ["你", "好"]:
+            yield part
+        if usage_sink is not None:
+            usage_sink.update({"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5})
+
+
+class EndlessLLM(LLMBase):
+    """持续输出的模型，记录上游流是否被关闭"""
+    
+    def __init__(self):
+        self.closed = False
+        self.sent = 0
+    
+    def generate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        return ""
+    
+    def generate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        yield ""
+    
+    async def agenerate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        try:
+            while True:
+                self.sent += 1
+                yield "字"
+                await asyncio.sleep(0)
+        finally:
+            self.closed = True
+
+
+class FakeHTTPRequest:
+    """第N次检查时报告客户端已断开"""
+    
+    def __init__(self, disconnect_after):
+        self.checks = 0
+        self.disconnect_after = disconnect_after
+    
+    async def is_disconnected(self):
+        self.checks += 1
+        return self.checks >= self.disconnect_after
+
+
+def _create_client() -> TestClient:
+    ModelManager._models["fake"] = FakeStreamingLLM()
+    app = FastAPI()
+    app.include_router(chat_router, prefix="/api/chat")
+    return TestClient(app)
+
+
+def _parse_events(body: str):
+    """把SSE响应体解析为(事件名, 数据)列表"""
+    events = []
+    for frame in body.strip().split("\n\n"):
+        event, data = None, []
+        for line in frame.split("\n"):
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                data.append(line[6:])
+        if event:
+            events.append((event, json.loads("\n".join(data))))
+    return events
+
+
+def test_stream_endpoint():
+    """/stream 应依次返回start、delta和带用量的done事件"""
+    client = _create_client()
+    response = client.post("/api/chat/stream", json={"prompt": "你好", "model_provider": "fake"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    
+    events = _parse_events(response.text)
+    assert [name for name, _ in events] == ["start", "delta", "delta", "done"]
+    assert "".join(data["content"] for name, data in events if name == "delta") == "你好"
+    done = events[-1][1]
+    assert done["usage"]["total_tokens"] == 5
+    assert done["timing"]["ttft_ms"] is not None
+
+
+def test_send_with_stream_flag():
+    """stream=True 的 /send 应走相同的SSE路径，并经过Agent"""
+    client = _create_client()
+    response = client.post("/api/chat/send", json={
+        "prompt": "你好",
+        "model_provider": "fake",
+        "stream": True,
+        "character_context": {"name": "测试角色"}
+    })
+    assert response.status_code == 200
+    events = _parse_events(response.text)
+    assert events[-1][0] == "done"
+    assert events[-1][1]["reply_length"] == 2
+
+
+def test_disconnect_closes_upstream_through_agent():
+    """轮询到客户端断开时应停止生成，并经Agent关闭模型的流"""
+    llm = EndlessLLM()
+    request = ChatRequest(prompt="讲个故事", character_context=CharacterContext(name="断开测试角色"))
+    interval = env_config.CHAT_DISCONNECT_CHECK_INTERVAL
+    env_config.CHAT_DISCONNECT_CHECK_INTERVAL = 0
+    cancelled_before = cancellation_tracker.stats()["cancelled"].get("chat", 0)
+    
+    async def collect():
+        stream = _chat_event_stream(request, llm, "fake", "fake", request.character_context, FakeHTTPRequest(5))
+        frames = [frame async for frame in stream]
+        # 在事件循环结束前检查，确认是主动关闭而不是退出时的清理
+        return frames, llm.closed
+    
+    try:
+        frames, closed = asyncio.run(collect())
+    finally:
+        env_config.CHAT_DISCONNECT_CHECK_INTERVAL = interval
+    
+    assert closed
+    assert llm.sent < 10
+    assert not any(frame.startswith("event: done") for frame in frames)
+    assert cancellation_tracker.stats()["cancelled"]["chat"] == cancelled_before + 1
+
+
+def test_closing_stream_closes_upstream():
+    """服务器关闭响应生成器（客户端断开）时也应关闭上游"""
+    llm = EndlessLLM()
+    request = ChatRequest(prompt="讲个故事")
+    
+    async def read_then_close():
+        stream = _chat_event_stream(request, llm, "fake", "fake", None)
+        for _ in range(3):
+            await stream.__anext__()
+        await stream.aclose()
+        return llm.closed
+    
+    assert asyncio.run(read_then_close())
+
+
+def test_heartbeat_and_multiline_event():
+    """空闲时应产出心跳信号，多行数据应拆成多条data行"""
+    async def slow_source():
+        await asyncio.sleep(0.05)
+        yield "x"
+    
+    async def collect():
+        return [item async for item in with_heartbeat(slow_source(), 0.01)]
+    
+    items = asyncio.run(collect())
+    assert items[-1] == "x"
+    assert None in items
+    assert sse_event("a\nb", event="delta") == "event: delta\ndata: a\ndata: b\n\n"
+
+
+if __name__ == "__main__":
+    test_stream_endpoint()
+    test_send_with_stream_flag()
+    test_disconnect_closes_upstream_through_agent()
+    test_closing_stream_closes_upstream()
+    test_heartbeat_and_multiline_event()
+    print("流式聊天接口测试通过")
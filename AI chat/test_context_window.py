@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上下文窗口测试
+
+验证token估算缓存、按预算从最早的轮次开始丢弃或折叠为摘要，
+以及系统消息和当前问题始终保留
+"""
+
+import os
+import sys
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm.context_window import ContextWindow, estimate_tokens, message_tokens
+
+
+def _conversation(turns, content="今天聊了很多事情" * 10):
+    messages = [{"role": "system", "content": "你是小明: 一个学生"}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"第{i}轮 {content}"})
+        messages.append({"role": "assistant", "content": f"回答{i} {content}"})
+    messages.append({"role": "user", "content": "现在几点了"})
+    return messages
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("你好世界") == 4
+    assert estimate_tokens("hello world!") == 3
+    before = estimate_tokens.cache_info().hits
+    estimate_tokens("你好世界")
+    assert estimate_tokens.cache_info().hits == before + 1
+
+
+def test_budget():
+    window = ContextWindow(default_context_tokens=8192, model_context_tokens={"big": 128000},
+                           reserved_completion_tokens=1000, max_prompt_tokens=6000)
+    assert window.budget("small") == 6000
+    assert window.budget("big") == 6000
+    assert ContextWindow(model_context_tokens={"big": 128000}, reserved_completion_tokens=1000).budget("big") == 127000
+
+
+def test_drop_oldest_turns():
+    window = ContextWindow(policy="drop")
+    messages = _conversation(30)
+    result = window.fit(messages, budget=1000)
+
+    assert result.tokens_after <= 1000
+    assert result.tokens_saved == result.tokens_before - result.tokens_after > 0
+    kept = result.messages
+    assert kept[0] == messages[0]
+    assert kept[-1] == messages[-1]
+    # 保留的是最近的完整轮次，历史以用户消息开头
+    assert kept[1]["role"] == "user"
+    assert kept[-2] == messages[-2]
+    assert result.dropped_messages % 2 == 0
+    assert window.stats()["tokens_saved"] == result.tokens_saved
+
+    # 未超出预算时原样返回
+    short = _conversation(1)
+    assert window.fit(short, budget=10000).messages is short
+
+
+def test_summarize_policy():
+    window = ContextWindow(policy="summarize", summary_max_chars=100)
+    result = window.fit(_conversation(30), budget=1000)
+    assert result.summarized
+    assert result.tokens_after <= 1000
+    assert result.messages[1]["role"] == "system"
+    assert result.messages[1]["content"].startswith("较早的对话摘要")
+
+
+def test_oversized_prompt_keeps_question():
+    window = ContextWindow()
+    messages = _conversation(2)
+    result = window.fit(messages, budget=10)
+    assert result.messages == [messages[0], messages[-1]]
+    assert result.tokens_after == message_tokens(messages[0]) + message_tokens(messages[-1])
+
+
+def test_prepare_messages_trims_history():
+    from test_async_llm import EchoLLM
+
+    llm = EchoLLM()
+    history = _conversation(500)[1:-1]
+    messages = llm.prepare_messages("现在几点了", {"name": "小明"}, history)
+    assert len(messages) < len(history)
+    assert messages[-1]["content"] == "现在几点了"
+
+
+if __name__ == "__main__":
+    test_estimate_tokens()
+    test_budget()
+    test_drop_oldest_turns()
+    test_summarize_policy()
+    test_oversized_prompt_keeps_question()
+    test_prepare_messages_trims_history()
+    print("上下文窗口测试通过")
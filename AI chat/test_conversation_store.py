@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务端会话存储测试
+
+验证会话的追加、分页、裁剪和淘汰，客户端只发送conversation_id时
+由服务端重建聊天历史（会话ID与其他角色一起发送时拒绝），同一角色的不同会话互相看不到对方的Agent记忆，
+以及前端接口带会话标识时召回本会话的记忆
+"""
+
+import os
+import sys
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from config import env_config
+from llm.base import LLMBase
+from api.chat_routes import router as chat_router, ModelManager
+from storage.conversation_store import Conversation, ConversationStore, conversation_store
+
+
+class RecordingLLM(LLMBase):
+    """记录收到的聊天历史的模型"""
+
+    def __init__(self):
+        self.histories = []
+        self.prompts = []
+
+    def generate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        self.histories.append(chat_history)
+        self.prompts.append(prompt)
+        return f"回复{len(self.histories)}"
+
+    def generate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        yield self.generate_response(prompt, character_context, chat_history)
+
+
+def test_append_page_and_recent():
+    store = ConversationStore(max_conversations=10, max_turns=100)
+    conversation = store.get_or_create("user-1", 1)
+    assert store.get_or_create("user-1", 1) is conversation
+    for i in range(5):
+        store.append_exchange(conversation, f"问{i}", f"答{i}")
+
+    assert conversation.total == 10
+    assert [turn.seq for turn in conversation.page(4, 3)] == [4, 5, 6]
+    assert conversation.page(4, 3)[0].content == "问2"
+    assert conversation.recent(2) == [
+        {"role": "user", "content": "问4"},
+        {"role": "assistant", "content": "答4"}
+    ]
+    assert store.stats()["appended"] == 10
+
+
+def test_trims_old_turns_keeping_sequence():
+    conversation = Conversation("c", "user-1", 1, max_turns=10)
+    for i in range(25):
+        conversation.append("user", str(i))
+
+    assert conversation.total == 25
+    assert len(conversation.page(0, 100)) <= 10
+    # 已裁掉的序号从内存中最早的一条开始返回
+    assert conversation.page(0, 1)[0].seq > 0
+    assert [turn.content for turn in conversation.page(20, 10)] == ["20", "21", "22", "23", "24"]
+
+
+def test_evicts_least_recently_used():
+    store = ConversationStore(max_conversations=2)
+    first = store.get_or_create("user-1", 1)
+    store.get_or_create("user-2", 1)
+    store.get(first.id)
+    store.get_or_create("user-3", 1)
+
+    assert store.get(first.id) is first
+    assert store.find("user-2", 1) is None
+    assert store.stats()["evictions"] == 1
+    assert store.delete("user-3", 1)
+    assert not store.delete("user-3", 1)
+
+
+def test_server_rebuilds_history_from_conversation_id():
+    model = RecordingLLM()
+    ModelManager._models["recording"] = model
+    app = FastAPI()
+    app.include_router(chat_router, prefix="/api/chat")
+    client = TestClient(app)
+
+    first = client.post("/api/chat/send", json={
+        "prompt": "第一句",
+        "model_provider": "recording",
+        "session_id": "test-session"
+    })
+    assert first.status_code == 200
+    conversation_id = first.json()["conversation_id"]
+    assert conversation_id
+
+    # 第二轮只发送新消息和会话ID
+    second = client.post("/api/chat/send", json={
+        "prompt": "第二句",
+        "model_provider": "recording",
+        "conversation_id": conversation_id
+    })
+    assert second.status_code == 200
+    assert second.json()["conversation_id"] == conversation_id
+    assert model.histories[-1] == [
+        {"role": "user", "content": "第一句"},
+        {"role": "assistant", "content": "回复1"}
+    ]
+
+    missing = client.post("/api/chat/send", json={
+        "prompt": "你好",
+        "model_provider": "recording",
+        "conversation_id": "missing"
+    })
+    assert missing.status_code == 404
+
+    conversation_store.delete("test-session", None)
+
+
+def test_conversation_of_other_character_rejected():
+    ModelManager._models["recording"] = RecordingLLM()
+    app = FastAPI()
+    app.include_router(chat_router, prefix="/api/chat")
+    client = TestClient(app)
+
+    first = client.post("/api/chat/send", json={
+        "prompt": "你好",
+        "model_provider": "recording",
+        "character_id": 1,
+        "session_id": "mismatch-session"
+    })
+    conversation_id = first.json()["conversation_id"]
+
+    # 会话ID与其他角色的ID一起发送时拒绝，不把消息写进原角色的会话
+    for stream in (False, True):
+        response = client.post("/api/chat/send", json={
+            "prompt": "你好",
+            "model_provider": "recording",
+            "character_id": 2,
+            "conversation_id": conversation_id,
+            "stream": stream
+        })
+        assert response.status_code == 400
+    assert len(conversation_store.get(conversation_id).recent(10)) == 2
+
+    same = client.post("/api/chat/send", json={
+        "prompt": "再见",
+        "model_provider": "recording",
+        "character_id": 1,
+        "conversation_id": conversation_id
+    })
+    assert same.status_code == 200
+
+    # 聊天历史同样只按会话所属的角色返回
+    history = client.get("/api/chat/history/1", params={"conversation_id": conversation_id, "offset": 1, "limit": 2})
+    assert [(m["sender"], m["text"]) for m in history.json()] == [("ai", "回复1"), ("user", "再见")]
+    other = client.get("/api/chat/history/2", params={"conversation_id": conversation_id})
+    assert other.status_code == 400
+    assert client.get("/api/chat/history/1", params={"conversation_id": "missing"}).status_code == 404
+
+    conversation_store.delete("mismatch-session", 1)
+
+
+def test_character_send_uses_conversation():
+    ModelManager._models["recording"] = RecordingLLM()
+    app = FastAPI()
+    app.include_router(chat_router, prefix="/api/chat")
+    client = TestClient(app)
+    # 前端接口不指定模型，使用默认提供商
+    default_provider = env_config.DEFAULT_LLM_PROVIDER
+    env_config.DEFAULT_LLM_PROVIDER = "recording"
+    try:
+        # 前端接口同样可以带会话标识，响应返回会话ID
+        first = client.post("/api/chat/character/send", json={
+            "characterId": 1,
+            "message": "第一句",
+            "sessionId": "frontend-session"
+        })
+        assert first.status_code == 200
+        conversation_id = first.json()["conversation_id"]
+        assert conversation_id
+
+        second = client.post("/api/chat/character/send", json={
+            "characterId": 1,
+            "message": "第二句",
+            "conversationId": conversation_id
+        })
+        assert second.json()["conversation_id"] == conversation_id
+        history = client.get("/api/chat/history/1", params={"session_id": "frontend-session"})
+        assert [m["text"] for m in history.json() if m["sender"] == "user"] == ["第一句", "第二句"]
+
+        rejected = client.post("/api/chat/character/send", json={
+            "characterId": 2,
+            "message": "你好",
+            "conversationId": conversation_id
+        })
+        assert rejected.status_code == 400
+    finally:
+        env_config.DEFAULT_LLM_PROVIDER = default_provider
+        conversation_store.delete("frontend-session", 1)
+
+
+def test_sessions_do_not_share_agent_memory():
+    model = RecordingLLM()
+    ModelManager._models["recording"] = model
+    app = FastAPI()
+    app.include_router(chat_router, prefix="/api/chat")
+    client = TestClient(app)
+
+    def send(session_id, prompt):
+        response = client.post("/api/chat/send", json={
+            "prompt": prompt,
+            "model_provider": "recording",
+            "character_id": 1,
+            "session_id": session_id
+        })
+        assert response.status_code == 200
+        return model.prompts[-1]
+
+    send("alice", "我的暗号是青鸟")
+    # 同一角色的另一个用户召回不到alice的记忆
+    assert "青鸟" not in send("bob", "我的暗号是什么")
+    # alice自己的会话仍然能召回
+    assert "青鸟" in send("alice", "我的暗号是什么")
+
+    # 清除bob的会话不影响alice的记忆
+    client.delete("/api/chat/history/1", params={"session_id": "bob"})
+    assert "青鸟" in send("alice", "暗号")
+
+    client.delete("/api/chat/history/1", params={"session_id": "alice"})
+
+
+def test_character_send_recalls_session_memory():
+    model = RecordingLLM()
+    ModelManager._models["recording"] = model
+    app = FastAPI()
+    app.include_router(chat_router, prefix="/api/chat")
+    client = TestClient(app)
+    default_provider = env_config.DEFAULT_LLM_PROVIDER
+    env_config.DEFAULT_LLM_PROVIDER = "recording"
+
+    def send(message, session_id=None):
+        body = {"characterId": 1, "message": message}
+        if session_id:
+            body["sessionId"] = session_id
+        assert client.post("/api/chat/character/send", json=body).status_code == 200
+        return model.prompts[-1]
+
+    try:
+        # 前端带会话标识时，召回同一会话的Agent记忆
+        send("我的暗号是白鹭", "frontend-memory")
+        assert "白鹭" in send("我的暗号是什么", "frontend-memory")
+        # 不带会话标识的请求使用临时Agent，不保留记忆
+        send("我的暗号是灰雀")
+        assert "灰雀" not in send("我的暗号是什么")
+    finally:
+        env_config.DEFAULT_LLM_PROVIDER = default_provider
+        client.delete("/api/chat/history/1", params={"session_id": "frontend-memory"})
+
+
+if __name__ == "__main__":
+    test_append_page_and_recent()
+    test_trims_old_turns_keeping_sequence()
+    test_evicts_least_recently_used()
+    test_server_rebuilds_history_from_conversation_id()
+    test_conversation_of_other_character_rejected()
+    test_character_send_uses_conversation()
+    test_sessions_do_not_share_agent_memory()
+    test_character_send_recalls_session_memory()
+    print("服务端会话存储测试通过")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端点健康跟踪测试
+
+验证按延迟EWMA选择最快的端点、连续失败后熔断、冷却后半开试探和恢复
+"""
+
+import os
+import sys
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.endpoint_health import EndpointGroup, EndpointHealthRegistry
+
+
+def test_prefers_fastest_endpoint():
+    group = EndpointGroup("test", ["primary", "backup"])
+    # 没有测量数据时按配置顺序
+    assert group.order() == ["primary", "backup"]
+
+    group.record_success("primary", 2.0)
+    group.record_success("backup", 0.2)
+    assert group.order() == ["backup", "primary"]
+
+    # 延迟相同时，出错的端点排名下降
+    group = EndpointGroup("test", ["primary", "backup"])
+    group.record_success("primary", 0.2)
+    group.record_success("backup", 0.2)
+    assert group.order() == ["primary", "backup"]
+    group.record_failure("primary")
+    assert group.order() == ["backup", "primary"]
+
+
+def test_circuit_opens_and_recovers():
+    group = EndpointGroup("test", ["primary", "backup"], failure_threshold=2, open_seconds=0.05)
+    group.record_failure("primary", 30.0)
+    assert group.is_available("primary")
+    group.record_failure("primary", 30.0)
+    assert not group.is_available("primary")
+
+    # 熔断期间主地址只作为兜底
+    assert group.order() == ["backup", "primary"]
+
+    # 冷却后放行一个试探请求，同一时间只放行一个
+    time.sleep(0.06)
+    assert group.order() == ["primary", "backup"]
+    assert group.order() == ["backup", "primary"]
+
+    # 试探失败重新熔断，试探成功恢复
+    group.record_failure("primary")
+    assert group.stats()["endpoints"][0]["state"] == "open"
+    time.sleep(0.06)
+    assert group.order()[0] == "primary"
+    group.record_success("primary", 0.1)
+    assert group.is_available("primary")
+    assert group.stats()["endpoints"][0]["trips"] == 2
+
+
+def test_error_rate_trips_without_consecutive_failures():
+    group = EndpointGroup("test", ["primary"], failure_threshold=100, error_rate_threshold=0.5, min_samples=4)
+    for _ in range(3):
+        group.record_failure("primary")
+        group.record_success("primary", 0.1)
+        group.record_failure("primary")
+    assert not group.is_available("primary")
+
+    # 熔断期间兜底请求成功不会直接恢复
+    group.record_success("primary", 0.1)
+    assert not group.is_available("primary")
+
+
+def test_registry_shares_groups():
+    registry = EndpointHealthRegistry()
+    group = registry.group("deepseek", ["a", "b"])
+    assert registry.group("deepseek", ["a", "b"]) is group
+    assert set(registry.stats()) == {"deepseek"}
+
+
+if __name__ == "__main__":
+    test_prefers_fastest_endpoint()
+    test_circuit_opens_and_recovers()
+    test_error_rate_trips_without_consecutive_failures()
+    test_registry_shares_groups()
+    print("端点健康跟踪测试通过")
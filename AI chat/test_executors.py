@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+专用执行器测试
+
+验证并发上限与排队上限、饱和时拒绝、统计信息，以及音频处理在进程池中执行
+"""
+
+import os
+import sys
+import math
+import time
+import struct
+import asyncio
+import threading
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.executors import BoundedExecutor, ExecutorSaturated
+from speech.audio_dsp import preprocess_pcm_to_wav
+
+
+def test_saturation_rejects_and_recovers():
+    executor = BoundedExecutor("test", "thread", max_workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def scenario():
+        first = asyncio.ensure_future(executor.run(release.wait, 5))
+        second = asyncio.ensure_future(executor.run(lambda: "queued"))
+        await asyncio.sleep(0.05)
+
+        stats = executor.stats()
+        assert stats["in_flight"] == 2
+        assert stats["queued"] == 1
+        assert stats["saturation"] == 1.0
+
+        try:
+            await executor.run(lambda: None)
+            assert False, "执行器已满时应拒绝"
+        except ExecutorSaturated:
+            pass
+
+        release.set()
+        assert await first is True
+        assert await second == "queued"
+        # 名额释放后可以继续提交
+        assert await executor.run(lambda x: x * 2, 21) == 42
+
+    try:
+        asyncio.run(scenario())
+        stats = executor.stats()
+        assert stats["in_flight"] == 0
+        assert stats["completed"] == 3
+        assert stats["rejected"] == 1
+        assert stats["peak_in_flight"] == 2
+    finally:
+        executor.shutdown()
+
+
+def test_errors_are_counted():
+    executor = BoundedExecutor("test", "thread", max_workers=2, max_queue=0)
+    try:
+        executor.call(int, "not a number")
+        assert False, "应抛出原始异常"
+    except ValueError:
+        pass
+    finally:
+        executor.shutdown()
+    stats = executor.stats()
+    assert stats["failed"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_dsp_runs_in_process_pool():
+    executor = BoundedExecutor("dsp", "process", max_workers=1, max_queue=4)
+    pcm = b"".join(
+        struct.pack("<h", int(3000 * math.sin(2 * math.pi * 440 * i / 16000)))
+        for i in range(16000)
+    )
+    try:
+        wav_bytes = executor.call(preprocess_pcm_to_wav, pcm, 16000, 1)
+        assert wav_bytes[:4] == b"RIFF"
+        assert len(wav_bytes) == len(pcm) + 44
+        assert executor.stats()["completed"] == 1
+    finally:
+        executor.shutdown()
+
+
+if __name__ == "__main__":
+    test_saturation_rejects_and_recovers()
+    test_errors_are_counted()
+    test_dsp_runs_in_process_pool()
+    print("专用执行器测试通过")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ffmpeg管道转码测试
+
+验证PCM/WAV/WebM/MP3之间的内存转码，以及字节数据转换全程不创建临时文件
+（需要本机安装ffmpeg，未安装时跳过）
+"""
+
+import io
+import os
+import sys
+import math
+import struct
+import shutil
+import tempfile
+import wave
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from speech import ffmpeg_pipe
+from speech.ffmpeg_pipe import decode_to_pcm, encode_pcm, pcm_to_wav, TranscodeError
+
+FFMPEG_AVAILABLE = shutil.which(ffmpeg_pipe.FFMPEG_BINARY) is not None
+
+
+def _sine_pcm(sample_rate=48000, seconds=1.0, freq=440):
+    frames = int(sample_rate * seconds)
+    return b"".join(
+        struct.pack("<h", int(8000 * math.sin(2 * math.pi * freq * i / sample_rate)))
+        for i in range(frames)
+    )
+
+
+def test_pcm_to_wav():
+    pcm = _sine_pcm(16000, 0.5)
+    wav_bytes = pcm_to_wav(pcm, 16000, 1)
+    with wave.open(io.BytesIO(wav_bytes)) as wf:
+        assert wf.getframerate() == 16000
+        assert wf.getnchannels() == 1
+        assert wf.getnframes() == 8000
+
+
+def test_webm_roundtrip_through_pipes():
+    if not FFMPEG_AVAILABLE:
+        print("未安装ffmpeg，跳过")
+        return
+    webm = encode_pcm(_sine_pcm(), 48000, 1, "webm", codec="libopus")
+    assert webm[:4] == b"\x1a\x45\xdf\xa3"  # EBML头
+
+    pcm = decode_to_pcm(webm, input_format="webm", sample_rate=16000, channels=1)
+    # 1秒16kHz单声道16位PCM，编解码器延迟允许少量误差
+    assert abs(len(pcm) - 32000) < 3200
+
+    try:
+        decode_to_pcm(b"not audio", input_format="webm")
+        assert False, "无效输入应抛出TranscodeError"
+    except TranscodeError:
+        pass
+
+
+def test_converter_does_not_touch_disk():
+    if not FFMPEG_AVAILABLE:
+        print("未安装ffmpeg，跳过")
+        return
+    from speech.audio_converter import audio_converter
+
+    webm = encode_pcm(_sine_pcm(), 48000, 1, "webm", codec="libopus")
+
+    original_mkstemp = tempfile.mkstemp
+
+    def forbidden(*args, **kwargs):
+        raise AssertionError("转换过程不应创建临时文件")
+
+    tempfile.mkstemp = forbidden
+    try:
+        wav_bytes, error = audio_converter.convert_bytes_to_wav_bytes(webm, "voice.webm", 16000, 1)
+        assert error is None
+        with wave.open(io.BytesIO(wav_bytes)) as wf:
+            assert wf.getframerate() == 16000
+            assert wf.getnchannels() == 1
+
+        mp3_bytes, error = audio_converter.transcode_bytes(wav_bytes, "voice.wav", "mp3")
+        assert error is None
+        assert mp3_bytes[:3] == b"ID3" or mp3_bytes[0] == 0xFF
+
+        webm_bytes, error = audio_converter.wav_to_webm_bytes(wav_bytes)
+        assert error is None
+        assert webm_bytes[:4] == b"\x1a\x45\xdf\xa3"
+    finally:
+        tempfile.mkstemp = original_mkstemp
+
+
+if __name__ == "__main__":
+    test_pcm_to_wav()
+    test_webm_roundtrip_through_pipes()
+    test_converter_does_not_touch_disk()
+    print("ffmpeg管道转码测试通过")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对冲请求测试
+
+验证主请求慢于延迟分位数时发出对冲请求并取消落后的请求、对冲比例限额，
+主请求失败时的故障转移，以及只对冲到未熔断的端点、半开试探请求不对冲
+"""
+
+import os
+import sys
+import asyncio
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import env_config
+from llm import deeplseek_llm
+from llm.deeplseek_llm import DeepSeekLLM
+from llm.hedging import HedgedRequests
+from utils.endpoint_health import EndpointGroup, OPEN
+
+
+def _warm(hedger, latency=0.01, count=20):
+    for _ in range(count):
+        hedger._record(latency)
+
+
+def test_hedge_wins_and_cancels_primary():
+    hedger = HedgedRequests(percentile=95, budget=1.0, min_samples=20)
+    _warm(hedger)
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+            return "primary"
+        except asyncio.CancelledError:
+            cancelled.append("primary")
+            raise
+
+    async def fast():
+        await asyncio.sleep(0.01)
+        return "backup"
+
+    assert asyncio.run(hedger.run([slow, fast])) == "backup"
+    assert cancelled == ["primary"]
+    stats = hedger.stats()
+    assert stats["hedges_fired"] == 1
+    assert stats["hedges_won"] == 1
+
+
+def test_no_hedge_when_primary_is_fast():
+    hedger = HedgedRequests(budget=1.0, min_samples=20)
+    _warm(hedger, latency=0.5)
+    calls = []
+
+    async def primary():
+        return "primary"
+
+    async def backup():
+        calls.append("backup")
+        return "backup"
+
+    assert asyncio.run(hedger.run([primary, backup])) == "primary"
+    assert calls == []
+    assert hedger.stats()["hedges_fired"] == 0
+
+
+def test_budget_limits_hedges():
+    hedger = HedgedRequests(budget=0.05, window=1000, min_samples=20)
+    _warm(hedger, latency=0.001, count=1000)
+
+    async def slow():
+        await asyncio.sleep(0.02)
+        return "primary"
+
+    async def backup():
+        await asyncio.sleep(0.05)
+        return "backup"
+
+    async def run_many():
+        for _ in range(40):
+            await hedger.run([slow, backup])
+
+    asyncio.run(run_many())
+    stats = hedger.stats()
+    # 40个请求最多对冲5%，即2个
+    assert stats["hedges_fired"] == 2
+    assert stats["hedges_skipped"] == 38
+    assert stats["hedges_won"] == 0
+
+
+def test_failover_when_primary_fails():
+    hedger = HedgedRequests(min_samples=20)
+
+    async def broken():
+        raise ConnectionError("primary down")
+
+    async def backup():
+        return "backup"
+
+    assert asyncio.run(hedger.run([broken, backup])) == "backup"
+    assert hedger.stats()["failovers"] == 1
+
+    async def run_all_broken():
+        return await hedger.run([broken, broken])
+
+    try:
+        asyncio.run(run_all_broken())
+        assert False, "全部失败时应抛出异常"
+    except ConnectionError:
+        pass
+
+
+def test_hedge_disabled_per_request():
+    hedger = HedgedRequests(percentile=95, budget=1.0, min_samples=20)
+    _warm(hedger)
+    calls = []
+
+    async def slow():
+        calls.append("primary")
+        await asyncio.sleep(0.1)
+        return "primary"
+
+    async def backup():
+        calls.append("backup")
+        return "backup"
+
+    assert asyncio.run(hedger.run([slow, backup], hedge=False)) == "primary"
+    assert calls == ["primary"]
+    assert hedger.stats()["hedges_fired"] == 0
+
+
+class _Response:
+    def json(self):
+        return {"choices": [{"message": {"content": "ok"}}]}
+
+
+def test_deepseek_hedges_only_to_closed_endpoints():
+    api_key = env_config.DEEPSEEK_API_KEY
+    env_config.DEEPSEEK_API_KEY = "test-key"
+    try:
+        model = DeepSeekLLM()
+    finally:
+        env_config.DEEPSEEK_API_KEY = api_key
+    primary, backup = "http://primary/chat", "http://backup/chat"
+    calls = []
+
+    async def fake_post(url, request_body):
+        calls.append(url)
+        await asyncio.sleep(0.1 if url == primary else 0.01)
+        return _Response()
+
+    model._apost = fake_post
+    original = deeplseek_llm.hedged_requests
+    try:
+        def send(primary_state=None, backup_state=None):
+            hedger = HedgedRequests(percentile=95, budget=1.0, min_samples=20)
+            _warm(hedger)
+            deeplseek_llm.hedged_requests = hedger
+            model.endpoints = EndpointGroup("test", [primary, backup], open_seconds=30)
+            for url, state in ((primary, primary_state), (backup, backup_state)):
+                if state is not None:
+                    model.endpoints._endpoints[url].state = OPEN
+                    model.endpoints._endpoints[url].opened_at = time.monotonic() - state
+            calls.clear()
+            asyncio.run(model.agenerate_response("你好"))
+            return list(calls)
+
+        # 两个端点都正常时对冲到备用端点
+        assert send() == [primary, backup]
+        # 备用端点熔断中，不对冲
+        assert send(backup_state=0) == [primary]
+        # 主端点冷却结束、本次为半开试探时，不对冲
+        assert send(primary_state=60) == [primary]
+    finally:
+        deeplseek_llm.hedged_requests = original
+
+
+if __name__ == "__main__":
+    test_hedge_wins_and_cancels_primary()
+    test_no_hedge_when_primary_is_fast()
+    test_budget_limits_hedges()
+    test_failover_when_primary_fails()
+    test_hedge_disabled_per_request()
+    test_deepseek_hedges_only_to_closed_endpoints()
+    print("对冲请求测试通过")
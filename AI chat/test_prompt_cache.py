@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+提示前缀缓存测试
+
+验证同一角色各轮对话的系统消息逐字节相同、每轮变化的内容只出现在最后的用户消息，
+以及前缀复用和上游缓存命中token的统计
+"""
+
+import os
+import sys
+import asyncio
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from api.models import CharacterContext
+from llm.base import LLMBase
+from llm.agent import Agent
+from llm.prompt_cache import PrefixCacheTracker, prefix_hash
+
+
+class RecordingLLM(LLMBase):
+    """记录每次请求的messages"""
+
+    def __init__(self):
+        self.requests = []
+
+    def generate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        self.requests.append(self.prepare_messages(prompt, character_context, chat_history))
+        return "好的"
+
+    def generate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        yield self.generate_response(prompt, character_context, chat_history)
+
+
+def test_agent_prefix_is_stable():
+    llm = RecordingLLM()
+    agent = Agent(llm, CharacterContext(name="小明", description="一个爱读书的学生"))
+    history = []
+    for question in ["你好", "你喜欢读什么书", "你还记得我刚才问了什么吗"]:
+        asyncio.run(agent.agenerate_response(question, chat_history=list(history)))
+        history += [{"role": "user", "content": question}, {"role": "assistant", "content": "好的"}]
+
+    first, second, third = llm.requests
+    assert first[0] == second[0] == third[0]
+    assert first[0]["role"] == "system"
+    assert "一个爱读书的学生" in first[0]["content"]
+    # 角色设定不再出现在用户消息中，本轮问题位于最后
+    assert "一个爱读书的学生" not in third[-1]["content"]
+    assert third[-1]["content"].endswith("你还记得我刚才问了什么吗")
+    # 历史部分与上一轮请求的前缀一致
+    assert third[1:3] == [{"role": "user", "content": "你好"}, {"role": "assistant", "content": "好的"}]
+    assert prefix_hash(first) == prefix_hash(third)
+
+
+def test_tracker_counts_reuse_and_cached_tokens():
+    tracker = PrefixCacheTracker(max_prefixes=2)
+    system_a = [{"role": "system", "content": "角色A"}, {"role": "user", "content": "1"}]
+    system_b = [{"role": "system", "content": "角色B"}, {"role": "user", "content": "2"}]
+    tracker.observe(system_a)
+    tracker.observe(system_a)
+    tracker.observe(system_b)
+    assert tracker.observe([{"role": "user", "content": "没有系统消息"}]) is None
+
+    tracker.record_usage({"prompt_tokens": 100, "prompt_tokens_details": {"cached_tokens": 64}})
+    tracker.record_usage({"prompt_tokens": 100, "prompt_cache_hit_tokens": 36})
+    tracker.record_usage(None)
+
+    stats = tracker.stats()
+    assert stats["requests"] == 3
+    assert stats["prefix_reuses"] == 1
+    assert stats["distinct_prefixes"] == 2
+    assert stats["cached_tokens"] == 100
+    assert stats["cached_token_ratio"] == 0.5
+
+
+if __name__ == "__main__":
+    test_agent_prefix_is_stable()
+    test_tracker_counts_reuse_and_cached_tokens()
+    print("提示前缀缓存测试通过")
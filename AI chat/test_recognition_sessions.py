@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式识别会话测试
+
+验证说话过程中逐段识别、停止时只等待最后一段、会话数上限、
+单会话音频上限、解码进程退出时报告会话错误、空闲会话自动过期，以及共享状态后端时跨工作进程转交音频块
+（转交的音频块同样计入单会话上限）
+（需要本机安装ffmpeg，未安装时跳过）
+"""
+
+import os
+import sys
+import math
+import time
+import struct
+import shutil
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from speech import ffmpeg_pipe
+from speech.streaming_recognition import RecognitionSessionManager, SessionLimitExceeded
+from storage.state_backend import SQLiteBackend
+
+FFMPEG_AVAILABLE = shutil.which(ffmpeg_pipe.FFMPEG_BINARY) is not None
+
+
+def _speech_then_silence(sample_rate=48000):
+    """两段1秒的"语音"，中间和末尾各1秒静音"""
+    tone = b"".join(
+        struct.pack("<h", int(8000 * math.sin(2 * math.pi * 440 * i / sample_rate)))
+        for i in range(sample_rate)
+    )
+    silence = b"\x00\x00" * sample_rate
+    pcm = tone + silence + tone + silence
+    return ffmpeg_pipe.encode_pcm(pcm, sample_rate, 1, "webm", codec="libopus")
+
+
+def _recognizer(calls):
+    def recognize(pcm, sample_rate):
+        calls.append(len(pcm))
+        return f"第{len(calls)}段", None
+    return recognize
+
+
+def test_segments_recognized_while_streaming():
+    if not FFMPEG_AVAILABLE:
+        print("未安装ffmpeg，跳过")
+        return
+
+    manager = RecognitionSessionManager(idle_ttl=60, max_sessions=4, max_session_bytes=10 * 1024 * 1024)
+    calls = []
+    session = manager.create("webm", recognize=_recognizer(calls))
+    webm = _speech_then_silence()
+    size = len(webm) // 8 + 1
+    for i in range(0, len(webm), size):
+        session.feed(webm[i:i + size])
+
+    # 停止之前，前面的语音段已经识别
+    deadline = time.time() + 10
+    while not calls and time.time() < deadline:
+        time.sleep(0.05)
+    assert calls, "说话过程中应已开始识别"
+
+    text = manager.finish(session.session_id)
+    assert text == "第1段第2段", text
+    assert manager.get(session.session_id) is None
+    assert manager.finish(session.session_id) is None
+    stats = manager.stats()
+    assert stats["created"] == 1 and stats["completed"] == 1 and stats["active_sessions"] == 0
+    manager.shutdown()
+
+
+def test_session_limits():
+    if not FFMPEG_AVAILABLE:
+        print("未安装ffmpeg，跳过")
+        return
+
+    manager = RecognitionSessionManager(idle_ttl=60, max_sessions=2, max_session_bytes=1000)
+    first = manager.create("webm", recognize=_recognizer([]))
+    manager.create("webm", recognize=_recognizer([]))
+    try:
+        manager.create("webm")
+        assert False, "超过会话上限时应拒绝"
+    except SessionLimitExceeded:
+        pass
+    assert manager.stats()["rejected"] == 1
+
+    try:
+        first.feed(b"\x00" * 2000)
+        assert False, "超过单会话音频上限时应拒绝"
+    except ValueError:
+        pass
+    manager.discard(first.session_id)
+    assert manager.stats()["active_sessions"] == 1
+    manager.shutdown()
+    assert manager.stats()["active_sessions"] == 0
+
+
+def test_decoder_exit_reported_as_session_error():
+    if not FFMPEG_AVAILABLE:
+        print("未安装ffmpeg，跳过")
+        return
+
+    manager = RecognitionSessionManager(idle_ttl=60, max_sessions=2, max_session_bytes=10 ** 6)
+    session = manager.create("webm", recognize=_recognizer([]))
+    # 解码进程退出后写入音频块，不把BrokenPipeError抛给调用方
+    session.decoder._process.kill()
+    session.decoder._process.wait()
+    try:
+        for _ in range(10):
+            manager.feed(session, b"\x00" * 65536)
+        assert False, "解码进程退出后应报告会话错误"
+    except RuntimeError:
+        pass
+    manager.discard(session.session_id)
+    assert manager.stats()["active_sessions"] == 0
+
+
+def test_idle_sessions_expire():
+    if not FFMPEG_AVAILABLE:
+        print("未安装ffmpeg，跳过")
+        return
+
+    manager = RecognitionSessionManager(idle_ttl=0.2, max_sessions=2, max_session_bytes=1000, sweep_interval=0.1)
+    session = manager.create("webm", recognize=_recognizer([]))
+    time.sleep(0.5)
+    assert manager.get(session.session_id) is None
+    # 后台回收线程已结束解码进程并释放名额
+    assert manager.stats()["expired"] == 1
+    assert session.status == "aborted"
+    manager.create("webm", recognize=_recognizer([]))
+    manager.create("webm", recognize=_recognizer([]))
+    manager.shutdown()
+
+
+def test_chunks_relayed_between_workers():
+    if not FFMPEG_AVAILABLE:
+        print("未安装ffmpeg，跳过")
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "state.db")
+        owner = RecognitionSessionManager(
+            idle_ttl=60, max_sessions=2, max_session_bytes=10 * 1024 * 1024,
+            backend=SQLiteBackend(path), relay_interval=0.02
+        )
+        other = RecognitionSessionManager(
+            idle_ttl=60, max_sessions=2, max_session_bytes=10 * 1024 * 1024,
+            backend=SQLiteBackend(path), relay_interval=0.02
+        )
+        # 模拟另一个工作进程
+        other.worker_id = "other-worker"
+
+        session = owner.create("webm", recognize=_recognizer([]))
+        assert other.get(session.session_id) is None
+        assert other.is_remote(session.session_id)
+        assert not owner.is_remote(session.session_id)
+
+        webm = _speech_then_silence()
+        size = len(webm) // 8 + 1
+        chunks = [webm[i:i + size] for i in range(0, len(webm), size)]
+        # 音频块交替落到两个进程，仍按顺序写入
+        for index, chunk in enumerate(chunks):
+            if index % 2 == 0:
+                other.feed_remote(session.session_id, chunk)
+            else:
+                owner.feed(session, chunk)
+
+        assert other.finish_remote(session.session_id, timeout=20) == "第1段第2段"
+        assert owner.get(session.session_id) is None
+        assert not other.is_remote(session.session_id)
+        assert owner.stats()["relayed_chunks"] == len(chunks[::2])
+        owner.shutdown()
+
+
+def test_relayed_chunks_count_toward_limit():
+    if not FFMPEG_AVAILABLE:
+        print("未安装ffmpeg，跳过")
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "state.db")
+        owner = RecognitionSessionManager(
+            idle_ttl=60, max_sessions=2, max_session_bytes=1000,
+            backend=SQLiteBackend(path), relay_interval=0.02
+        )
+        other = RecognitionSessionManager(
+            idle_ttl=60, max_sessions=2, max_session_bytes=1000,
+            backend=SQLiteBackend(path), relay_interval=0.02
+        )
+        other.worker_id = "other-worker"
+
+        session = owner.create("webm", recognize=_recognizer([]))
+        owner.feed(session, b"\x00" * 600)
+        # 两个进程收到的音频合计超过上限
+        try:
+            other.feed_remote(session.session_id, b"\x00" * 600)
+            assert False, "转交的音频块应计入上限"
+        except ValueError:
+            pass
+        other.feed_remote(session.session_id, b"\x00" * 400)
+        try:
+            owner.feed(session, b"\x00")
+            assert False, "本进程的音频块应计入转交的字节数"
+        except ValueError:
+            pass
+
+        # 其他进程丢弃会话时，所在进程结束解码进程并释放名额
+        other.discard(session.session_id)
+        deadline = time.monotonic() + 5
+        while owner.get(session.session_id) is not None and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert owner.get(session.session_id) is None
+        assert session.status == "aborted"
+        assert not other.is_remote(session.session_id)
+        owner.shutdown()
+
+
+if __name__ == "__main__":
+    test_segments_recognized_while_streaming()
+    test_session_limits()
+    test_decoder_exit_reported_as_session_error()
+    test_idle_sessions_expire()
+    test_chunks_relayed_between_workers()
+    test_relayed_chunks_count_toward_limit()
+    print("流式识别会话测试通过")
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM响应缓存测试
+
+验证相同请求复用回复、并发的相同请求只调用一次上游（包括流式请求共享同一份增量），
+以及TTL过期和按最近使用淘汰，经过Agent的相同请求也能命中（不注入记忆、不重复写入记忆）
+"""
+
+import os
+import sys
+import asyncio
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm.base import LLMBase
+from llm.response_cache import ResponseCache, CachedLLM
+from llm.agent import Agent
+from api.models import CharacterContext
+
+
+class SlowLLM(LLMBase):
+    """记录调用次数、响应较慢的模型"""
+
+    def __init__(self):
+        self.model = "test-model"
+        self.temperature = 0.7
+        self.calls = 0
+
+    def generate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        self.calls += 1
+        return f"回复:{prompt}"
+
+    def generate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        yield self.generate_response(prompt)
+
+    async def agenerate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        usage_sink = kwargs.get("usage_sink")
+        if usage_sink is not None:
+            usage_sink.update({"total_tokens": 10})
+        return f"回复:{prompt}"
+
+    async def agenerate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        self.calls += 1
+        for part in ["你", "好", "！"]:
+            await asyncio.sleep(0.01)
+            yield part
+
+
+def test_concurrent_calls_are_coalesced():
+    llm = SlowLLM()
+    cache = ResponseCache(max_entries=10, ttl=60)
+    cached = CachedLLM(llm, "test", cache)
+
+    async def run():
+        usages = [{} for _ in range(5)]
+        replies = await asyncio.gather(*[
+            cached.agenerate_response("你好", usage_sink=usage) for usage in usages
+        ])
+        return replies, usages
+
+    replies, usages = asyncio.run(run())
+    assert replies == ["回复:你好"] * 5
+    assert all(usage == {"total_tokens": 10} for usage in usages)
+    assert llm.calls == 1
+    assert cache.stats()["coalesced"] == 4
+
+    # 之后的相同请求直接命中缓存，不同的请求仍调用上游
+    assert asyncio.run(cached.agenerate_response("你好")) == "回复:你好"
+    assert asyncio.run(cached.agenerate_response("再见")) == "回复:再见"
+    assert llm.calls == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_streaming_callers_share_one_stream():
+    llm = SlowLLM()
+    cache = ResponseCache(max_entries=10, ttl=60)
+    cached = CachedLLM(llm, "test", cache)
+
+    async def collect():
+        return [delta async for delta in cached.agenerate_streaming_response("讲个故事")]
+
+    async def run():
+        return await asyncio.gather(*[collect() for _ in range(3)])
+
+    streams = asyncio.run(run())
+    assert streams == [["你", "好", "！"]] * 3
+    assert llm.calls == 1
+
+    # 完整生成的回复写入缓存，之后作为一次增量返回
+    assert asyncio.run(collect()) == ["你好！"]
+    assert llm.calls == 1
+
+
+def test_key_covers_model_and_messages():
+    key = ResponseCache.make_key("openai", "a", 0.7, [{"role": "user", "content": "你好"}], {})
+    assert key == ResponseCache.make_key("openai", "a", 0.7, [{"content": "你好", "role": "user"}], {})
+    assert key != ResponseCache.make_key("deepseek", "a", 0.7, [{"role": "user", "content": "你好"}], {})
+    assert key != ResponseCache.make_key("openai", "a", 0.2, [{"role": "user", "content": "你好"}], {})
+    assert key != ResponseCache.make_key("openai", "a", 0.7, [{"role": "user", "content": "您好"}], {})
+
+
+def test_ttl_and_lru_eviction():
+    cache = ResponseCache(max_entries=2, ttl=60)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    cache.put("c", "3")
+    # b最久未使用，被淘汰
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.stats()["evictions"] == 1
+
+    short = ResponseCache(max_entries=2, ttl=0.01)
+    short.put("a", "1")
+    time.sleep(0.02)
+    assert short.get("a") is None
+
+
+def test_agent_calls_hit_cache():
+    llm = SlowLLM()
+    cached = CachedLLM(llm, "test", ResponseCache(max_entries=10, ttl=60))
+    agent = Agent(llm, CharacterContext(name="图书管理员", description="熟悉每一本书"))
+
+    async def run():
+        # 不使用缓存的对话照常写入记忆
+        await agent.agenerate_response("你好")
+        memories = len(agent.memory)
+        llm.calls = 0
+
+        actions = [await agent.aautonomous_action("在图书馆", llm=cached) for _ in range(3)]
+        replies = [await agent.agenerate_response("推荐一本书", llm=cached) for _ in range(2)]
+        return memories, actions, replies
+
+    memories, actions, replies = asyncio.run(run())
+    assert len(set(actions)) == 1 and len(set(replies)) == 1
+    # 每种请求只调用一次上游，命中缓存的回复不重复写入记忆
+    assert llm.calls == 2
+    assert len(agent.memory) == memories == 1
+
+
+if __name__ == "__main__":
+    test_concurrent_calls_are_coalesced()
+    test_streaming_callers_share_one_stream()
+    test_key_covers_model_and_messages()
+    test_ttl_and_lru_eviction()
+    test_agent_calls_hit_cache()
+    print("LLM响应缓存测试通过")
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite持久化测试
+
+验证写入成批提交、重启后会话和Agent状态从数据库恢复、
+早于内存窗口的历史从数据库分页读取，单个写操作失败时只丢弃该操作，延迟加载会等待未提交的写入，
+以及请求路径上的Agent加载不阻塞事件循环、并发请求只加载一次
+"""
+
+import os
+import sys
+import asyncio
+import tempfile
+import threading
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from api.models import CharacterContext
+from llm.base import LLMBase
+from llm.agent import AgentManager
+from storage.conversation_store import ConversationStore
+from storage.sqlite_store import SQLiteStore
+
+
+class DummyLLM(LLMBase):
+    """不调用上游的模型"""
+
+    model = "dummy"
+
+    def generate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        return "ok"
+
+    def generate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        yield "ok"
+
+
+class SlowLLM(DummyLLM):
+    """回复前等待一段时间的模型"""
+
+    async def agenerate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        await asyncio.sleep(0.05)
+        return "回复"
+
+
+class SlowLoadStore(SQLiteStore):
+    """读取Agent状态较慢（如在等待未提交的写入）的存储"""
+
+    loads = 0
+
+    def load_agent(self, *args, **kwargs):
+        self.loads += 1
+        time.sleep(0.2)
+        return super().load_agent(*args, **kwargs)
+
+
+def _store(directory):
+    return SQLiteStore(os.path.join(directory, "data", "test.db"), flush_interval=0.01)
+
+
+def test_conversations_survive_restart():
+    with tempfile.TemporaryDirectory() as directory:
+        store = _store(directory)
+        conversations = ConversationStore(max_conversations=10, max_turns=10, store=store)
+        conversation = conversations.get_or_create("user-1", 1)
+        for i in range(15):
+            conversations.append_exchange(conversation, f"问{i}", f"答{i}")
+        store.flush()
+        assert store.stats()["written"] == store.stats()["enqueued"]
+        assert store.stats()["batches"] < store.stats()["written"]
+
+        # 重启：新的内存存储，按用户和角色延迟加载
+        restarted = ConversationStore(max_conversations=10, max_turns=10, store=store)
+        loaded = restarted.find("user-1", 1)
+        assert loaded.id == conversation.id
+        assert loaded.total == 30
+        assert loaded.recent(2) == [
+            {"role": "user", "content": "问14"},
+            {"role": "assistant", "content": "答14"}
+        ]
+        # 内存中只有最近10条，更早的从数据库读取
+        assert [turn.content for turn in restarted.page(loaded, 0, 3)] == ["问0", "答0", "问1"]
+
+        # 继续追加时序号接着数据库中的消息
+        restarted.append(loaded, "user", "新消息")
+        assert restarted.page(loaded, 30, 5)[0].content == "新消息"
+
+        assert restarted.delete("user-1", 1)
+        assert ConversationStore(store=store).find("user-1", 1) is None
+        store.close()
+
+
+def test_failed_write_does_not_discard_batch():
+    with tempfile.TemporaryDirectory() as directory:
+        store = _store(directory)
+        # 写入线程停在回调中，之后的写操作进入同一批
+        release = threading.Event()
+        store.after_commit(release.wait)
+        store.save_conversation("c1", "user-1", 1, time.time())
+        store.append_turn("c1", 0, "user", "你好", time.time())
+        # 违反NOT NULL约束的写操作
+        store.append_turn("c1", 1, None, "坏数据", time.time())
+        store.append_turn("c1", 2, "assistant", "你好呀", time.time())
+        release.set()
+        store.flush()
+
+        assert store.load_conversation("c1") is not None
+        assert [turn[1] for turn in store.load_turns("c1", 0, 10)] == ["user", "assistant"]
+        assert store.stats()["errors"] == 1
+        store.close()
+
+
+def test_lazy_load_waits_for_pending_writes():
+    with tempfile.TemporaryDirectory() as directory:
+        store = _store(directory)
+        conversations = ConversationStore(max_conversations=1, store=store)
+        first = conversations.get_or_create("user-1", 1)
+        conversations.append_exchange(first, "你好", "你好呀")
+        # 立即被淘汰后访问，不手动flush
+        conversations.get_or_create("user-2", 1)
+        loaded = conversations.get(first.id)
+        assert loaded is not first
+        assert loaded.recent(2)[1]["content"] == "你好呀"
+        assert conversations.stats()["loaded"] == 1
+        store.close()
+
+
+def test_agent_state_survives_restart():
+    with tempfile.TemporaryDirectory() as directory:
+        store = _store(directory)
+        llm = DummyLLM()
+        context = CharacterContext(name="持久角色", other_info={"memory": [{"user_input": "预置", "agent_response": "记忆"}]})
+
+        agent = AgentManager(store=store).get_agent(llm, context)
+        agent.goals = ["找到宝藏"]
+        agent.emotional_state = {"开心": 0.8}
+        agent._update_memory("我叫小明", "你好小明")
+        agent.summary = "用户自称小明"
+        agent.summary_seq = 0
+        agent._persist_state()
+        store.flush()
+
+        restored = AgentManager(store=store).get_agent(DummyLLM(), context)
+        assert restored is not agent
+        assert restored.goals == ["找到宝藏"]
+        assert restored.emotional_state == {"开心": 0.8}
+        assert restored.summary == "用户自称小明"
+        assert [(r.seq, r.user_input) for r in restored.memory] == [(0, "预置"), (1, "我叫小明")]
+        assert restored.memory.recall("小明", 1)[0].agent_response == "你好小明"
+
+        # 清除角色后不再恢复
+        manager = AgentManager(store=store)
+        manager.clear_agent("持久角色")
+        fresh = manager.get_agent(DummyLLM(), CharacterContext(name="持久角色"))
+        assert len(fresh.memory) == 0
+        assert fresh.goals == []
+        store.close()
+
+
+def test_turn_in_progress_does_not_restore_cleared_agent():
+    with tempfile.TemporaryDirectory() as directory:
+        store = _store(directory)
+        llm = SlowLLM()
+        context = CharacterContext(name="清除角色")
+        manager = AgentManager(store=store)
+        agent = manager.get_agent(llm, context)
+
+        async def main():
+            turn = asyncio.ensure_future(agent.agenerate_response("秘密"))
+            await asyncio.sleep(0.01)
+            manager.clear_agent("清除角色")
+            await turn
+
+        asyncio.run(main())
+        store.flush()
+
+        # 清除时进行中的一轮结束后不再写回数据库
+        restored = AgentManager(store=store).get_agent(llm, context)
+        assert len(restored.memory) == 0
+        assert store.agent_keys("清除角色") == [AgentManager._store_key(llm, context)]
+        store.close()
+
+
+def test_scoped_agents_persisted_separately():
+    with tempfile.TemporaryDirectory() as directory:
+        store = _store(directory)
+        llm = DummyLLM()
+        context = CharacterContext(name="会话角色")
+        manager = AgentManager(store=store)
+        manager.get_agent(llm, context, scope="conv-a")._update_memory("甲的话", "回复甲")
+        manager.get_agent(llm, context, scope="conv-b")._update_memory("乙的话", "回复乙")
+        store.flush()
+
+        restarted = AgentManager(store=store)
+        assert [r.user_input for r in restarted.get_agent(llm, context, scope="conv-a").memory] == ["甲的话"]
+        assert store.agent_keys("会话角色", "conv-b") == [AgentManager._store_key(llm, context, "conv-b")]
+
+        # 只清除一个会话的Agent
+        restarted.clear_agent("会话角色", "conv-a")
+        store.flush()
+        fresh = AgentManager(store=store)
+        assert len(fresh.get_agent(llm, context, scope="conv-a").memory) == 0
+        assert [r.user_input for r in fresh.get_agent(llm, context, scope="conv-b").memory] == ["乙的话"]
+        store.close()
+
+
+def test_agent_load_does_not_block_event_loop():
+    with tempfile.TemporaryDirectory() as directory:
+        store = SlowLoadStore(os.path.join(directory, "test.db"), flush_interval=0.01)
+        manager = AgentManager(store=store)
+        llm, context = DummyLLM(), CharacterContext(name="冷启动角色")
+
+        async def run():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            task = asyncio.ensure_future(ticker())
+            agents = await asyncio.gather(*[manager.aget_agent(llm, context, scope="conv") for _ in range(5)])
+            task.cancel()
+            return agents, ticks
+
+        agents, ticks = asyncio.run(run())
+        # 并发请求等待同一次加载，加载期间事件循环照常运行
+        assert all(agent is agents[0] for agent in agents)
+        assert store.loads == 1
+        assert ticks >= 10
+        assert manager.stats()["misses"] == 1 and manager.stats()["hits"] == 4
+
+        # 加载期间被清除时，作废读到的状态重新加载
+        async def clear_during_load():
+            load = asyncio.ensure_future(manager.aget_agent(llm, context, scope="other"))
+            await asyncio.sleep(0.05)
+            manager.clear_agent("冷启动角色", "other")
+            return await load
+
+        agent = asyncio.run(clear_during_load())
+        assert store.loads == 3
+        assert agent.store is not None and not agent.detached
+        store.close()
+
+
+if __name__ == "__main__":
+    test_conversations_survive_restart()
+    test_failed_write_does_not_discard_batch()
+    test_lazy_load_waits_for_pending_writes()
+    test_agent_state_survives_restart()
+    test_turn_in_progress_does_not_restore_cleared_agent()
+    test_scoped_agents_persisted_separately()
+    test_agent_load_does_not_block_event_loop()
+    print("SQLite持久化测试通过")
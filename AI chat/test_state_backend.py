@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享状态后端测试
+
+验证进程内和SQLite后端的键值过期、版本号、原子计数和队列，另一个进程写入的数据可见，
+以及多个工作进程共享后端时Agent、会话和响应缓存在进程间同步
+"""
+
+import os
+import sys
+import asyncio
+import time
+import tempfile
+import multiprocessing
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from api.models import CharacterContext
+from llm.base import LLMBase
+import llm.agent
+from config import env_config
+from llm.agent import AgentBusy, AgentManager
+from llm.response_cache import ResponseCache
+from storage.conversation_store import ConversationStore
+from storage.sqlite_store import SQLiteStore
+from storage.state_backend import InProcessBackend, SQLiteBackend
+
+
+class DummyLLM(LLMBase):
+    """不调用上游的模型"""
+
+    model = "dummy"
+
+    def generate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        return "ok"
+
+    def generate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        yield "ok"
+
+    async def agenerate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        await asyncio.sleep(0.01)
+        return "ok"
+
+
+class SlowLLM(DummyLLM):
+    """每轮耗时较长的模型"""
+
+    async def agenerate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        await asyncio.sleep(0.5)
+        return "ok"
+
+
+def _check_backend(backend):
+    backend.set("ns", "a", {"text": "你好"})
+    backend.set("ns", "short", "x", ttl=0.05)
+    assert backend.get("ns", "a") == {"text": "你好"}
+    assert backend.get("ns", "short") == "x"
+    time.sleep(0.06)
+    assert backend.get("ns", "short") is None
+    backend.delete("ns", "a")
+    assert backend.get("ns", "a") is None
+
+    assert backend.version("ns", "v") == 0
+    assert backend.bump("ns", "v") == 1
+    assert backend.bump("ns", "v") == 2
+    assert backend.version("ns", "v") == 2
+    assert backend.add("ns", "n", 600) == 600
+    assert backend.add("ns", "n", -200) == 400
+    backend.delete("ns", "n")
+    assert backend.add("ns", "n", 1) == 1
+
+    for value in [b"1", b"2", None, b"3"]:
+        backend.push("ns", "q", value)
+    assert backend.drain("ns", "q") == [b"1", b"2", None, b"3"]
+    assert backend.drain("ns", "q") == []
+
+    assert backend.try_lock("ns", "l", "a", ttl=0.05)
+    assert backend.try_lock("ns", "l", "a", ttl=0.05)
+    assert not backend.try_lock("ns", "l", "b", ttl=0.05)
+    backend.unlock("ns", "l", "b")
+    assert not backend.try_lock("ns", "l", "b", ttl=0.05)
+    # 持有者不释放时租期过后可以获取
+    time.sleep(0.06)
+    assert backend.try_lock("ns", "l", "b", ttl=10)
+    backend.unlock("ns", "l", "b")
+    assert backend.try_lock("ns", "l", "a", ttl=10)
+
+
+def test_in_process_backend():
+    _check_backend(InProcessBackend())
+
+
+def test_sqlite_backend():
+    with tempfile.TemporaryDirectory() as directory:
+        _check_backend(SQLiteBackend(os.path.join(directory, "state.db")))
+
+
+def _child_writes(path):
+    backend = SQLiteBackend(path)
+    backend.set("ns", "from-child", os.getpid())
+    backend.push("ns", "q", "child")
+    backend.bump("ns", "v")
+
+
+def test_sqlite_backend_shared_between_processes():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "state.db")
+        backend = SQLiteBackend(path)
+        child = multiprocessing.get_context("spawn").Process(target=_child_writes, args=(path,))
+        child.start()
+        child.join(30)
+        assert child.exitcode == 0
+        assert backend.get("ns", "from-child") == child.pid
+        assert backend.drain("ns", "q") == ["child"]
+        assert backend.version("ns", "v") == 1
+
+
+def _child_adds(path):
+    backend = SQLiteBackend(path)
+    for _ in range(200):
+        backend.add("ns", "counter", 1)
+
+
+def test_sqlite_backend_add_is_atomic():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "state.db")
+        children = [multiprocessing.Process(target=_child_adds, args=(path,)) for _ in range(4)]
+        for child in children:
+            child.start()
+        for child in children:
+            child.join(30)
+        # 多个进程同时相加不丢失增量
+        assert SQLiteBackend(path).version("ns", "counter") == 800
+
+
+def _worker(directory):
+    """模拟一个工作进程：各自的持久化存储和共享后端连接，指向同一组文件"""
+    store = SQLiteStore(os.path.join(directory, "data.db"), flush_interval=0.01)
+    backend = SQLiteBackend(os.path.join(directory, "state.db"))
+    return store, backend
+
+
+def test_agent_updates_visible_to_other_worker():
+    with tempfile.TemporaryDirectory() as directory:
+        store_a, backend_a = _worker(directory)
+        store_b, backend_b = _worker(directory)
+        manager_a = AgentManager(store=store_a, backend=backend_a)
+        manager_b = AgentManager(store=store_b, backend=backend_b)
+        context = CharacterContext(name="共享角色")
+        llm_a, llm_b = DummyLLM(), DummyLLM()
+
+        agent_a = manager_a.get_agent(llm_a, context)
+        agent_b = manager_b.get_agent(llm_b, context)
+        store_a.flush()
+        store_b.flush()
+
+        agent_a._update_memory("我叫小红", "你好小红")
+        store_a.flush()
+
+        # B进程的副本已过期，访问时重新加载
+        reloaded = manager_b.get_agent(llm_b, context)
+        assert reloaded is not agent_b
+        assert [record.user_input for record in reloaded.memory] == ["我叫小红"]
+        assert manager_b.stats()["reloads"] == 1
+        # A进程自己的更新不会导致重新加载
+        assert manager_a.get_agent(llm_a, context) is agent_a
+
+        store_a.close()
+        store_b.close()
+
+
+def test_agent_turns_serialized_across_workers():
+    with tempfile.TemporaryDirectory() as directory:
+        store_a, backend_a = _worker(directory)
+        store_b, backend_b = _worker(directory)
+        context = CharacterContext(name="热门角色")
+        llm_a, llm_b = DummyLLM(), DummyLLM()
+        agent_a = AgentManager(store=store_a, backend=backend_a).get_agent(llm_a, context)
+        agent_b = AgentManager(store=store_b, backend=backend_b).get_agent(llm_b, context)
+
+        async def turns(agent, name):
+            for i in range(5):
+                await agent.agenerate_response(f"{name}{i}")
+
+        async def main():
+            await asyncio.gather(turns(agent_a, "甲"), turns(agent_b, "乙"))
+
+        asyncio.run(main())
+
+        # 两个进程交替写入，每一轮都看到了对方之前的记忆，序号不冲突
+        saved = store_a.load_agent(agent_a.store_key, "热门角色", 50)
+        assert [seq for seq, _, _ in saved["memory"]] == list(range(10))
+        assert sorted(user_input for _, user_input, _ in saved["memory"]) == sorted(
+            [f"甲{i}" for i in range(5)] + [f"乙{i}" for i in range(5)]
+        )
+        store_a.close()
+        store_b.close()
+
+
+def test_agent_turn_lease_renewed_and_wait_bounded():
+    lease, wait = llm.agent._TURN_LEASE_SECONDS, env_config.AGENT_TURN_WAIT_TIMEOUT
+    llm.agent._TURN_LEASE_SECONDS = 0.15
+    env_config.AGENT_TURN_WAIT_TIMEOUT = 0.2
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            store, backend = _worker(directory)
+            agent = AgentManager(store=store, backend=backend).get_agent(SlowLLM(), CharacterContext(name="长回合角色"))
+
+            async def main():
+                turn = asyncio.ensure_future(agent.agenerate_response("你好"))
+                await asyncio.sleep(0.1)
+                # 回合耗时超过租期，续租后其他进程仍拿不到锁
+                stolen = []
+                while not turn.done():
+                    stolen.append(await asyncio.to_thread(backend.try_lock, "agent_turn", agent.store_key, "other", 1))
+                    await asyncio.sleep(0.05)
+                await turn
+                return stolen
+
+            assert not any(asyncio.run(main()))
+
+            # 其他进程长期持有锁时，等待有上限
+            assert backend.try_lock("agent_turn", agent.store_key, "other", 5)
+            started = time.monotonic()
+            try:
+                asyncio.run(agent.agenerate_response("还在吗"))
+                assert False, "应抛出AgentBusy"
+            except AgentBusy:
+                pass
+            assert time.monotonic() - started < 1
+            store.close()
+    finally:
+        llm.agent._TURN_LEASE_SECONDS, env_config.AGENT_TURN_WAIT_TIMEOUT = lease, wait
+
+
+def test_conversation_updates_visible_to_other_worker():
+    with tempfile.TemporaryDirectory() as directory:
+        store_a, backend_a = _worker(directory)
+        store_b, backend_b = _worker(directory)
+        conversations_a = ConversationStore(store=store_a, backend=backend_a)
+        conversations_b = ConversationStore(store=store_b, backend=backend_b)
+
+        conversation = conversations_a.get_or_create("user-1", 1)
+        conversations_a.append_exchange(conversation, "第一句", "回复1")
+        store_a.flush()
+        assert conversations_b.get(conversation.id).total == 2
+
+        conversations_a.append_exchange(conversation, "第二句", "回复2")
+        store_a.flush()
+        assert conversations_b.find("user-1", 1).recent(1) == [{"role": "assistant", "content": "回复2"}]
+
+        conversations_a.delete("user-1", 1)
+        store_a.flush()
+        assert conversations_b.find("user-1", 1) is None
+
+        store_a.close()
+        store_b.close()
+
+
+def test_response_cache_shared_between_workers():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "state.db")
+        cache_a = ResponseCache(backend=SQLiteBackend(path))
+        cache_b = ResponseCache(backend=SQLiteBackend(path))
+        local = ResponseCache(backend=InProcessBackend())
+
+        cache_a.put("key", "回复")
+        assert cache_b.get("key") == "回复"
+        assert cache_b.stats()["shared_hits"] == 1
+        # 第二次从本进程缓存读取
+        assert cache_b.get("key") == "回复"
+        assert cache_b.stats()["shared_hits"] == 1
+        assert not local.stats()["shared"]
+
+
+if __name__ == "__main__":
+    test_in_process_backend()
+    test_sqlite_backend()
+    test_sqlite_backend_shared_between_processes()
+    test_sqlite_backend_add_is_atomic()
+    test_agent_updates_visible_to_other_worker()
+    test_agent_turns_serialized_across_workers()
+    test_agent_turn_lease_renewed_and_wait_bounded()
+    test_conversation_updates_visible_to_other_worker()
+    test_response_cache_shared_between_workers()
+    print("共享状态后端测试通过")
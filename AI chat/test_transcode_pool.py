@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常驻转码工作进程池测试
+
+验证工作进程复用、处理N个任务后重启、并发时统计计数一致、队列满时拒绝以及任务超时
+（需要本机安装ffmpeg，未安装时跳过）
+"""
+
+import os
+import sys
+import math
+import struct
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from speech import ffmpeg_pipe
+from speech.ffmpeg_pipe import TranscodeError
+from speech.transcode_pool import TranscodePool
+
+FFMPEG_AVAILABLE = shutil.which(ffmpeg_pipe.FFMPEG_BINARY) is not None
+
+
+def _pcm(seconds=0.5, sample_rate=16000):
+    return b"".join(
+        struct.pack("<h", int(8000 * math.sin(2 * math.pi * 440 * i / sample_rate)))
+        for i in range(int(sample_rate * seconds))
+    )
+
+
+def _to_wav(pool, pcm, **kwargs):
+    return pool.transcode(
+        pcm,
+        input_format="s16le",
+        output_format="wav",
+        input_args=["-ar", "16000", "-ac", "1"],
+        **kwargs
+    )
+
+
+def test_workers_are_reused_and_recycled():
+    if not FFMPEG_AVAILABLE:
+        print("未安装ffmpeg，跳过")
+        return
+    pool = TranscodePool(size=1, max_jobs_per_worker=3, queue_size=8, job_timeout=10)
+    try:
+        pcm = _pcm()
+        for _ in range(5):
+            assert _to_wav(pool, pcm)[:4] == b"RIFF"
+        stats = pool.stats()
+        assert stats["completed"] == 5
+        # 前3个任务共用一个进程，之后重启一次
+        assert stats["spawns"] == 2
+        assert stats["recycles"] == 1
+
+        try:
+            pool.transcode(b"not audio", input_format="webm")
+            assert False, "无效输入应抛出TranscodeError"
+        except TranscodeError:
+            pass
+        # 转码失败不影响工作进程继续服务
+        assert _to_wav(pool, pcm)[:4] == b"RIFF"
+        assert pool.stats()["failed"] == 1
+    finally:
+        pool.shutdown()
+
+
+def test_counters_consistent_under_concurrency():
+    if not FFMPEG_AVAILABLE:
+        print("未安装ffmpeg，跳过")
+        return
+    pool = TranscodePool(size=3, max_jobs_per_worker=4, queue_size=64, job_timeout=10)
+    try:
+        pcm = _pcm(0.1)
+        # 多个调度线程同时完成任务、重启工作进程
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda _: _to_wav(pool, pcm), range(40)))
+        assert all(result[:4] == b"RIFF" for result in results)
+        stats = pool.stats()
+        assert stats["submitted"] == stats["completed"] == 40
+        assert stats["spawns"] == stats["recycles"] + stats["alive_workers"]
+    finally:
+        pool.shutdown()
+
+
+def test_queue_full_is_rejected():
+    pool = TranscodePool(size=1, max_jobs_per_worker=10, queue_size=1, job_timeout=10)
+    # 不启动调度线程，直接填满队列
+    pool._started = True
+    try:
+        pool.submit(b"a", input_format="s16le")
+        try:
+            pool.submit(b"b", input_format="s16le")
+            assert False, "队列满时应拒绝"
+        except TranscodeError:
+            pass
+        stats = pool.stats()
+        assert stats["queue_depth"] == 1
+        assert stats["rejected"] == 1
+    finally:
+        pool._started = False
+
+
+def test_job_timeout():
+    if not FFMPEG_AVAILABLE:
+        print("未安装ffmpeg，跳过")
+        return
+    pool = TranscodePool(size=1, max_jobs_per_worker=10, queue_size=4, job_timeout=10)
+    try:
+        # -re 按实时速度读取输入，2秒音频必然超过0.3秒的超时
+        try:
+            pool.transcode(
+                _pcm(seconds=2),
+                input_format="s16le",
+                output_format="wav",
+                input_args=["-re", "-ar", "16000", "-ac", "1"],
+                timeout=0.3
+            )
+            assert False, "应当超时"
+        except TranscodeError as e:
+            assert "超时" in str(e)
+        assert _to_wav(pool, _pcm())[:4] == b"RIFF"
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    test_workers_are_reused_and_recycled()
+    test_counters_consistent_under_concurrency()
+    test_queue_full_is_rejected()
+    test_job_timeout()
+    print("转码工作进程池测试通过")
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TTS音频缓存测试
+
+验证缓存键规范化、内存/磁盘命中、按字节LRU淘汰以及清空，
+TTS API不可用、回退到gTTS时相同的文本命中缓存，以及清空缓存的管理接口需要授权
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api import admin_routes
+from config import env_config
+from speech import tts, tts_endpoint
+from speech.tts_cache import TTSAudioCache
+from speech.tts_endpoint import TTSEndpointDiscovery
+
+
+def _cache(cache_dir, memory_max_bytes=1024, disk_max_bytes=4096):
+    return TTSAudioCache(cache_dir, memory_max_bytes=memory_max_bytes, disk_max_bytes=disk_max_bytes)
+
+
+def test_key_normalization():
+    cache = _cache(tempfile.mkdtemp())
+    key = cache.make_key("  你好，\n世界 ", "api", "voice", 1.0, "zh-CN")
+    assert key == cache.make_key("你好， 世界", "api", "voice", 1, "zh-cn")
+    assert key != cache.make_key("你好， 世界", "gtts", "voice", 1.0, "zh-CN")
+    assert key != cache.make_key("你好， 世界", "api", "voice", 1.2, "zh-CN")
+
+
+def test_memory_and_disk_hits():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = _cache(cache_dir)
+        key = cache.make_key("你好", "api", "voice", 1.0, "zh-CN")
+        assert cache.get(key) is None
+        cache.put(key, b"a" * 100)
+        assert cache.get(key) == b"a" * 100
+        assert os.path.exists(os.path.join(cache_dir, key[:2], key[2:4], key + ".mp3"))
+        
+        # 新实例从磁盘索引命中
+        reloaded = _cache(cache_dir)
+        assert reloaded.get(key) == b"a" * 100
+        stats = reloaded.stats()
+        assert stats["disk_hits"] == 1 and stats["disk_entries"] == 1
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def test_byte_based_lru_eviction_and_purge():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = _cache(cache_dir, memory_max_bytes=1000, disk_max_bytes=250)
+        keys = [cache.make_key(f"第{i}句", "api", "voice", 1.0, "zh-CN") for i in range(3)]
+        cache.put(keys[0], b"x" * 100)
+        cache.put(keys[1], b"y" * 100)
+        cache.get(keys[0])  # keys[1]变成最久未使用
+        cache.put(keys[2], b"z" * 100)
+        
+        stats = cache.stats()
+        assert stats["disk_bytes"] == 200
+        assert stats["disk_evictions"] == 1
+        assert not os.path.exists(cache._path(keys[1]))
+        
+        assert cache.purge()["removed_entries"] == 2
+        assert cache.get(keys[0]) is None
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+class FailingPool:
+    """所有TTS API请求都失败"""
+    
+    def post(self, url, headers=None, json=None, timeout=None):
+        raise ConnectionError("unreachable")
+
+
+class FakeGTTS:
+    """记录合成次数的gTTS"""
+    
+    calls = 0
+    
+    def __init__(self, text, lang, slow):
+        self.text = text
+    
+    def write_to_fp(self, fp):
+        FakeGTTS.calls += 1
+        fp.write(f"gtts:{self.text}".encode("utf-8"))
+
+
+def test_fallback_engine_hits_cache():
+    cache_dir = tempfile.mkdtemp()
+    pool, gtts = tts_endpoint.http_pool, tts.gTTS
+    tts_endpoint.http_pool = FailingPool()
+    tts.gTTS = FakeGTTS
+    try:
+        service = tts.TextToSpeech()
+        service.tts_engine, service.api_key = "api", "key"
+        service.endpoint_discovery = TTSEndpointDiscovery("key", ["https://a.example/v1"], "tts", "voice", 1.0)
+        service.cache = _cache(cache_dir)
+        
+        # API探测全部失败，回退到gTTS合成；之后相同的文本按gTTS的缓存键命中
+        first, error = service.text_to_speech_bytes("你好")
+        assert error is None and first == "gtts:你好".encode("utf-8")
+        probes = service.endpoint_discovery.probes
+        second, error = service.text_to_speech_bytes("你好")
+        assert second == first
+        assert FakeGTTS.calls == 1
+        assert service.endpoint_discovery.probes == probes
+        assert service.cache.stats()["memory_hits"] == 1
+    finally:
+        tts_endpoint.http_pool, tts.gTTS = pool, gtts
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def _client_from(host):
+    """客户端地址为host的管理接口测试客户端"""
+    app = FastAPI()
+    app.include_router(admin_routes.router, prefix="/api/admin")
+
+    async def asgi(scope, receive, send):
+        if scope["type"] == "http":
+            scope["client"] = (host, 50000)
+        await app(scope, receive, send)
+
+    return TestClient(asgi)
+
+
+def test_purge_requires_admin():
+    cache_dir = tempfile.mkdtemp()
+    cache, admin_routes.tts_engine.cache = admin_routes.tts_engine.cache, _cache(cache_dir)
+    token = env_config.ADMIN_TOKEN
+    try:
+        # 未配置令牌时只允许本机访问
+        env_config.ADMIN_TOKEN = ""
+        assert _client_from("203.0.113.5").delete("/api/admin/tts-cache").status_code == 403
+        assert _client_from("127.0.0.1").delete("/api/admin/tts-cache").status_code == 200
+
+        # 配置令牌后需要在请求头中带上，本机也不例外
+        env_config.ADMIN_TOKEN = "secret"
+        remote = _client_from("203.0.113.5")
+        assert _client_from("127.0.0.1").delete("/api/admin/tts-cache").status_code == 403
+        assert remote.delete("/api/admin/tts-cache", headers={"X-Admin-Token": "wrong"}).status_code == 403
+        assert remote.delete("/api/admin/tts-cache", headers={"X-Admin-Token": "secret"}).status_code == 200
+        # 只读的统计接口不受影响
+        assert remote.get("/api/admin/tts-cache").status_code == 200
+    finally:
+        env_config.ADMIN_TOKEN = token
+        admin_routes.tts_engine.cache = cache
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_key_normalization()
+    test_memory_and_disk_hits()
+    test_byte_based_lru_eviction_and_purge()
+    test_fallback_engine_hits_cache()
+    test_purge_requires_admin()
+    print("TTS音频缓存测试通过")
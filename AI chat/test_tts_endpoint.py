@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TTS端点发现测试
+
+使用假的HTTP连接池验证探测顺序、结果缓存、失败TTL和后台重新探测，
+以及手动触发重新探测的管理接口需要授权
+"""
+
+import os
+import sys
+import base64
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api import admin_routes
+from config import env_config
+from speech import tts_endpoint
+from speech.tts_endpoint import TTSEndpointDiscovery, ENDPOINT_PATHS, BODY_SCHEMAS
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, content=b"", headers=None, payload=None):
+        self.status_code = status_code
+        self.content = content
+        self.reason = "OK" if status_code == 200 else "ERROR"
+        self.headers = headers or {"Content-Type": "audio/mpeg"}
+        self._payload = payload
+    
+    def json(self):
+        return self._payload
+
+
+class FakePool:
+    """只有working集合中的 (URL, 请求体第一个键) 返回音频"""
+    
+    def __init__(self, working):
+        self.working = set(working)
+        self.calls = []
+    
+    def post(self, url, headers=None, json=None, timeout=None):
+        key = (url, next(iter(json)))
+        self.calls.append(key)
+        if key in self.working:
+            return FakeResponse(content=b"mp3-bytes")
+        return FakeResponse(status_code=404)
+
+
+def _discovery():
+    return TTSEndpointDiscovery(
+        api_key="key",
+        base_urls=["https://a.example/v1", "https://b.example/v1"],
+        model="tts",
+        voice_type="voice",
+        speed=1.0
+    )
+
+
+def test_candidates_are_ordered_and_deduplicated():
+    discovery = TTSEndpointDiscovery("key", ["https://a/v1", "https://a/v1"], "tts", "voice", 1.0)
+    candidates = discovery.candidates()
+    assert len(candidates) == len(ENDPOINT_PATHS) * len(BODY_SCHEMAS)
+    assert candidates[0] == ("https://a/v1/voice/tts", "qiniu")
+    assert candidates == discovery.candidates()
+
+
+def test_probe_once_then_reuse():
+    pool = FakePool({("https://a.example/v1/audio/speech", "model")})
+    tts_endpoint.http_pool = pool
+    discovery = _discovery()
+    
+    assert discovery.synthesize("第一句") == b"mp3-bytes"
+    probe_calls = len(pool.calls)
+    assert discovery.status()["endpoint"]["schema"] == "openai"
+    
+    # 之后的调用只发一次请求
+    assert discovery.synthesize("第二句") == b"mp3-bytes"
+    assert len(pool.calls) == probe_calls + 1
+
+
+def test_reprobe_when_cached_endpoint_fails():
+    pool = FakePool({("https://a.example/v1/voice/tts", "audio")})
+    tts_endpoint.http_pool = pool
+    discovery = _discovery()
+    assert discovery.synthesize("你好") == b"mp3-bytes"
+    
+    # 主地址的组合失效，其他组合可用
+    pool.working = {("https://a.example/v1/audio/speech", "model")}
+    assert discovery.synthesize("你好") is None
+    discovery._probe_done.wait(5)
+    assert discovery.status()["endpoint"]["url"] == "https://a.example/v1/audio/speech"
+    assert discovery.synthesize("你好") == b"mp3-bytes"
+
+
+def test_failover_to_backup_base_url():
+    pool = FakePool({("https://a.example/v1/voice/tts", "audio")})
+    tts_endpoint.http_pool = pool
+    discovery = TTSEndpointDiscovery("key", ["https://c.example/v1", "https://d.example/v1"], "tts", "voice", 1.0)
+    pool.working = {("https://c.example/v1/voice/tts", "audio")}
+    assert discovery.synthesize("你好") == b"mp3-bytes"
+    
+    # 主地址失效时，缓存的组合直接在备用地址上重试，不需要重新探测
+    pool.working = {("https://d.example/v1/voice/tts", "audio")}
+    calls = len(pool.calls)
+    assert discovery.synthesize("你好") == b"mp3-bytes"
+    assert pool.calls[calls:] == [("https://c.example/v1/voice/tts", "audio"), ("https://d.example/v1/voice/tts", "audio")]
+    assert discovery.status()["endpoint"]["url"] == "https://c.example/v1/voice/tts"
+    
+    # 主地址出错后排到备用地址之后，之后的请求直接发往备用地址
+    calls = len(pool.calls)
+    assert discovery.synthesize("你好") == b"mp3-bytes"
+    assert pool.calls[calls:] == [("https://d.example/v1/voice/tts", "audio")]
+
+
+def test_extract_base64_json_audio():
+    response = FakeResponse(
+        headers={"Content-Type": "application/json"},
+        payload={"data": base64.b64encode(b"audio").decode("ascii")}
+    )
+    assert TTSEndpointDiscovery._extract_audio(response) == b"audio"
+
+
+class CountingDiscovery:
+    """记录后台探测次数的端点发现"""
+
+    def __init__(self):
+        self.probes = 0
+
+    def start_background_probe(self):
+        self.probes += 1
+        return True
+
+
+def test_reprobe_requires_admin():
+    app = FastAPI()
+    app.include_router(admin_routes.router, prefix="/api/admin")
+    # 测试客户端的地址不是本机地址
+    client = TestClient(app)
+    discovery = CountingDiscovery()
+    original, admin_routes.tts_engine.endpoint_discovery = admin_routes.tts_engine.endpoint_discovery, discovery
+    token = env_config.ADMIN_TOKEN
+    try:
+        env_config.ADMIN_TOKEN = ""
+        assert client.post("/api/admin/tts-endpoint/reprobe").status_code == 403
+        env_config.ADMIN_TOKEN = "secret"
+        assert client.post("/api/admin/tts-endpoint/reprobe").status_code == 403
+        assert discovery.probes == 0
+
+        response = client.post("/api/admin/tts-endpoint/reprobe", headers={"X-Admin-Token": "secret"})
+        assert response.json() == {"started": True}
+        assert discovery.probes == 1
+    finally:
+        env_config.ADMIN_TOKEN = token
+        admin_routes.tts_engine.endpoint_discovery = original
+
+
+if __name__ == "__main__":
+    test_candidates_are_ordered_and_deduplicated()
+    test_probe_once_then_reuse()
+    test_reprobe_when_cached_endpoint_fails()
+    test_failover_to_backup_base_url()
+    test_extract_base64_json_audio()
+    test_reprobe_requires_admin()
+    print("TTS端点发现测试通过")
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+全双工语音聊天测试
+
+验证流式分句，以及WebSocket语音聊天中 识别 → LLM → 分句 → TTS 的重叠执行：
+第一句的音频在后续句子生成完之前就已推送；识别会话经会话管理器创建，受会话数和音频大小上限约束
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import struct
+import asyncio
+import shutil
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from llm.base import LLMBase
+from api.chat_routes import ModelManager
+from api import voice_ws_routes
+from speech import ffmpeg_pipe, streaming_recognition
+from speech.sentence_splitter import SentenceSplitter
+from speech.voice_pipeline import VoiceReplyPipeline
+
+FFMPEG_AVAILABLE = shutil.which(ffmpeg_pipe.FFMPEG_BINARY) is not None
+
+
+class SlowStreamingLLM(LLMBase):
+    """逐句缓慢输出的测试模型"""
+
+    def generate_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        return "第一句话。第二句话。第三句话。"
+
+    def generate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        yield self.generate_response(prompt)
+
+    async def agenerate_streaming_response(self, prompt, character_context=None, chat_history=None, **kwargs):
+        for part in ["第一句", "话。", "第二句", "话。", "第三句", "话。"]:
+            await asyncio.sleep(0.1)
+            yield part
+
+
+async def _fake_synthesize(text: str) -> bytes:
+    await asyncio.sleep(0.02)
+    return ("MP3:" + text).encode("utf-8")
+
+
+def test_sentence_splitter():
+    splitter = SentenceSplitter(min_chars=4, max_chars=20)
+    sentences = []
+    for part in ["你好！我是", "小明。Pi is 3", ".14. Ri", "ght! 最后"]:
+        sentences += splitter.feed(part)
+    assert sentences == ["你好！我是小明。", "Pi is 3.14.", "Right!"]
+    assert splitter.flush() == "最后"
+
+    # 没有句号的长句在逗号处断开
+    splitter = SentenceSplitter(max_chars=10)
+    assert splitter.feed("一二三四五，六七八九十一二") == ["一二三四五，"]
+
+
+def test_pipeline_overlaps_llm_and_tts():
+    async def scenario():
+        pipeline = VoiceReplyPipeline(_fake_synthesize, max_parallel=2)
+        events = []
+        async for event in pipeline.run(SlowStreamingLLM().agenerate_streaming_response("hi")):
+            events.append((time.perf_counter(), event))
+        return pipeline, events
+
+    pipeline, events = asyncio.run(scenario())
+    audio = [event for _, event in events if event["type"] == "audio"]
+    assert [event["index"] for event in audio] == [0, 1, 2]
+    assert audio[0]["audio"] == "MP3:第一句话。".encode("utf-8")
+    assert pipeline.reply == "第一句话。第二句话。第三句话。"
+
+    # 第一句的音频早于最后一个增量文本到达
+    first_audio_at = next(at for at, event in events if event["type"] == "audio")
+    last_delta_at = max(at for at, event in events if event["type"] == "delta")
+    assert first_audio_at < last_delta_at
+    timing = pipeline.timing()
+    assert timing["first_audio_ms"] < timing["total_ms"]
+
+
+def test_websocket_voice_chat():
+    if not FFMPEG_AVAILABLE:
+        print("未安装ffmpeg，跳过")
+        return
+
+    ModelManager._models["fake"] = SlowStreamingLLM()
+    original_synthesize = voice_ws_routes._synthesize
+    original_recognize = streaming_recognition._default_recognize
+    voice_ws_routes._synthesize = _fake_synthesize
+    streaming_recognition._default_recognize = lambda pcm, rate: ("介绍一下你自己", None)
+
+    sample_rate = 48000
+    pcm = b"".join(
+        struct.pack("<h", int(8000 * math.sin(2 * math.pi * 440 * i / sample_rate)))
+        for i in range(sample_rate)
+    )
+    webm = ffmpeg_pipe.encode_pcm(pcm, sample_rate, 1, "webm", codec="libopus")
+
+    app = FastAPI()
+    app.include_router(voice_ws_routes.router, prefix="/api/voice")
+    try:
+        with TestClient(app).websocket_connect("/api/voice/ws") as ws:
+            assert ws.receive_json()["type"] == "ready"
+            ws.send_json({"type": "start", "model_provider": "fake"})
+            assert ws.receive_json()["type"] == "ready"
+
+            # 按MediaRecorder的方式分块发送
+            size = len(webm) // 4 + 1
+            for i in range(0, len(webm), size):
+                ws.send_bytes(webm[i:i + size])
+            ws.send_json({"type": "end"})
+
+            messages = []
+            audio_frames = []
+            while True:
+                message = ws.receive()
+                if message.get("bytes") is not None:
+                    audio_frames.append(message["bytes"])
+                    continue
+                event = json.loads(message["text"])
+                messages.append(event)
+                if event["type"] in ("done", "error"):
+                    break
+
+        types = [event["type"] for event in messages]
+        assert "user_text" in types
+        assert next(e for e in messages if e["type"] == "user_text")["text"] == "介绍一下你自己"
+        assert types[-1] == "done"
+        # 每个音频头后面紧跟一个二进制帧
+        headers = [event for event in messages if event["type"] == "audio"]
+        assert [event["index"] for event in headers] == [0, 1, 2]
+        assert [len(frame) for frame in audio_frames] == [event["size"] for event in headers]
+        # 第一句音频在回复生成完之前就已推送
+        assert types.index("audio") < len(types) - 1 - types[::-1].index("delta")
+        done = messages[-1]
+        assert done["reply"] == "第一句话。第二句话。第三句话。"
+        assert done["timing"]["asr_ms"] is not None
+    finally:
+        voice_ws_routes._synthesize = original_synthesize
+        streaming_recognition._default_recognize = original_recognize
+
+
+def test_websocket_sessions_limited():
+    if not FFMPEG_AVAILABLE:
+        print("未安装ffmpeg，跳过")
+        return
+
+    sessions = streaming_recognition.recognition_sessions
+    limits = sessions.max_sessions, sessions.max_session_bytes
+    app = FastAPI()
+    app.include_router(voice_ws_routes.router, prefix="/api/voice")
+    try:
+        with TestClient(app).websocket_connect("/api/voice/ws") as ws:
+            assert ws.receive_json()["type"] == "ready"
+            # 不在白名单中的格式不会传给ffmpeg
+            ws.send_json({"type": "start", "audio_format": "lavfi"})
+            assert ws.receive_json() == {"type": "error", "detail": "不支持的音频格式"}
+
+            # 会话经会话管理器创建，受会话数上限约束
+            sessions.max_sessions = 0
+            ws.send_bytes(b"\x00" * 100)
+            assert ws.receive_json()["detail"] == "语音服务繁忙，请稍后重试"
+
+            # 超过单会话音频上限时丢弃本轮
+            sessions.max_sessions, sessions.max_session_bytes = limits[0], 1000
+            created = sessions.stats()["created"]
+            ws.send_bytes(b"\x00" * 600)
+            ws.send_bytes(b"\x00" * 600)
+            assert ws.receive_json()["detail"] == "音频过长"
+            assert sessions.stats()["created"] == created + 1
+            assert sessions.stats()["active_sessions"] == 0
+    finally:
+        sessions.max_sessions, sessions.max_session_bytes = limits
+
+
+if __name__ == "__main__":
+    test_sentence_splitter()
+    test_pipeline_overlaps_llm_and_tts()
+    test_websocket_voice_chat()
+    test_websocket_sessions_limited()
+    print("全双工语音聊天测试通过")
@@ -0,0 +1,271 @@
+"""
+上游端点健康跟踪
+同一服务的主URL和备用URL（DeepSeek、TTS）按实际表现选择：
+- 每个端点记录延迟和错误率的指数加权移动平均（EWMA）
+- 连续失败或错误率过高时熔断，冷却期内不再发送请求
+- 冷却期结束后进入半开状态，只放行一个试探请求，成功则恢复，失败则重新熔断
+- 调用方按"最快的健康端点优先"的顺序尝试，熔断中的端点只作为最后的兜底
+"""
+
+import threading
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+from config import env_config
+
+logger = logging.getLogger("ai_chat_service.utils.endpoint_health")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class EndpointHealth:
+    """单个端点的健康状态"""
+
+    def __init__(self, url: str, index: int):
+        self.url = url
+        self.index = index
+        self.state = CLOSED
+        self.ewma_latency: Optional[float] = None
+        self.ewma_error = 0.0
+        self.samples = 0
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at: Optional[float] = None
+
+        self.requests = 0
+        self.failures = 0
+        self.trips = 0
+
+
+class EndpointGroup:
+    """一组可互相替代的端点（主URL在前）"""
+
+    def __init__(
+        self,
+        name: str,
+        urls: List[str],
+        alpha: float = 0.2,
+        failure_threshold: int = 3,
+        error_rate_threshold: float = 0.5,
+        min_samples: int = 10,
+        open_seconds: float = 30
+    ):
+        """
+        初始化端点组
+
+        参数:
+            name: 端点组名称
+            urls: 端点URL列表，按配置的优先级排列
+            alpha: EWMA平滑系数，越大越侧重最近的请求
+            failure_threshold: 连续失败多少次后熔断
+            error_rate_threshold: 错误率EWMA超过该值时熔断
+            min_samples: 按错误率熔断前至少需要的请求数
+            open_seconds: 熔断后的冷却时间（秒）
+        """
+        self.name = name
+        self.alpha = alpha
+        self.failure_threshold = max(1, failure_threshold)
+        self.error_rate_threshold = error_rate_threshold
+        self.min_samples = min_samples
+        self.open_seconds = open_seconds
+
+        self._endpoints: Dict[str, EndpointHealth] = {}
+        for url in urls:
+            if url and url not in self._endpoints:
+                self._endpoints[url] = EndpointHealth(url, len(self._endpoints))
+        self._lock = threading.Lock()
+
+    @property
+    def urls(self) -> List[str]:
+        """按配置顺序的端点URL"""
+        return list(self._endpoints)
+
+    def _score(self, endpoint: EndpointHealth, neutral: float) -> float:
+        """排序得分：延迟EWMA按错误率加罚，未测量过的端点取中性值"""
+        latency = endpoint.ewma_latency if endpoint.ewma_latency is not None else neutral
+        return latency * (1 + 4 * endpoint.ewma_error)
+
+    def order(self, claim_probes: bool = True) -> List[str]:
+        """
+        获取本次请求尝试端点的顺序
+
+        冷却期结束的熔断端点放在最前作为半开试探（同一时间只放行一个），
+        其余健康端点按得分从低到高，熔断中的端点排在最后作为兜底
+
+        参数:
+            claim_probes: 是否占用半开试探名额（只查看顺序时传False）
+
+        返回:
+            端点URL列表
+        """
+        now = time.monotonic()
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+            measured = [e.ewma_latency for e in endpoints if e.ewma_latency is not None]
+            neutral = sum(measured) / len(measured) if measured else 0.0
+
+            probes, healthy, unavailable = [], [], []
+            for endpoint in endpoints:
+                if endpoint.state == CLOSED:
+                    healthy.append(endpoint)
+                elif claim_probes and self._claim_probe(endpoint, now):
+                    probes.append(endpoint)
+                else:
+                    unavailable.append(endpoint)
+
+            healthy.sort(key=lambda e: (self._score(e, neutral), e.index))
+            unavailable.sort(key=lambda e: e.index)
+            return [e.url for e in probes + healthy + unavailable]
+
+    def _claim_probe(self, endpoint: EndpointHealth, now: float) -> bool:
+        """熔断端点冷却结束后放行一个试探请求（调用方持有锁）"""
+        if endpoint.state == OPEN and now - endpoint.opened_at >= self.open_seconds:
+            endpoint.state = HALF_OPEN
+            endpoint.probe_started_at = now
+            return True
+        # 试探请求长时间没有结果（调用方没有用到该端点），允许重新试探
+        if endpoint.state == HALF_OPEN and now - (endpoint.probe_started_at or 0.0) >= self.open_seconds:
+            endpoint.probe_started_at = now
+            return True
+        return False
+
+    def record_success(self, url: str, latency: float):
+        """
+        记录一次成功的请求
+
+        参数:
+            url: 端点URL
+            latency: 请求耗时（秒）
+        """
+        with self._lock:
+            endpoint = self._endpoints.get(url)
+            if endpoint is None:
+                return
+            endpoint.requests += 1
+            endpoint.samples += 1
+            endpoint.consecutive_failures = 0
+            endpoint.ewma_error *= 1 - self.alpha
+            if endpoint.ewma_latency is None:
+                endpoint.ewma_latency = latency
+            else:
+                endpoint.ewma_latency += self.alpha * (latency - endpoint.ewma_latency)
+            # 只有半开试探成功才恢复；熔断期间兜底请求的成功只更新统计
+            if endpoint.state == HALF_OPEN:
+                logger.info(f"端点恢复（{self.name}）: {url}")
+                endpoint.state = CLOSED
+                endpoint.probe_started_at = None
+
+    def record_failure(self, url: str, latency: Optional[float] = None):
+        """
+        记录一次失败的请求
+
+        参数:
+            url: 端点URL
+            latency: 失败前的耗时（秒，超时等情况计入延迟EWMA）
+        """
+        with self._lock:
+            endpoint = self._endpoints.get(url)
+            if endpoint is None:
+                return
+            endpoint.requests += 1
+            endpoint.failures += 1
+            endpoint.samples += 1
+            endpoint.consecutive_failures += 1
+            endpoint.ewma_error += self.alpha * (1 - endpoint.ewma_error)
+            if latency is not None and endpoint.ewma_latency is not None:
+                endpoint.ewma_latency += self.alpha * (max(latency, endpoint.ewma_latency) - endpoint.ewma_latency)
+
+            if endpoint.state == HALF_OPEN or (
+                endpoint.state == CLOSED and (
+                    endpoint.consecutive_failures >= self.failure_threshold
+                    or (endpoint.samples >= self.min_samples and endpoint.ewma_error >= self.error_rate_threshold)
+                )
+            ):
+                self._trip(endpoint)
+            elif endpoint.state == OPEN:
+                # 兜底请求也失败，重新计算冷却时间
+                endpoint.opened_at = time.monotonic()
+
+    def _trip(self, endpoint: EndpointHealth):
+        """熔断端点（调用方持有锁）"""
+        endpoint.state = OPEN
+        endpoint.opened_at = time.monotonic()
+        endpoint.probe_started_at = None
+        endpoint.trips += 1
+        logger.warning(
+            f"端点熔断（{self.name}）: {endpoint.url}，连续失败{endpoint.consecutive_failures}次，"
+            f"错误率{endpoint.ewma_error:.2f}，{self.open_seconds}秒后试探恢复"
+        )
+
+    def is_available(self, url: str) -> bool:
+        """端点当前是否可以正常接收请求（未熔断）"""
+        with self._lock:
+            endpoint = self._endpoints.get(url)
+            return endpoint is not None and endpoint.state == CLOSED
+
+    def stats(self) -> Dict[str, Any]:
+        """获取端点组状态"""
+        now = time.monotonic()
+        with self._lock:
+            endpoints = []
+            for endpoint in self._endpoints.values():
+                endpoints.append({
+                    "url": endpoint.url,
+                    "state": endpoint.state,
+                    "ewma_latency_ms": round(endpoint.ewma_latency * 1000, 1) if endpoint.ewma_latency is not None else None,
+                    "error_rate": round(endpoint.ewma_error, 4),
+                    "consecutive_failures": endpoint.consecutive_failures,
+                    "requests": endpoint.requests,
+                    "failures": endpoint.failures,
+                    "trips": endpoint.trips,
+                    "retry_in": round(max(0.0, self.open_seconds - (now - endpoint.opened_at)), 1)
+                    if endpoint.state == OPEN else None
+                })
+        return {"endpoints": endpoints, "order": self.order(claim_probes=False)}
+
+
+class EndpointHealthRegistry:
+    """按名称管理端点组"""
+
+    def __init__(self):
+        self._groups: Dict[str, EndpointGroup] = {}
+        self._lock = threading.Lock()
+
+    def group(self, name: str, urls: List[str]) -> EndpointGroup:
+        """
+        获取或创建端点组（同名的端点组在各个模型实例间共享）
+
+        参数:
+            name: 端点组名称
+            urls: 端点URL列表，按配置的优先级排列
+
+        返回:
+            端点组
+        """
+        with self._lock:
+            group = self._groups.get(name)
+            if group is None or group.urls != [url for url in dict.fromkeys(urls) if url]:
+                group = EndpointGroup(
+                    name,
+                    urls,
+                    alpha=env_config.ENDPOINT_EWMA_ALPHA,
+                    failure_threshold=env_config.ENDPOINT_FAILURE_THRESHOLD,
+                    error_rate_threshold=env_config.ENDPOINT_ERROR_RATE_THRESHOLD,
+                    min_samples=env_config.ENDPOINT_MIN_SAMPLES,
+                    open_seconds=env_config.ENDPOINT_OPEN_SECONDS
+                )
+                self._groups[name] = group
+            return group
+
+    def stats(self) -> Dict[str, Any]:
+        """获取所有端点组状态"""
+        with self._lock:
+            groups = dict(self._groups)
+        return {name: group.stats() for name, group in groups.items()}
+
+
+# 创建全局实例
+endpoint_health = EndpointHealthRegistry()
@@ -0,0 +1,279 @@
+"""
+专用执行器
+把语音相关的阻塞调用从事件循环中移出，按负载类型分到独立的池中：
+- asr / tts / audio：线程池，用于等待上游服务或转码进程的I/O密集调用
+- dsp：进程池，用于pydub/numpy等CPU密集的音频处理
+每个池有自己的并发上限和排队上限，排满时立即拒绝，
+因此语音流量再大也不会占用文本聊天使用的默认线程池
+"""
+
+import asyncio
+import multiprocessing
+import threading
+import time
+import logging
+from concurrent.futures import CancelledError, Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from config import env_config
+
+logger = logging.getLogger("ai_chat_service.utils.executors")
+
+
+class ExecutorSaturated(Exception):
+    """执行器已满（运行中和排队中的任务达到上限）"""
+
+
+def _timed_call(func: Callable, args: tuple, kwargs: dict):
+    """在工作线程/进程中执行并返回(开始时间, 结果)，用于统计排队时间"""
+    return time.time(), func(*args, **kwargs)
+
+
+class BoundedExecutor:
+    """带并发上限和使用统计的执行器"""
+
+    def __init__(self, name: str, kind: str, max_workers: int, max_queue: int):
+        """
+        初始化执行器（底层线程池/进程池在首次使用时创建）
+
+        参数:
+            name: 执行器名称
+            kind: "thread" 或 "process"
+            max_workers: 最大并发数
+            max_queue: 并发数满后允许排队的任务数
+        """
+        if kind not in ("thread", "process"):
+            raise ValueError(f"不支持的执行器类型: {kind}")
+        self.name = name
+        self.kind = kind
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.kind == "thread":
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.max_workers,
+                            thread_name_prefix=f"{self.name}-executor"
+                        )
+                    else:
+                        # 服务进程中有大量线程，使用spawn避免fork带来的锁状态问题
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=self.max_workers,
+                            mp_context=multiprocessing.get_context("spawn")
+                        )
+                    logger.info(f"创建{self.kind}执行器: {self.name}，并发上限: {self.max_workers}")
+        return self._executor
+
+    def _acquire(self):
+        """占用一个名额，已满时拒绝"""
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise ExecutorSaturated(f"执行器{self.name}已满（并发{self.max_workers}，排队{self.max_queue}）")
+            self.in_flight += 1
+            self.submitted += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _release(self, submitted_at: float, started_at: Optional[float], error: bool, cancelled: bool = False):
+        finished_at = time.time()
+        with self._lock:
+            self.in_flight -= 1
+            if cancelled:
+                self.cancelled += 1
+            elif error:
+                self.failed += 1
+            else:
+                self.completed += 1
+            if started_at is not None:
+                self._wait_total += max(0.0, started_at - submitted_at)
+                self._run_total += finished_at - started_at
+
+    def _submit(self, func: Callable, args: tuple, kwargs: dict):
+        self._acquire()
+        submitted_at = time.time()
+        try:
+            future = self._get_executor().submit(_timed_call, func, args, kwargs)
+        except Exception:
+            self._release(submitted_at, None, error=True)
+            raise
+        return future, submitted_at
+
+    def _unwrap(self, future, submitted_at: float):
+        """取出结果并记录统计"""
+        try:
+            started_at, result = future.result()
+        except CancelledError:
+            # 调用方取消时仍在排队的任务不再执行
+            self._release(submitted_at, None, error=False, cancelled=True)
+            raise
+        except BaseException:
+            self._release(submitted_at, None, error=True)
+            raise
+        self._release(submitted_at, started_at, error=False)
+        return result
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        在执行器中运行并等待结果（供异步路由使用）
+
+        参数:
+            func: 要执行的函数（进程执行器要求可序列化）
+            *args, **kwargs: 函数参数
+
+        返回:
+            函数返回值
+        """
+        future, submitted_at = self._submit(func, args, kwargs)
+        try:
+            await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # 调用方已取消，由回调在任务真正结束时记录统计
+            future.add_done_callback(lambda f: self._discard(f, submitted_at))
+            raise
+        except Exception:
+            # 异常由_unwrap重新抛出并记录
+            pass
+        return self._unwrap(future, submitted_at)
+
+    def _discard(self, future, submitted_at: float):
+        try:
+            self._unwrap(future, submitted_at)
+        except BaseException:
+            pass
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        在执行器中运行并阻塞等待结果（供已在工作线程中的同步代码使用）
+
+        参数:
+            func: 要执行的函数
+            *args, **kwargs: 函数参数
+
+        返回:
+            函数返回值
+        """
+        future, submitted_at = self._submit(func, args, kwargs)
+        return self._unwrap(future, submitted_at)
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        提交任务但不等待（供需要回调的同步代码使用）
+
+        参数:
+            func: 要执行的函数
+            *args, **kwargs: 函数参数
+
+        返回:
+            结果为函数返回值的Future
+        """
+        future, submitted_at = self._submit(func, args, kwargs)
+        result: Future = Future()
+
+        def on_done(f):
+            try:
+                result.set_result(self._unwrap(f, submitted_at))
+            except BaseException as e:
+                result.set_exception(e)
+
+        future.add_done_callback(on_done)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """获取执行器统计"""
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.max_workers),
+                "peak_in_flight": self.peak_in_flight,
+                "saturation": round(self.in_flight / (self.max_workers + self.max_queue), 3),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled,
+                "avg_wait_ms": round(self._wait_total / finished * 1000, 2) if finished else 0.0,
+                "avg_run_ms": round(self._run_total / finished * 1000, 2) if finished else 0.0
+            }
+
+    def shutdown(self):
+        """关闭底层线程池/进程池"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ExecutorRegistry:
+    """按名称管理的执行器集合"""
+
+    def __init__(self):
+        self._executors: Dict[str, BoundedExecutor] = {}
+
+    def register(self, name: str, kind: str, max_workers: int, max_queue: int) -> BoundedExecutor:
+        """
+        注册执行器
+
+        参数:
+            name: 执行器名称
+            kind: "thread" 或 "process"
+            max_workers: 最大并发数
+            max_queue: 排队上限
+
+        返回:
+            注册的执行器
+        """
+        executor = BoundedExecutor(name, kind, max_workers, max_queue)
+        self._executors[name] = executor
+        return executor
+
+    def get(self, name: str) -> BoundedExecutor:
+        """获取执行器"""
+        try:
+            return self._executors[name]
+        except KeyError:
+            raise KeyError(f"未注册的执行器: {name}")
+
+    async def run(self, name: str, func: Callable, *args, **kwargs) -> Any:
+        """在指定执行器中异步运行"""
+        return await self.get(name).run(func, *args, **kwargs)
+
+    def call(self, name: str, func: Callable, *args, **kwargs) -> Any:
+        """在指定执行器中同步运行"""
+        return self.get(name).call(func, *args, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取所有执行器的统计"""
+        return {name: executor.stats() for name, executor in self._executors.items()}
+
+    def shutdown(self):
+        """关闭所有执行器"""
+        for executor in self._executors.values():
+            executor.shutdown()
+
+
+# 创建全局实例
+executors = ExecutorRegistry()
+executors.register("asr", "thread", env_config.ASR_EXECUTOR_WORKERS, env_config.ASR_EXECUTOR_QUEUE)
+executors.register("tts", "thread", env_config.TTS_EXECUTOR_WORKERS, env_config.TTS_EXECUTOR_QUEUE)
+executors.register("audio", "thread", env_config.AUDIO_EXECUTOR_WORKERS, env_config.AUDIO_EXECUTOR_QUEUE)
+executors.register("dsp", "process", env_config.DSP_PROCESS_WORKERS, env_config.DSP_PROCESS_QUEUE)
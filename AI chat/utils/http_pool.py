@@ -0,0 +1,355 @@
+"""
+出站HTTP连接池
+为llm/和speech/中所有上游调用提供共享的长连接会话：
+- 按主机配置连接池大小
+- keep-alive连接复用，避免每次请求重新进行TCP/TLS握手
+- 安装h2时异步客户端启用HTTP/2
+- 连接池使用率统计
+"""
+
+import threading
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+import httpx
+
+try:
+    import h2  # noqa: F401
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
+from config import env_config
+
+logger = logging.getLogger("ai_chat_service.utils.http_pool")
+
+
+class HostStats:
+    """单个主机的请求统计"""
+
+    def __init__(self, host: str, pool_size: int):
+        self.host = host
+        self.pool_size = pool_size
+        self.requests_total = 0
+        self.sync_requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.http2_responses = 0
+        self._lock = threading.Lock()
+
+    def begin(self, sync: bool = False):
+        """
+        记录请求开始
+
+        参数:
+            sync: 是否为经requests发出的同步请求
+        """
+        with self._lock:
+            self.requests_total += 1
+            if sync:
+                self.sync_requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def end(self, error: bool = False, http_version: Optional[str] = None):
+        """记录请求结束（收到响应头或失败）"""
+        with self._lock:
+            self.in_flight -= 1
+            if error:
+                self.errors += 1
+            if http_version == "HTTP/2":
+                self.http2_responses += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "pool_size": self.pool_size,
+            "requests_total": self.requests_total,
+            "sync_requests": self.sync_requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "utilization": round(self.in_flight / self.pool_size, 3) if self.pool_size else 0.0,
+            "http2_responses": self.http2_responses
+        }
+
+
+class _CountingAdapter(HTTPAdapter):
+    """带统计的requests适配器"""
+
+    def __init__(self, stats: HostStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        self.stats.begin(sync=True)
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            self.stats.end(error=True)
+            raise
+        self.stats.end(error=response.status_code >= 500)
+        return response
+
+
+class _CountingAsyncTransport(httpx.AsyncBaseTransport):
+    """带统计的httpx异步传输层"""
+
+    def __init__(self, stats: HostStats, transport: httpx.AsyncHTTPTransport):
+        self.stats = stats
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.begin()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception:
+            self.stats.end(error=True)
+            raise
+        self.stats.end(
+            error=response.status_code >= 500,
+            http_version=response.extensions.get("http_version", b"").decode("ascii", "ignore")
+        )
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class _CountingTransport(httpx.BaseTransport):
+    """带统计的httpx同步传输层（供SDK客户端使用）"""
+
+    def __init__(self, stats: HostStats, transport: httpx.HTTPTransport):
+        self.stats = stats
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.begin()
+        try:
+            response = self.transport.handle_request(request)
+        except Exception:
+            self.stats.end(error=True)
+            raise
+        self.stats.end(
+            error=response.status_code >= 500,
+            http_version=response.extensions.get("http_version", b"").decode("ascii", "ignore")
+        )
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+class HTTPClientPool:
+    """共享的出站HTTP连接池"""
+
+    def __init__(self):
+        """初始化连接池配置"""
+        self.default_pool_size = env_config.HTTP_POOL_MAXSIZE
+        self.host_pool_sizes = self._parse_host_sizes(env_config.HTTP_POOL_HOST_SIZES)
+        self.keepalive_expiry = env_config.HTTP_KEEPALIVE_EXPIRY
+        self.http2 = env_config.HTTP2_ENABLED and H2_AVAILABLE
+
+        if env_config.HTTP2_ENABLED and not H2_AVAILABLE:
+            logger.info("未安装h2，异步客户端使用HTTP/1.1")
+
+        self._session = requests.Session()
+        self._mounted_hosts = set()
+        self._async_clients: Dict[str, httpx.AsyncClient] = {}
+        self._sync_clients: Dict[str, httpx.Client] = {}
+        self._stats: Dict[str, HostStats] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse_host_sizes(spec: str) -> Dict[str, int]:
+        """
+        解析按主机配置的连接池大小
+
+        参数:
+            spec: 形如 "openai.qiniu.com=32,api.qnaigc.com=8" 的配置字符串
+
+        返回:
+            主机到连接池大小的映射
+        """
+        sizes = {}
+        for item in (spec or "").split(","):
+            if "=" not in item:
+                continue
+            host, size = item.split("=", 1)
+            try:
+                sizes[host.strip().lower()] = int(size)
+            except ValueError:
+                logger.warning(f"忽略无效的连接池配置: {item}")
+        return sizes
+
+    @staticmethod
+    def _origin(url: str):
+        """返回(scheme, host)"""
+        parts = urlsplit(url)
+        return parts.scheme or "https", (parts.hostname or "").lower()
+
+    def pool_size(self, host: str) -> int:
+        """获取指定主机的连接池大小"""
+        return self.host_pool_sizes.get(host, self.default_pool_size)
+
+    def _host_stats(self, host: str) -> HostStats:
+        stats = self._stats.get(host)
+        if stats is None:
+            stats = self._stats[host] = HostStats(host, self.pool_size(host))
+        return stats
+
+    def _limits(self, host: str) -> httpx.Limits:
+        size = self.pool_size(host)
+        return httpx.Limits(
+            max_connections=size,
+            max_keepalive_connections=size,
+            keepalive_expiry=self.keepalive_expiry
+        )
+
+    def session(self, url: str) -> requests.Session:
+        """
+        获取挂载了该主机连接池的requests会话
+
+        参数:
+            url: 请求地址
+
+        返回:
+            共享的requests.Session
+        """
+        scheme, host = self._origin(url)
+        prefix = f"{scheme}://{host}"
+        if prefix not in self._mounted_hosts:
+            with self._lock:
+                if prefix not in self._mounted_hosts:
+                    size = self.pool_size(host)
+                    adapter = _CountingAdapter(
+                        self._host_stats(host),
+                        pool_connections=1,
+                        pool_maxsize=size
+                    )
+                    self._session.mount(prefix, adapter)
+                    self._mounted_hosts.add(prefix)
+                    logger.info(f"创建连接池: {prefix}，大小: {size}")
+        return self._session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """通过连接池发送同步请求"""
+        return self.session(url).request(method, url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """通过连接池发送同步POST请求"""
+        return self.request("POST", url, **kwargs)
+
+    def async_client(self, url: str) -> httpx.AsyncClient:
+        """
+        获取该主机的共享异步客户端
+
+        参数:
+            url: 请求地址
+
+        返回:
+            httpx.AsyncClient
+        """
+        scheme, host = self._origin(url)
+        key = f"{scheme}://{host}"
+        client = self._async_clients.get(key)
+        if client is None or client.is_closed:
+            with self._lock:
+                client = self._async_clients.get(key)
+                if client is None or client.is_closed:
+                    transport = httpx.AsyncHTTPTransport(
+                        http2=self.http2,
+                        limits=self._limits(host)
+                    )
+                    client = httpx.AsyncClient(
+                        transport=_CountingAsyncTransport(self._host_stats(host), transport),
+                        timeout=30
+                    )
+                    self._async_clients[key] = client
+        return client
+
+    def sync_client(self, url: str) -> httpx.Client:
+        """
+        获取该主机的共享同步httpx客户端（供基于httpx的SDK使用）
+
+        参数:
+            url: 请求地址
+
+        返回:
+            httpx.Client
+        """
+        scheme, host = self._origin(url)
+        key = f"{scheme}://{host}"
+        client = self._sync_clients.get(key)
+        if client is None or client.is_closed:
+            with self._lock:
+                client = self._sync_clients.get(key)
+                if client is None or client.is_closed:
+                    transport = httpx.HTTPTransport(
+                        http2=self.http2,
+                        limits=self._limits(host)
+                    )
+                    client = httpx.Client(
+                        transport=_CountingTransport(self._host_stats(host), transport),
+                        timeout=30
+                    )
+                    self._sync_clients[key] = client
+        return client
+
+    async def apost(self, url: str, **kwargs) -> httpx.Response:
+        """通过连接池发送异步POST请求"""
+        return await self.async_client(url).post(url, **kwargs)
+
+    @asynccontextmanager
+    async def astream(self, method: str, url: str, **kwargs):
+        """通过连接池发送异步流式请求"""
+        async with self.async_client(url).stream(method, url, **kwargs) as response:
+            yield response
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取连接池使用统计
+
+        返回:
+            按主机划分的统计信息
+        """
+        hosts = {host: stats.to_dict() for host, stats in list(self._stats.items())}
+
+        # 补充requests连接池中实际建立的连接数，用于计算连接复用率
+        for prefix, adapter in list(self._session.adapters.items()):
+            if not isinstance(adapter, _CountingAdapter):
+                continue
+            host_stats = hosts.get(adapter.stats.host)
+            try:
+                pools = adapter.poolmanager.pools
+                new_connections = sum(pools[key].num_connections for key in pools.keys())
+            except Exception:
+                continue
+            host_stats["new_connections"] = new_connections
+            if host_stats["sync_requests"]:
+                host_stats["reuse_ratio"] = round(1 - new_connections / host_stats["sync_requests"], 3)
+
+        return {
+            "http2_enabled": self.http2,
+            "keepalive_expiry": self.keepalive_expiry,
+            "default_pool_size": self.default_pool_size,
+            "hosts": hosts
+        }
+
+    async def aclose(self):
+        """关闭所有连接"""
+        for client in list(self._async_clients.values()):
+            await client.aclose()
+        for client in list(self._sync_clients.values()):
+            client.close()
+        self._async_clients.clear()
+        self._sync_clients.clear()
+        self._session.close()
+
+
+# 创建全局实例
+http_pool = HTTPClientPool()
@@ -0,0 +1,72 @@
+"""
+Server-Sent Events 工具函数
+负责SSE帧的格式化以及在上游空闲时插入心跳帧
+"""
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Optional
+
+# 心跳帧：以冒号开头的注释行，客户端会忽略，但能保持连接和代理不超时
+HEARTBEAT_FRAME = ": ping\n\n"
+
+
+def sse_event(data: Any, event: Optional[str] = None) -> str:
+    """
+    格式化一个SSE事件
+    
+    参数:
+        data: 事件数据，非字符串会序列化为JSON
+        event: 事件名称（可选）
+    
+    返回:
+        SSE帧文本
+    """
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False, default=str)
+    
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    for line in data.split("\n"):
+        lines.append(f"data: {line}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def with_heartbeat(source: AsyncIterator[Any], interval: float) -> AsyncIterator[Optional[Any]]:
+    """
+    迭代异步数据源，超过interval秒没有新数据时产出None作为心跳信号
+    
+    参数:
+        source: 异步数据源
+        interval: 心跳间隔（秒）
+    
+    返回:
+        数据项或None（心跳）的异步迭代器
+    """
+    iterator = source.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=interval)
+            if not done:
+                yield None
+                continue
+            task, pending = pending, None
+            try:
+                item = task.result()
+            except StopAsyncIteration:
+                break
+            yield item
+    finally:
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, Exception):
+                pass
+        # 关闭数据源，释放上游连接
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
@@ -2,8 +2,24 @@ import api from '../utils/api';
 import type { Character, Message } from '../types/character';
 import voiceService from './voice.service';
 
+// 本地保存的会话标识，服务端按 (会话标识, 角色) 保存聊天历史和角色记忆
+const SESSION_ID_KEY = 'chatSessionId';
+
 // 角色服务
 class CharacterService {
+  // 服务端返回的会话ID（按角色）
+  private conversationIds = new Map<number, string>();
+
+  // 获取本客户端的会话标识，首次使用时生成并保存
+  private getSessionId(): string {
+    let sessionId = localStorage.getItem(SESSION_ID_KEY);
+    if (!sessionId) {
+      sessionId = `web_${Date.now().toString(36)}_${Math.random().toString(36).slice(2, 10)}`;
+      localStorage.setItem(SESSION_ID_KEY, sessionId);
+    }
+    return sessionId;
+  }
+
   // 获取角色列表
   async getCharacters(): Promise<Character[]> {
     try {
@@ -64,8 +80,12 @@ class CharacterService {
       const data = await api.post('/chat/character/send', {
         characterId,
         message,
-        characterContext: character
+        characterContext: character,
+        sessionId: this.getSessionId()
       });
+      if (data.conversation_id) {
+        this.conversationIds.set(characterId, data.conversation_id);
+      }
       return data.reply || '抱歉，我无法回答这个问题。';
     } catch (error) {
       console.error('发送消息失败:', error);
@@ -84,7 +104,9 @@ class CharacterService {
   // 获取聊天历史
   async getChatHistory(characterId: number): Promise<Message[]> {
     try {
-      const data = await api.get(`/chat/history/${characterId}`);
+      const data = await api.get(`/chat/history/${characterId}`, {
+        params: { session_id: this.getSessionId() }
+      });
       return data || [];
     } catch (error) {
       console.error('获取聊天历史失败:', error);
@@ -144,7 +166,8 @@ class CharacterService {
     try {
       const data = await api.post('/chat/agent/autonomous-action', {
         characterId,
-        situation
+        situation,
+        conversationId: this.conversationIds.get(characterId)
       });
       return data.reply || '抱歉，我现在无法执行这个操作。';
     } catch (error) {